@@ -0,0 +1,133 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+from typing import Dict, Any
+
+# Этапы обработки в порядке прохождения (колонки <stage>_ms в событиях бота)
+STAGES = ["queue", "owner_check", "loop_check", "zep_read", "openai", "zep_write", "send", "total"]
+
+OUTCOME_LABELS = {
+    "answered": "Ответ отправлен",
+    "processed": "Обработано (business)",
+    "ignored_owner_message": "Сообщение владельца",
+    "ignored_loop_detected": "Петля (LoopDetector)",
+    "error": "Ошибка",
+}
+
+
+# Строковые колонки событий, остальные - числовые
+CATEGORY_COLUMNS = ("kind", "outcome", "reason", "connection_id", "stale_action")
+
+
+def events_frame(payload: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Колоночный ответ /admin/analytics/events -> DataFrame
+
+    Колонки сразу собираются в массивы нужного типа: числа - float64 (None ->
+    NaN), строки - категории (меньше памяти, быстрее groupby), без
+    промежуточных object-колонок.
+    """
+    columns = {}
+    for name, values in payload["columns"].items():
+        if name in CATEGORY_COLUMNS:
+            columns[name] = pd.Categorical(values)
+        else:
+            columns[name] = np.array(values, dtype=float)
+    df = pd.DataFrame(columns)
+    if df.empty:
+        return df
+    df["ts"] = pd.to_datetime(df["ts"], unit="s")
+    df.attrs["sample_step"] = payload.get("sample_step", 1)
+    df.attrs["total_rows"] = payload.get("total_rows", len(df))
+    return df
+
+
+def stage_latency(df: pd.DataFrame) -> pd.DataFrame:
+    """p50/p95/p99 длительности по этапам (мс), пропуски этапа не учитываются"""
+    columns = [f"{stage}_ms" for stage in STAGES if f"{stage}_ms" in df]
+    if df.empty or not columns:
+        return pd.DataFrame(columns=["count", "p50", "p95", "p99"])
+    values = df[columns].to_numpy(dtype=float)
+    counts = np.count_nonzero(~np.isnan(values), axis=0)
+    with warnings.catch_warnings():
+        # Этап без единого значения дает NaN и предупреждение numpy - такие этапы отбрасываются ниже
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        percentiles = np.nanpercentile(values, [50, 95, 99], axis=0)
+    result = pd.DataFrame(
+        {"count": counts, "p50": percentiles[0], "p95": percentiles[1], "p99": percentiles[2]},
+        index=[column[:-3] for column in columns]
+    )
+    return result[result["count"] > 0].round(1)
+
+
+def tokens_per_turn(df: pd.DataFrame) -> Dict[str, Any]:
+    """Токены ответа на один ход диалога (только ответы OpenAI; оценка по фрагментам потока)"""
+    if df.empty or "completion_tokens" not in df:
+        return {"turns": 0}
+    tokens = df["completion_tokens"].to_numpy(dtype=float)
+    tokens = tokens[~np.isnan(tokens)]
+    if tokens.size == 0:
+        return {"turns": 0}
+    step = df.attrs.get("sample_step", 1)
+    return {
+        "turns": int(tokens.size * step),
+        "mean": round(float(tokens.mean()), 1),
+        "p50": float(np.percentile(tokens, 50)),
+        "p95": float(np.percentile(tokens, 95)),
+        "total": int(tokens.sum() * step),
+    }
+
+
+def outcome_rates(df: pd.DataFrame) -> pd.DataFrame:
+    """Число и доля исходов обработки (с учетом выборки при большом объеме)"""
+    if df.empty:
+        return pd.DataFrame(columns=["count", "share"])
+    counts = df["outcome"].value_counts()
+    counts = counts[counts > 0]
+    result = pd.DataFrame({
+        "count": counts * df.attrs.get("sample_step", 1),
+        "share": (counts / counts.sum() * 100).round(2)
+    })
+    result.index = [OUTCOME_LABELS.get(outcome, outcome) for outcome in result.index]
+    return result
+
+
+def filter_rates(df: pd.DataFrame) -> Dict[str, Any]:
+    """Доля business сообщений, отсеянных фильтром владельца и LoopDetector"""
+    if df.empty:
+        return {"business_messages": 0}
+    business = df[df["kind"] == "business_message"]
+    total = len(business)
+    if total == 0:
+        return {"business_messages": 0}
+    owner = int((business["outcome"] == "ignored_owner_message").sum())
+    loop = int((business["outcome"] == "ignored_loop_detected").sum())
+    step = df.attrs.get("sample_step", 1)
+    return {
+        "business_messages": total * step,
+        "owner_hits": owner * step,
+        "owner_rate": round(owner / total * 100, 2),
+        "loop_ignored": loop * step,
+        "loop_rate": round(loop / total * 100, 2),
+    }
+
+
+def loop_ignore_reasons(df: pd.DataFrame) -> pd.Series:
+    """Причины игнорирования LoopDetector"""
+    if df.empty or "reason" not in df:
+        return pd.Series(dtype=int)
+    reasons = df.loc[df["outcome"] == "ignored_loop_detected", "reason"].astype(str)
+    return reasons.value_counts() * df.attrs.get("sample_step", 1)
+
+
+def hourly_volume(df: pd.DataFrame) -> pd.DataFrame:
+    """События по часам в разрезе исходов (для графика)"""
+    if df.empty:
+        return pd.DataFrame()
+    volume = (
+        df.assign(outcome=df["outcome"].astype(str))
+        .pivot_table(index=pd.Grouper(key="ts", freq="1h"), columns="outcome", values="kind",
+                     aggfunc="size", fill_value=0)
+    )
+    return volume * df.attrs.get("sample_step", 1)
@@ -0,0 +1,59 @@
+import streamlit as st
+import requests
+import os
+from typing import Dict, Any, Optional
+
+from admin.config import DEFAULT_BOT_URL, STATUS_POLL_TTL
+from admin.status_poller import BotStatusPoller
+
+
+@st.cache_resource
+def get_status_poller(base_url: str, admin_token: Optional[str]) -> BotStatusPoller:
+    """Один поллер на процесс Streamlit (общий для всех сессий и перезапусков скрипта)"""
+    headers = {"X-Admin-Token": admin_token} if admin_token else {}
+    return BotStatusPoller(base_url, headers=headers, ttl=STATUS_POLL_TTL)
+
+
+class BotAPI:
+    """Клиент admin API бота: версии инструкций публикуются без пересборки"""
+
+    def __init__(self):
+        self.base_url = st.secrets.get("BOT_URL", os.getenv("BOT_URL", DEFAULT_BOT_URL)).rstrip("/")
+        self.admin_token = st.secrets.get("ADMIN_API_TOKEN", os.getenv("ADMIN_API_TOKEN"))
+        self.timeout = 10
+
+    @property
+    def status(self) -> BotStatusPoller:
+        return get_status_poller(self.base_url, self.admin_token)
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {"X-Admin-User": "streamlit-admin"}
+        if self.admin_token:
+            headers["X-Admin-Token"] = self.admin_token
+        return headers
+
+    def request(self, method: str, path: str, **kwargs) -> Dict[str, Any]:
+        """Запрос к боту; ошибки HTTP и ответы {"error": ...} -> RuntimeError"""
+        response = requests.request(
+            method, f"{self.base_url}{path}", headers=self._headers(), timeout=self.timeout, **kwargs
+        )
+        if response.status_code != 200:
+            try:
+                detail = response.json().get("detail", response.text)
+            except ValueError:
+                detail = response.text
+            raise RuntimeError(f"HTTP {response.status_code}: {detail}")
+        data = response.json()
+        if isinstance(data, dict) and "error" in data:
+            raise RuntimeError(data["error"])
+        return data
+
+    def publish_instruction(self, instruction: Dict[str, Any], comment: str = None) -> Dict[str, Any]:
+        return self.request("POST", "/admin/instructions", json={
+            "instruction": instruction,
+            "author": "streamlit-admin",
+            "comment": comment
+        })
+
+    def activate_version(self, version: str) -> Dict[str, Any]:
+        return self.request("POST", f"/admin/instructions/{version}/activate")
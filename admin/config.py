@@ -10,6 +10,12 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # Путь к файлу инструкций
 INSTRUCTION_FILE = os.path.join(BASE_DIR, 'data', 'instruction.json')
 
+# URL бота по умолчанию (переопределяется BOT_URL в secrets/окружении)
+DEFAULT_BOT_URL = 'https://bot-production-472c.up.railway.app'
+
+# Как часто фоновый поллер обновляет статус бота (секунды)
+STATUS_POLL_TTL = 15
+
 # Настройки для Streamlit
 STREAMLIT_CONFIG = {
     'page_title': 'Textil PRO Bot Admin',
@@ -3,6 +3,7 @@ import git
 import os
 import requests
 import base64
+import hashlib
 import json
 from datetime import datetime
 from typing import Optional, Dict, Any
@@ -17,6 +18,15 @@ class DeployManager:
         self.github_repo = st.secrets.get("GITHUB_REPO", "Textill_PRO_BOT")
         self.github_api_base = "https://api.github.com"
         
+        # Одна сессия на все запросы к GitHub (keep-alive); DeployManager кэшируется на процесс
+        self.github_session = requests.Session()
+        self.github_session.headers.update({"Accept": "application/vnd.github.v3+json"})
+        if self.github_token:
+            self.github_session.headers["Authorization"] = f"token {self.github_token}"
+        # path -> (ETag, ответ): повторный GET с If-None-Match получает 304 без тела
+        # и не расходует лимит запросов GitHub API
+        self._file_cache: Dict[str, tuple] = {}
+        
         # Railway настройки
         self.railway_token = st.secrets.get("RAILWAY_TOKEN", os.getenv("RAILWAY_TOKEN"))
         self.railway_project_id = st.secrets.get("RAILWAY_PROJECT_ID", os.getenv("RAILWAY_PROJECT_ID"))
@@ -50,15 +60,21 @@ class DeployManager:
         """Получает содержимое файла из GitHub через API"""
         try:
             url = f"{self.github_api_base}/repos/{self.github_owner}/{self.github_repo}/contents/{file_path}"
-            headers = {
-                "Authorization": f"token {self.github_token}",
-                "Accept": "application/vnd.github.v3+json"
-            }
+            headers = {}
+            cached = self._file_cache.get(file_path)
+            if cached:
+                headers["If-None-Match"] = cached[0]
             
-            response = requests.get(url, headers=headers)
+            response = self.github_session.get(url, headers=headers, timeout=15)
+            if response.status_code == 304:
+                return cached[1]
             if response.status_code == 200:
-                return response.json()
+                data = response.json()
+                if response.headers.get("ETag"):
+                    self._file_cache[file_path] = (response.headers["ETag"], data)
+                return data
             elif response.status_code == 404:
+                self._file_cache.pop(file_path, None)
                 return None  # Файл не найден
             else:
                 st.error(f"Ошибка получения файла: {response.status_code}")
@@ -68,18 +84,24 @@ class DeployManager:
             st.error(f"Ошибка при обращении к GitHub API: {e}")
             return None
     
+    @staticmethod
+    def git_blob_sha(content: str) -> str:
+        """SHA, который GitHub вернет для файла с таким содержимым (git blob)"""
+        data = content.encode('utf-8')
+        return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+    
+    def file_matches_github(self, file_path: str, content: str) -> bool:
+        """Совпадает ли содержимое с файлом в GitHub (сравнение по SHA, без скачивания текста)"""
+        current_file = self.get_file_content_from_github(file_path)
+        return bool(current_file) and current_file.get("sha") == self.git_blob_sha(content)
+    
     def update_file_via_github_api(self, file_path: str, content: str, commit_message: str) -> bool:
         """Обновляет файл в GitHub через API"""
         try:
-            # Получаем текущий файл для SHA
+            # SHA текущего файла (повторный запрос - условный, обычно 304 из кэша)
             current_file = self.get_file_content_from_github(file_path)
             
             url = f"{self.github_api_base}/repos/{self.github_owner}/{self.github_repo}/contents/{file_path}"
-            headers = {
-                "Authorization": f"token {self.github_token}",
-                "Accept": "application/vnd.github.v3+json",
-                "Content-Type": "application/json"
-            }
             
             # Кодируем содержимое в base64
             content_encoded = base64.b64encode(content.encode('utf-8')).decode('utf-8')
@@ -94,9 +116,11 @@ class DeployManager:
             if current_file:
                 data["sha"] = current_file["sha"]
             
-            response = requests.put(url, headers=headers, json=data)
+            response = self.github_session.put(url, json=data, timeout=30)
             
             if response.status_code in [200, 201]:
+                # Кэш GET устарел: следующий запрос возьмет новый SHA
+                self._file_cache.pop(file_path, None)
                 return True
             else:
                 return False
@@ -162,7 +186,11 @@ class DeployManager:
             st.error("❌ GitHub токен не настроен")
             return False
         
-        # Шаг 1: Обновляем файл в GitHub
+        # Шаг 1: Обновляем файл в GitHub (пустой коммит не создаем)
+        if self.file_matches_github("data/instruction.json", instruction_content):
+            st.info("📝 Файл в GitHub уже совпадает - коммит не нужен")
+            return True
+        
         st.info("🔄 Обновление файла в GitHub...")
         github_success = self.update_file_via_github_api("data/instruction.json", instruction_content, commit_message)
         
@@ -179,12 +207,29 @@ class DeployManager:
         
         return True
 
-def show_deploy_status():
-    """Показывает статус деплоя в боковой панели"""
+@st.cache_resource
+def get_deploy_manager() -> DeployManager:
+    """DeployManager создается один раз на процесс, а не на каждый перезапуск скрипта"""
+    return DeployManager()
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_cached_git_status() -> Dict[str, Any]:
+    """Статус локального Git (открытие репозитория не повторяется чаще раза в минуту)"""
+    return get_deploy_manager().get_git_status()
+
+
+def show_deploy_status(bot_api):
+    """
+    Показывает статус деплоя в боковой панели
+
+    Ничего не запрашивает синхронно: статус бота берется из фонового
+    поллера (bot_api.status), статус Git - из кэша.
+    """
     st.sidebar.markdown("---")
     st.sidebar.markdown("### 🚀 Статус деплоя")
     
-    deploy_manager = DeployManager()
+    deploy_manager = get_deploy_manager()
     
     # Показываем информацию о GitHub API
     try:
@@ -203,29 +248,28 @@ def show_deploy_status():
     
     # Проверяем статус бота
     st.sidebar.markdown("### 🤖 Статус бота")
-    try:
-        import requests
-        response = requests.get("https://bot-production-472c.up.railway.app/", timeout=5)
-        if response.status_code == 200:
-            st.sidebar.success("✅ Бот онлайн")
-            
-            # Проверяем промпт
-            prompt_response = requests.get("https://bot-production-472c.up.railway.app/debug/prompt", timeout=5)
-            if prompt_response.status_code == 200:
-                prompt_data = prompt_response.json()
-                st.sidebar.info(f"""
-                **Промпт:**
-                Обновлен: {prompt_data.get('last_updated', 'неизвестно')[:16]}
-                Длина: {prompt_data.get('system_instruction_length', 0)} символов
-                """)
-        else:
-            st.sidebar.error("❌ Бот недоступен")
-    except Exception as e:
-        st.sidebar.error(f"❌ Ошибка проверки бота: {str(e)[:50]}")
+    status = bot_api.status.snapshot()
+    if status["fetched_at"] is None:
+        st.sidebar.info("⏳ Проверка бота...")
+    elif "root" in status["errors"]:
+        st.sidebar.error(f"❌ Бот недоступен: {status['errors']['root'][:50]}")
+    else:
+        st.sidebar.success("✅ Бот онлайн")
+        prompt_data = status["results"].get("prompt")
+        if prompt_data:
+            version = prompt_data.get("version", {})
+            st.sidebar.info(f"""
+            **Промпт:**
+            Версия: {version.get('version', 'неизвестно') if isinstance(version, dict) else version}
+            Обновлен: {str(prompt_data.get('last_updated', 'неизвестно'))[:16]}
+            Длина: {prompt_data.get('system_instruction_length', 0)} символов
+            """)
+    if status["age"] is not None:
+        st.sidebar.caption(f"Обновлено {int(status['age'])} с назад ({status['fetch_ms']} мс)")
     
     # Пытаемся получить Git статус (может не работать в облаке)
     try:
-        git_status = deploy_manager.get_git_status()
+        git_status = get_cached_git_status()
         
         if "error" not in git_status:
             # Показываем статус Git
@@ -0,0 +1,89 @@
+import streamlit as st
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from admin.config import STREAMLIT_CONFIG
+from admin.auth import check_password
+from admin.bot_api import BotAPI
+from admin.analytics_queries import (
+    events_frame, filter_rates, hourly_volume, loop_ignore_reasons, outcome_rates, stage_latency, tokens_per_turn
+)
+
+PERIODS = {"1 час": 1, "24 часа": 24, "7 дней": 24 * 7, "30 дней": 24 * 30}
+TOKENS_NOTE = (
+    "Приблизительно: считаются фрагменты потока ответа OpenAI (обычно один токен на фрагмент). "
+    "Точный расход токенов - в биллинге OpenAI."
+)
+
+
+@st.cache_data(ttl=60, show_spinner="Загрузка событий...")
+def load_events(base_url: str, hours: float):
+    """События из бота (колоночный JSON); кэш на минуту для всех сессий панели"""
+    payload = BotAPI().request("GET", "/admin/analytics/events", params={"hours": hours})
+    return events_frame(payload)
+
+
+def main():
+    st.set_page_config(
+        page_title=f"Аналитика · {STREAMLIT_CONFIG['page_title']}",
+        page_icon="📊",
+        layout=STREAMLIT_CONFIG['layout']
+    )
+
+    if not check_password():
+        return
+
+    st.title("📊 Аналитика диалогов")
+
+    bot_api = BotAPI()
+    period = st.radio("Период:", list(PERIODS), index=1, horizontal=True)
+    try:
+        df = load_events(bot_api.base_url, PERIODS[period])
+    except Exception as e:
+        st.error(f"❌ Не удалось загрузить события: {e}")
+        return
+
+    if df.empty:
+        st.info("Событий за период нет")
+        return
+
+    if df.attrs.get("sample_step", 1) > 1:
+        st.caption(
+            f"Событий {df.attrs['total_rows']:,}: показатели посчитаны по равномерной выборке "
+            f"(каждое {df.attrs['sample_step']}-е), счетчики пересчитаны на полный объем"
+        )
+
+    filters = filter_rates(df)
+    tokens = tokens_per_turn(df)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Событий", f"{df.attrs.get('total_rows', len(df)):,}")
+    col2.metric("Токенов на ответ (среднее, ≈)", tokens.get("mean", "—"), help=TOKENS_NOTE)
+    col3.metric("Сообщения владельца", f"{filters.get('owner_rate', 0)}%", f"{filters.get('owner_hits', 0)} шт.", delta_color="off")
+    col4.metric("Отсеяно LoopDetector", f"{filters.get('loop_rate', 0)}%", f"{filters.get('loop_ignored', 0)} шт.", delta_color="off")
+
+    st.subheader("⏱️ Задержка по этапам, мс")
+    st.dataframe(stage_latency(df), use_container_width=True)
+
+    st.subheader("📈 События по часам")
+    st.bar_chart(hourly_volume(df))
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("🧾 Исходы обработки")
+        st.dataframe(outcome_rates(df), use_container_width=True)
+    with col2:
+        st.subheader("🔁 Причины игнорирования (LoopDetector)")
+        reasons = loop_ignore_reasons(df)
+        if reasons.empty:
+            st.info("Сообщения не игнорировались")
+        else:
+            st.dataframe(reasons.rename("count"), use_container_width=True)
+
+    st.subheader("🪙 Токены на ход диалога")
+    st.caption(TOKENS_NOTE)
+    st.json(tokens)
+
+
+main()
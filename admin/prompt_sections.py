@@ -0,0 +1,83 @@
+import difflib
+import re
+from typing import List, Dict, Any, Tuple
+
+# Заголовок markdown в начале строки: "## Тема" и "##Тема" (в инструкции встречаются оба)
+HEADING_RE = re.compile(r"^#{1,6}(?!#)")
+
+
+def split_sections(text: str) -> List[Tuple[str, str]]:
+    """
+    Делит инструкцию на разделы по markdown заголовкам
+
+    Returns:
+        [(заголовок, текст раздела)], первый раздел - текст до первого
+        заголовка (заголовок ""). "".join(h + body) возвращает исходный текст.
+    """
+    sections: List[Tuple[str, str]] = []
+    heading, body = "", []
+    for line in text.splitlines(keepends=True):
+        if HEADING_RE.match(line):
+            if heading or body:
+                sections.append((heading, "".join(body)))
+            heading, body = line, []
+        else:
+            body.append(line)
+    sections.append((heading, "".join(body)))
+    return sections
+
+
+def join_sections(texts: List[str]) -> str:
+    """
+    Склеивает разделы (заголовок + текст) обратно в инструкцию
+
+    Раздел, отредактированный без перевода строки в конце, иначе слился бы
+    со следующим заголовком.
+    """
+    parts = []
+    for index, text in enumerate(texts):
+        if index < len(texts) - 1 and text and not text.endswith("\n"):
+            text += "\n"
+        parts.append(text)
+    return "".join(parts)
+
+
+def section_title(text: str, index: int) -> str:
+    """Подпись раздела (по его первой строке-заголовку) для списка выбора"""
+    first_line = text.split("\n", 1)[0]
+    title = first_line.lstrip("#").strip() if HEADING_RE.match(first_line) else ""
+    return f"{index}. {title}" if title else f"{index}. (вступление)"
+
+
+def diff_sections(old_text: str, new_text: str) -> Dict[str, Any]:
+    """
+    Что изменилось между двумя версиями инструкции
+
+    Returns:
+        {"changed": bool, "sections": [заголовки измененных/добавленных/удаленных
+        разделов], "added_lines": int, "removed_lines": int}
+    """
+    if old_text == new_text:
+        return {"changed": False, "sections": [], "added_lines": 0, "removed_lines": 0}
+
+    old_sections = split_sections(old_text)
+    new_sections = split_sections(new_text)
+    old_keys = [heading + body for heading, body in old_sections]
+    new_keys = [heading + body for heading, body in new_sections]
+
+    changed_sections = []
+    matcher = difflib.SequenceMatcher(a=old_keys, b=new_keys, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        for heading, _body in new_sections[j1:j2] or old_sections[i1:i2]:
+            changed_sections.append(heading.lstrip("#").strip() or "(вступление)")
+
+    added = removed = 0
+    for line in difflib.unified_diff(old_text.splitlines(), new_text.splitlines(), lineterm="", n=0):
+        if line.startswith("+") and not line.startswith("+++"):
+            added += 1
+        elif line.startswith("-") and not line.startswith("---"):
+            removed += 1
+
+    return {"changed": True, "sections": changed_sections, "added_lines": added, "removed_lines": removed}
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import time
+from typing import Dict, Any, Optional
+
+import aiohttp
+
+# Что показывает админ панель: имя -> путь на боте
+STATUS_ENDPOINTS = {
+    "root": "/",
+    "prompt": "/debug/prompt",
+    "instructions": "/admin/instructions?limit=20",
+    # Редактор берет активную версию отсюда, а не запросом при отрисовке страницы
+    "active_instruction": "/admin/instructions/active",
+}
+
+
+class BotStatusPoller:
+    """
+    Фоновый опрос статуса бота для админ панели
+
+    Streamlit перезапускает скрипт на каждое действие пользователя (в т.ч.
+    ввод в текстовом поле), поэтому синхронные запросы к боту прямо в
+    скрипте тормозят весь интерфейс. Поллер работает в отдельном потоке со
+    своим event loop: раз в ttl секунд параллельно опрашивает все
+    STATUS_ENDPOINTS через одну aiohttp сессию, а страница берет последний
+    результат из памяти без ожидания.
+
+    Пока панель никто не открывает (нет вызовов snapshot() дольше idle_after
+    секунд), бот не опрашивается.
+    """
+
+    def __init__(self, base_url: str, headers: Optional[Dict[str, str]] = None,
+                 ttl: float = 15.0, timeout: float = 5.0, idle_after: float = 300.0):
+        self.base_url = base_url.rstrip("/")
+        self.headers = headers or {}
+        self.ttl = ttl
+        self.timeout = timeout
+        self.idle_after = idle_after
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._fetched = threading.Condition(self._lock)
+        self._results: Dict[str, Any] = {}
+        self._errors: Dict[str, str] = {}
+        self._fetched_at: Optional[float] = None
+        self._fetch_ms: Optional[float] = None
+        self._generation = 0
+        self._last_access = time.monotonic()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._thread_main, name="bot-status-poller", daemon=True)
+            self._thread.start()
+
+    def _thread_main(self):
+        # Свой event loop и одна aiohttp сессия на все время жизни потока
+        loop = asyncio.new_event_loop()
+        session = loop.run_until_complete(self._create_session())
+        while True:
+            self._wake.clear()
+            if time.monotonic() - self._last_access < self.idle_after:
+                loop.run_until_complete(self._fetch_all(session))
+            # Ждем ttl или принудительного обновления (кнопка в панели)
+            self._wake.wait(self.ttl)
+
+    async def _create_session(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(headers=self.headers, timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def _fetch(self, session: aiohttp.ClientSession, path: str) -> Any:
+        async with session.get(f"{self.base_url}{path}") as response:
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+            return await response.json(content_type=None)
+
+    async def _fetch_all(self, session: aiohttp.ClientSession):
+        started = time.perf_counter()
+        names = list(STATUS_ENDPOINTS)
+        responses = await asyncio.gather(
+            *(self._fetch(session, STATUS_ENDPOINTS[name]) for name in names),
+            return_exceptions=True
+        )
+
+        results, errors = {}, {}
+        for name, response in zip(names, responses):
+            if isinstance(response, Exception):
+                errors[name] = f"{type(response).__name__}: {response}" if str(response) else type(response).__name__
+            elif isinstance(response, dict) and "error" in response:
+                errors[name] = str(response["error"])
+            else:
+                results[name] = response
+
+        with self._fetched:
+            # Успешные ответы заменяют старые, по ошибкам остается последний удачный результат
+            self._results.update(results)
+            self._errors = errors
+            self._fetched_at = time.time()
+            self._fetch_ms = round((time.perf_counter() - started) * 1000, 1)
+            self._generation += 1
+            self._fetched.notify_all()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Последний результат опроса (не блокирует)"""
+        self.start()
+        with self._lock:
+            if time.monotonic() - self._last_access >= self.idle_after:
+                # Панель снова открыли после простоя - данные устарели, обновляем сразу
+                self._wake.set()
+            self._last_access = time.monotonic()
+            return {
+                "results": dict(self._results),
+                "errors": dict(self._errors),
+                "fetched_at": self._fetched_at,
+                "age": time.time() - self._fetched_at if self._fetched_at else None,
+                "fetch_ms": self._fetch_ms,
+            }
+
+    def refresh(self, wait: float = 0.0) -> Dict[str, Any]:
+        """
+        Внеочередной опрос (после публикации версии, по кнопке)
+
+        wait > 0 - дождаться нового результата, но не дольше wait секунд
+        """
+        self.start()
+        with self._lock:
+            self._last_access = time.monotonic()
+            generation = self._generation
+        self._wake.set()
+        if wait > 0:
+            with self._fetched:
+                self._fetched.wait_for(lambda: self._generation > generation, timeout=wait)
+        return self.snapshot()
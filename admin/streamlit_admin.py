@@ -9,16 +9,42 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from admin.config import INSTRUCTION_FILE, DEFAULT_INSTRUCTION, STREAMLIT_CONFIG
 from admin.auth import check_password
 from admin.deploy_integration import DeployManager, show_deploy_status
+from admin.bot_api import BotAPI
+from admin.prompt_sections import diff_sections, join_sections, section_title, split_sections
 
 
-def load_instruction():
+def load_instruction(bot_api=None):
+    """
+    Инструкции для редактора - один раз за сессию (в т.ч. файл или значения по умолчанию)
+
+    Активная версия в боте - источник правды, но берется из фонового поллера
+    (bot_api.status): при недоступном боте перезапуски скрипта (каждое
+    действие в панели) не ждут таймаута запроса. Поллер еще ни разу не
+    опрашивал бота - страница ждет его первый результат, не дольше таймаута опроса.
+    """
+    if "instruction_data" in st.session_state:
+        return st.session_state["instruction_data"]
+    
+    if bot_api is not None:
+        status = bot_api.status.snapshot()
+        if status["fetched_at"] is None:
+            status = bot_api.status.refresh(wait=bot_api.status.timeout)
+        active = status["results"].get("active_instruction")
+        if active and "active_instruction" not in status["errors"]:
+            st.session_state["loaded_version"] = active["version"]
+            st.session_state["instruction_data"] = active["instruction"]
+            return active["instruction"]
+    
+    # Бот недоступен - файл; результат тоже кэшируется до конца сессии
+    st.session_state.pop("loaded_version", None)
     try:
         with open(INSTRUCTION_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
+            instruction_data = json.load(f)
     except FileNotFoundError:
-        default_data = DEFAULT_INSTRUCTION.copy()
-        default_data["last_updated"] = datetime.now().isoformat()
-        return default_data
+        instruction_data = DEFAULT_INSTRUCTION.copy()
+        instruction_data["last_updated"] = datetime.now().isoformat()
+    st.session_state["instruction_data"] = instruction_data
+    return instruction_data
 
 
 def save_instruction(instruction_data):
@@ -31,6 +57,50 @@ def save_instruction(instruction_data):
         return False
 
 
+def edit_system_instruction(instruction_text):
+    """
+    Редактор системной инструкции по разделам (markdown заголовкам)
+
+    На странице - только выбранный раздел, правка применяется кнопкой формы,
+    поэтому ввод текста не перезапускает скрипт и не гоняет весь 40 КБ
+    промпт в браузер и обратно. Разделы живут в session_state до сохранения.
+
+    Returns:
+        Текущий полный текст инструкции с учетом правок
+    """
+    if st.session_state.get("sections_source") != instruction_text:
+        st.session_state["sections"] = [heading + body for heading, body in split_sections(instruction_text)]
+        st.session_state["sections_source"] = instruction_text
+    sections = st.session_state["sections"]
+    
+    mode = st.radio("Редактирование:", ["По разделам", "Весь текст"], horizontal=True)
+    if mode == "Весь текст":
+        full_text = join_sections(sections)
+        with st.form("full_instruction_form"):
+            new_text = st.text_area("Системная инструкция:", value=full_text, height=400)
+            if st.form_submit_button("✔️ Применить") and new_text != full_text:
+                st.session_state["sections"] = [heading + body for heading, body in split_sections(new_text)]
+                st.rerun()
+        return full_text
+    
+    titles = [section_title(text, index + 1) for index, text in enumerate(sections)]
+    index = st.selectbox("Раздел:", range(len(sections)), format_func=lambda i: titles[i])
+    with st.form(f"section_form_{index}"):
+        new_text = st.text_area(titles[index], value=sections[index], height=300)
+        if st.form_submit_button("✔️ Применить раздел") and new_text != sections[index]:
+            sections[index] = new_text
+            st.rerun()
+    
+    current_text = join_sections(sections)
+    changes = diff_sections(instruction_text, current_text)
+    if changes["changed"]:
+        st.caption(
+            f"✏️ Не сохранено: разделов {len(changes['sections'])}, "
+            f"+{changes['added_lines']} / -{changes['removed_lines']} строк"
+        )
+    return current_text
+
+
 def main():
     st.set_page_config(
         page_title=STREAMLIT_CONFIG['page_title'],
@@ -46,18 +116,26 @@ def main():
     st.title("🤖 Artyom Integrator - Админ панель")
     
     # Показываем статус деплоя в боковой панели
-    deploy_manager = show_deploy_status()
+    bot_api = BotAPI()
+    deploy_manager = show_deploy_status(bot_api)
     
-    if not os.path.exists(INSTRUCTION_FILE):
+    instruction_data = load_instruction(bot_api)
+    if st.session_state.get("loaded_version"):
+        st.caption(f"🗂️ Активная версия в боте: `{st.session_state['loaded_version']}`")
+    elif not os.path.exists(INSTRUCTION_FILE):
         st.warning("⚠️ Файл инструкций не найден. Создайте новые инструкции.")
+    else:
+        st.warning("⚠️ Бот недоступен - инструкции загружены из файла")
+    status = bot_api.status.snapshot()
+    bot_answers = "active_instruction" in status["results"] and "active_instruction" not in status["errors"]
+    if not st.session_state.get("loaded_version") and bot_answers:
+        # Бот снова отвечает: перечитать активную версию (несохраненные правки будут потеряны)
+        if st.button("📥 Загрузить активную версию из бота"):
+            st.session_state.pop("instruction_data", None)
+            st.rerun()
     
-    instruction_data = load_instruction()
-    
-    system_instruction = st.text_area(
-        "Системная инструкция:",
-        value=instruction_data.get("system_instruction", ""),
-        height=400
-    )
+    original_instruction = instruction_data.get("system_instruction", "")
+    system_instruction = edit_system_instruction(original_instruction)
     
     welcome_message = st.text_area(
         "Приветственное сообщение:",
@@ -74,55 +152,112 @@ def main():
     
     with col1:
         if st.button("🔍 Проверить текущий промпт", use_container_width=True):
-            try:
-                import requests
-                response = requests.get("https://bot-production-472c.up.railway.app/debug/prompt", timeout=10)
-                if response.status_code == 200:
-                    data = response.json()
-                    if "error" not in data:
-                        st.success("✅ Связь с ботом установлена")
-                        st.json(data)
-                    else:
-                        st.error(f"❌ Ошибка бота: {data['error']}")
-                else:
-                    st.error(f"❌ HTTP {response.status_code}")
-            except Exception as e:
-                st.error(f"❌ Не удается подключиться к боту: {e}")
+            status = bot_api.status.refresh(wait=5)
+            if "prompt" in status["errors"]:
+                st.error(f"❌ Не удается получить промпт: {status['errors']['prompt']}")
+            elif "prompt" in status["results"]:
+                st.success("✅ Связь с ботом установлена")
+                st.json(status["results"]["prompt"])
+            else:
+                st.info("⏳ Бот еще не ответил")
     
     with col2:
         if st.button("🔄 Перезагрузить промпт", use_container_width=True):
             try:
-                import requests
-                response = requests.post("https://bot-production-472c.up.railway.app/admin/reload-prompt", timeout=10)
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get("changed"):
-                        st.success(f"✅ Промпт обновлен: {data['old_updated']} → {data['new_updated']}")
-                    else:
-                        st.info("📝 Промпт перезагружен (без изменений)")
+                data = bot_api.request("POST", "/admin/reload-prompt")
+                bot_api.status.refresh()
+                if data.get("changed"):
+                    st.success(f"✅ Промпт обновлен: {data['old_updated']} → {data['new_updated']}")
                 else:
-                    st.error(f"❌ HTTP {response.status_code}")
+                    st.info("📝 Промпт перезагружен (без изменений)")
             except Exception as e:
                 st.error(f"❌ Ошибка перезагрузки: {e}")
     
     st.markdown("---")
     
+    comment = st.text_input("Комментарий к версии (необязательно):")
+    github_backup = st.checkbox(
+        "Также закоммитить в GitHub (бэкап в репозитории, пересборка бота 2-3 минуты)",
+        value=False
+    )
+    
     if st.button("🚀 Сохранить", type="primary", use_container_width=True):
+        changes = diff_sections(original_instruction, system_instruction)
+        welcome_changed = welcome_message != instruction_data.get("welcome_message", "")
+        if not changes["changed"] and not welcome_changed:
+            st.info("📝 Изменений нет - сохранение пропущено")
+            return
+        changed_sections = changes["sections"] + (["Приветственное сообщение"] if welcome_changed else [])
+        
         new_instruction_data = {
             "system_instruction": system_instruction,
             "welcome_message": welcome_message,
             "last_updated": datetime.now().isoformat()
         }
         
-        if save_instruction(new_instruction_data):
+        # Публикация новой версии в боте - применяется примерно за секунду
+        published = False
+        try:
+            result = bot_api.publish_instruction(
+                new_instruction_data, comment or f"Изменено: {', '.join(changed_sections)[:200]}"
+            )
+            published = True
+            st.session_state["loaded_version"] = result["new_version"]
+            st.session_state["instruction_data"] = new_instruction_data
+            bot_api.status.refresh()
+            if result.get("changed"):
+                st.success(f"✅ Версия {result['new_version']} активна в боте (была {result['old_version']})")
+            else:
+                st.info("📝 Инструкции не изменились")
+        except Exception as e:
+            st.error(f"❌ Не удалось опубликовать версию в боте: {e}")
+            st.warning("⚠️ Сохраняю через GitHub - изменения применятся после пересборки")
+        
+        if (github_backup or not published) and save_instruction(new_instruction_data):
             # Автоматический деплой через GitHub API
-            commit_message = f"Update bot instructions via admin panel\n\n- Modified system instruction\n- Updated welcome message\n- Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n🤖 Generated with [Claude Code](https://claude.ai/code)\n\nCo-Authored-By: Claude <noreply@anthropic.com>"
+            commit_message = f"Update bot instructions via admin panel\n\n" + "".join(f"- {title}\n" for title in changed_sections) + f"- Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n🤖 Generated with [Claude Code](https://claude.ai/code)\n\nCo-Authored-By: Claude <noreply@anthropic.com>"
             
             # Конвертируем данные в JSON для передачи в GitHub API
             instruction_json = json.dumps(new_instruction_data, ensure_ascii=False, indent=2)
             
             deploy_manager.auto_deploy_changes(commit_message, instruction_json)
+        
+        if published:
             st.balloons()
+    
+    st.markdown("---")
+    show_version_history(bot_api)
+
+
+def show_version_history(bot_api):
+    """История версий инструкций с мгновенным откатом"""
+    st.subheader("🗂️ История версий")
+    status = bot_api.status.snapshot()
+    if "instructions" not in status["results"]:
+        st.info(f"История версий недоступна: {status['errors'].get('instructions', 'загрузка...')}")
+        return
+    versions = status["results"]["instructions"]["versions"]
+    
+    for version in versions:
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            marker = "🟢 " if version["active"] else ""
+            st.markdown(
+                f"{marker}`{version['version']}` · {version['created_at']} · "
+                f"{version.get('author') or '—'} · {version['system_instruction_length']} симв."
+                + (f"  \n{version['comment']}" if version.get("comment") else "")
+            )
+        with col2:
+            if not version["active"] and st.button("↩️ Откатить", key=f"activate_{version['version']}"):
+                try:
+                    result = bot_api.activate_version(version["version"])
+                    st.success(f"✅ Активна версия {result['new_version']}")
+                    # Редактор перечитает активную версию, история - обновится
+                    st.session_state.pop("instruction_data", None)
+                    bot_api.status.refresh(wait=5)
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"❌ Ошибка отката: {e}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк has_attachments: прежняя реализация против таблицы извлечения
+
+Запуск:
+    python benchmarks/bench_attachments.py [--number 200000]
+
+Прежняя реализация скопирована из webhook.py без изменений, чтобы сравнение
+оставалось воспроизводимым после рефакторинга.
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.attachments import has_attachments  # noqa: E402
+
+
+def legacy_has_attachments(message):
+    """Реализация до рефакторинга (webhook.py)"""
+    attachment_types = [
+        'photo', 'document', 'video', 'audio', 'voice', 'video_note',
+        'sticker', 'animation', 'contact', 'location', 'venue', 'poll'
+    ]
+
+    attachments_found = []
+    attachments_details = []
+
+    for attachment_type in attachment_types:
+        if attachment_type in message:
+            attachments_found.append(attachment_type)
+
+            attachment_data = message[attachment_type]
+            detail = {"type": attachment_type}
+
+            if attachment_type == 'photo':
+                if isinstance(attachment_data, list) and len(attachment_data) > 0:
+                    largest_photo = max(attachment_data, key=lambda x: x.get('file_size', 0))
+                    detail.update({
+                        "file_id": largest_photo.get('file_id'),
+                        "file_size": largest_photo.get('file_size'),
+                        "width": largest_photo.get('width'),
+                        "height": largest_photo.get('height')
+                    })
+            elif attachment_type == 'document':
+                detail.update({
+                    "file_id": attachment_data.get('file_id'),
+                    "file_name": attachment_data.get('file_name'),
+                    "file_size": attachment_data.get('file_size'),
+                    "mime_type": attachment_data.get('mime_type')
+                })
+            elif attachment_type in ['video', 'audio', 'voice', 'video_note']:
+                detail.update({
+                    "file_id": attachment_data.get('file_id'),
+                    "file_size": attachment_data.get('file_size'),
+                    "duration": attachment_data.get('duration')
+                })
+                if attachment_type == 'video':
+                    detail.update({
+                        "width": attachment_data.get('width'),
+                        "height": attachment_data.get('height')
+                    })
+            elif attachment_type == 'sticker':
+                detail.update({
+                    "file_id": attachment_data.get('file_id'),
+                    "width": attachment_data.get('width'),
+                    "height": attachment_data.get('height'),
+                    "emoji": attachment_data.get('emoji')
+                })
+            elif attachment_type == 'contact':
+                detail.update({
+                    "phone_number": attachment_data.get('phone_number'),
+                    "first_name": attachment_data.get('first_name'),
+                    "last_name": attachment_data.get('last_name')
+                })
+            elif attachment_type == 'location':
+                detail.update({
+                    "latitude": attachment_data.get('latitude'),
+                    "longitude": attachment_data.get('longitude')
+                })
+            else:
+                if hasattr(attachment_data, 'get') and attachment_data.get('file_id'):
+                    detail["file_id"] = attachment_data.get('file_id')
+
+            attachments_details.append(detail)
+
+    return attachments_found, attachments_details
+
+
+BASE_MESSAGE = {
+    "message_id": 1001,
+    "date": 1750000000,
+    "chat": {"id": 987654321, "type": "private"},
+    "from": {"id": 987654321, "is_bot": False, "first_name": "Клиент"},
+    "business_connection_id": "conn_abc"
+}
+
+SAMPLES = {
+    "text_only": {**BASE_MESSAGE, "text": "Сколько стоит пошив 500 футболок?"},
+    "photo_caption": {**BASE_MESSAGE, "caption": "Вот образец", "photo": [
+        {"file_id": "s", "file_size": 1200, "width": 90, "height": 90},
+        {"file_id": "m", "file_size": 15000, "width": 320, "height": 320},
+        {"file_id": "l", "file_size": 98000, "width": 1280, "height": 1280}
+    ]},
+    "document": {**BASE_MESSAGE, "document": {
+        "file_id": "doc", "file_name": "ТЗ.pdf", "file_size": 250000, "mime_type": "application/pdf"
+    }},
+    "video_and_contact": {**BASE_MESSAGE,
+        "video": {"file_id": "v", "file_size": 5000000, "duration": 12, "width": 720, "height": 1280},
+        "contact": {"phone_number": "+7900", "first_name": "Иван", "last_name": "Петров"}
+    }
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк has_attachments")
+    parser.add_argument("--number", type=int, default=200000, help="вызовов на один замер")
+    parser.add_argument("--repeat", type=int, default=5, help="число замеров (берется минимум)")
+    args = parser.parse_args()
+
+    print(f"{'сообщение':<20} {'до, нс':>10} {'после, нс':>10} {'ускорение':>10}")
+    for name, message in SAMPLES.items():
+        assert legacy_has_attachments(message) == has_attachments(message), name
+
+        before = min(timeit.repeat(lambda: legacy_has_attachments(message), number=args.number, repeat=args.repeat))
+        after = min(timeit.repeat(lambda: has_attachments(message), number=args.number, repeat=args.repeat))
+        before_ns = before / args.number * 1e9
+        after_ns = after / args.number * 1e9
+        print(f"{name:<20} {before_ns:>10.0f} {after_ns:>10.0f} {before_ns / after_ns:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
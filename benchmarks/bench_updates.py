@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк разбора webhook updates: прежний путь против bot.updates
+
+Запуск:
+    python benchmarks/bench_updates.py [--number 50000] [--corpus benchmarks/corpus/updates.jsonl]
+
+Корпус - записанные updates (по одному JSON на строку) в том виде, в каком
+их присылает Telegram. Прежний путь скопирован из process_webhook /
+handle_update: decode в str, json.loads, цепочка проверок "in" и повторное
+извлечение полей из словарей. Новый путь - parse_update из bytes и доступ
+к тем же полям через представления.
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.updates import JSON_BACKEND, parse_update  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus", "updates.jsonl")
+
+
+def legacy_process(body: bytes):
+    """Путь до рефакторинга (process_webhook + handle_update + handle_*)"""
+    json_string = body.decode('utf-8')
+    update_dict = json.loads(json_string)
+
+    message_timestamp = None
+    message_type = "unknown"
+    if "message" in update_dict:
+        message_timestamp = update_dict["message"].get("date")
+        message_type = "message"
+    elif "business_message" in update_dict:
+        message_timestamp = update_dict["business_message"].get("date")
+        message_type = "business_message"
+
+    if "message" in update_dict:
+        debug_type = "message"
+    elif "business_message" in update_dict:
+        debug_type = "business_message"
+    elif "business_connection" in update_dict:
+        debug_type = "business_connection"
+    elif "edited_business_message" in update_dict:
+        debug_type = "edited_business_message"
+    elif "deleted_business_messages" in update_dict:
+        debug_type = "deleted_business_messages"
+    else:
+        debug_type = f"other: {list(update_dict.keys())}"
+
+    fields = None
+    if message_type in ("message", "business_message"):
+        msg = update_dict[message_type]
+        fields = (
+            msg["chat"]["id"],
+            msg.get("text", "") or msg.get("caption", ""),
+            msg.get("from", {}).get("id", "unknown"),
+            msg.get("from", {}).get("first_name", "Клиент"),
+            msg.get("business_connection_id"),
+        )
+    return message_timestamp, debug_type, fields
+
+
+def new_process(body: bytes):
+    """Путь через parse_update"""
+    update = parse_update(body)
+    message_timestamp = None
+    fields = None
+    if update.kind in ("message", "business_message"):
+        msg = update.message
+        message_timestamp = msg.date
+        fields = (msg.chat_id, msg.text, msg.user_id, msg.user_name, msg.business_connection_id)
+    return message_timestamp, update.type_label, fields
+
+
+def load_corpus(path):
+    with open(path, "rb") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора updates")
+    parser.add_argument("--number", type=int, default=50000, help="проходов по корпусу на один замер")
+    parser.add_argument("--repeat", type=int, default=5, help="число замеров (берется минимум)")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="файл с updates (JSON на строку)")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    for body in corpus:
+        legacy, new = legacy_process(body), new_process(body)
+        # Имя по умолчанию у обычных сообщений отличается ("Пользователь"), но в корпусе оно всегда задано
+        assert legacy == new, (legacy, new)
+
+    def run_legacy():
+        for body in corpus:
+            legacy_process(body)
+
+    def run_new():
+        for body in corpus:
+            new_process(body)
+
+    before = min(timeit.repeat(run_legacy, number=args.number, repeat=args.repeat))
+    after = min(timeit.repeat(run_new, number=args.number, repeat=args.repeat))
+    total = args.number * len(corpus)
+    before_us = before / total * 1e6
+    after_us = after / total * 1e6
+
+    print(f"JSON backend: {JSON_BACKEND}, updates в корпусе: {len(corpus)}")
+    print(f"{'путь':<10} {'мкс/update':>12}")
+    print(f"{'до':<10} {before_us:>12.2f}")
+    print(f"{'после':<10} {after_us:>12.2f}")
+    print(f"ускорение: {before_us / after_us:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""
+Fake-сервисы Telegram Bot API, OpenAI и Zep для офлайн бенчмарков
+
+Небольшие aiohttp серверы (каждый на своем порту) с настраиваемыми
+задержками, внедрением ошибок и счетчиками запросов. webhook.py
+направляется на них переменными окружения (FakeServices.env()), поэтому
+его можно нагружать без сети и с повторяемым результатом (в т.ч. в CI).
+
+Из кода:
+    services = FakeServices(Scenario.load("benchmarks/fake_services/scenarios/baseline.json"))
+    services.start()                 # фоновый поток со своим event loop
+    os.environ.update(services.env())
+    ...
+    print(services.get_stats())
+    services.stop()
+
+Отдельным процессом (адреса выводятся как export для запуска бота):
+    python -m benchmarks.fake_services --scenario benchmarks/fake_services/scenarios/zep_outage.json
+"""
+
+from .profiles import EndpointProfile, Latency, Scenario
+from .runner import FakeServices
+from .telegram import FakeTelegram
+from .openai_api import FakeOpenAI
+from .zep import FakeZep
+
+__all__ = ["EndpointProfile", "FakeOpenAI", "FakeServices", "FakeTelegram", "FakeZep", "Latency", "Scenario"]
@@ -0,0 +1,45 @@
+"""
+Fake-сервисы отдельным процессом
+
+    python -m benchmarks.fake_services [--scenario FILE] [--telegram-port 8081 --openai-port 8082 --zep-port 8083]
+
+Выводит export-строки для запуска бота на fake-сервисах; по Ctrl+C или
+SIGTERM печатает счетчики запросов.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import signal
+
+from . import FakeServices, Scenario
+
+
+async def main(args):
+    scenario = Scenario.load(args.scenario) if args.scenario else Scenario()
+    services = FakeServices(scenario, host=args.host, ports={
+        "telegram": args.telegram_port, "openai": args.openai_port, "zep": args.zep_port
+    })
+    await services.serve()
+    for name, value in services.env().items():
+        print(f"export {name}={value}")
+    print(f"# control API: {', '.join(url + '/_fake/stats' for url in services.urls.values())}", flush=True)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    print(json.dumps(services.get_stats(), ensure_ascii=False, indent=2))
+    await services.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Telegram/OpenAI/Zep для офлайн бенчмарков")
+    parser.add_argument("--scenario", help="JSON сценарий (профили endpoint и расписание)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--telegram-port", type=int, default=8081)
+    parser.add_argument("--openai-port", type=int, default=8082)
+    parser.add_argument("--zep-port", type=int, default=8083)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,117 @@
+import abc
+import asyncio
+import random
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+from .profiles import EndpointProfile
+
+
+class FakeService(abc.ABC):
+    """
+    Основа fake-сервиса: профили endpoint, счетчики запросов и control API
+
+    Control API (для сценариев CI и других процессов):
+        GET  /_fake/stats     - счетчики запросов/ошибок и текущие профили
+        POST /_fake/profile   - {"endpoint": "sendMessage", "latency": ..., "errors": ...}
+        POST /_fake/reset     - сброс счетчиков и состояния
+
+    У каждого endpoint свой генератор случайных чисел (seed + сервис +
+    endpoint), поэтому последовательность задержек и ошибок endpoint не
+    зависит от того, как перемежаются запросы к другим endpoint.
+    """
+
+    name = "service"
+
+    def __init__(self, profiles: Dict[str, Dict[str, Any]] = None, seed: int = 1):
+        self.seed = seed
+        self.profiles: Dict[str, EndpointProfile] = {"default": EndpointProfile()}
+        for endpoint, settings in (profiles or {}).items():
+            self.configure(endpoint, **settings)
+        self.requests = Counter()
+        self.errors = Counter()
+        self._rngs: Dict[str, random.Random] = {}
+
+    # === профили ===
+
+    def profile(self, endpoint: str) -> EndpointProfile:
+        return self.profiles.get(endpoint) or self.profiles["default"]
+
+    def configure(self, endpoint: str = "default", **settings):
+        """Меняет профиль endpoint (не указанные поля берутся из текущего профиля)"""
+        current = self.profiles.get(endpoint) or self.profiles["default"]
+        self.profiles[endpoint] = current.updated(**settings)
+
+    def setting(self, endpoint: str, key: str, default: Any = None) -> Any:
+        return self.profile(endpoint).extra.get(key, default)
+
+    def _rng(self, endpoint: str) -> random.Random:
+        rng = self._rngs.get(endpoint)
+        if rng is None:
+            rng = self._rngs[endpoint] = random.Random(f"{self.seed}:{self.name}:{endpoint}")
+        return rng
+
+    async def inject(self, endpoint: str) -> Optional[web.Response]:
+        """Считает запрос, выдерживает задержку профиля; web.Response если запрос должен упасть"""
+        self.requests[endpoint] += 1
+        profile = self.profile(endpoint)
+        rng = self._rng(endpoint)
+        delay = profile.latency.sample(rng)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        status = profile.pick_error(rng)
+        if status is None:
+            return None
+        self.errors[endpoint] += 1
+        return web.json_response(self.error_body(status), status=status)
+
+    def error_body(self, status: int) -> Dict[str, Any]:
+        """Тело ответа с ошибкой в формате сервиса"""
+        return {"error": "fake error", "status": status}
+
+    # === состояние ===
+
+    def reset(self):
+        self.requests.clear()
+        self.errors.clear()
+        self._rngs.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "service": self.name,
+            "requests": dict(self.requests),
+            "errors": dict(self.errors),
+            "profiles": {endpoint: profile.to_dict() for endpoint, profile in self.profiles.items()}
+        }
+
+    # === HTTP ===
+
+    @abc.abstractmethod
+    def add_routes(self, app: web.Application):
+        """Регистрирует endpoint сервиса в приложении aiohttp"""
+
+    async def _control_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.get_stats())
+
+    async def _control_profile(self, request: web.Request) -> web.Response:
+        settings = await request.json()
+        endpoint = settings.pop("endpoint", "default")
+        try:
+            self.configure(endpoint, **settings)
+        except (TypeError, ValueError) as e:
+            return web.json_response({"error": str(e)}, status=400)
+        return web.json_response({"endpoint": endpoint, "profile": self.profiles[endpoint].to_dict()})
+
+    async def _control_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({"status": "reset"})
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_get("/_fake/stats", self._control_stats)
+        app.router.add_post("/_fake/profile", self._control_profile)
+        app.router.add_post("/_fake/reset", self._control_reset)
+        self.add_routes(app)
+        return app
@@ -0,0 +1,76 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict
+
+from aiohttp import web
+
+from .base import FakeService
+
+
+class FakeOpenAI(FakeService):
+    """
+    OpenAI API: GET /v1/models и POST /v1/chat/completions (stream и без)
+
+    Адрес для бота: OPENAI_BASE_URL=<url>/v1. Задержка профиля - время до
+    первого токена, дальше tokens фрагментов с паузой token_ms.
+    """
+
+    name = "openai"
+
+    DEFAULTS = {"tokens": 40, "token_ms": 5.0}
+
+    def error_body(self, status: int) -> Dict[str, Any]:
+        kind = "rate_limit_exceeded" if status == 429 else "server_error"
+        return {"error": {"message": f"fake error {status}", "type": kind, "code": kind}}
+
+    async def models(self, request: web.Request) -> web.Response:
+        error = await self.inject("models")
+        if error is not None:
+            return error
+        return web.json_response({"object": "list", "data": [
+            {"id": "gpt-4o-mini", "object": "model", "created": 0, "owned_by": "fake"}
+        ]})
+
+    def _chunk(self, model: str, delta: Dict[str, Any], finish_reason=None) -> bytes:
+        chunk = {
+            "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode()
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        endpoint = "chat.completions"
+        error = await self.inject(endpoint)
+        if error is not None:
+            return error
+        body = await request.json()
+        model = body.get("model", "gpt-4o-mini")
+        tokens = int(self.setting(endpoint, "tokens", self.DEFAULTS["tokens"]))
+        token_ms = float(self.setting(endpoint, "token_ms", self.DEFAULTS["token_ms"]))
+        words = [f"слово{index} " for index in range(tokens)]
+
+        if not body.get("stream"):
+            await asyncio.sleep(tokens * token_ms / 1000)
+            return web.json_response({
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": tokens, "total_tokens": tokens}
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(self._chunk(model, {"role": "assistant", "content": ""}))
+        for word in words:
+            if token_ms:
+                await asyncio.sleep(token_ms / 1000)
+            await response.write(self._chunk(model, {"content": word}))
+        await response.write(self._chunk(model, {}, "stop"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def add_routes(self, app: web.Application):
+        app.router.add_get("/v1/models", self.models)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
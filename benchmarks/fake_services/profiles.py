@@ -0,0 +1,124 @@
+"""
+Профили задержки и ошибок fake-сервисов
+
+Задержка задается строкой:
+    "0" | "fixed:50" | "uniform:20:80" | "lognormal:300:0.6" (медиана мс, sigma)
+
+Ошибки - доля запросов и HTTP статус, можно несколько через запятую:
+    "0.02" (500) | "0.02:429" | "0.01:429,0.005:503"
+"""
+
+import json
+import random
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class Latency:
+    """Распределение задержки"""
+
+    KINDS = ("fixed", "uniform", "lognormal")
+
+    def __init__(self, spec: str = "0"):
+        self.spec = str(spec)
+        kind, *args = self.spec.split(":")
+        self.kind = kind if args else "fixed"
+        self.args = [float(a) for a in args] if args else [float(kind)]
+        if self.kind not in self.KINDS:
+            raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+    def sample(self, rng: random.Random) -> float:
+        """Задержка в секундах"""
+        if self.kind == "uniform":
+            ms = rng.uniform(self.args[0], self.args[1])
+        elif self.kind == "lognormal":
+            median, sigma = self.args
+            ms = median * rng.lognormvariate(0, sigma) if median > 0 else 0.0
+        else:
+            ms = self.args[0]
+        return ms / 1000
+
+
+def parse_errors(spec: str) -> List[Tuple[float, int]]:
+    """"0.01:429,0.005:503" -> [(0.01, 429), (0.005, 503)]"""
+    faults = []
+    for part in str(spec).split(","):
+        rate, _, status = part.strip().partition(":")
+        if rate and float(rate) > 0:
+            faults.append((float(rate), int(status or 500)))
+    return faults
+
+
+class EndpointProfile:
+    """
+    Поведение endpoint: задержка, ошибки и параметры сервиса
+    (например tokens/token_ms для stream OpenAI)
+    """
+
+    __slots__ = ('latency', 'errors', 'extra')
+
+    def __init__(self, latency: str = "0", errors: str = "0", **extra):
+        self.latency = Latency(latency)
+        self.errors = parse_errors(errors)
+        self.extra = extra
+
+    def updated(self, **settings) -> 'EndpointProfile':
+        """Копия профиля с измененными полями (профили не мутируются - их читают обработчики)"""
+        merged = {"latency": self.latency.spec, "errors": self.errors_spec(), **self.extra}
+        merged.update(settings)
+        return EndpointProfile(**merged)
+
+    def errors_spec(self) -> str:
+        return ",".join(f"{rate}:{status}" for rate, status in self.errors) or "0"
+
+    def pick_error(self, rng: random.Random) -> Optional[int]:
+        """HTTP статус ошибки для этого запроса или None"""
+        if not self.errors:
+            return None
+        roll = rng.random()
+        for rate, status in self.errors:
+            if roll < rate:
+                return status
+            roll -= rate
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"latency": self.latency.spec, "errors": self.errors_spec(), **self.extra}
+
+
+class Scenario:
+    """
+    Сценарий из JSON: профили endpoint и изменения по расписанию
+
+    {
+      "seed": 1,
+      "services": {
+        "telegram": {"default": {"latency": "uniform:20:60"}, "sendMessage": {"errors": "0.01:429"}},
+        "openai": {"default": {"latency": "lognormal:300:0.4", "tokens": 40, "token_ms": 5}},
+        "zep": {"default": {"latency": "fixed:30"}}
+      },
+      "schedule": [
+        {"at": 10, "service": "zep", "errors": "0.5:503"},
+        {"at": 20, "service": "zep", "errors": "0"}
+      ]
+    }
+
+    endpoint в schedule необязателен ("default" - все endpoint без своего профиля).
+    """
+
+    def __init__(self, services: Dict[str, Dict[str, Dict[str, Any]]] = None,
+                 schedule: List[Dict[str, Any]] = None, seed: int = 1):
+        self.services = services or {}
+        self.schedule = sorted(schedule or [], key=lambda step: step["at"])
+        self.seed = seed
+
+    @classmethod
+    def load(cls, path: str) -> 'Scenario':
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("services"), data.get("schedule"), data.get("seed", 1))
+
+    def override(self, service: str, endpoint: str = "default", **settings):
+        """Изменяет профиль (для параметров командной строки поверх файла)"""
+        settings = {key: value for key, value in settings.items() if value is not None}
+        if settings:
+            self.services.setdefault(service, {}).setdefault(endpoint, {}).update(settings)
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from aiohttp import web
+
+from .openai_api import FakeOpenAI
+from .profiles import Scenario
+from .telegram import FakeTelegram
+from .zep import FakeZep
+
+logger = logging.getLogger(__name__)
+
+
+class FakeServices:
+    """
+    Три fake-сервиса по сценарию: запуск, расписание изменений профилей, статистика
+
+    start()/stop() - в фоновом потоке со своим event loop (задержки
+    fake-сервисов не попадают в измеряемый loop бота); serve() - в текущем loop.
+    """
+
+    def __init__(
+        self,
+        scenario: Optional[Scenario] = None,
+        host: str = "127.0.0.1",
+        ports: Optional[Dict[str, int]] = None,     # 0 - свободный порт
+        on_message: Optional[Callable[[Dict[str, Any]], None]] = None
+    ):
+        self.scenario = scenario or Scenario()
+        self.host = host
+        self.ports = {"telegram": 0, "openai": 0, "zep": 0, **(ports or {})}
+        profiles = self.scenario.services
+        seed = self.scenario.seed
+        self.telegram = FakeTelegram(profiles.get("telegram"), seed, on_message=on_message)
+        self.openai = FakeOpenAI(profiles.get("openai"), seed)
+        self.zep = FakeZep(profiles.get("zep"), seed)
+        self.services = {"telegram": self.telegram, "openai": self.openai, "zep": self.zep}
+        self.urls: Dict[str, str] = {}
+        self.applied_steps = 0
+        self._runners = []
+        self._timers = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _apply_step(self, step: Dict[str, Any]):
+        settings = {k: v for k, v in step.items() if k not in ("at", "service", "endpoint")}
+        self.services[step["service"]].configure(step.get("endpoint", "default"), **settings)
+        self.applied_steps += 1
+        logger.info(f"🎬 Сценарий +{step['at']}с: {step['service']}.{step.get('endpoint', 'default')} -> {settings}")
+
+    async def serve(self):
+        """Запуск серверов и расписания сценария в текущем event loop"""
+        loop = asyncio.get_running_loop()
+        for name, service in self.services.items():
+            runner = web.AppRunner(service.make_app(), access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, self.host, self.ports[name])
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            self.urls[name] = f"http://{self.host}:{port}"
+            self._runners.append(runner)
+        for step in self.scenario.schedule:
+            self._timers.append(loop.call_later(step["at"], self._apply_step, step))
+
+    async def close(self):
+        for timer in self._timers:
+            timer.cancel()
+        for runner in self._runners:
+            await runner.cleanup()
+        self._runners.clear()
+        # Запросы, брошенные клиентом на середине (отмененный stream OpenAI и т.п.)
+        pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def start(self) -> Dict[str, str]:
+        """Запуск в фоновом потоке; возвращает адреса сервисов"""
+        started = threading.Event()
+        failure = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._loop.run_until_complete(self.serve())
+            except Exception as e:
+                failure.append(e)
+                return
+            finally:
+                started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="fake-services", daemon=True)
+        self._thread.start()
+        if not started.wait(10):
+            raise RuntimeError("Fake-сервисы не запустились за 10 секунд")
+        if failure:
+            raise failure[0]
+        return self.urls
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.close(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+        self._loop.close()
+        self._loop = None
+
+    def env(self) -> Dict[str, str]:
+        """Переменные окружения, направляющие бота на fake-сервисы"""
+        return {
+            "TELEGRAM_API_BASE": self.urls["telegram"],
+            "OPENAI_BASE_URL": f"{self.urls['openai']}/v1",
+            "ZEP_API_URL": self.urls["zep"],
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "urls": self.urls,
+            "scenario_steps_applied": self.applied_steps,
+            **{name: service.get_stats() for name, service in self.services.items()}
+        }
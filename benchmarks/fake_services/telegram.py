@@ -0,0 +1,125 @@
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from aiohttp import web
+
+from .base import FakeService
+
+
+class FakeTelegram(FakeService):
+    """
+    Bot API: getMe, getWebhookInfo, setWebhook, deleteWebhook, getUpdates, sendMessage, sendChatAction
+
+    Адрес для бота: TELEGRAM_API_BASE=<url>. Отправленные сообщения хранятся
+    (последние max_messages) и передаются в on_message - по ним нагрузочный
+    тест считает время до ответа клиенту. Накопившиеся updates для проверки
+    выгрузки backlog задаются через POST /_fake/backlog: getUpdates выдает их,
+    а offset подтверждает, как в Telegram.
+    """
+
+    name = "telegram"
+
+    def __init__(self, profiles=None, seed: int = 1, max_messages: int = 1000,
+                 on_message: Optional[Callable[[Dict[str, Any]], None]] = None):
+        super().__init__(profiles, seed)
+        self.on_message = on_message
+        self.messages = deque(maxlen=max_messages)
+        self.webhook: Dict[str, Any] = {"url": "", "allowed_updates": None}
+        self.backlog: List[Dict[str, Any]] = []
+        self._message_id = 0
+
+    def error_body(self, status: int) -> Dict[str, Any]:
+        body = {"ok": False, "error_code": status, "description": f"fake error {status}"}
+        if status == 429:
+            body["parameters"] = {"retry_after": 1}
+        return body
+
+    def reset(self):
+        super().reset()
+        self.messages.clear()
+        self.backlog.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = super().get_stats()
+        stats["webhook"] = self.webhook
+        stats["messages_stored"] = len(self.messages)
+        stats["backlog"] = len(self.backlog)
+        return stats
+
+    async def _params(self, request: web.Request) -> Dict[str, Any]:
+        """telebot передает параметры в query string, прямые вызовы бота - в JSON"""
+        params = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            else:
+                params.update(await request.post())
+        return params
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        error = await self.inject(method)
+        if error is not None:
+            return error
+        params = await self._params(request)
+
+        if method == "getMe":
+            result = {"id": 100000, "is_bot": True, "first_name": "Fake Bot", "username": "fake_bot",
+                      "can_connect_to_business": True}
+        elif method == "getWebhookInfo":
+            result = {"url": self.webhook["url"], "has_custom_certificate": False, "pending_update_count": len(self.backlog),
+                      "allowed_updates": self.webhook["allowed_updates"]}
+        elif method == "setWebhook":
+            allowed = params.get("allowed_updates")
+            self.webhook = {"url": params.get("url", ""), "allowed_updates": allowed}
+            result = True
+        elif method == "deleteWebhook":
+            self.webhook = {"url": "", "allowed_updates": None}
+            result = True
+        elif method == "sendMessage":
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "text": params.get("text", "")
+            }
+            if params.get("business_connection_id"):
+                result["business_connection_id"] = params["business_connection_id"]
+            self.messages.append(result)
+            if self.on_message is not None:
+                self.on_message(result)
+        elif method == "getUpdates":
+            if self.webhook["url"]:
+                return web.json_response(
+                    {"ok": False, "error_code": 409, "description": "Conflict: can't use getUpdates method while webhook is active"},
+                    status=409
+                )
+            if params.get("offset") is not None:
+                # Updates до offset подтверждены и удаляются
+                offset = int(params["offset"])
+                self.backlog = [update for update in self.backlog if update["update_id"] >= offset]
+            result = self.backlog[:int(params.get("limit", 100))]
+        else:
+            # sendChatAction и прочие методы без результата
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def list_messages(self, request: web.Request) -> web.Response:
+        """Отправленные ботом сообщения (для проверок в CI): ?chat_id=&limit="""
+        chat_id = request.query.get("chat_id")
+        limit = int(request.query.get("limit", 100))
+        messages = [m for m in self.messages if chat_id is None or str(m["chat"]["id"]) == chat_id]
+        return web.json_response(messages[-limit:])
+
+    async def add_backlog(self, request: web.Request) -> web.Response:
+        """Накопившиеся за время простоя updates: тело - список updates"""
+        self.backlog.extend(await request.json())
+        self.backlog.sort(key=lambda update: update["update_id"])
+        return web.json_response({"backlog": len(self.backlog)})
+
+    def add_routes(self, app: web.Application):
+        app.router.add_get("/_fake/messages", self.list_messages)
+        app.router.add_post("/_fake/backlog", self.add_backlog)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
@@ -0,0 +1,113 @@
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Any, Dict
+
+from aiohttp import web
+
+from .base import FakeService
+
+API = "/api/v2"
+
+
+class FakeZep(FakeService):
+    """
+    Zep Cloud v2: пользователи, сессии и память сессий
+
+    Адрес для бота: ZEP_API_URL=<url> (SDK сам добавляет /api/v2). Память
+    хранится в процессе: memory.get возвращает последние max_messages
+    сообщений, добавленных memory.add, и короткий context.
+    """
+
+    name = "zep"
+
+    def __init__(self, profiles=None, seed: int = 1, max_messages: int = 20):
+        super().__init__(profiles, seed)
+        self.max_messages = max_messages
+        self.users: Dict[str, Dict[str, Any]] = {}
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.memory = defaultdict(lambda: deque(maxlen=self.max_messages))
+
+    def error_body(self, status: int) -> Dict[str, Any]:
+        return {"message": f"fake error {status}"}
+
+    def reset(self):
+        super().reset()
+        self.users.clear()
+        self.sessions.clear()
+        self.memory.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = super().get_stats()
+        stats.update(users=len(self.users), sessions=len(self.sessions))
+        return stats
+
+    async def get_user(self, request: web.Request) -> web.Response:
+        error = await self.inject("user.get")
+        if error is not None:
+            return error
+        user = self.users.get(request.match_info["user_id"])
+        if user is None:
+            return web.json_response({"message": "not found"}, status=404)
+        return web.json_response(user)
+
+    async def add_user(self, request: web.Request) -> web.Response:
+        error = await self.inject("user.add")
+        if error is not None:
+            return error
+        data = await request.json()
+        user_id = data.get("user_id")
+        if user_id in self.users:
+            return web.json_response({"message": "user already exists"}, status=400)
+        user = dict(data, created_at=datetime.now().isoformat())
+        self.users[user_id] = user
+        return web.json_response(user)
+
+    async def list_users(self, request: web.Request) -> web.Response:
+        error = await self.inject("user.list_ordered")
+        if error is not None:
+            return error
+        page_size = int(request.query.get("pageSize", 10))
+        users = list(self.users.values())[:page_size]
+        return web.json_response({"users": users, "total_count": len(self.users), "row_count": len(users)})
+
+    async def add_session(self, request: web.Request) -> web.Response:
+        error = await self.inject("memory.add_session")
+        if error is not None:
+            return error
+        data = await request.json()
+        session_id = data.get("session_id")
+        if session_id in self.sessions:
+            return web.json_response({"message": "session already exists"}, status=400)
+        session = dict(data, created_at=datetime.now().isoformat())
+        self.sessions[session_id] = session
+        return web.json_response(session)
+
+    async def get_memory(self, request: web.Request) -> web.Response:
+        error = await self.inject("memory.get")
+        if error is not None:
+            return error
+        messages = list(self.memory.get(request.match_info["session_id"], ()))
+        context = f"Клиент обсуждал с консультантом {len(messages)} сообщений." if messages else ""
+        return web.json_response({"context": context, "messages": messages})
+
+    async def add_memory(self, request: web.Request) -> web.Response:
+        error = await self.inject("memory.add")
+        if error is not None:
+            return error
+        data = await request.json()
+        session_messages = self.memory[request.match_info["session_id"]]
+        for message in data.get("messages", []):
+            session_messages.append({
+                "role": message.get("role"),
+                "role_type": message.get("role_type"),
+                "content": message.get("content", "")
+            })
+        return web.json_response({})
+
+    def add_routes(self, app: web.Application):
+        app.router.add_get(f"{API}/users-ordered", self.list_users)
+        app.router.add_get(f"{API}/users/{{user_id}}", self.get_user)
+        app.router.add_post(f"{API}/users", self.add_user)
+        app.router.add_post(f"{API}/sessions", self.add_session)
+        app.router.add_get(f"{API}/sessions/{{session_id}}/memory", self.get_memory)
+        app.router.add_post(f"{API}/sessions/{{session_id}}/memory", self.add_memory)
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест webhook:app на fake-сервисах Telegram, OpenAI и Zep
+
+Запуск:
+    python benchmarks/loadtest.py [--rate 50] [--duration 30] [--concurrency 64]
+        [--corpus benchmarks/corpus/updates.jsonl]
+        [--scenario benchmarks/fake_services/scenarios/zep_outage.json]
+        [--openai-latency lognormal:400:0.5] [--openai-errors 0.02:429]
+        [--telegram-latency uniform:20:80] [--zep-latency fixed:30] [--zep-errors 0.01]
+
+Приложение запускается в этом процессе (startup/shutdown как у uvicorn), а
+updates отправляются через ASGI транспорт httpx - без сети, но через весь
+стек FastAPI. Fake-сервисы работают в отдельном потоке (benchmarks/fake_services),
+БД, логи и версии инструкций - во временном каталоге.
+
+Без --corpus генерируются синтетические updates: business_message,
+message и business_connection в пропорции --mix по --chats чатам. С
+--corpus записанные updates воспроизводятся по кругу (дата заменяется на
+текущую, update_id - на уникальный).
+
+Отчет:
+    - пропускная способность приема (updates/s) и обработки (ответов/s)
+    - p50/p95/p99 ответа webhook (ack) и времени до ответа клиенту (sendMessage в fake Telegram)
+    - задержка event loop: насколько позже запланированного просыпается периодическая задача
+"""
+
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict, deque
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_services import FakeServices, Scenario  # noqa: E402
+
+DEFAULT_SCENARIO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_services", "scenarios", "baseline.json")
+
+SECRET = "loadtest-secret"
+QUESTIONS = [
+    "Здравствуйте! Сколько стоит пошив 500 футболок с логотипом?",
+    "Какие сроки изготовления худи?",
+    "Есть ли у вас образцы тканей?",
+    "Можно ли заказать доставку в Казахстан?",
+    "Какой минимальный тираж для вышивки?",
+    "Работаете ли вы с хлопком пенье?",
+]
+
+
+def percentiles(values, points=(50, 95, 99)):
+    """Перцентили (nearest rank) + максимум, в мс"""
+    if not values:
+        return {f"p{p}": None for p in points} | {"max": None, "count": 0}
+    ordered = sorted(values)
+    result = {f"p{p}": round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))], 1) for p in points}
+    result["max"] = round(ordered[-1], 1)
+    result["count"] = len(ordered)
+    return result
+
+
+def parse_mix(spec: str):
+    kinds, weights = [], []
+    for part in spec.split(","):
+        kind, _, weight = part.partition("=")
+        kinds.append(kind.strip())
+        weights.append(float(weight or 1))
+    return kinds, weights
+
+
+class UpdateSource:
+    """Поток updates: синтетические или записанные (с уникальными update_id и текущей датой)"""
+
+    def __init__(self, args):
+        self.rng = random.Random(args.seed)
+        self.chats = args.chats
+        self.connections = args.connections
+        self.kinds, self.weights = parse_mix(args.mix)
+        self.counter = itertools.count(1)
+        self.corpus = None
+        if args.corpus:
+            with open(args.corpus, "rb") as f:
+                self.corpus = [json.loads(line) for line in f if line.strip()]
+            self.corpus_iter = itertools.cycle(self.corpus)
+
+    def next(self):
+        """(update, chat_id или None если ответа не ожидается)"""
+        n = next(self.counter)
+        now = int(time.time())
+        if self.corpus is not None:
+            update = json.loads(json.dumps(next(self.corpus_iter)))
+            update["update_id"] = n
+            kind = next((k for k in update if k != "update_id"), None)
+            body = update.get(kind)
+            if isinstance(body, dict) and "date" in body:
+                body["date"] = now
+            expects_reply = kind in ("message", "business_message") and isinstance(body, dict)
+            return update, body["chat"]["id"] if expects_reply else None
+
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        chat = self.rng.randrange(self.chats)
+        connection_id = f"Bconn_load_{chat % self.connections}"
+        if kind == "business_connection":
+            owner = 900000 + chat % self.connections
+            return {"update_id": n, "business_connection": {
+                "id": connection_id, "user": {"id": owner, "first_name": "Владелец", "username": f"owner{owner}"},
+                "user_chat_id": owner, "date": now, "can_reply": True, "is_enabled": True
+            }}, None
+
+        chat_id = (200000 if kind == "business_message" else 300000) + chat
+        # Номер в тексте - иначе LoopDetector отсеет повторы как duplicate_message
+        message = {
+            "message_id": n, "date": now,
+            "chat": {"id": chat_id, "first_name": "Клиент", "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Клиент", "language_code": "ru"},
+            "text": f"{self.rng.choice(QUESTIONS)} (#{n})"
+        }
+        if kind == "business_message":
+            message["business_connection_id"] = connection_id
+        return {"update_id": n, kind: message}, chat_id
+
+
+async def sample_loop_lag(interval: float, samples: list, stop: asyncio.Event):
+    """Задержка пробуждения периодической задачи = время, когда loop был занят чужим кодом"""
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - expected) * 1000)
+
+
+async def run(args, webhook, services, replies):
+    import httpx
+
+    await webhook.startup()
+    source = UpdateSource(args)
+    lag_samples, ack_ms, statuses = [], [], Counter()
+    sends = defaultdict(deque)     # chat_id -> времена отправки update, ожидающих ответа
+    stop_lag = asyncio.Event()
+    lag_task = asyncio.create_task(sample_loop_lag(args.lag_interval / 1000, lag_samples, stop_lag))
+    semaphore = asyncio.Semaphore(args.concurrency)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=webhook.app), base_url="http://loadtest") as client:
+        async def fire(update, chat_id):
+            try:
+                started = time.perf_counter()
+                if chat_id is not None:
+                    sends[chat_id].append(started)
+                try:
+                    response = await client.post("/webhook", content=json.dumps(update), headers=headers)
+                    ack_ms.append((time.perf_counter() - started) * 1000)
+                    body = response.json()
+                    statuses[body.get("status") or body.get("action") or f"http_{response.status_code}"] += 1
+                except Exception as e:
+                    statuses[f"exception:{type(e).__name__}"] += 1
+            finally:
+                semaphore.release()
+
+        tasks = set()
+        started = time.perf_counter()
+        deadline = started + args.duration
+        sent = 0
+        while time.perf_counter() < deadline and (not args.count or sent < args.count):
+            if args.rate:
+                # Открытая модель нагрузки: отправка по расписанию, независимо от ответов
+                target = started + sent / args.rate
+                delay = target - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await semaphore.acquire()
+            update, chat_id = source.next()
+            task = asyncio.create_task(fire(update, chat_id))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            sent += 1
+        send_seconds = time.perf_counter() - started
+        await asyncio.gather(*tasks)
+
+        # Ждем, пока пул обработает очередь (ответы приходят в заглушку Telegram)
+        drain_deadline = time.perf_counter() + args.drain_timeout
+        while time.perf_counter() < drain_deadline:
+            stats = webhook.worker_pool.get_stats()
+            if stats["queued"] == 0 and stats["in_flight"] == 0 and not webhook.stale_coalescer.get_stats()["buffered_messages"]:
+                break
+            await asyncio.sleep(0.05)
+        total_seconds = time.perf_counter() - started
+
+    stop_lag.set()
+    await lag_task
+    pool_stats = webhook.worker_pool.get_stats()
+    loop_blocks = webhook.loop_monitor.get_stats(include_stacks=False)["blocked_by_source"] if webhook.loop_monitor else {}
+    await webhook.shutdown()
+
+    # Ответ сопоставляется с самым ранним неотвеченным update того же чата
+    e2e_ms = []
+    for chat_id, replied_at in sorted(replies, key=lambda item: item[1]):
+        pending = sends.get(chat_id)
+        if pending:
+            e2e_ms.append((replied_at - pending.popleft()) * 1000)
+
+    return {
+        "sent": sent,
+        "send_seconds": round(send_seconds, 2),
+        "total_seconds": round(total_seconds, 2),
+        "ingest_rate": round(sent / send_seconds, 1) if send_seconds else None,
+        "reply_rate": round(len(replies) / total_seconds, 1) if total_seconds else None,
+        "replies": len(replies),
+        "unanswered": sum(len(pending) for pending in sends.values()),
+        "ack_ms": percentiles(ack_ms),
+        "end_to_end_ms": percentiles(e2e_ms),
+        "loop_lag_ms": percentiles(lag_samples),
+        "webhook_statuses": dict(statuses),
+        "pool": pool_stats,
+        "loop_blocks": loop_blocks,
+        "fake_requests": {name: service.get_stats()["requests"] for name, service in services.services.items()},
+        "fake_errors": {name: service.get_stats()["errors"] for name, service in services.services.items()},
+    }
+
+
+def print_report(report, args):
+    print("\n" + "=" * 60)
+    print("📊 НАГРУЗОЧНЫЙ ТЕСТ webhook:app")
+    print("=" * 60)
+    print(f"Режим: {'корпус ' + args.corpus if args.corpus else 'синтетика ' + args.mix}, сценарий {os.path.basename(args.scenario)}")
+    print(f"Отправлено: {report['sent']} updates за {report['send_seconds']} с "
+          f"(прием {report['ingest_rate']}/с, цель {args.rate or 'макс'}/с, concurrency {args.concurrency})")
+    print(f"Ответов клиентам: {report['replies']} за {report['total_seconds']} с "
+          f"({report['reply_rate']}/с), без ответа: {report['unanswered']}")
+    print(f"\n{'метрика':<22}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'n':>8}")
+    for title, key in (("ack webhook, мс", "ack_ms"), ("до ответа, мс", "end_to_end_ms"), ("лаг event loop, мс", "loop_lag_ms")):
+        stats = report[key]
+        row = "".join(f"{'—' if stats[p] is None else stats[p]:>9}" for p in ("p50", "p95", "p99", "max"))
+        print(f"{title:<22}{row}{stats['count']:>8}")
+    print(f"\nСтатусы webhook: {report['webhook_statuses']}")
+    print(f"Исходы обработки: {report['pool']['actions']} (ошибок: {report['pool']['failed']}, "
+          f"отклонено: {report['pool']['rejected']}, макс. ожидание в очереди {report['pool']['max_queue_wait_ms']} мс)")
+    for source, stats in report["loop_blocks"].items():
+        print(f"Блокировки event loop в {source}: {stats['count']} (всего {stats['total_ms']} мс, макс. {stats['max_ms']} мс)")
+    for name, requests in report["fake_requests"].items():
+        errors = report["fake_errors"][name]
+        print(f"Запросы к fake {name}: {requests}" + (f", внедренные ошибки: {errors}" if errors else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест webhook:app на fake-сервисах")
+    parser.add_argument("--rate", type=float, default=50, help="updates в секунду (0 - без ограничения)")
+    parser.add_argument("--duration", type=float, default=20, help="длительность отправки, с")
+    parser.add_argument("--count", type=int, default=0, help="остановиться после N updates")
+    parser.add_argument("--concurrency", type=int, default=64, help="одновременных запросов к webhook")
+    parser.add_argument("--corpus", help="записанные updates (JSON на строку)")
+    parser.add_argument("--mix", default="business_message=0.85,message=0.1,business_connection=0.05")
+    parser.add_argument("--chats", type=int, default=2000)
+    parser.add_argument("--connections", type=int, default=5, help="business аккаунтов")
+    parser.add_argument("--workers", type=int, default=None, help="WORKER_CONCURRENCY бота")
+    parser.add_argument("--scenario", default=DEFAULT_SCENARIO, help="сценарий fake-сервисов (JSON)")
+    # Поверх сценария (профиль "default" сервиса)
+    parser.add_argument("--telegram-latency")
+    parser.add_argument("--telegram-errors")
+    parser.add_argument("--openai-latency", help="время до первого токена")
+    parser.add_argument("--openai-errors")
+    parser.add_argument("--openai-tokens", type=int)
+    parser.add_argument("--openai-token-ms", type=float)
+    parser.add_argument("--zep-latency")
+    parser.add_argument("--zep-errors")
+    parser.add_argument("--lag-interval", type=float, default=10, help="период замера лага event loop, мс")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="ожидание обработки очереди после отправки, с")
+    parser.add_argument("--seed", type=int, help="seed updates и fake-сервисов (по умолчанию из сценария)")
+    parser.add_argument("--json", help="сохранить отчет в JSON")
+    parser.add_argument("--verbose", action="store_true", help="не глушить print/лог бота в консоли")
+    args = parser.parse_args()
+    # Пути - до перехода во временный каталог
+    args.corpus = args.corpus and os.path.abspath(args.corpus)
+    args.json = args.json and os.path.abspath(args.json)
+
+    scenario = Scenario.load(args.scenario)
+    scenario.override("telegram", latency=args.telegram_latency, errors=args.telegram_errors)
+    scenario.override("openai", latency=args.openai_latency, errors=args.openai_errors,
+                      tokens=args.openai_tokens, token_ms=args.openai_token_ms)
+    scenario.override("zep", latency=args.zep_latency, errors=args.zep_errors)
+    if args.seed is not None:
+        scenario.seed = args.seed
+    args.seed = scenario.seed
+
+    replies = []
+    services = FakeServices(
+        scenario,
+        # Вызывается в потоке fake-сервисов: list.append атомарен
+        on_message=lambda message: replies.append((message["chat"]["id"], time.perf_counter()))
+    )
+    services.start()
+
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    os.environ.update(services.env())
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123456:loadtest",
+        "OPENAI_API_KEY": "sk-loadtest",
+        "ZEP_API_KEY": "zep-loadtest",
+        "WEBHOOK_SECRET_TOKEN": SECRET,
+        "WEBHOOK_URL": "http://loadtest/webhook",
+        "DATABASE_PATH": os.path.join(workdir, "bot.db"),
+        "INSTRUCTION_STORE_PATH": os.path.join(workdir, "bot.db"),
+        "ANALYTICS_DB_PATH": os.path.join(workdir, "analytics.db"),
+        "INSTRUCTION_WATCH_INTERVAL": "0",
+        "BACKLOG_DRAIN_THRESHOLD": "0",
+    })
+    if args.workers:
+        os.environ["WORKER_CONCURRENCY"] = str(args.workers)
+    # logs/bot.log бота пишется во временный каталог
+    os.chdir(workdir)
+
+    quiet = contextlib.ExitStack()
+    if not args.verbose:
+        quiet.enter_context(contextlib.redirect_stdout(open(os.devnull, "w")))
+    with quiet:
+        import webhook
+        if not args.verbose:
+            webhook.logger.removeHandler(webhook.console_handler)
+            # Предупреждения модулей bot/* (без своих хендлеров) - в файл, а не в консоль
+            logging.basicConfig(filename=os.path.join(workdir, "modules.log"), level=logging.WARNING)
+        report = asyncio.run(run(args, webhook, services, replies))
+    services.stop()
+
+    print_report(report, args)
+    print(f"\nЛоги и БД прогона: {workdir}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
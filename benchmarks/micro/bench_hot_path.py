@@ -0,0 +1,213 @@
+"""
+Микробенчмарки CPU части обработки одного update
+
+Запуск (результаты сохраняются с id коммита, см. benchmarks/run_micro.py):
+    python benchmarks/run_micro.py [--compare]
+"""
+
+import itertools
+import json
+import time
+
+from bot.agent import TextilProAgent
+from bot.attachments import has_attachments
+from bot.database import BusinessOwnersDB
+from bot.scheduler import PriorityFairQueue
+from bot.stale_policy import is_message_too_old
+from bot.updates import parse_update
+from bot.warm_snapshot import WarmSnapshot
+from bot.worker_pool import UpdateJob
+
+from conftest import ACTIVE_CHATS
+
+PHOTO_MESSAGE = {
+    "message_id": 1, "date": 1750000000, "chat": {"id": 1, "type": "private"},
+    "caption": "Вот такой принт нужен",
+    "photo": [
+        {"file_id": "small", "file_unique_id": "s", "width": 90, "height": 90, "file_size": 1200},
+        {"file_id": "large", "file_unique_id": "l", "width": 1280, "height": 1280, "file_size": 180000},
+    ],
+}
+ZEP_CONTEXT = "Клиент заказывает футболки с логотипом для корпоратива, бюджет ограничен. " * 10
+ZEP_HISTORY = "\n".join(
+    f"{'Пользователь' if index % 2 == 0 else 'Ассистент'}: сообщение {index} о ткани, сроках и цене партии"
+    for index in range(6)
+)
+
+
+# === разбор update ===
+
+def bench_json_loads(benchmark, corpus_bodies):
+    benchmark(lambda: [json.loads(body) for body in corpus_bodies])
+
+
+def bench_parse_update(benchmark, corpus_bodies):
+    """Путь webhook: parse_update (orjson если установлен) + поля сообщения"""
+    def run():
+        for body in corpus_bodies:
+            update = parse_update(body)
+            if update.is_message:
+                message = update.message
+                message.chat_id, message.text, message.user_id, message.business_connection_id
+
+    benchmark(run)
+
+
+# === фильтры сообщения ===
+
+def bench_has_attachments_text(benchmark, corpus_messages):
+    benchmark(lambda: [has_attachments(message) for message in corpus_messages])
+
+
+def bench_has_attachments_photo(benchmark):
+    benchmark(has_attachments, PHOTO_MESSAGE)
+
+
+def bench_is_message_too_old(benchmark):
+    timestamp = int(time.time()) - 30
+    benchmark(is_message_too_old, timestamp)
+
+
+# === LoopDetector при 10k активных чатов ===
+
+def bench_message_hash(benchmark):
+    detector_text = "Здравствуйте!  Сколько стоит пошив 500 футболок   с логотипом?"
+    from bot.loop_detector import LoopDetector
+    benchmark(LoopDetector()._get_message_hash, detector_text, 123456)
+
+
+def bench_loop_should_ignore_10k_chats(benchmark, loop_detector):
+    """
+    Сообщение клиента проходит все проверки (частота, подписи, дубликаты)
+
+    min_message_interval=0: проверка частоты выполняется, но повторный заход
+    в тот же чат за время бенчмарка не считается петлей.
+    """
+    loop_detector.min_message_interval = 0.0
+    counter = itertools.count()
+
+    def run():
+        n = next(counter)
+        return loop_detector.should_ignore_message(
+            text=f"Сколько стоит пошив {n} футболок?", chat_id=n % ACTIVE_CHATS, user_id=n
+        )
+
+    result = benchmark(run)
+    assert result == (False, None)
+
+
+def bench_loop_track_bot_response_10k_chats(benchmark, loop_detector):
+    counter = itertools.count()
+
+    def run():
+        n = next(counter)
+        loop_detector.track_bot_response(f"Ответ консультанта номер {n}", n % ACTIVE_CHATS)
+
+    benchmark(run)
+
+
+# === сборка промпта ===
+
+def bench_build_system_prompt(benchmark, prompt):
+    benchmark(prompt.build_system_prompt, ZEP_CONTEXT, ZEP_HISTORY, "Клиент написал несколько сообщений подряд.")
+
+
+def bench_generate_response_offline(benchmark, prompt, event_loop_runner, capsys):
+    """
+    generate_response без OpenAI и Zep: локальная история, сборка промпта,
+    запасной ответ и запись в локальную память (print'ы - часть пути)
+    """
+    agent = TextilProAgent()
+    agent._clients_ready = True
+    agent.set_prompt(prompt)
+    for index in range(10):
+        agent.add_to_local_session("user_1", f"вопрос {index}", f"ответ {index}")
+
+    benchmark(lambda: event_loop_runner(agent.generate_response("Сколько стоит ткань?", "user_1", "Клиент")))
+
+
+# === фильтр владельца ===
+
+async def _owners_db(tmp_path):
+    db = BusinessOwnersDB(str(tmp_path / "owners.db"))
+    await db.init_db()
+    for index in range(100):
+        await db.save_business_owner(f"Bconn_{index}", 900000 + index, f"Владелец {index}")
+    return db
+
+
+def bench_is_owner_message_cached(benchmark, tmp_path, event_loop_runner):
+    db = event_loop_runner(_owners_db(tmp_path))
+    result = benchmark(lambda: event_loop_runner(db.is_owner_message("Bconn_42", 123456)))
+    assert result is False
+
+
+def bench_is_owner_message_uncached(benchmark, tmp_path, event_loop_runner):
+    """Промах кэша: запрос к SQLite (первое сообщение после старта или деактивации)"""
+    db = event_loop_runner(_owners_db(tmp_path))
+
+    def run():
+        db._owner_cache.clear()
+        return event_loop_runner(db.is_owner_message("Bconn_42", 900042))
+
+    assert benchmark(run) is True
+
+
+# === снимок кэшей ===
+
+def _warm_sections():
+    exchange = {"user": "Сколько стоит пошив 500 футболок?", "assistant": "Зависит от ткани и сроков. " * 5,
+                "timestamp": "2025-06-15T12:00:00"}
+    return {
+        "sessions": {f"business_{chat_id}": [exchange] * 10 for chat_id in range(ACTIVE_CHATS)},
+        "zep_known": {"users": [f"business_{chat_id}" for chat_id in range(ACTIVE_CHATS)], "sessions": []}
+    }
+
+
+def bench_warm_snapshot_save(benchmark, tmp_path):
+    """Снимок сессий ACTIVE_CHATS чатов по 10 обменов (кодирование + атомарная запись)"""
+    snapshot = WarmSnapshot(str(tmp_path / "warm.bin"))
+    sections = _warm_sections()
+    benchmark(lambda: snapshot.save(sections))
+
+
+def bench_warm_snapshot_load_sessions(benchmark, tmp_path):
+    """Чтение снимка при старте и декодирование раздела сессий"""
+    snapshot = WarmSnapshot(str(tmp_path / "warm.bin"))
+    snapshot.save(_warm_sections())
+
+    def run():
+        snapshot.load()
+        return snapshot.take("sessions")
+
+    assert len(benchmark(run)) == ACTIVE_CHATS
+
+
+# === очередь пула ===
+
+def bench_priority_queue_put_get(benchmark, event_loop_runner):
+    """put + get job в очереди пула при 1000 jobs в очереди из ACTIVE_CHATS чатов"""
+    queue = PriorityFairQueue(maxsize=0)
+    counter = itertools.count()
+
+    def make_job():
+        chat_id = next(counter) % ACTIVE_CHATS
+        message = {"message_id": 1, "chat": {"id": chat_id}, "from": {"id": chat_id}, "text": "Сколько стоит ткань?"}
+        return UpdateJob({"business_message": message}, "business_message", chat_key=("business_message", chat_id, "Bconn"))
+
+    for _ in range(1000):
+        queue.put_nowait(make_job())
+
+    async def run():
+        queue.put_nowait(make_job())
+        return await queue.get()
+
+    benchmark(lambda: event_loop_runner(run()))
+
+
+def bench_event_loop_overhead(benchmark, event_loop_runner):
+    """Базовая линия для async бенчмарков: run_until_complete пустой корутины"""
+    async def noop():
+        return None
+
+    benchmark(lambda: event_loop_runner(noop()))
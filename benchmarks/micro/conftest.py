@@ -0,0 +1,82 @@
+"""
+Общие данные микробенчмарков: корпус updates, инструкции, LoopDetector на 10k чатов, БД владельцев
+"""
+
+import asyncio
+import json
+import os
+import sys
+from collections import deque
+from datetime import datetime, timedelta
+
+import pytest
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(os.path.dirname(BENCH_DIR))
+sys.path.insert(0, REPO_DIR)
+# bot.config требует токен при импорте (bot.agent); сеть в бенчмарках не используется
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:bench")
+
+from bot.loop_detector import LoopDetector  # noqa: E402
+from bot.prompt import PromptSnapshot, load_prompt_file  # noqa: E402
+
+CORPUS_PATH = os.path.join(REPO_DIR, "benchmarks", "corpus", "updates.jsonl")
+INSTRUCTION_PATH = os.path.join(REPO_DIR, "data", "instruction.json")
+ACTIVE_CHATS = 10_000
+
+
+@pytest.fixture(scope="session")
+def corpus_bodies():
+    """Записанные updates как bytes (тело запроса webhook)"""
+    with open(CORPUS_PATH, "rb") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+@pytest.fixture(scope="session")
+def corpus_messages(corpus_bodies):
+    """Словари message/business_message из корпуса"""
+    messages = []
+    for body in corpus_bodies:
+        update = json.loads(body)
+        for kind in ("message", "business_message"):
+            if kind in update:
+                messages.append(update[kind])
+    return messages
+
+
+@pytest.fixture(scope="session")
+def prompt():
+    """Инструкции из data/instruction.json (в репозитории может не быть - тогда сопоставимый по размеру текст)"""
+    if os.path.exists(INSTRUCTION_PATH):
+        return load_prompt_file(INSTRUCTION_PATH)
+    section = "## Раздел\nКонсультант отвечает вежливо, коротко и по делу о пошиве одежды.\n" * 300
+    return PromptSnapshot({"system_instruction": section, "welcome_message": "Добро пожаловать!"})
+
+
+@pytest.fixture
+def loop_detector():
+    """
+    LoopDetector с ACTIVE_CHATS чатами в истории (по 5 сообщений на чат)
+
+    Последние сообщения чатов - минуту назад: проверки частоты проходят, а
+    записи еще внутри окна дубликатов, то есть очистка обходит все чаты.
+    """
+    detector = LoopDetector()
+    minute_ago = datetime.now() - timedelta(minutes=1)
+    for chat_id in range(ACTIVE_CHATS):
+        history = deque(maxlen=detector.max_recent_messages)
+        for index in range(5):
+            message_hash = detector._get_message_hash(f"Вопрос {index} о пошиве футболок", chat_id)
+            history.append((minute_ago, message_hash))
+            detector.recent_message_hashes.add(message_hash)
+        detector.message_history[chat_id] = history
+        detector.last_message_time[chat_id] = minute_ago
+    return detector
+
+
+@pytest.fixture
+def event_loop_runner():
+    """Выполнение корутины в одном loop на весь бенчмарк (без создания loop на каждый вызов)"""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Запуск микробенчмарков (benchmarks/micro) с сохранением результатов по коммитам
+
+Запуск:
+    python benchmarks/run_micro.py                  # замер + сохранение в benchmarks/results
+    python benchmarks/run_micro.py --compare        # + сравнение с последним сохраненным замером,
+                                                    #   ошибка если медиана выросла больше --threshold
+    python benchmarks/run_micro.py --compare 0003   # сравнение с конкретным замером
+    python benchmarks/run_micro.py -k loop          # только часть бенчмарков
+
+Каждый замер сохраняется pytest-benchmark в
+benchmarks/results/<машина>/NNNN_<коммит>_<дата>.json (с флагом
+uncommitted-changes, если дерево не чистое), поэтому историю можно
+сравнить по коммитам: pytest-benchmark compare benchmarks/results/*/*.json
+Результаты зависят от машины - сравнивать имеет смысл замеры с одного
+хоста (в CI - с одного раннера, каталог results кэшируется между сборками).
+"""
+
+import argparse
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+STORAGE = os.path.join(BENCH_DIR, "results")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки hot path с сохранением по коммитам")
+    parser.add_argument("--compare", nargs="?", const=True, default=None,
+                        help="сравнить с последним (или указанным) сохраненным замером")
+    parser.add_argument("--threshold", type=float, default=20, help="допустимый рост медианы, %%")
+    parser.add_argument("--no-save", action="store_true", help="не сохранять результаты")
+    parser.add_argument("--quick", action="store_true", help="короткие замеры (проверка, что бенчмарки работают)")
+    parser.add_argument("-k", dest="keyword", help="фильтр бенчмарков (как pytest -k)")
+    args = parser.parse_args()
+
+    import pytest
+
+    pytest_args = [
+        os.path.join(BENCH_DIR, "micro"),
+        "-c", os.path.join(BENCH_DIR, "micro", "pytest.ini"),
+        f"--benchmark-storage=file://{STORAGE}",
+    ]
+    if not args.no_save:
+        pytest_args.append("--benchmark-autosave")
+    if args.compare:
+        pytest_args.append("--benchmark-compare" if args.compare is True else f"--benchmark-compare={args.compare}")
+        pytest_args.append(f"--benchmark-compare-fail=median:{args.threshold:g}%")
+    if args.quick:
+        pytest_args += ["--benchmark-min-time=0.001", "--benchmark-max-time=0.05", "--benchmark-warmup=off"]
+    if args.keyword:
+        pytest_args += ["-k", args.keyword]
+    return pytest.main(pytest_args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
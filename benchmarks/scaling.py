@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Масштабирование webhook по процессам: пропускная способность при WEB_CONCURRENCY = 1..N
+
+Запуск:
+    python benchmarks/scaling.py --processes 1,2,4 [--duration 20] [--concurrency 128]
+        [--scenario benchmarks/fake_services/scenarios/cpu_bound.json] [--state sqlite]
+
+Для каждого числа процессов бот запускается как в продакшене (python
+webhook.py; при WEB_CONCURRENCY > 1 - процесс приема и WEB_CONCURRENCY
+workers очереди на диске с общим состоянием SHARED_STATE_URL), fake-сервисы - отдельным процессом (python -m
+benchmarks.fake_services), а этот процесс отправляет updates по HTTP с
+--concurrency одновременными запросами (закрытая модель: следующий update
+сразу после ответа на предыдущий).
+
+Сценарий cpu_bound (задержки fake-сервисов 0) упирает бота в CPU: рост
+ответов/с с числом процессов показывает, сколько дает multi-worker режим.
+С реальными задержками OpenAI (baseline.json) ответов/с ограничивает
+WORKER_CONCURRENCY, а не ядра.
+
+Генератор нагрузки и fake-сервисы тоже занимают CPU: на машине с C ядрами
+осмысленно мерить до C - 2 процессов бота.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from loadtest import SECRET, UpdateSource, percentiles  # noqa: E402
+
+DEFAULT_SCENARIO = os.path.join(BENCH_DIR, "fake_services", "scenarios", "cpu_bound.json")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until(check, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if await check():
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"не дождались: {what}")
+
+
+async def sent_messages(session, telegram_url) -> int:
+    async with session.get(f"{telegram_url}/_fake/stats") as response:
+        return (await response.json())["requests"].get("sendMessage", 0)
+
+
+async def measure(args, processes, telegram_url, bot_url):
+    import aiohttp
+
+    source = UpdateSource(SimpleNamespace(seed=args.seed, chats=args.chats, connections=5, mix=args.mix, corpus=None))
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET, "Content-Type": "application/json"}
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        # Один процесс - прием и обработка в нем; несколько - workers очереди на портах PORT+1..PORT+N
+        port = int(bot_url.rsplit(":", 1)[1])
+        worker_urls = [bot_url] if processes == 1 else [f"http://127.0.0.1:{port + i}" for i in range(1, processes + 1)]
+        busy = {}
+
+        async def probe(probe_session, url):
+            async with probe_session.get(f"{url}/debug/workers") as response:
+                stats = await response.json()
+                busy[url] = stats["pool"]["queued"] + stats["pool"]["in_flight"]
+                queue = stats.get("update_queue")
+                if queue is not None:
+                    busy[f"{url}/queue"] = queue["ready"] + queue["leased"]
+
+        async def poll_workers():
+            busy.clear()
+            async with aiohttp.ClientSession() as probe_session:
+                await asyncio.gather(
+                    *(probe(probe_session, url) for url in {bot_url, *worker_urls}), return_exceptions=True
+                )
+
+        async def all_workers_up():
+            await poll_workers()
+            return all(url in busy for url in {bot_url, *worker_urls})
+
+        async def all_workers_idle():
+            return await all_workers_up() and not any(busy.values())
+
+        await wait_until(all_workers_up, 60, f"{processes} процессов бота")
+
+        replies_before = await sent_messages(session, telegram_url)
+        ack_ms, expected, errors = [], 0, 0
+        started = time.perf_counter()
+        deadline = started + args.duration
+
+        async def client():
+            nonlocal expected, errors
+            while time.perf_counter() < deadline:
+                update, chat_id = source.next()
+                sent_at = time.perf_counter()
+                try:
+                    async with session.post(f"{bot_url}/webhook", data=json.dumps(update), headers=headers) as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors += 1
+                            continue
+                except aiohttp.ClientError:
+                    errors += 1
+                    continue
+                ack_ms.append((time.perf_counter() - sent_at) * 1000)
+                if chat_id is not None:
+                    expected += 1
+
+        await asyncio.gather(*(client() for _ in range(args.concurrency)))
+        send_seconds = time.perf_counter() - started
+
+        # Очереди workers разбираются после окончания отправки
+        await wait_until(all_workers_idle, args.drain_timeout, "обработки очередей")
+        total_seconds = time.perf_counter() - started
+        replies = await sent_messages(session, telegram_url) - replies_before
+
+    return {
+        "processes": processes,
+        "sent": len(ack_ms),
+        "http_errors": errors,
+        "ingest_rate": round(len(ack_ms) / send_seconds, 1),
+        "replies": replies,
+        "expected_replies": expected,
+        "reply_rate": round(replies / total_seconds, 1) if total_seconds > 0 else None,
+        "ack_ms": percentiles(ack_ms),
+    }
+
+
+def start_bot(args, processes, fake_env, port, workdir):
+    env = dict(os.environ)
+    env.update(fake_env)
+    env.update({
+        "PORT": str(port),
+        "WEB_CONCURRENCY": str(processes),
+        "WORKER_CONCURRENCY": str(args.workers),
+        "TELEGRAM_BOT_TOKEN": "123456:scaling",
+        "OPENAI_API_KEY": "sk-scaling",
+        "ZEP_API_KEY": "zep-scaling",
+        "WEBHOOK_SECRET_TOKEN": SECRET,
+        "WEBHOOK_URL": f"http://127.0.0.1:{port}/webhook",
+        "DATABASE_PATH": os.path.join(workdir, "bot.db"),
+        "INSTRUCTION_STORE_PATH": os.path.join(workdir, "bot.db"),
+        "ANALYTICS_DB_PATH": os.path.join(workdir, "analytics.db"),
+        "UPDATE_QUEUE_PATH": os.path.join(workdir, "update_queue.db"),
+        "CHECKPOINT_PATH": os.path.join(workdir, "checkpoint.db"),
+        "WARM_SNAPSHOT_PATH": os.path.join(workdir, "warm_snapshot.bin"),
+        "BACKLOG_SPOOL_PATH": os.path.join(workdir, "backlog_spool.db"),
+        "INSTRUCTION_WATCH_INTERVAL": "0",
+        "BACKLOG_DRAIN_THRESHOLD": "0",
+        "LOOP_MONITOR_ENABLED": "false",
+        "PYTHONUNBUFFERED": "1",
+    })
+    if args.state == "sqlite" or processes > 1:
+        env["SHARED_STATE_URL"] = "sqlite://" + os.path.join(workdir, "shared_state.db")
+    else:
+        env["SHARED_STATE_URL"] = "memory://"
+    log = open(os.path.join(workdir, "bot.out"), "w")
+    return subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, "webhook.py")],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True
+    )
+
+
+def stop_process(process, timeout: float = 20):
+    """SIGTERM группе процессов (uvicorn и его workers), через timeout - SIGKILL"""
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def print_table(results):
+    print("\n" + "=" * 72)
+    print("📊 МАСШТАБИРОВАНИЕ ПО ПРОЦЕССАМ (WEB_CONCURRENCY)")
+    print("=" * 72)
+    print(f"{'процессов':>10}{'прием/с':>10}{'ответов/с':>11}{'ускорение':>11}{'ack p50':>9}{'ack p99':>9}{'ответов':>12}")
+    base = results[0]["reply_rate"] if results and results[0]["reply_rate"] else None
+    for result in results:
+        speedup = f"{result['reply_rate'] / base:.2f}x" if base and result["reply_rate"] else "—"
+        print(f"{result['processes']:>10}{result['ingest_rate']:>10}{result['reply_rate'] or '—':>11}{speedup:>11}"
+              f"{result['ack_ms']['p50'] or '—':>9}{result['ack_ms']['p99'] or '—':>9}"
+              f"{result['replies']:>6}/{result['expected_replies']:<5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность webhook при 1..N процессах uvicorn")
+    parser.add_argument("--processes", default=None, help="список WEB_CONCURRENCY через запятую (по умолчанию 1..число ядер)")
+    parser.add_argument("--duration", type=float, default=20, help="длительность отправки на каждый замер, с")
+    parser.add_argument("--concurrency", type=int, default=128, help="одновременных запросов к webhook")
+    parser.add_argument("--workers", type=int, default=64, help="WORKER_CONCURRENCY каждого процесса")
+    parser.add_argument("--chats", type=int, default=5000)
+    parser.add_argument("--mix", default="business_message=0.9,message=0.1")
+    parser.add_argument("--scenario", default=DEFAULT_SCENARIO, help="сценарий fake-сервисов")
+    parser.add_argument("--state", choices=("memory", "sqlite"), default="memory",
+                        help="состояние при 1 процессе (при нескольких всегда sqlite)")
+    parser.add_argument("--drain-timeout", type=float, default=300, help="ожидание обработки очередей после отправки, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    counts = [int(n) for n in args.processes.split(",")] if args.processes else list(range(1, (os.cpu_count() or 1) + 1))
+    ports = {"telegram": free_port(), "openai": free_port(), "zep": free_port()}
+    fake_log = tempfile.NamedTemporaryFile("w", prefix="scaling_fake_", suffix=".log", delete=False)
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_services", "--scenario", os.path.abspath(args.scenario),
+         "--telegram-port", str(ports["telegram"]), "--openai-port", str(ports["openai"]), "--zep-port", str(ports["zep"])],
+        cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=fake_log, text=True, start_new_session=True
+    )
+    print(f"🧪 Fake-сервисы: логи {fake_log.name}", flush=True)
+    fake_env = {}
+    for line in fake.stdout:
+        if line.startswith("export "):
+            name, _, value = line[len("export "):].strip().partition("=")
+            fake_env[name] = value
+        if line.startswith("#"):
+            break
+    telegram_url = fake_env["TELEGRAM_API_BASE"]
+
+    results = []
+    try:
+        for processes in counts:
+            workdir = tempfile.mkdtemp(prefix=f"scaling_{processes}_")
+            port = free_port()
+            bot = start_bot(args, processes, fake_env, port, workdir)
+            print(f"🚀 {processes} процесс(ов) бота, порт {port}, логи {workdir}/bot.out", flush=True)
+            try:
+                result = asyncio.run(measure(args, processes, telegram_url, f"http://127.0.0.1:{port}"))
+            finally:
+                stop_process(bot)
+            print(f"   ответов/с: {result['reply_rate']}, прием/с: {result['ingest_rate']}", flush=True)
+            results.append(result)
+    finally:
+        stop_process(fake)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"cpu_count": os.cpu_count(), "args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
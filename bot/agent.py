@@ -1,14 +1,12 @@
-import json
 import asyncio
 import logging
+import threading
+import time
 from datetime import datetime
-from typing import Optional, Dict, Any
-
-import openai
-from zep_cloud.client import AsyncZep
-from zep_cloud.types import Message
+from typing import Optional, Dict, Any, List
 
 from .config import INSTRUCTION_FILE, OPENAI_API_KEY, OPENAI_MODEL, ZEP_API_KEY
+from .prompt import PromptSnapshot, default_prompt, load_prompt_file
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -16,79 +14,170 @@ logger = logging.getLogger(__name__)
 
 class TextilProAgent:
     def __init__(self):
+        # ✅ Конструктор дешевый: клиенты и инструкции создаются лениво или в warm_up(),
+        # чтобы импорт webhook.py не тратил время холодного старта
+        self._openai_client = None
+        self._zep_client = None
+        self._clients_ready = False
+        # Текущая версия инструкций; подменяется целиком (см. bot/prompt.py)
+        self._prompt: Optional[PromptSnapshot] = None
+        self._init_lock = threading.Lock()
+        self.user_sessions = {}  # Резервное хранение сессий в памяти
+        # Сессии из снимка прошлого запуска (bot/warm_snapshot.py): переносятся в user_sessions при первом обращении
+        self.warm_sessions: Dict[str, List[Dict[str, Any]]] = {}
+        # Пользователи и сессии, уже заведенные в Zep: повторно user.get / add_session не вызываются
+        self.known_zep_users = set()
+        self.known_zep_sessions = set()
+        # Общее хранилище сессий при нескольких workers (bot/shared_state.py), None - user_sessions
+        self.session_store = None
+        # Статистика генерации: отмененные ответы и сэкономленные токены
+        self.generation_stats = {
+            'completed': 0,
+            'cancelled': 0,
+            'cancelled_before_openai': 0,
+            'completion_tokens': 0,
+            'discarded_tokens': 0,
+            'tokens_saved_estimate': 0
+        }
+
+    def _init_clients(self):
+        # SDK импортируются здесь: только openai импортируется ~1 секунду,
+        # а warm_up() выполняется в потоке параллельно с остальным стартом
+        import openai
+        from zep_cloud.client import AsyncZep
+
         # Инициализируем OpenAI клиент если API ключ доступен
         if OPENAI_API_KEY:
-            self.openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+            self._openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
             print("✅ OpenAI клиент инициализирован")
         else:
-            self.openai_client = None
+            self._openai_client = None
             print("⚠️ OpenAI API ключ не найден, используется упрощенный режим")
         
         # Инициализируем Zep клиент если API ключ доступен
         if ZEP_API_KEY and ZEP_API_KEY != "test_key":
             try:
-                self.zep_client = AsyncZep(api_key=ZEP_API_KEY)
+                self._zep_client = AsyncZep(api_key=ZEP_API_KEY)
                 print(f"✅ Zep клиент инициализирован с ключом длиной {len(ZEP_API_KEY)} символов")
                 print(f"🔑 Zep API Key начинается с: {ZEP_API_KEY[:8]}...")
             except Exception as e:
                 print(f"❌ Ошибка инициализации Zep клиента: {e}")
-                self.zep_client = None
+                self._zep_client = None
         else:
-            self.zep_client = None
+            self._zep_client = None
             if not ZEP_API_KEY:
                 print("⚠️ ZEP_API_KEY не установлен, используется локальная память")
             else:
                 print(f"⚠️ ZEP_API_KEY имеет значение 'test_key', используется локальная память")
-        self.instruction = self._load_instruction()
-        self.user_sessions = {}  # Резервное хранение сессий в памяти
+
+    def _ensure_clients(self):
+        if self._clients_ready:
+            return
+        with self._init_lock:
+            if not self._clients_ready:
+                self._init_clients()
+                self._clients_ready = True
+
+    @property
+    def openai_client(self):
+        self._ensure_clients()
+        return self._openai_client
+
+    @property
+    def zep_client(self):
+        self._ensure_clients()
+        return self._zep_client
+
+    @property
+    def prompt(self) -> PromptSnapshot:
+        if self._prompt is None:
+            with self._init_lock:
+                if self._prompt is None:
+                    self._prompt = self._load_prompt()
+        return self._prompt
+
+    def set_prompt(self, snapshot: PromptSnapshot) -> bool:
+        """
+        Атомарно подменяет версию инструкций
+
+        Returns:
+            False если версия не изменилась
+        """
+        current = self._prompt
+        if current is not None and current.version == snapshot.version:
+            return False
+        self._prompt = snapshot
+        old_version = current.version if current else None
+        logger.info(f"✅ Инструкции обновлены: версия {old_version} -> {snapshot.version} ({snapshot.get('last_updated', 'неизвестно')})")
+        print(f"✅ Инструкции обновлены: версия {old_version} -> {snapshot.version}")
+        return True
+
+    @property
+    def instruction(self) -> Dict[str, Any]:
+        return self.prompt.instruction
+
+    @instruction.setter
+    def instruction(self, value: Dict[str, Any]):
+        self.set_prompt(PromptSnapshot(value))
+
+    def warm_up(self):
+        """
+        Создает клиентов и загружает инструкции заранее
+
+        Блокирующий метод - при старте сервера вызывается через asyncio.to_thread,
+        параллельно с остальными шагами запуска.
+        """
+        self._ensure_clients()
+        _ = self.prompt
     
-    def _load_instruction(self) -> Dict[str, Any]:
+    def _load_prompt(self) -> PromptSnapshot:
         try:
-            with open(INSTRUCTION_FILE, 'r', encoding='utf-8') as f:
-                instruction = json.load(f)
-                logger.info(f"✅ Инструкции успешно загружены из {INSTRUCTION_FILE}")
-                logger.info(f"📝 Последнее обновление: {instruction.get('last_updated', 'неизвестно')}")
-                logger.info(f"📏 Длина системной инструкции: {len(instruction.get('system_instruction', ''))}")
-                print(f"✅ Инструкции успешно загружены из {INSTRUCTION_FILE}")
-                print(f"📝 Последнее обновление: {instruction.get('last_updated', 'неизвестно')}")
-                return instruction
+            snapshot = load_prompt_file(INSTRUCTION_FILE)
+            logger.info(f"✅ Инструкции успешно загружены из {INSTRUCTION_FILE} (версия {snapshot.version})")
+            logger.info(f"📝 Последнее обновление: {snapshot.get('last_updated', 'неизвестно')}")
+            logger.info(f"📏 Длина системной инструкции: {len(snapshot.get('system_instruction', ''))}")
+            print(f"✅ Инструкции успешно загружены из {INSTRUCTION_FILE}")
+            print(f"📝 Последнее обновление: {snapshot.get('last_updated', 'неизвестно')}")
+            return snapshot
         except FileNotFoundError:
             logger.warning(f"⚠️ ВНИМАНИЕ: Файл {INSTRUCTION_FILE} не найден! Используется базовая инструкция.")
             print(f"⚠️ ВНИМАНИЕ: Файл {INSTRUCTION_FILE} не найден! Используется базовая инструкция.")
-            return {
-                "system_instruction": "Вы - помощник службы поддержки Textil PRO.",
-                "welcome_message": "Добро пожаловать! Чем могу помочь?",
-                "last_updated": datetime.now().isoformat()
-            }
+            return default_prompt()
         except Exception as e:
             print(f"❌ Ошибка при загрузке инструкций: {e}")
-            return {
-                "system_instruction": "Вы - помощник службы поддержки Textil PRO.",
-                "welcome_message": "Добро пожаловать! Чем могу помочь?",
-                "last_updated": datetime.now().isoformat()
-            }
+            return default_prompt()
     
-    def reload_instruction(self):
+    def reload_instruction(self) -> bool:
+        """
+        Перечитывает instruction.json (блокирующий метод - вызывать в потоке)
+
+        Returns:
+            True если загружена новая версия
+        """
         logger.info("🔄 Перезагрузка инструкций...")
         print("🔄 Перезагрузка инструкций...")
-        old_updated = self.instruction.get('last_updated', 'неизвестно')
-        self.instruction = self._load_instruction()
-        new_updated = self.instruction.get('last_updated', 'неизвестно')
-        
-        if old_updated != new_updated:
-            logger.info(f"✅ Инструкции обновлены: {old_updated} -> {new_updated}")
-            print(f"✅ Инструкции обновлены: {old_updated} -> {new_updated}")
-        else:
-            logger.info("📝 Инструкции перезагружены (без изменений)")
-            print("📝 Инструкции перезагружены (без изменений)")
+        if self.set_prompt(self._load_prompt()):
+            return True
+        logger.info("📝 Инструкции перезагружены (без изменений)")
+        print("📝 Инструкции перезагружены (без изменений)")
+        return False
     
-    async def add_to_zep_memory(self, session_id: str, user_message: str, bot_response: str, user_name: str = None):
+    async def add_to_zep_memory(
+        self,
+        session_id: str,
+        user_message: str,
+        bot_response: str,
+        user_name: str = None,
+        assistant_name: str = None
+    ):
         """Добавляет сообщения в Zep Memory с именами пользователей"""
         if not self.zep_client:
             print(f"⚠️ Zep клиент не инициализирован, используем локальную память для {session_id}")
-            self.add_to_local_session(session_id, user_message, bot_response)
+            await self.save_local_session(session_id, user_message, bot_response)
             return False
             
+        from zep_cloud.types import Message
+
         try:
             # Используем имя пользователя или ID для роли
             user_role = user_name if user_name else f"User_{session_id.split('_')[-1][:6]}"
@@ -100,7 +189,7 @@ class TextilProAgent:
                     content=user_message
                 ),
                 Message(
-                    role="Анастасия",  # Имя бота-консультанта
+                    role=assistant_name or "Анастасия",  # Имя бота-консультанта (из профиля аккаунта)
                     role_type="assistant",
                     content=bot_response
                 )
@@ -115,14 +204,14 @@ class TextilProAgent:
         except Exception as e:
             print(f"❌ Ошибка при добавлении в Zep: {type(e).__name__}: {e}")
             # Fallback: добавляем в локальную память
-            self.add_to_local_session(session_id, user_message, bot_response)
+            await self.save_local_session(session_id, user_message, bot_response)
             return False
     
     async def get_zep_memory_context(self, session_id: str) -> str:
         """Получает контекст из Zep Memory"""
         if not self.zep_client:
             print(f"⚠️ Zep не доступен, используем локальную историю для {session_id}")
-            return self.get_local_session_history(session_id)
+            return await self.local_session_history(session_id)
             
         try:
             memory = await self.zep_client.memory.get(session_id=session_id)
@@ -132,7 +221,7 @@ class TextilProAgent:
             
         except Exception as e:
             print(f"❌ Ошибка при получении контекста из Zep: {type(e).__name__}: {e}")
-            return self.get_local_session_history(session_id)
+            return await self.local_session_history(session_id)
     
     async def get_zep_recent_messages(self, session_id: str, limit: int = 6) -> str:
         """Получает последние сообщения из Zep Memory"""
@@ -152,53 +241,139 @@ class TextilProAgent:
             
         except Exception as e:
             print(f"❌ Ошибка при получении сообщений из Zep: {e}")
-            return self.get_local_session_history(session_id)
+            return await self.local_session_history(session_id)
     
     def add_to_local_session(self, session_id: str, user_message: str, bot_response: str):
         """Резервное локальное хранение сессий"""
-        if session_id not in self.user_sessions:
-            self.user_sessions[session_id] = []
-        
-        self.user_sessions[session_id].append({
+        exchange = {
             "user": user_message,
             "assistant": bot_response,
             "timestamp": datetime.now().isoformat()
-        })
+        }
+        if self.session_store is not None:
+            self.session_store.append_session(session_id, exchange, keep=10)
+            return
+
+        if session_id not in self.user_sessions:
+            self.user_sessions[session_id] = self.warm_sessions.pop(session_id, [])
+        
+        self.user_sessions[session_id].append(exchange)
         
         # Ограничиваем историю 10 последними сообщениями
         if len(self.user_sessions[session_id]) > 10:
             self.user_sessions[session_id] = self.user_sessions[session_id][-10:]
     
+    async def save_local_session(self, session_id: str, user_message: str, bot_response: str):
+        """add_to_local_session из event loop: общее хранилище сессий (SQLite) - в потоке"""
+        if self.session_store is not None:
+            await asyncio.to_thread(self.add_to_local_session, session_id, user_message, bot_response)
+        else:
+            self.add_to_local_session(session_id, user_message, bot_response)
+
+    async def local_session_history(self, session_id: str) -> str:
+        """get_local_session_history из event loop: общее хранилище сессий (SQLite) - в потоке"""
+        if self.session_store is not None:
+            return await asyncio.to_thread(self.get_local_session_history, session_id)
+        return self.get_local_session_history(session_id)
+
+    def get_local_session(self, session_id: str) -> List[Dict[str, Any]]:
+        """Обмены сессии из локального (или общего) хранилища"""
+        if self.session_store is not None:
+            return self.session_store.get_session(session_id)
+        if session_id not in self.user_sessions and session_id in self.warm_sessions:
+            self.user_sessions[session_id] = self.warm_sessions.pop(session_id)
+        return self.user_sessions.get(session_id, [])
+    
+    def local_session_ids(self) -> List[str]:
+        if self.session_store is not None:
+            return self.session_store.session_ids()
+        return list(self.user_sessions.keys()) + [sid for sid in self.warm_sessions if sid not in self.user_sessions]
+
+    def export_warm_state(self, max_age: Optional[float] = None, max_sessions: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Локальные сессии и известные Zep пользователи/сессии для снимка (сессии в общем состоянии не пишутся)
+
+        Сессии без обменов за max_age секунд в снимок не попадают, из
+        остальных - не больше max_sessions последних: иначе снимок рос бы с
+        каждым рестартом.
+        """
+        sessions = None
+        if self.session_store is None:
+            # Копии списков: снимок кодируется в другом потоке
+            sessions = {**self.warm_sessions, **{sid: list(exchanges) for sid, exchanges in self.user_sessions.items()}}
+            sessions = recent_sessions(sessions, max_age, max_sessions)
+        return {
+            "sessions": sessions,
+            "zep_known": {"users": sorted(self.known_zep_users), "sessions": sorted(self.known_zep_sessions)}
+                         if self.known_zep_users or self.known_zep_sessions else None
+        }
+
+    def import_warm_sessions(self, sessions: Dict[str, List[Dict[str, Any]]], max_age: Optional[float] = None):
+        """Сессии снимка; уже начатые в этом процессе не заменяются, устаревшие пропускаются"""
+        for session_id, exchanges in recent_sessions(sessions, max_age).items():
+            if session_id not in self.user_sessions:
+                self.warm_sessions.setdefault(session_id, exchanges)
+
+    def import_zep_known(self, known: Dict[str, List[str]]):
+        self.known_zep_users.update(known.get("users", []))
+        self.known_zep_sessions.update(known.get("sessions", []))
+    
     def get_local_session_history(self, session_id: str) -> str:
         """Получает историю из локального хранилища"""
-        if session_id not in self.user_sessions:
+        exchanges = self.get_local_session(session_id)
+        if not exchanges:
             return ""
         
         history = []
-        for exchange in self.user_sessions[session_id][-6:]:  # Последние 6 обменов
+        for exchange in exchanges[-6:]:  # Последние 6 обменов
             history.append(f"Пользователь: {exchange['user']}")
             history.append(f"Ассистент: {exchange['assistant']}")
         
         return "\n".join(history) if history else ""
     
-    async def generate_response(self, user_message: str, session_id: str, user_name: str = None) -> str:
+    async def generate_response(
+        self,
+        user_message: str,
+        session_id: str,
+        user_name: str = None,
+        extra_instructions: str = None,
+        prompt: Optional[PromptSnapshot] = None,
+        trace: Optional[Dict[str, Any]] = None,
+        legacy_session_id: Optional[str] = None
+    ) -> str:
+        """
+        Генерирует ответ консультанта
+
+        Args:
+            user_message: текст клиента (сохраняется в память как есть)
+            session_id: ID сессии Zep
+            user_name: имя клиента
+            extra_instructions: служебные указания только для этого ответа
+                (например, что сообщение пролежало в очереди во время деплоя)
+            prompt: инструкции профиля business аккаунта (по умолчанию instruction.json)
+            trace: сюда записываются длительности этапов (мс) и число токенов
+            legacy_session_id: прежний ID сессии клиента (миграция) - память
+                читается из него, пока в session_id ничего нет; пишется
+                только в session_id
+        """
+        # Версия фиксируется в начале: обновление инструкций во время ответа его не затронет
+        prompt = prompt or self.prompt
+        trace = trace if trace is not None else {}
+        openai_called = False
         try:
-            system_prompt = self.instruction.get("system_instruction", "")
-            
             # Пытаемся получить контекст из Zep Memory
+            started = time.perf_counter()
             zep_context = await self.get_zep_memory_context(session_id)
             zep_history = await self.get_zep_recent_messages(session_id)
+            if legacy_session_id and not zep_context and not zep_history:
+                zep_context = await self.get_zep_memory_context(legacy_session_id)
+                zep_history = await self.get_zep_recent_messages(legacy_session_id)
+            trace['zep_read_ms'] = (time.perf_counter() - started) * 1000
             
-            # Добавляем контекст и историю в системный промпт
-            if zep_context:
-                system_prompt += f"\n\nКонтекст предыдущих разговоров:\n{zep_context}"
-            
-            if zep_history:
-                system_prompt += f"\n\nПоследние сообщения:\n{zep_history}"
-            
-            # Дополнительное напоминание о форматировании и приветствии
-            system_prompt += "\n\n⚠️ КРИТИЧЕСКИ ВАЖНО: Форматируй ответы с абзацами! Используй двойные переносы строк между смысловыми блоками. НЕ пиши сплошным текстом!"
-            system_prompt += "\n\n⚠️ ПРАВИЛО ПРИВЕТСТВИЯ: НЕ начинай каждый ответ с 'Здравствуйте!' Приветствуй только при первом сообщении или /start. В продолжении диалога сразу переходи к сути!"
+            # Статический префикс (инструкция + правила форматирования и приветствия)
+            # собран заранее, сюда добавляются только контекст и история
+            system_prompt = prompt.build_system_prompt(zep_context, zep_history, extra_instructions)
+            trace['prompt_chars'] = len(system_prompt) + len(user_message)
             
             messages = [
                 {"role": "system", "content": system_prompt},
@@ -225,35 +400,99 @@ class TextilProAgent:
                 else:
                     bot_response = f"Поняла ваш вопрос! Отличный вопрос о текстильном производстве.\n\nПодготовлю детальный ответ специально для вас. Минуточку!\n\nАнастасия, Textil PRO"
             else:
-                response = await self.openai_client.chat.completions.create(
-                    model=OPENAI_MODEL,
-                    messages=messages,
-                    max_tokens=1000,
-                    temperature=0.7
-                )
-                bot_response = response.choices[0].message.content
+                openai_called = True
+                started = time.perf_counter()
+                bot_response = await self._stream_completion(messages, trace)
+                trace['openai_ms'] = (time.perf_counter() - started) * 1000
             
             # Сохраняем в Zep Memory (с fallback на локальное хранилище)
-            await self.add_to_zep_memory(session_id, user_message, bot_response, user_name)
+            started = time.perf_counter()
+            await self.add_to_zep_memory(
+                session_id, user_message, bot_response, user_name,
+                assistant_name=prompt.get("assistant_name")
+            )
+            trace['zep_write_ms'] = (time.perf_counter() - started) * 1000
             
             return bot_response
             
+        except asyncio.CancelledError:
+            if not openai_called:
+                self._record_cancel(0, openai_called=False)
+            raise
         except Exception as e:
             print(f"Ошибка при генерации ответа: {e}")
             return "Извините, произошла техническая ошибка. Попробуйте написать снова или обратитесь ко мне напрямую.\n\nАнастасия, Textil PRO"
     
+    async def _stream_completion(self, messages, trace: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Запрос к OpenAI в режиме stream
+
+        Если обработку отменили (клиент написал новое сообщение или удалил
+        вопрос), HTTP поток закрывается сразу и OpenAI перестает генерировать
+        токены. Каждый фрагмент stream считается за один токен.
+        """
+        chunks = []
+        stream = None
+        try:
+            stream = await self.openai_client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                max_tokens=1000,
+                temperature=0.7,
+                stream=True
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks.append(chunk.choices[0].delta.content)
+        except asyncio.CancelledError:
+            self._record_cancel(len(chunks))
+            raise
+        finally:
+            if stream is not None:
+                await stream.response.aclose()
+
+        self.generation_stats['completed'] += 1
+        # Оценка: фрагмент потока обычно один токен, но не всегда (usage в потоке
+        # openai==1.3.7 не отдает) - точное число токенов смотреть в биллинге OpenAI
+        self.generation_stats['completion_tokens'] += len(chunks)
+        if trace is not None:
+            trace['completion_tokens'] = len(chunks)
+        return "".join(chunks)
+
+    def _record_cancel(self, streamed_tokens: int, openai_called: bool = True):
+        stats = self.generation_stats
+        stats['cancelled'] += 1
+        if not openai_called:
+            # Отменено на этапе Zep - запрос к OpenAI не отправлялся вовсе
+            stats['cancelled_before_openai'] += 1
+        stats['discarded_tokens'] += streamed_tokens
+        # Оценка: средняя длина ответа минус уже сгенерированная часть
+        if stats['completed']:
+            average = stats['completion_tokens'] / stats['completed']
+            stats['tokens_saved_estimate'] += max(int(average) - streamed_tokens, 0)
+
+    def get_generation_stats(self) -> Dict[str, Any]:
+        stats = dict(self.generation_stats)
+        stats['avg_completion_tokens'] = (
+            round(stats['completion_tokens'] / stats['completed'], 1) if stats['completed'] else None
+        )
+        return stats
+
     async def ensure_user_exists(self, user_id: str, user_data: Dict[str, Any] = None):
         """Создает пользователя в Zep если его еще нет"""
         if not self.zep_client:
             return False
+        if user_id in self.known_zep_users:
+            return True
             
         try:
             # Пытаемся получить пользователя
             try:
                 user = await self.zep_client.user.get(user_id=user_id)
                 print(f"✅ Пользователь {user_id} уже существует в Zep")
+                self.known_zep_users.add(user_id)
                 return True
-            except:
+            except Exception:
                 # Пользователь не существует, создаем
                 pass
             
@@ -270,6 +509,7 @@ class TextilProAgent:
                 }
             )
             print(f"✅ Создан новый пользователь в Zep: {user_id}")
+            self.known_zep_users.add(user_id)
             return True
             
         except Exception as e:
@@ -280,6 +520,8 @@ class TextilProAgent:
         """Создает сессию в Zep если ее еще нет"""
         if not self.zep_client:
             return False
+        if session_id in self.known_zep_sessions:
+            return True
             
         try:
             # Создаем сессию
@@ -292,6 +534,7 @@ class TextilProAgent:
                 }
             )
             print(f"✅ Создана сессия в Zep: {session_id} для пользователя {user_id}")
+            self.known_zep_sessions.add(session_id)
             return True
             
         except Exception as e:
@@ -299,8 +542,24 @@ class TextilProAgent:
             print(f"ℹ️ Сессия {session_id} возможно уже существует или будет создана автоматически")
             return True
     
-    def get_welcome_message(self) -> str:
-        return self.instruction.get("welcome_message", "Добро пожаловать!")
+    def get_welcome_message(self, prompt: Optional[PromptSnapshot] = None) -> str:
+        return (prompt or self.prompt).get("welcome_message", "Добро пожаловать!")
+
+
+agent = TextilProAgent()
 
 
-agent = TextilProAgent()
\ No newline at end of file
+def recent_sessions(
+    sessions: Dict[str, List[Dict[str, Any]]],
+    max_age: Optional[float] = None,
+    max_sessions: Optional[int] = None
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Сессии с обменом не старше max_age секунд, не больше max_sessions самых свежих"""
+    # timestamp - datetime.isoformat() одного формата: строки сравниваются как время
+    last = {sid: exchanges[-1].get("timestamp", "") for sid, exchanges in sessions.items() if exchanges}
+    if max_age is not None:
+        cutoff = datetime.fromtimestamp(time.time() - max_age).isoformat()
+        last = {sid: at for sid, at in last.items() if at >= cutoff}
+    if max_sessions is not None and len(last) > max_sessions:
+        last = dict(sorted(last.items(), key=lambda item: item[1])[-max_sessions:])
+    return {sid: sessions[sid] for sid in last}
@@ -0,0 +1,187 @@
+"""
+Журнал событий обработки сообщений для аналитики
+
+Каждый обработанный update (ответ, игнор петли, сообщение владельца,
+отмена, ошибка) записывается одной строкой с длительностью этапов и числом
+токенов. Запись не блокирует ответы: события копятся в памяти и раз в
+flush_interval секунд вставляются пачкой в отдельную SQLite БД (в потоке).
+
+Таблица только дополняется, колонки фиксированные и числовые, а индекс по
+времени позволяет читать окно в миллионах строк по диапазону ts. Чтение
+для админ панели - fetch_columns(): выбранные колонки как массивы
+(колоночный формат сразу ложится в pandas.DataFrame).
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Этапы обработки, длительность которых записывается (мс)
+STAGES = ('queue', 'owner_check', 'loop_check', 'zep_read', 'openai', 'zep_write', 'send', 'total')
+
+COLUMNS = (
+    'ts', 'kind', 'connection_id', 'chat_id', 'outcome', 'reason',
+    *(f'{stage}_ms' for stage in STAGES),
+    # completion_tokens - фрагменты потока OpenAI (около одного токена на фрагмент, не usage API)
+    'completion_tokens', 'prompt_chars', 'merged_count', 'regenerations', 'stale_action'
+)
+
+_COLUMN_TYPES = {
+    'ts': 'REAL NOT NULL',
+    'kind': 'TEXT',
+    'connection_id': 'TEXT',
+    'chat_id': 'INTEGER',
+    'outcome': 'TEXT NOT NULL',
+    'reason': 'TEXT',
+    'completion_tokens': 'INTEGER',
+    'prompt_chars': 'INTEGER',
+    'merged_count': 'INTEGER',
+    'regenerations': 'INTEGER',
+    'stale_action': 'TEXT',
+}
+
+
+class AnalyticsRecorder:
+    """Буфер событий в памяти + пакетная запись в SQLite"""
+
+    def __init__(
+        self,
+        db_path: str,
+        flush_interval: float = 2.0,
+        max_buffer: int = 50000,        # при недоступной БД старые события отбрасываются
+        retention_days: float = 90.0
+    ):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self._buffer: deque = deque(maxlen=max_buffer)
+        self._task: Optional[asyncio.Task] = None
+        self._pruned_at = 0.0
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+    def init_db(self):
+        """Создание таблицы и индексов (блокирующий метод - вызывать в потоке)"""
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        columns_sql = ",\n".join(f"{name} {_COLUMN_TYPES.get(name, 'REAL')}" for name in COLUMNS)
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'CREATE TABLE IF NOT EXISTS turn_events (\nid INTEGER PRIMARY KEY,\n{columns_sql}\n)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_turn_events_ts ON turn_events(ts)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_turn_events_outcome_ts ON turn_events(outcome, ts)')
+
+    def record(self, event: Dict[str, Any]):
+        """Добавляет событие в буфер (без ввода-вывода)"""
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        event.setdefault('ts', time.time())
+        self._buffer.append(tuple(event.get(name) for name in COLUMNS))
+        self.recorded += 1
+
+    def _write_batch(self, rows: List[tuple]):
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        with sqlite3.connect(self.db_path) as conn:
+            conn.executemany(f'INSERT INTO turn_events ({", ".join(COLUMNS)}) VALUES ({placeholders})', rows)
+            # Старые события удаляются не чаще раза в час
+            now = time.time()
+            if self.retention_days and now - self._pruned_at > 3600:
+                conn.execute('DELETE FROM turn_events WHERE ts < ?', (now - self.retention_days * 86400,))
+                self._pruned_at = now
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        rows = list(self._buffer)
+        self._buffer.clear()
+        try:
+            await asyncio.to_thread(self._write_batch, rows)
+            self.written += len(rows)
+        except Exception as e:
+            # Возвращаем события в буфер - запишутся при следующей попытке. Пока шла
+            # запись, буфер пополнялся: не поместившиеся самые старые события
+            # отбрасываются и учитываются в dropped (новые не вытесняются молча)
+            room = self._buffer.maxlen - len(self._buffer)
+            if room < len(rows):
+                self.dropped += len(rows) - room
+                rows = rows[len(rows) - room:]
+            self._buffer.extendleft(reversed(rows))
+            self.errors += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            logger.error(f"❌ Ошибка записи аналитики: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'db_path': self.db_path,
+            'buffered': len(self._buffer),
+            'recorded': self.recorded,
+            'written': self.written,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'last_error': self.last_error
+        }
+
+
+def fetch_columns(
+    db_path: str,
+    since: float,
+    until: Optional[float] = None,
+    columns: Optional[Iterable[str]] = None,
+    max_rows: int = 200000
+) -> Dict[str, Any]:
+    """
+    События за период в колоночном виде (блокирующая функция - вызывать в потоке)
+
+    Если событий больше max_rows, берется равномерная выборка каждой
+    sample_step-й строки: перцентили по выборке практически не меняются,
+    а счетчики нужно умножать на sample_step.
+
+    Returns:
+        {"columns": {name: [...]}, "rows": int, "total_rows": int, "sample_step": int}
+    """
+    until = until or time.time()
+    selected = [name for name in (columns or COLUMNS) if name in COLUMNS]
+    if 'ts' not in selected:
+        selected.insert(0, 'ts')
+
+    with sqlite3.connect(db_path) as conn:
+        total = conn.execute(
+            'SELECT COUNT(*) FROM turn_events WHERE ts >= ? AND ts < ?', (since, until)
+        ).fetchone()[0]
+        sample_step = max(1, -(-total // max_rows)) if total else 1
+        query = f'SELECT {", ".join(selected)} FROM turn_events WHERE ts >= ? AND ts < ?'
+        params: list = [since, until]
+        if sample_step > 1:
+            query += ' AND id % ? = 0'
+            params.append(sample_step)
+        rows = conn.execute(query + ' ORDER BY ts', params).fetchall()
+
+    values = list(zip(*rows)) if rows else [() for _ in selected]
+    data = {name: list(column) for name, column in zip(selected, values)}
+    return {"columns": data, "rows": len(rows), "total_rows": total, "sample_step": sample_step}
@@ -0,0 +1,144 @@
+"""
+Распознавание вложений в сообщениях Telegram
+
+Функция has_attachments вызывается для каждого сообщения, поэтому таблица
+извлечения метаданных собирается один раз при импорте, а для сообщений без
+вложений (подавляющее большинство) работа заканчивается одной проверкой
+пересечения ключей.
+"""
+
+from typing import Any, Callable, Dict, List, Tuple
+
+# Порядок важен: в нем вложения попадают в результат и в логи
+ATTACHMENT_TYPES = (
+    'photo', 'document', 'video', 'audio', 'voice', 'video_note',
+    'sticker', 'animation', 'contact', 'location', 'venue', 'poll'
+)
+ATTACHMENT_KEYS = frozenset(ATTACHMENT_TYPES)
+
+# Ответы на вложение без текста
+ATTACHMENT_REPLY_PHOTO = "Фото увидела. Прокомментируйте, пожалуйста, что именно сейчас отправили?"
+ATTACHMENT_REPLY_SINGLE = "Вложение получила. Прокомментируйте, пожалуйста, что именно сейчас отправили?"
+ATTACHMENT_REPLY_MULTIPLE = "Вложения получила. Прокомментируйте, пожалуйста, что именно сейчас отправили?"
+
+
+def _extract_photo(data) -> Dict[str, Any]:
+    # Фото приходит массивом размеров - берем самый большой по file_size
+    if not isinstance(data, list) or not data:
+        return {}
+    largest = data[0]
+    largest_size = largest.get('file_size', 0)
+    for size in data[1:]:
+        file_size = size.get('file_size', 0)
+        if file_size > largest_size:
+            largest, largest_size = size, file_size
+    return {
+        "file_id": largest.get('file_id'),
+        "file_size": largest.get('file_size'),
+        "width": largest.get('width'),
+        "height": largest.get('height')
+    }
+
+
+def _extract_document(data) -> Dict[str, Any]:
+    return {
+        "file_id": data.get('file_id'),
+        "file_name": data.get('file_name'),
+        "file_size": data.get('file_size'),
+        "mime_type": data.get('mime_type')
+    }
+
+
+def _extract_media(data) -> Dict[str, Any]:
+    return {
+        "file_id": data.get('file_id'),
+        "file_size": data.get('file_size'),
+        "duration": data.get('duration')
+    }
+
+
+def _extract_video(data) -> Dict[str, Any]:
+    detail = _extract_media(data)
+    detail["width"] = data.get('width')
+    detail["height"] = data.get('height')
+    return detail
+
+
+def _extract_sticker(data) -> Dict[str, Any]:
+    return {
+        "file_id": data.get('file_id'),
+        "width": data.get('width'),
+        "height": data.get('height'),
+        "emoji": data.get('emoji')
+    }
+
+
+def _extract_contact(data) -> Dict[str, Any]:
+    return {
+        "phone_number": data.get('phone_number'),
+        "first_name": data.get('first_name'),
+        "last_name": data.get('last_name')
+    }
+
+
+def _extract_location(data) -> Dict[str, Any]:
+    return {
+        "latitude": data.get('latitude'),
+        "longitude": data.get('longitude')
+    }
+
+
+def _extract_file_id(data) -> Dict[str, Any]:
+    # Для остальных типов сохраняем только file_id, если он есть
+    if hasattr(data, 'get') and data.get('file_id'):
+        return {"file_id": data.get('file_id')}
+    return {}
+
+
+ATTACHMENT_EXTRACTORS: Dict[str, Callable[[Any], Dict[str, Any]]] = {
+    'photo': _extract_photo,
+    'document': _extract_document,
+    'video': _extract_video,
+    'audio': _extract_media,
+    'voice': _extract_media,
+    'video_note': _extract_media,
+    'sticker': _extract_sticker,
+    'contact': _extract_contact,
+    'location': _extract_location,
+    'animation': _extract_file_id,
+    'venue': _extract_file_id,
+    'poll': _extract_file_id
+}
+
+
+def has_attachments(message: Dict[str, Any]) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    Проверяет наличие вложений в сообщении и извлекает их метаданные
+
+    Args:
+        message: словарь message/business_message из update
+
+    Returns:
+        (attachments_found, attachments_details) - типы вложений и их метаданные
+    """
+    if ATTACHMENT_KEYS.isdisjoint(message):
+        return [], []
+
+    attachments_found = []
+    attachments_details = []
+    for attachment_type in ATTACHMENT_TYPES:
+        if attachment_type in message:
+            attachments_found.append(attachment_type)
+            detail = {"type": attachment_type}
+            detail.update(ATTACHMENT_EXTRACTORS[attachment_type](message[attachment_type]))
+            attachments_details.append(detail)
+
+    return attachments_found, attachments_details
+
+
+def attachment_reply_text(attachments: List[str]) -> str:
+    """Ответ на вложение без текста: просим клиента прокомментировать"""
+    if len(attachments) == 1:
+        # Особый ответ для фото
+        return ATTACHMENT_REPLY_PHOTO if attachments[0] == 'photo' else ATTACHMENT_REPLY_SINGLE
+    return ATTACHMENT_REPLY_MULTIPLE
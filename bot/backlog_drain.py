@@ -0,0 +1,234 @@
+"""
+Пакетная выгрузка накопившихся updates после сбоя (backlog drain)
+
+Когда pending_update_count исчисляется сотнями, воспроизводить их через
+webhook по одному (полный вызов LLM на каждое сообщение) долго и дорого,
+а удалять через clear_pending_updates.py - значит потерять клиентов.
+
+Drainer забирает backlog через getUpdates, группирует сообщения по
+отправителю в чате, склеивает пропущенные сообщения клиента в один вопрос
+и отправляет один сводный ответ на чат. Число параллельно обрабатываемых
+чатов и размер пачки getUpdates настраиваются.
+
+getUpdates не работает при установленном webhook, поэтому на время выгрузки
+webhook снимается (БЕЗ drop_pending_updates) и затем восстанавливается.
+Updates, пришедшие в этот промежуток, остаются в очереди Telegram и будут
+доставлены через webhook.
+
+getUpdates с offset подтверждает Telegram все updates до него, поэтому
+каждая пачка сначала сохраняется на диск (persist_batch), и только потом
+запрашивается следующая. Обрабатываются сохраненные updates
+(load_persisted): если выгрузку прервал редеплой, подтвержденные, но не
+отвеченные сообщения не теряются - resume() при следующем старте
+доделывает их.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Типы updates с текстом клиента - их склеиваем по отправителю
+MESSAGE_KINDS = ("business_message", "message")
+
+
+def group_updates_by_sender(updates: List[Dict[str, Any]]):
+    """
+    Делит updates на служебные и сгруппированные по отправителю сообщения
+
+    Args:
+        updates: сырые updates из getUpdates (в порядке update_id)
+
+    Returns:
+        (service_updates, groups) - служебные updates в исходном порядке
+        и OrderedDict {(kind, chat_id, sender_id): [update, ...]}
+    """
+    service_updates = []
+    groups: "OrderedDict[Hashable, List[Dict[str, Any]]]" = OrderedDict()
+
+    for update in updates:
+        kind = next((k for k in MESSAGE_KINDS if k in update), None)
+        if kind is None:
+            service_updates.append(update)
+            continue
+        message = update[kind]
+        key = (kind, message.get("chat", {}).get("id"), message.get("from", {}).get("id"))
+        groups.setdefault(key, []).append(update)
+
+    return service_updates, groups
+
+
+class BacklogDrainer:
+    """Выгрузка backlog через getUpdates с группировкой по чатам"""
+
+    def __init__(
+        self,
+        api_call: Callable[[str, Dict[str, Any]], Awaitable[Any]],
+        process_service_update: Callable[[Dict[str, Any]], Awaitable[Any]],
+        process_sender_group: Callable[[Hashable, List[Dict[str, Any]]], Awaitable[Any]],
+        persist_batch: Optional[Callable[[List[Dict[str, Any]]], Awaitable[Any]]] = None,
+        load_persisted: Optional[Callable[[], Awaitable[List[Dict[str, Any]]]]] = None,
+        batch_size: int = 100,        # updates за один вызов getUpdates (максимум Telegram - 100)
+        concurrency: int = 4,         # чатов обрабатывается параллельно
+        max_updates: int = 5000       # защита от бесконечной выгрузки
+    ):
+        self.api_call = api_call
+        self.process_service_update = process_service_update
+        self.process_sender_group = process_sender_group
+        # Без persist_batch пачки подтверждаются сразу и живут только в памяти
+        self.persist_batch = persist_batch
+        self.load_persisted = load_persisted
+        self.batch_size = min(max(batch_size, 1), 100)
+        self.concurrency = max(concurrency, 1)
+        self.max_updates = max_updates
+
+        self.running = False
+        self.last_report: Optional[Dict[str, Any]] = None
+
+    async def fetch_backlog(self, allowed_updates: List[str]) -> List[Dict[str, Any]]:
+        """
+        Забирает pending updates пачками, пока очередь не опустеет
+
+        Пачка подтверждается (offset следующего getUpdates) только после
+        persist_batch: если сохранить не удалось, она остается в Telegram.
+        """
+        updates: List[Dict[str, Any]] = []
+        offset = None
+
+        while len(updates) < self.max_updates:
+            params = {"limit": self.batch_size, "timeout": 0, "allowed_updates": allowed_updates}
+            if offset is not None:
+                params["offset"] = offset
+            batch = await self.api_call("getUpdates", params)
+            if not batch:
+                break
+            if self.persist_batch is not None:
+                await self.persist_batch(batch)
+            updates.extend(batch)
+            offset = batch[-1]["update_id"] + 1
+            logger.info(f"📥 Backlog: получено {len(updates)} updates")
+
+        if offset is not None:
+            # Подтверждаем обработку: Telegram удаляет updates с update_id < offset
+            await self.api_call("getUpdates", {"offset": offset, "limit": 1, "timeout": 0})
+
+        return updates
+
+    async def drain(
+        self,
+        allowed_updates: List[str],
+        restore_webhook: Callable[[], Awaitable[Any]]
+    ) -> Dict[str, Any]:
+        """
+        Полный цикл: снять webhook, выгрузить backlog, обработать, вернуть webhook
+
+        Args:
+            allowed_updates: типы updates для getUpdates
+            restore_webhook: корутина, заново устанавливающая webhook
+
+        Returns:
+            Отчет о выгрузке (количество, группы, время, пропускная способность)
+        """
+        if self.running:
+            return {"status": "already_running"}
+
+        self.running = True
+        started = time.perf_counter()
+        report: Dict[str, Any] = {"status": "running", "started_at": datetime.now().isoformat()}
+        self.last_report = report
+
+        try:
+            await self.api_call("deleteWebhook", {"drop_pending_updates": False})
+            try:
+                updates = await self.fetch_backlog(allowed_updates)
+            finally:
+                await restore_webhook()
+            report.update({"fetched_updates": len(updates), "fetch_seconds": round(time.perf_counter() - started, 2)})
+            if self.load_persisted is not None:
+                # Вместе с новыми - не доделанные прерванной выгрузкой
+                updates = await self.load_persisted()
+            await self._process(updates, report, started)
+            return report
+
+        except Exception as e:
+            report.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+            logger.error(f"❌ Ошибка выгрузки backlog: {e}")
+            return report
+
+        finally:
+            self.running = False
+
+    async def resume(self) -> Optional[Dict[str, Any]]:
+        """Доделывает updates, сохраненные прерванной выгрузкой (при старте, webhook не трогается)"""
+        if self.running or self.load_persisted is None:
+            return None
+
+        self.running = True
+        started = time.perf_counter()
+        report: Dict[str, Any] = {"status": "running", "resumed": True, "started_at": datetime.now().isoformat()}
+        self.last_report = report
+        try:
+            updates = await self.load_persisted()
+            if not updates:
+                report["status"] = "nothing_to_resume"
+                return report
+            logger.info(f"♻️ Backlog: {len(updates)} сохраненных updates прерванной выгрузки")
+            await self._process(updates, report, started)
+            return report
+        except Exception as e:
+            report.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+            logger.error(f"❌ Ошибка продолжения выгрузки backlog: {e}")
+            return report
+        finally:
+            self.running = False
+
+    async def _process(self, updates: List[Dict[str, Any]], report: Dict[str, Any], started: float):
+        """Служебные updates по порядку, затем сообщения - один вопрос на отправителя"""
+        fetched_at = time.perf_counter()
+        service_updates, groups = group_updates_by_sender(updates)
+        report.update({
+            "processed_updates": len(updates),
+            "service_updates": len(service_updates),
+            "sender_groups": len(groups)
+        })
+        logger.info(
+            f"📦 Backlog: {len(updates)} updates, {len(groups)} отправителей, "
+            f"{len(service_updates)} служебных"
+        )
+
+        # Служебные updates (business_connection и т.п.) - сначала и по порядку:
+        # от них зависит фильтрация сообщений владельца
+        for update in service_updates:
+            try:
+                await self.process_service_update(update)
+            except Exception as e:
+                logger.error(f"❌ Backlog: ошибка служебного update {update.get('update_id')}: {e}")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        failed = 0
+
+        async def run_group(key, group):
+            nonlocal failed
+            async with semaphore:
+                try:
+                    await self.process_sender_group(key, group)
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"❌ Backlog: ошибка обработки чата {key}: {e}")
+
+        await asyncio.gather(*(run_group(key, group) for key, group in groups.items()))
+
+        elapsed = time.perf_counter() - started
+        report.update({
+            "status": "done",
+            "failed_groups": failed,
+            "elapsed_seconds": round(elapsed, 2),
+            "processing_seconds": round(time.perf_counter() - fetched_at, 2),
+            "updates_per_second": round(len(updates) / elapsed, 1) if elapsed > 0 else None,
+            "finished_at": datetime.now().isoformat()
+        })
+        logger.info(f"✅ Backlog выгружен: {report}")
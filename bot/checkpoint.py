@@ -0,0 +1,94 @@
+"""
+Checkpoint состояния процесса при остановке
+
+При одном процессе (SHARED_STATE_URL=memory://) защита от повторной
+доставки update, счетчики и история LoopDetector живут только в памяти:
+после редеплоя новый инстанс принимал бы повтор update, который старый уже
+обработал, и не узнавал бы только что отправленные ответы бота.
+
+При остановке состояние пишется в SQLite (одна строка JSON на раздел), при
+старте - читается обратно. Checkpoint старше max_age не загружается:
+claims и окна LoopDetector к этому времени все равно истекли бы.
+С общим SQLite состоянием (несколько процессов) checkpoint не нужен -
+разделы без данных (None) не пишутся.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StateCheckpoint:
+    """Разделы состояния {name: JSON} в одном файле SQLite"""
+
+    def __init__(self, db_path: str, max_age: float = 3600.0):
+        self.db_path = db_path
+        self.max_age = max_age
+        self.last_saved: Optional[Dict[str, Any]] = None
+        self.last_loaded: Optional[Dict[str, Any]] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                name TEXT PRIMARY KEY,
+                saved_at REAL NOT NULL,
+                data TEXT NOT NULL
+            )
+        ''')
+        return conn
+
+    def save(self, sections: Dict[str, Optional[Any]]) -> Dict[str, Any]:
+        """Пишет разделы одной транзакцией (блокирующий вызов - из asyncio.to_thread)"""
+        started = time.perf_counter()
+        now = time.time()
+        rows = [
+            (name, now, json.dumps(data, ensure_ascii=False, default=str))
+            for name, data in sections.items() if data is not None
+        ]
+        with self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO checkpoints (name, saved_at, data) VALUES (?, ?, ?)', rows)
+        conn.close()
+        self.last_saved = {
+            "sections": {name: len(data) for name, _, data in rows},
+            "ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+        logger.info(f"💾 Checkpoint состояния: {self.db_path} {self.last_saved}")
+        return self.last_saved
+
+    def load(self) -> Dict[str, Any]:
+        """Разделы не старше max_age; прочитанный checkpoint удаляется (повторно не применяется)"""
+        if not os.path.exists(self.db_path):
+            return {}
+        cutoff = time.time() - self.max_age
+        with self._connect() as conn:
+            rows = conn.execute('SELECT name, saved_at, data FROM checkpoints').fetchall()
+            conn.execute('DELETE FROM checkpoints')
+        conn.close()
+        sections = {}
+        for name, saved_at, data in rows:
+            if saved_at < cutoff:
+                logger.info(f"💾 Раздел checkpoint '{name}' устарел ({time.time() - saved_at:.0f} с) - пропущен")
+                continue
+            try:
+                sections[name] = json.loads(data)
+            except ValueError as e:
+                logger.error(f"❌ Поврежденный раздел checkpoint '{name}': {e}")
+        self.last_loaded = {"sections": sorted(sections), "found": len(rows)}
+        return sections
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.db_path,
+            "max_age_s": self.max_age,
+            "last_saved": self.last_saved,
+            "last_loaded": self.last_loaded
+        }
@@ -11,7 +11,9 @@ BOT_USERNAME = os.getenv('BOT_USERNAME')
 # Абсолютный путь к файлу инструкций
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 INSTRUCTION_FILE = os.path.join(BASE_DIR, 'data', 'instruction.json')
-DATABASE_PATH = os.path.join(BASE_DIR, 'data', 'bot.db')  # SQLite БД для business_owners
+DATABASE_PATH = os.getenv('DATABASE_PATH', os.path.join(BASE_DIR, 'data', 'bot.db'))  # SQLite БД для business_owners
+# Хранилище версий инструкций (на Railway - путь на volume, чтобы версии переживали деплой)
+INSTRUCTION_STORE_PATH = os.getenv('INSTRUCTION_STORE_PATH', DATABASE_PATH)
 OPENAI_MODEL = 'gpt-4o-mini'  # Используем более экономичную модель
 
 if not TELEGRAM_BOT_TOKEN:
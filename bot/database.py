@@ -6,6 +6,7 @@ SQLite база данных для хранения Business Connections вла
 """
 
 import aiosqlite
+import threading
 import logging
 from datetime import datetime
 from typing import Optional, Dict, List
@@ -19,6 +20,8 @@ class BusinessOwnersDB:
 
     def __init__(self, db_path: str):
         self.db_path = db_path
+        # connection_id -> owner_user_id активных соединений (проверка владельца на каждом сообщении)
+        self._owner_cache: Dict[str, int] = {}
         self._ensure_directory()
 
     def _ensure_directory(self):
@@ -99,6 +102,11 @@ class BusinessOwnersDB:
 
                 await db.commit()
 
+                if is_active:
+                    self._owner_cache[connection_id] = owner_user_id
+                else:
+                    self._owner_cache.pop(connection_id, None)
+
                 status = "активен" if is_active else "отключен"
                 logger.info(f"✅ Сохранен владелец Business Connection: {owner_name or owner_user_id} ({connection_id[:20]}...) - {status}")
                 return True
@@ -107,6 +115,20 @@ class BusinessOwnersDB:
             logger.error(f"❌ Ошибка сохранения владельца: {e}")
             return False
 
+    def cached_owner(self, connection_id: Optional[str]) -> Optional[int]:
+        """owner_user_id из кэша без обращения к БД (None - неизвестен или кэш еще не прогрет)"""
+        return self._owner_cache.get(connection_id) if connection_id else None
+
+    async def warm_owner_cache(self) -> int:
+        """Загружает владельцев всех активных соединений одним запросом (теплый старт кэша)"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('SELECT connection_id, owner_user_id FROM business_connections WHERE is_active = 1')
+            rows = await cursor.fetchall()
+        for connection_id, owner_user_id in rows:
+            # Записи, появившиеся за время запроса, новее
+            self._owner_cache.setdefault(connection_id, owner_user_id)
+        return len(rows)
+
     async def get_business_owner(self, connection_id: str) -> Optional[int]:
         """
         Получает owner_user_id для данного connection_id
@@ -117,6 +139,10 @@ class BusinessOwnersDB:
         Returns:
             owner_user_id или None если не найден
         """
+        owner_id = self._owner_cache.get(connection_id)
+        if owner_id is not None:
+            return owner_id
+
         try:
             async with aiosqlite.connect(self.db_path) as db:
                 cursor = await db.execute(
@@ -127,6 +153,7 @@ class BusinessOwnersDB:
 
                 if row:
                     logger.debug(f"✅ Найден владелец для connection {connection_id[:20]}...: user_id={row[0]}")
+                    self._owner_cache[connection_id] = row[0]
                     return row[0]
                 else:
                     logger.debug(f"⚠️ Владелец не найден для connection {connection_id[:20]}...")
@@ -218,6 +245,7 @@ class BusinessOwnersDB:
                 ''', (connection_id,))
 
                 await db.commit()
+                self._owner_cache.pop(connection_id, None)
                 logger.info(f"❌ Деактивирован Business Connection: {connection_id[:20]}...")
                 return True
 
@@ -225,6 +253,16 @@ class BusinessOwnersDB:
             logger.error(f"❌ Ошибка деактивации connection: {e}")
             return False
 
+    async def ping(self) -> None:
+        """
+        Лёгкая проверка доступности БД для health check
+
+        Raises:
+            Exception если БД недоступна
+        """
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute('SELECT 1')
+
     async def get_stats(self) -> Dict:
         """
         Получает статистику по базе данных
@@ -266,3 +304,29 @@ class BusinessOwnersDB:
                 'active_connections': 0,
                 'total_connections': 0
             }
+
+
+def stop_orphan_connections(timeout: float = 1.0) -> int:
+    """
+    Останавливает потоки aiosqlite, оставшиеся без владельца (при остановке сервера)
+
+    Каждое соединение aiosqlite - отдельный не-daemon поток. Если запрос
+    отменили, пока соединение открывалось (CancelledError внутри
+    `async with aiosqlite.connect(...)`), до close дело не доходит: поток ждет
+    команд вечно, и интерпретатор не завершается после остановки uvicorn.
+
+    Returns:
+        число остановленных потоков
+    """
+    orphans = [
+        thread for thread in threading.enumerate()
+        if isinstance(thread, aiosqlite.Connection) and thread.is_alive()
+    ]
+    for thread in orphans:
+        # Поток доделывает команды в очереди и выходит из цикла (см. aiosqlite.Connection.run)
+        thread._running = False
+    for thread in orphans:
+        thread.join(timeout)
+    if orphans:
+        logger.warning(f"🧹 Остановлено потоков aiosqlite без close: {len(orphans)}")
+    return len(orphans)
@@ -0,0 +1,465 @@
+"""
+Надежная очередь updates на диске между ingest и worker процессами
+
+В режиме по умолчанию (PROCESS_ROLE=all) update живет только в памяти
+процесса: webhook уже ответил Telegram 200, и если процесс упал или
+перезапустился во время генерации, update потерян. При разделении ролей:
+
+- ingest (PROCESS_ROLE=ingest) проверяет secret, отсекает повторы и
+  слишком старые сообщения и пишет тело update в очередь - одна короткая
+  транзакция SQLite, без AI и сетевых вызовов;
+- worker (PROCESS_ROLE=worker) берет updates в аренду (lease), обрабатывает
+  их своим пулом и подтверждает (ack) после завершения job.
+
+Очередь - таблица SQLite в режиме WAL (один файл на хосте или volume).
+Строка удаляется только после ack; аренда упавшего worker истекает через
+lease_seconds, и update получит другой worker (или этот же после
+перезапуска). Попытка засчитывается, когда обработка строки начинается
+(start_processing), а не при аренде: строки, взятые вместе с update,
+уронившим worker, но еще ждавшие в его пуле, не теряют попыток. Update, из-за
+которого worker падает снова и снова, после max_attempts попыток помечается
+dead и больше не выдается; посмотреть и вернуть такие строки - dead_letters()
+и requeue_dead().
+
+Порядок внутри чата: строки выдаются по возрастанию id, а строки чата,
+который сейчас в аренде у другого worker, пропускаются. Поэтому сообщения,
+правки и удаления одного чата попадают в тот worker, где лежит его
+неотвеченный job, и обрабатываются по порядку.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class QueuedUpdate:
+    """Строка очереди, выданная worker"""
+
+    __slots__ = ('id', 'payload', 'chat_ref', 'attempts', 'enqueued_at')
+
+    def __init__(self, id: int, payload: bytes, chat_ref: Optional[str], attempts: int, enqueued_at: float):
+        self.id = id
+        self.payload = payload
+        self.chat_ref = chat_ref
+        self.attempts = attempts
+        self.enqueued_at = enqueued_at
+
+
+class DurableQueue:
+    """Очередь updates в SQLite (WAL) с арендой, подтверждением и dead letters"""
+
+    def __init__(self, db_path: str, lease_seconds: float = 60.0, max_attempts: int = 5):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.acked = 0
+        self.dead_lettered = 0
+
+    def start(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # isolation_level=None: транзакции только явные (BEGIN IMMEDIATE), остальное - autocommit
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS updates (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                update_id INTEGER,
+                chat_ref TEXT,
+                payload BLOB NOT NULL,
+                enqueued_at REAL NOT NULL,
+                lease_owner TEXT,
+                lease_until REAL NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                started INTEGER NOT NULL DEFAULT 0,
+                dead INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_updates_ready ON updates (dead, lease_until, id);
+            CREATE INDEX IF NOT EXISTS idx_updates_owner ON updates (lease_owner, chat_ref);
+        ''')
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(updates)')}
+        if 'started' not in columns:
+            # Очередь, созданная до учета попыток по началу обработки
+            conn.execute('ALTER TABLE updates ADD COLUMN started INTEGER NOT NULL DEFAULT 0')
+        self._conn = conn
+        logger.info(f"📥 Очередь updates: {self.db_path}")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _transaction(self, fn):
+        """fn(conn) внутри BEGIN IMMEDIATE: выдача строк без гонки между workers"""
+        with self._lock:
+            conn = self._conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = fn(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+
+    # === ingest ===
+
+    def put(self, payload: bytes, update_id: Optional[int] = None, chat_ref: Optional[str] = None) -> int:
+        """Сохраняет тело update (сырые байты webhook - без повторной сериализации)"""
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO updates (update_id, chat_ref, payload, enqueued_at) VALUES (?, ?, ?, ?)',
+                (update_id, chat_ref, payload, time.time())
+            )
+        self.enqueued += 1
+        return cursor.lastrowid
+
+    def put_many(self, items: Iterable[Tuple[bytes, Optional[int], Optional[str]]]) -> int:
+        """(payload, update_id, chat_ref) одной транзакцией - пачка backlog сохраняется целиком или никак"""
+        now = time.time()
+        rows = [(update_id, chat_ref, payload, now) for payload, update_id, chat_ref in items]
+        self._transaction(lambda conn: conn.executemany(
+            'INSERT INTO updates (update_id, chat_ref, payload, enqueued_at) VALUES (?, ?, ?, ?)', rows
+        ))
+        self.enqueued += len(rows)
+        return len(rows)
+
+    # === worker ===
+
+    def lease(self, owner: str, limit: int) -> List[QueuedUpdate]:
+        """
+        Выдает до limit строк в аренду owner
+
+        Свободные и просроченные строки по порядку id, кроме чатов, которые
+        сейчас в аренде у другого worker.
+        """
+        if limit <= 0:
+            return []
+
+        def run(conn):
+            now = time.time()
+            rows = conn.execute(
+                '''
+                SELECT id, payload, chat_ref, attempts, enqueued_at FROM updates
+                WHERE dead = 0 AND lease_until < ?
+                  AND (chat_ref IS NULL OR chat_ref NOT IN (
+                      SELECT chat_ref FROM updates
+                      WHERE lease_owner IS NOT NULL AND lease_owner != ? AND lease_until >= ? AND chat_ref IS NOT NULL
+                  ))
+                ORDER BY id LIMIT ?
+                ''',
+                (now, owner, now, limit)
+            ).fetchall()
+            leased, dead = [], []
+            for row_id, payload, chat_ref, attempts, enqueued_at in rows:
+                if attempts >= self.max_attempts:
+                    dead.append(row_id)
+                    continue
+                leased.append(QueuedUpdate(row_id, payload, chat_ref, attempts + 1, enqueued_at))
+            if leased:
+                conn.executemany(
+                    'UPDATE updates SET lease_owner = ?, lease_until = ?, started = 0 WHERE id = ?',
+                    [(owner, now + self.lease_seconds, item.id) for item in leased]
+                )
+            if dead:
+                conn.executemany('UPDATE updates SET dead = 1, lease_owner = NULL WHERE id = ?', [(row_id,) for row_id in dead])
+            return leased, dead
+
+        leased, dead = self._transaction(run)
+        if dead:
+            self.dead_lettered += len(dead)
+            logger.error(f"☠️ Updates {dead} не обработаны за {self.max_attempts} попыток - помечены dead")
+        return leased
+
+    def start_processing(self, ids: Iterable[int]):
+        """Обработка строк началась - попытка засчитывается (один раз за аренду)"""
+        ids = [(row_id,) for row_id in ids]
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany('UPDATE updates SET attempts = attempts + 1, started = 1 WHERE id = ? AND started = 0', ids)
+
+    def ack(self, ids: Iterable[int]):
+        """Update обработан - строка удаляется"""
+        ids = [(row_id,) for row_id in ids]
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany('DELETE FROM updates WHERE id = ?', ids)
+        self.acked += len(ids)
+
+    def extend(self, owner: str) -> int:
+        """Продлевает аренду всех строк owner (worker жив, генерация идет)"""
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE updates SET lease_until = ? WHERE lease_owner = ? AND dead = 0',
+                (time.time() + self.lease_seconds, owner)
+            )
+        return cursor.rowcount
+
+    def release(self, owner: str, ids: Optional[Iterable[int]] = None, count_attempt: bool = False) -> int:
+        """
+        Возвращает строки в очередь без ожидания конца аренды
+
+        Строки, обработка которых не начиналась, попытку не тратят. Начатые:
+        остановка worker - попытка возвращается; перезапуск после падения
+        (count_attempt=True) - остается, иначе update, который роняет
+        worker, никогда не попадет в dead.
+        """
+        attempts = 'attempts' if count_attempt else 'attempts - started'
+        with self._lock:
+            if ids is None:
+                cursor = self._conn.execute(
+                    f'UPDATE updates SET lease_owner = NULL, lease_until = 0, attempts = {attempts}, started = 0 '
+                    'WHERE lease_owner = ? AND dead = 0',
+                    (owner,)
+                )
+            else:
+                cursor = self._conn.executemany(
+                    f'UPDATE updates SET lease_owner = NULL, lease_until = 0, attempts = {attempts}, started = 0 '
+                    'WHERE id = ? AND lease_owner = ?',
+                    [(row_id, owner) for row_id in ids]
+                )
+        return cursor.rowcount
+
+    def dead_letters(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Строки dead для разбора: id, update_id, чат, попытки, возраст и тело update"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT id, update_id, chat_ref, attempts, enqueued_at, payload FROM updates WHERE dead = 1 ORDER BY id LIMIT ?',
+                (limit,)
+            ).fetchall()
+        now = time.time()
+        return [
+            {
+                'id': row_id,
+                'update_id': update_id,
+                'chat_ref': chat_ref,
+                'attempts': attempts,
+                'age_s': round(now - enqueued_at, 1),
+                'payload': bytes(payload).decode('utf-8', errors='replace')
+            }
+            for row_id, update_id, chat_ref, attempts, enqueued_at, payload in rows
+        ]
+
+    def requeue_dead(self, ids: Optional[Iterable[int]] = None) -> int:
+        """Возвращает строки dead в очередь с нулевым счетчиком попыток (ids=None - все)"""
+        reset = 'UPDATE updates SET dead = 0, attempts = 0, started = 0, lease_owner = NULL, lease_until = 0 '
+        with self._lock:
+            if ids is None:
+                cursor = self._conn.execute(reset + 'WHERE dead = 1')
+            else:
+                cursor = self._conn.executemany(reset + 'WHERE id = ? AND dead = 1', [(row_id,) for row_id in ids])
+        if cursor.rowcount:
+            logger.warning(f"♻️ {cursor.rowcount} updates из dead возвращены в очередь")
+        return cursor.rowcount
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.time()
+            ready, leased, dead, oldest = self._conn.execute(
+                '''
+                SELECT
+                    SUM(dead = 0 AND lease_until < ?),
+                    SUM(dead = 0 AND lease_until >= ?),
+                    SUM(dead = 1),
+                    MIN(CASE WHEN dead = 0 THEN enqueued_at END)
+                FROM updates
+                ''',
+                (now, now)
+            ).fetchone()
+            owners = self._conn.execute(
+                'SELECT lease_owner, COUNT(*) FROM updates WHERE dead = 0 AND lease_until >= ? GROUP BY lease_owner',
+                (now,)
+            ).fetchall()
+        return {
+            'path': self.db_path,
+            'ready': ready or 0,
+            'leased': leased or 0,
+            'dead': dead or 0,
+            'oldest_age_s': round(now - oldest, 1) if oldest else None,
+            'leased_by': dict(owners),
+            'enqueued': self.enqueued,
+            'acked': self.acked,
+            'dead_lettered': self.dead_lettered,
+            'lease_seconds': self.lease_seconds,
+            'max_attempts': self.max_attempts
+        }
+
+
+class QueueConsumer:
+    """
+    Цикл worker: аренда строк -> dispatch в пул -> ack по завершении job
+
+    dispatch(item) возвращает:
+    - True - update передан в пул/буфер склейки, ack сделает владелец job (ack());
+    - False - update обработан сразу (правка, удаление, слишком старое) - ack здесь;
+    - None - пул переполнен, строка возвращается в очередь вместе со всеми
+      следующими строками того же чата из этой пачки.
+
+    Берется не больше prefetch строк сверх подтвержденных: остальное ждет в
+    очереди, где его может взять другой worker.
+    """
+
+    def __init__(
+        self,
+        queue: DurableQueue,
+        owner: str,
+        dispatch: Callable[[QueuedUpdate], Optional[bool]],
+        prefetch: int = 16,
+        poll_interval: float = 0.1
+    ):
+        self.queue = queue
+        self.owner = owner
+        self.dispatch = dispatch
+        self.prefetch = prefetch
+        self.poll_interval = poll_interval
+        self.outstanding: Set[int] = set()
+        self.leased_total = 0
+        self.redelivered = 0
+        self._task: Optional[asyncio.Task] = None
+        self._last_extend = 0.0
+        # Подтверждения, которые пишутся в SQLite в потоке (не блокируя event loop)
+        self._acks: Set[asyncio.Task] = set()
+
+    async def start_processing(self, ids: Iterable[int]):
+        """Job со строками очереди начал работу в пуле - их попытка засчитывается"""
+        ids = [row_id for row_id in ids if row_id in self.outstanding]
+        if not ids:
+            return
+        try:
+            await asyncio.to_thread(self.queue.start_processing, ids)
+        except sqlite3.Error as e:
+            logger.error(f"❌ Не удалось отметить начало обработки updates {ids}: {e}")
+
+    def ack(self, ids: Iterable[int]):
+        """Строки обработаны: сразу снимаются с учета, удаление из SQLite - в потоке"""
+        ids = [row_id for row_id in ids if row_id in self.outstanding]
+        if not ids:
+            return
+        self.outstanding.difference_update(ids)
+        task = asyncio.get_running_loop().create_task(self._ack(ids))
+        self._acks.add(task)
+        task.add_done_callback(self._acks.discard)
+
+    async def _ack(self, ids: List[int]):
+        try:
+            await asyncio.to_thread(self.queue.ack, ids)
+        except sqlite3.Error as e:
+            # Строки останутся в аренде и будут выданы повторно после ее окончания
+            logger.error(f"❌ Не удалось подтвердить updates {ids}: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                now = time.monotonic()
+                if self.outstanding and now - self._last_extend >= self.queue.lease_seconds / 4:
+                    self._last_extend = now
+                    await asyncio.to_thread(self.queue.extend, self.owner)
+                items = await asyncio.to_thread(self.queue.lease, self.owner, self.prefetch - len(self.outstanding))
+            except sqlite3.Error as e:
+                logger.error(f"❌ Ошибка чтения очереди updates: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not items:
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            self.leased_total += len(items)
+            rejected = []
+            # Чаты, update которых не принят пулом: следующие updates этих чатов
+            # (правки, удаления) ждут в очереди вместе с ним, порядок не нарушается
+            blocked_chats = set()
+            for item in items:
+                if item.chat_ref is not None and item.chat_ref in blocked_chats:
+                    rejected.append(item.id)
+                    continue
+                if item.attempts > 1:
+                    self.redelivered += 1
+                    logger.warning(f"♻️ Повторная выдача update из очереди (id {item.id}, попытка {item.attempts})")
+                self.outstanding.add(item.id)
+                try:
+                    accepted = self.dispatch(item)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка разбора update из очереди (id {item.id}): {e}")
+                    accepted = False
+                if accepted is None:
+                    self.outstanding.discard(item.id)
+                    rejected.append(item.id)
+                    if item.chat_ref is not None:
+                        blocked_chats.add(item.chat_ref)
+                elif not accepted:
+                    self.ack([item.id])
+            if rejected:
+                await asyncio.to_thread(self.queue.release, self.owner, rejected)
+                await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        """
+        Запуск в event loop worker; строки прошлой жизни этого owner сразу возвращаются в очередь
+
+        Попытка остается только у строк, обработка которых успела начаться.
+        """
+        if self._task is not None:
+            return
+        released = self.queue.release(self.owner, count_attempt=True)
+        if released:
+            logger.warning(f"♻️ {released} updates прерванной работы {self.owner} возвращены в очередь")
+        self._task = asyncio.create_task(self._run(), name="queue-consumer")
+        logger.info(f"✅ Worker {self.owner} читает очередь {self.queue.db_path}")
+
+    async def pause(self):
+        """
+        Прекращает выдачу новых строк (остановка worker), подтверждения продолжают работать
+
+        Аренда взятых строк продлевается сразу: jobs пула дорабатывают до
+        конца ожидания остановки.
+        """
+        await self._cancel()
+        if self.outstanding:
+            await asyncio.to_thread(self.queue.extend, self.owner)
+
+    async def _cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def stop(self):
+        """Прекращает выдачу; неподтвержденные строки возвращаются в очередь для других workers"""
+        await self._cancel()
+        await asyncio.gather(*self._acks, return_exceptions=True)
+        if self.outstanding:
+            released = await asyncio.to_thread(self.queue.release, self.owner, list(self.outstanding))
+            logger.info(f"♻️ {released} неподтвержденных updates возвращены в очередь")
+            self.outstanding.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'owner': self.owner,
+            'running': self._task is not None,
+            'prefetch': self.prefetch,
+            'outstanding': len(self.outstanding),
+            'leased_total': self.leased_total,
+            'redelivered': self.redelivered
+        }
+
+
+def chat_ref_key(chat_id: Any, connection_id: Optional[str]) -> Optional[str]:
+    """Ключ чата в очереди: (chat_id, business_connection_id) как у PendingMessages.chat_ref"""
+    if chat_id is None:
+        return None
+    return json.dumps([chat_id, connection_id])
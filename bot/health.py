@@ -0,0 +1,142 @@
+"""
+Кэш идентичности бота и фоновая проверка зависимостей
+
+Health check endpoint'ы не должны ходить в сеть: Railway опрашивает их часто,
+и блокирующий вызов getMe при медленном Telegram делает сервис "unhealthy".
+Все сетевые проверки выполняются фоновой задачей, а endpoint'ы отдают
+закэшированный результат.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BotIdentityCache:
+    """Закэшированный результат getMe"""
+
+    def __init__(self):
+        self.id: Optional[int] = None
+        self.username: Optional[str] = None
+        self.first_name: Optional[str] = None
+        self.fetched_at: Optional[datetime] = None
+
+    def update(self, bot_info) -> None:
+        """
+        Обновляет кэш из объекта telebot.types.User
+
+        Args:
+            bot_info: результат bot.get_me()
+        """
+        self.id = bot_info.id
+        self.username = bot_info.username
+        self.first_name = bot_info.first_name
+        self.fetched_at = datetime.now()
+
+    @property
+    def is_known(self) -> bool:
+        return self.id is not None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'username': self.username,
+            'first_name': self.first_name,
+            'fetched_at': self.fetched_at.isoformat() if self.fetched_at else None
+        }
+
+
+class DependencyProber:
+    """
+    Фоновый опрос внешних зависимостей (Telegram, OpenAI, Zep, SQLite)
+
+    Каждая проверка - корутина без аргументов. Она возвращает None (OK),
+    строку "disabled" (зависимость не настроена) или бросает исключение.
+    Результаты хранятся в self.status и читаются endpoint'ами без сетевых вызовов.
+    """
+
+    def __init__(
+        self,
+        probes: Dict[str, Callable[[], Awaitable[Optional[str]]]],
+        interval: float = 30.0,   # период опроса (секунды)
+        timeout: float = 10.0     # таймаут одной проверки (секунды)
+    ):
+        self.probes = probes
+        self.interval = interval
+        self.timeout = timeout
+        self.started_at = time.monotonic()
+
+        # {name: {"state": "ok"|"error"|"disabled"|"unknown", ...}}
+        self.status: Dict[str, Dict[str, Any]] = {
+            name: {'state': 'unknown', 'checked_at': None} for name in probes
+        }
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run_probe(self, name: str, probe: Callable[[], Awaitable[Optional[str]]]):
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(probe(), timeout=self.timeout)
+            state = 'disabled' if result == 'disabled' else 'ok'
+            error = None
+        except asyncio.TimeoutError:
+            state, error = 'error', f'timeout after {self.timeout}s'
+        except Exception as e:
+            state, error = 'error', f'{type(e).__name__}: {e}'
+
+        previous = self.status.get(name, {}).get('state')
+        self.status[name] = {
+            'state': state,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 1),
+            'checked_at': datetime.now().isoformat(),
+            'error': error
+        }
+
+        if state == 'error' and previous != 'error':
+            logger.warning(f"⚠️ Зависимость {name} недоступна: {error}")
+        elif state == 'ok' and previous == 'error':
+            logger.info(f"✅ Зависимость {name} снова доступна")
+
+    async def probe_all(self):
+        """Запускает все проверки параллельно"""
+        await asyncio.gather(*(self._run_probe(name, probe) for name, probe in self.probes.items()))
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error(f"❌ Ошибка фоновой проверки зависимостей: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Запускает фоновый опрос в текущем event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def is_ready(self, required: Iterable[str]) -> bool:
+        """
+        Готов ли сервис принимать трафик
+
+        Args:
+            required: имена зависимостей, без которых сервис не работает
+
+        Returns:
+            True если все обязательные зависимости в состоянии ok/disabled
+        """
+        return all(self.status.get(name, {}).get('state') in ('ok', 'disabled') for name in required)
+
+    def uptime_seconds(self) -> float:
+        return round(time.monotonic() - self.started_at, 1)
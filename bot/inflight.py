@@ -0,0 +1,211 @@
+"""
+Правки и удаления сообщений клиентов, на которые бот еще не ответил
+
+Telegram присылает edited_business_message и deleted_business_messages.
+Если клиент исправил или удалил сообщение, пока ответ на него стоит
+в очереди или генерируется, старая работа бессмысленна:
+
+- правка в очереди: текст job заменяется, ответ строится уже по новому тексту
+- правка во время генерации: генерация отменяется и запускается заново
+- удаление: сообщение убирается из job; если в job больше ничего не осталось,
+  генерация отменяется (ответ не отправляется и не пишется в Zep)
+- новое сообщение того же клиента, пока ответ на предыдущее генерируется:
+  старая генерация отменяется (HTTP поток OpenAI закрывается), а новый
+  job забирает себе неотвеченный вопрос - клиент получает один ответ на оба
+
+Реестр знает все jobs от постановки в очередь до завершения обработчика.
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from .worker_pool import UpdateJob
+
+logger = logging.getLogger(__name__)
+
+# Причины отмены
+CANCEL_EDITED = "edited"
+CANCEL_DELETED = "deleted"
+CANCEL_SUPERSEDED = "superseded"
+
+
+class PendingMessages:
+    """Реестр сообщений клиентов, ответ на которые еще не отправлен"""
+
+    def __init__(self, handler: Callable[[UpdateJob], Awaitable[Optional[Dict[str, Any]]]]):
+        self.handler = handler
+        # ((chat_id, business_connection_id), message_id) -> job
+        self._jobs: Dict[Tuple[Any, Any], UpdateJob] = {}
+        # chat_key -> job, обработчик которого выполняется сейчас
+        self._running: Dict[Any, UpdateJob] = {}
+        self.counters: Counter = Counter()
+
+    @staticmethod
+    def _chat_id(job: UpdateJob):
+        return job.chat_key[1] if job.chat_key else None
+
+    @staticmethod
+    def chat_ref(job: UpdateJob):
+        """(chat_id, business_connection_id): один клиент может писать в разные business аккаунты"""
+        return job.chat_key[1:] if job.chat_key else None
+
+    def track(self, job: UpdateJob):
+        """Регистрирует job (повторный вызов для склеенного job перенаправляет ключи на него)"""
+        chat_ref = self.chat_ref(job)
+        if chat_ref is None:
+            return
+        for message_id in job.message_ids:
+            self._jobs[(chat_ref, message_id)] = job
+
+    def untrack(self, job: UpdateJob):
+        chat_ref = self.chat_ref(job)
+        for message_id in job.message_ids:
+            if self._jobs.get((chat_ref, message_id)) is job:
+                del self._jobs[(chat_ref, message_id)]
+
+    def find(self, chat_ref, message_id) -> Optional[UpdateJob]:
+        return self._jobs.get((chat_ref, message_id))
+
+    async def run(self, job: UpdateJob) -> Optional[Dict[str, Any]]:
+        """
+        Обертка обработчика для пула: пропускает отмененные jobs
+        и перезапускает генерацию после правки
+        """
+        try:
+            while True:
+                if job.cancel_reason is not None:
+                    self.counters[f"skipped_{job.cancel_reason}"] += 1
+                    return {"ok": True, "action": f"cancelled_{job.cancel_reason}"}
+
+                job.task = asyncio.ensure_future(self.handler(job))
+                if job.chat_key is not None:
+                    self._running[job.chat_key] = job
+                try:
+                    return await job.task
+                except asyncio.CancelledError:
+                    # Отменили не мы (остановка сервера) - пробрасываем дальше
+                    if job.cancel_reason is None or not job.task.cancelled():
+                        raise
+                    if not job.restart:
+                        self.counters[f"cancelled_{job.cancel_reason}"] += 1
+                        logger.info(f"🛑 Генерация ответа отменена ({job.cancel_reason}): chat {self._chat_id(job)}")
+                        return {"ok": True, "action": f"cancelled_{job.cancel_reason}"}
+
+                    # Сообщение изменилось - генерируем заново по новому тексту
+                    self.counters["regenerated"] += 1
+                    logger.info(f"🔁 Генерация перезапущена после правки: chat {self._chat_id(job)}")
+                    job.cancel_reason = None
+                    job.restart = False
+                    job.regenerations += 1
+                finally:
+                    job.task = None
+        finally:
+            if self._running.get(job.chat_key) is job:
+                del self._running[job.chat_key]
+            self.untrack(job)
+
+    def _interrupt(self, job: UpdateJob, reason: str, restart: bool):
+        """Отменяет job: в очереди - помечает, во время генерации - отменяет task"""
+        job.cancel_reason = reason
+        job.restart = restart
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+
+    def supersede(self, job: UpdateJob) -> bool:
+        """
+        Новое сообщение клиента: отменяет генерацию ответа на предыдущее
+        и переносит неотвеченный вопрос в новый job
+
+        Returns:
+            True если предыдущая генерация отменена
+        """
+        active = self._running.get(job.chat_key)
+        if active is None or active is job or active.task is None or active.sending:
+            return False
+        # Только тот же отправитель: сообщение владельца аккаунта не должно отменять ответ клиенту
+        if active.sender_id != job.sender_id or active.cancel_reason is not None:
+            return False
+
+        job.parts = active.parts + job.parts
+        job.rebuild()
+        # Вопрос переехал в новый job - и строки очереди подтверждаются вместе с ним
+        job.queue_ids = active.queue_ids + job.queue_ids
+        active.queue_ids = []
+        job.age_minutes = max(job.age_minutes, active.age_minutes)
+        self._interrupt(active, CANCEL_SUPERSEDED, restart=False)
+        self.track(job)
+        self.counters["superseded"] += 1
+        logger.info(f"⏭️ Клиент написал снова - отменяю генерацию ответа в chat {self._chat_id(job)}")
+        return True
+
+    def apply_edit(self, chat_ref, edited_message: Dict[str, Any]) -> str:
+        """
+        Применяет правку сообщения клиента
+
+        Returns:
+            updated_queued / regenerating / too_late / not_pending
+        """
+        message_id = edited_message.get("message_id")
+        job = self.find(chat_ref, message_id)
+        if job is None:
+            # Ответ уже отправлен (или сообщение не обрабатывалось) - менять нечего
+            self.counters["edit_not_pending"] += 1
+            return "not_pending"
+        if job.sending:
+            # Ответ уже отправляется - перегенерировать поздно
+            self.counters["edit_too_late"] += 1
+            return "too_late"
+
+        job.parts = [edited_message if part.get("message_id") == message_id else part for part in job.parts]
+        job.rebuild()
+
+        if job.task is None:
+            self.counters["edit_updated_queued"] += 1
+            return "updated_queued"
+
+        self._interrupt(job, CANCEL_EDITED, restart=True)
+        return "regenerating"
+
+    def apply_delete(self, chat_ref, message_ids: Iterable[Any]) -> Dict[str, int]:
+        """
+        Применяет удаление сообщений клиента
+
+        Returns:
+            Счетчики: cancelled (job отменен), trimmed (из job убрана часть
+            склеенных сообщений), too_late (ответ уже отправляется), not_pending
+        """
+        result: Counter = Counter()
+        for message_id in message_ids:
+            job = self.find(chat_ref, message_id)
+            if job is None:
+                result["not_pending"] += 1
+                continue
+            if job.sending:
+                result["too_late"] += 1
+                continue
+
+            del self._jobs[(chat_ref, message_id)]
+            job.parts = [part for part in job.parts if part.get("message_id") != message_id]
+
+            if not job.parts:
+                self._interrupt(job, CANCEL_DELETED, restart=False)
+                result["cancelled"] += 1
+            else:
+                job.rebuild()
+                if job.task is not None:
+                    # Остальные склеенные сообщения еще актуальны - отвечаем на них
+                    self._interrupt(job, CANCEL_DELETED, restart=True)
+                result["trimmed"] += 1
+
+        for key, value in result.items():
+            self.counters[f"delete_{key}"] += value
+        return dict(result)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'pending_messages': len(self._jobs),
+            'generating_chats': len(self._running),
+            'counters': dict(self.counters)
+        }
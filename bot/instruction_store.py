@@ -0,0 +1,212 @@
+"""
+Версионированное хранилище инструкций (SQLite)
+
+Каждая версия инструкций хранится один раз под хешем своего содержимого,
+активная версия - отдельная запись с номером ревизии. Админ панель
+публикует версию через API бота, бот раз в секунду сверяет ревизию и
+подменяет промпт без пересборки на Railway. Откат - это просто активация
+одной из ранее сохраненных версий.
+
+Модуль синхронный (sqlite3), чтобы его можно было использовать и из
+скриптов. В боте методы вызываются через asyncio.to_thread.
+"""
+
+import contextlib
+import json
+import os
+import re
+import sqlite3
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .prompt import PromptSnapshot, instruction_hash
+
+# Версия из URL или админ панели: только hex (иначе % и _ работали бы в LIKE как шаблон)
+_HASH_PREFIX = re.compile(r"[0-9a-f]+")
+
+
+class InstructionStore:
+    """Хранилище версий инструкций с активной версией и журналом активаций"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._init_db()
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Соединение на одну операцию: транзакция и закрытие (watcher обращается раз в секунду)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            # WAL: бот читает ревизию каждую секунду, не мешая записи
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS instruction_versions (
+                    hash TEXT PRIMARY KEY,
+                    instruction_json TEXT NOT NULL,
+                    author TEXT,
+                    comment TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS instruction_activations (
+                    revision INTEGER PRIMARY KEY AUTOINCREMENT,
+                    hash TEXT NOT NULL REFERENCES instruction_versions(hash),
+                    author TEXT,
+                    activated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+    def publish(
+        self,
+        instruction: Dict[str, Any],
+        author: Optional[str] = None,
+        comment: Optional[str] = None,
+        activate: bool = True
+    ) -> Tuple[str, bool]:
+        """
+        Сохраняет версию (если такой еще нет) и по умолчанию делает ее активной
+
+        Returns:
+            (hash, activated) - activated=False если эта версия уже была активной
+        """
+        version_hash = instruction_hash(instruction)
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO instruction_versions (hash, instruction_json, author, comment) VALUES (?, ?, ?, ?)',
+                (version_hash, json.dumps(instruction, ensure_ascii=False), author, comment)
+            )
+        if not activate:
+            return version_hash, False
+        return version_hash, self.activate(version_hash, author=author)
+
+    def import_version(self, instruction: Dict[str, Any], author: Optional[str] = None, comment: Optional[str] = None) -> bool:
+        """
+        Публикует инструкции, только если такого содержимого еще не было
+
+        Используется при старте для instruction.json из репозитория: новая
+        правка файла становится активной версией, а уже известная (например,
+        после отката в админ панели) не перебивает выбранную версию.
+        """
+        if self.get(instruction_hash(instruction)) is not None:
+            return False
+        self.publish(instruction, author=author, comment=comment)
+        return True
+
+    def resolve(self, version: str) -> Optional[str]:
+        """Полный хеш по префиксу (в интерфейсе показываются первые 12 символов)"""
+        if not _HASH_PREFIX.fullmatch(version):
+            return None
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT hash FROM instruction_versions WHERE hash LIKE ? LIMIT 2', (f"{version}%",)
+            ).fetchall()
+        return rows[0]['hash'] if len(rows) == 1 else None
+
+    def activate(self, version: str, author: Optional[str] = None) -> bool:
+        """
+        Делает версию активной (в т.ч. откат на старую)
+
+        Returns:
+            False если версия уже активна
+
+        Raises:
+            KeyError если версия не найдена
+        """
+        version_hash = self.resolve(version)
+        if version_hash is None:
+            raise KeyError(f"Версия инструкций {version} не найдена")
+        active = self.active()
+        if active and active[0] == version_hash:
+            return False
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO instruction_activations (hash, author) VALUES (?, ?)', (version_hash, author)
+            )
+        return True
+
+    def active(self) -> Optional[Tuple[str, int]]:
+        """(hash, revision) активной версии - дешевый запрос для опроса изменений"""
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT hash, revision FROM instruction_activations ORDER BY revision DESC LIMIT 1'
+            ).fetchone()
+        return (row['hash'], row['revision']) if row else None
+
+    def get(self, version_hash: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT instruction_json FROM instruction_versions WHERE hash = ?', (version_hash,)
+            ).fetchone()
+        return json.loads(row['instruction_json']) if row else None
+
+    def get_active(self) -> Optional[Tuple[str, int, Dict[str, Any]]]:
+        """(hash, revision, instruction) активной версии"""
+        active = self.active()
+        if active is None:
+            return None
+        return active[0], active[1], self.get(active[0])
+
+    def list_versions(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Версии, начиная с последних, с отметкой активной"""
+        active = self.active()
+        active_hash = active[0] if active else None
+        with self._connect() as conn:
+            rows = conn.execute('''
+                SELECT v.hash, v.author, v.comment, v.created_at, v.instruction_json,
+                       MAX(a.activated_at) AS last_activated_at
+                FROM instruction_versions v
+                LEFT JOIN instruction_activations a ON a.hash = v.hash
+                GROUP BY v.hash
+                ORDER BY v.created_at DESC, v.rowid DESC
+                LIMIT ?
+            ''', (limit,)).fetchall()
+
+        versions = []
+        for row in rows:
+            instruction = json.loads(row['instruction_json'])
+            versions.append({
+                'version': row['hash'][:12],
+                'hash': row['hash'],
+                'author': row['author'],
+                'comment': row['comment'],
+                'created_at': row['created_at'],
+                'last_activated_at': row['last_activated_at'],
+                'last_updated': instruction.get('last_updated'),
+                'system_instruction_length': len(instruction.get('system_instruction', '')),
+                'active': row['hash'] == active_hash
+            })
+        return versions
+
+    def history(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Журнал активаций (публикации и откаты)"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT revision, hash, author, activated_at FROM instruction_activations ORDER BY revision DESC LIMIT ?',
+                (limit,)
+            ).fetchall()
+        return [
+            {'revision': row['revision'], 'version': row['hash'][:12], 'author': row['author'], 'activated_at': row['activated_at']}
+            for row in rows
+        ]
+
+    def snapshot(self, version_hash: str, revision: Optional[int] = None) -> Optional[PromptSnapshot]:
+        """PromptSnapshot версии (версия снапшота = первые 12 символов хеша)"""
+        instruction = self.get(version_hash)
+        if instruction is None:
+            return None
+        source = f"store:{revision}" if revision is not None else "store"
+        return PromptSnapshot(instruction, version=version_hash[:12], source=source)
+
+    def is_empty(self) -> bool:
+        return self.active() is None
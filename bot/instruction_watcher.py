@@ -0,0 +1,171 @@
+"""
+Фоновое отслеживание изменений инструкций
+
+InstructionWatcher раз в interval секунд сравнивает mtime и размер
+instruction.json (os.stat - дешевая операция). При изменении файл читается
+и разбирается в отдельном потоке, а готовый PromptSnapshot передается в
+on_change. Битый или недописанный JSON не применяется: остается предыдущая
+версия, попытка повторяется при следующем изменении файла.
+
+InstructionStoreWatcher так же опрашивает номер ревизии активной версии в
+хранилище версий (один индексный запрос) - так публикация и откат из админ
+панели доходят до всех процессов бота примерно за секунду.
+"""
+
+import abc
+import asyncio
+import inspect
+import logging
+import os
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .instruction_store import InstructionStore
+from .prompt import PromptSnapshot, load_prompt_file
+
+logger = logging.getLogger(__name__)
+
+
+class _PollingWatcher(abc.ABC):
+    """Общий цикл опроса: check() раз в interval секунд в фоновой задаче"""
+
+    def __init__(self, on_change: Callable[[PromptSnapshot], Any], interval: float):
+        self.on_change = on_change
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.reloads = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+    @abc.abstractmethod
+    async def check(self) -> bool:
+        """Проверяет источник и применяет новую версию; True - версия сменилась"""
+
+    async def _apply(self, snapshot: PromptSnapshot):
+        self.reloads += 1
+        result = self.on_change(snapshot)
+        if inspect.isawaitable(result):
+            await result
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                self.errors += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.error(f"❌ Ошибка отслеживания инструкций: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"👀 {type(self).__name__}: опрос каждые {self.interval}с")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'interval': self.interval,
+            'running': self._task is not None,
+            'reloads': self.reloads,
+            'errors': self.errors,
+            'last_error': self.last_error
+        }
+
+
+class InstructionWatcher(_PollingWatcher):
+    """
+    Опрос mtime файла инструкций + разбор новой версии вне event loop
+
+    Первая проверка после start() перечитывает файл (если не вызван prime()):
+    так не теряется правка, сделанная между загрузкой при старте и запуском
+    опроса (та же версия по хешу содержимого просто не применяется).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        on_change: Callable[[PromptSnapshot], Any],
+        interval: float = 2.0
+    ):
+        super().__init__(on_change, interval)
+        self.path = path
+        self._stamp: Optional[Tuple[float, int]] = None
+
+    def prime(self):
+        """Запоминает текущее состояние файла: первая проверка не будет перечитывать его"""
+        self._stamp = self._read_stamp()
+
+    def _read_stamp(self) -> Optional[Tuple[float, int]]:
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    async def check(self) -> bool:
+        """
+        Одна проверка файла
+
+        Returns:
+            True если загружена новая версия
+        """
+        stamp = self._read_stamp()
+        if stamp is None or stamp == self._stamp:
+            return False
+
+        try:
+            snapshot = await asyncio.to_thread(load_prompt_file, self.path)
+        except Exception as e:
+            # Файл могут дописывать прямо сейчас - попробуем при следующем изменении
+            self._stamp = stamp
+            self.errors += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            logger.error(f"❌ Не удалось загрузить измененный {self.path}: {e}")
+            return False
+
+        self._stamp = stamp
+        await self._apply(snapshot)
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'path': self.path, **super().get_stats()}
+
+
+class InstructionStoreWatcher(_PollingWatcher):
+    """Опрос ревизии активной версии в InstructionStore"""
+
+    def __init__(
+        self,
+        store: InstructionStore,
+        on_change: Callable[[PromptSnapshot], Any],
+        interval: float = 1.0
+    ):
+        super().__init__(on_change, interval)
+        self.store = store
+        self.revision: Optional[int] = None
+
+    async def check(self) -> bool:
+        """
+        Одна проверка хранилища
+
+        Returns:
+            True если применена другая активная версия (публикация или откат)
+        """
+        active = await asyncio.to_thread(self.store.active)
+        if active is None or active[1] == self.revision:
+            return False
+
+        version_hash, revision = active
+        snapshot = await asyncio.to_thread(self.store.snapshot, version_hash, revision)
+        self.revision = revision
+        if snapshot is not None:
+            await self._apply(snapshot)
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'db_path': self.store.db_path, 'revision': self.revision, **super().get_stats()}
@@ -9,7 +9,7 @@ import logging
 import hashlib
 from datetime import datetime, timedelta
 from collections import deque
-from typing import Optional, Dict, Set
+from typing import Any, Dict, List, Optional, Set
 
 logger = logging.getLogger(__name__)
 
@@ -51,11 +51,15 @@ class LoopDetector:
         self,
         min_message_interval: float = 2.0,  # минимальный интервал между сообщениями (секунды)
         max_recent_messages: int = 50,       # количество сохраняемых хешей сообщений
-        duplicate_window: int = 300          # окно обнаружения дубликатов (секунды)
+        duplicate_window: int = 300,         # окно обнаружения дубликатов (секунды)
+        signatures: Optional[List[str]] = None,         # подписи бота (по умолчанию BOT_SIGNATURES)
+        greeting_patterns: Optional[List[str]] = None   # начала ответов (по умолчанию BOT_GREETING_PATTERNS)
     ):
         self.min_message_interval = min_message_interval
         self.max_recent_messages = max_recent_messages
         self.duplicate_window = duplicate_window
+        self.signatures = signatures if signatures is not None else self.BOT_SIGNATURES
+        self.greeting_patterns = greeting_patterns if greeting_patterns is not None else self.BOT_GREETING_PATTERNS
 
         # История сообщений: {chat_id: deque of (timestamp, message_hash)}
         self.message_history: Dict[int, deque] = {}
@@ -95,13 +99,13 @@ class LoopDetector:
         text_lower = text.lower()
 
         # Проверка на характерные подписи
-        for signature in self.BOT_SIGNATURES:
+        for signature in self.signatures:
             if signature.lower() in text_lower:
                 logger.info(f"🔍 Обнаружена подпись бота: '{signature}'")
                 return True
 
         # Проверка на характерные приветствия
-        for pattern in self.BOT_GREETING_PATTERNS:
+        for pattern in self.greeting_patterns:
             if text.startswith(pattern) or text_lower.startswith(pattern.lower()):
                 logger.info(f"🔍 Обнаружено приветствие бота: '{pattern}'")
                 return True
@@ -184,7 +188,9 @@ class LoopDetector:
         text: str,
         chat_id: int,
         user_id: int,
-        from_business_api: bool = True
+        from_business_api: bool = True,
+        check_rate: bool = True,
+        check_duplicate: bool = True
     ) -> tuple[bool, Optional[str]]:
         """
         Определяет, нужно ли игнорировать сообщение
@@ -194,6 +200,10 @@ class LoopDetector:
             chat_id: ID чата
             user_id: ID пользователя
             from_business_api: пришло ли из Business API
+            check_rate: проверять ли частоту сообщений (False для накопившихся
+                updates после деплоя - они всегда приходят пачкой)
+            check_duplicate: проверять ли повтор текста (False для update, выданного
+                очередью повторно: первая попытка уже запомнила его хеш)
 
         Returns:
             (should_ignore, reason) - нужно ли игнорировать и причина
@@ -208,12 +218,12 @@ class LoopDetector:
             return True, "bot_message_detected"
 
         # Проверка 2: Слишком быстрое сообщение
-        if self._is_rapid_message(chat_id):
+        if check_rate and self._is_rapid_message(chat_id):
             logger.warning(f"🚫 LOOP DETECTED: Слишком быстрое сообщение")
             return True, "rapid_message"
 
         # Проверка 3: Дубликат сообщения
-        if self._is_duplicate_message(text, chat_id):
+        if check_duplicate and self._is_duplicate_message(text, chat_id):
             logger.warning(f"🚫 LOOP DETECTED: Дубликат сообщения")
             return True, "duplicate_message"
 
@@ -243,6 +253,35 @@ class LoopDetector:
 
         logger.debug(f"📝 Отслеживаю ответ бота в chat {chat_id}")
 
+    def export_state(self) -> Optional[Dict[str, Any]]:
+        """История для checkpoint при остановке (JSON: chat_id и unix time)"""
+        cutoff = datetime.now() - timedelta(seconds=self.duplicate_window)
+        return {
+            'last_message': [[chat_id, at.timestamp()] for chat_id, at in self.last_message_time.items()],
+            'history': [
+                [chat_id, [[at.timestamp(), message_hash] for at, message_hash in history if at >= cutoff]]
+                for chat_id, history in self.message_history.items()
+            ]
+        }
+
+    def import_state(self, state: Dict[str, Any]):
+        """Восстанавливает историю из checkpoint (устаревшие записи отбрасываются)"""
+        now = datetime.now()
+        cutoff = now - timedelta(seconds=self.duplicate_window)
+        for chat_id, at in state.get('last_message', []):
+            at = datetime.fromtimestamp(at)
+            if now - at < timedelta(seconds=self.min_message_interval):
+                self.last_message_time[chat_id] = max(at, self.last_message_time.get(chat_id, at))
+        for chat_id, entries in state.get('history', []):
+            for at, message_hash in entries:
+                at = datetime.fromtimestamp(at)
+                if at < cutoff:
+                    continue
+                if chat_id not in self.message_history:
+                    self.message_history[chat_id] = deque(maxlen=self.max_recent_messages)
+                self.message_history[chat_id].append((at, message_hash))
+                self.recent_message_hashes.add(message_hash)
+
     def get_stats(self) -> Dict:
         """
         Получает статистику работы детектора
@@ -260,3 +299,118 @@ class LoopDetector:
             'duplicate_window': self.duplicate_window,
             'last_cleanup': datetime.now().isoformat()
         }
+
+
+class SharedLoopDetector(LoopDetector):
+    """
+    LoopDetector с историей в общем состоянии процессов (bot/shared_state.py)
+
+    При нескольких uvicorn workers сообщения одного чата попадают в разные
+    процессы: частота и дубликаты проверяются по общей истории, а не по
+    памяти процесса. Проверки текста (подписи, приветствия) не меняются.
+    """
+
+    def __init__(self, state, namespace: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.state = state
+        self.namespace = namespace or ""
+
+    def _is_rapid_message(self, chat_id: int) -> bool:
+        now = datetime.now().timestamp()
+        previous = self.state.touch_chat(self.namespace, chat_id, now)
+        if previous is not None and now - previous < self.min_message_interval:
+            logger.warning(f"⚡ Слишком быстрое сообщение от chat {chat_id}: {now - previous:.2f}с < {self.min_message_interval}с")
+            return True
+        return False
+
+    def _is_duplicate_message(self, text: str, chat_id: int) -> bool:
+        duplicate = self.state.remember_hash(
+            self.namespace, chat_id, self._get_message_hash(text, chat_id), datetime.now().timestamp(),
+            window=self.duplicate_window, keep=self.max_recent_messages
+        )
+        if duplicate:
+            logger.warning(f"🔄 Обнаружен дубликат сообщения в chat {chat_id}")
+        return duplicate
+
+    def export_state(self) -> Optional[Dict[str, Any]]:
+        # История уже в общем SQLite и переживает перезапуск
+        return None
+
+    def import_state(self, state: Dict[str, Any]):
+        pass
+
+    def track_bot_response(self, text: str, chat_id: int):
+        self.state.remember_hash(
+            self.namespace, chat_id, self._get_message_hash(text, chat_id), datetime.now().timestamp(),
+            window=self.duplicate_window, keep=self.max_recent_messages, check=False
+        )
+        logger.debug(f"📝 Отслеживаю ответ бота в chat {chat_id}")
+
+    def get_stats(self) -> Dict:
+        since = datetime.now().timestamp() - self.duplicate_window
+        return {
+            **self.state.loop_stats(self.namespace, since),
+            'min_message_interval': self.min_message_interval,
+            'duplicate_window': self.duplicate_window,
+            'last_cleanup': datetime.now().isoformat()
+        }
+
+
+class LoopDetectorRegistry:
+    """
+    Отдельный LoopDetector на каждый Business Connection
+
+    История сообщений и подписи бота у каждого business аккаунта свои:
+    ответ консультанта одного аккаунта не должен считаться "петлей" в другом.
+    Namespace None - сообщения без connection_id и обычные чаты.
+
+    С общим состоянием (state.shared) детекторы хранят историю в нем, чтобы
+    все uvicorn workers видели одни и те же сообщения.
+    """
+
+    def __init__(self, state=None, **detector_kwargs):
+        self.state = state if state is not None and state.shared else None
+        self.detector_kwargs = detector_kwargs
+        self.detectors: Dict[Optional[str], LoopDetector] = {}
+
+    def get(self, namespace: Optional[str] = None, signatures: Optional[List[str]] = None) -> LoopDetector:
+        detector = self.detectors.get(namespace)
+        if detector is None:
+            if self.state is not None:
+                detector = SharedLoopDetector(self.state, namespace, signatures=signatures, **self.detector_kwargs)
+            else:
+                detector = LoopDetector(signatures=signatures, **self.detector_kwargs)
+            self.detectors[namespace] = detector
+        elif signatures is not None and detector.signatures != signatures:
+            # Профиль аккаунта изменился - обновляем подписи, история сохраняется
+            detector.signatures = signatures
+        return detector
+
+    def export_state(self) -> Optional[Dict[str, Any]]:
+        """{namespace: история детектора} или None, если история в общем состоянии"""
+        if self.state is not None:
+            return None
+        # JSON: namespace None (обычные чаты) хранится как пустая строка
+        return {namespace or "": detector.export_state() for namespace, detector in self.detectors.items()}
+
+    def import_state(self, state: Dict[str, Any]):
+        for namespace, detector_state in state.items():
+            self.get(namespace or None).import_state(detector_state)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {
+            'namespaces': len(self.detectors),
+            'tracked_chats': 0,
+            'total_tracked_messages': 0,
+            'recent_hashes_count': 0
+        }
+        for detector in self.detectors.values():
+            detector_stats = detector.get_stats()
+            for key in ('tracked_chats', 'total_tracked_messages', 'recent_hashes_count'):
+                stats[key] += detector_stats[key]
+        stats.update({
+            'min_message_interval': self.detector_kwargs.get('min_message_interval'),
+            'duplicate_window': self.detector_kwargs.get('duplicate_window'),
+            'last_cleanup': datetime.now().isoformat()
+        })
+        return stats
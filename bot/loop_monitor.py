@@ -0,0 +1,196 @@
+"""
+Монитор event loop: лаг и блокирующие вызовы
+
+webhook.py смешивает синхронный код (telebot, requests, запись логов,
+json.dumps больших структур) с async обработчиками. Пока такой вызов
+выполняется в потоке event loop, все остальные updates стоят.
+
+Сторожевой поток раз в interval ставит в loop пустой callback
+(call_soon_threadsafe) и ждет его выполнения:
+- время до выполнения - лаг event loop (скользящее окно для перцентилей);
+- если callback не выполнен за block_threshold, loop заблокирован: поток
+  снимает стек потока event loop (sys._current_frames) - это и есть код,
+  который держит loop, - и ждет разблокировки, чтобы узнать длительность.
+
+Блокировка относится к текущей задаче loop: запросу (шаблон пути FastAPI,
+метка ставится ASGI middleware) или фоновой задаче (по имени задачи).
+В обычном режиме стоимость - один callback и одно пробуждение потока за
+interval; стек снимается только при блокировке.
+"""
+
+import asyncio
+import logging
+import re
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_TASK_SUFFIX_RE = re.compile(r"-\d+$")
+
+
+class EventLoopMonitor:
+    """Лаг event loop и блокировки дольше порога со стеком и источником"""
+
+    def __init__(
+        self,
+        interval: float = 0.25,             # период проверки, секунды
+        block_threshold: float = 0.1,       # блокировка дольше этого - событие со стеком
+        window: int = 1200,                 # замеров лага для перцентилей (5 минут при 0.25 с)
+        max_events: int = 50,               # последние блокировки со стеками
+        stack_limit: int = 25               # кадров стека (от самого вложенного)
+    ):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.stack_limit = stack_limit
+        self.lag_samples: deque = deque(maxlen=window)
+        self.events: deque = deque(maxlen=max_events)
+        self.blocks_by_source: Dict[str, Dict[str, float]] = {}
+        self.blocked_total = 0
+        self.max_lag_ms = 0.0
+        self._labels: "weakref.WeakKeyDictionary[asyncio.Task, dict]" = weakref.WeakKeyDictionary()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # === метки источников ===
+
+    def label_current_task(self, scope: dict):
+        """
+        Привязывает текущую задачу к ASGI запросу
+
+        Сохраняется сам scope: роутер позже добавляет в него route, и в
+        событии окажется шаблон пути (/debug/memory/{session_id}), а не
+        конкретный URL.
+        """
+        task = asyncio.current_task()
+        if task is not None:
+            self._labels[task] = scope
+
+    def _source(self) -> str:
+        """Что выполняется в loop сейчас (вызывается из сторожевого потока)"""
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        if task is None:
+            return "callback"
+        scope = self._labels.get(task)
+        if scope is not None:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or scope.get("path", "?")
+            return f"{scope.get('method', '')} {path}".strip()
+        return _TASK_SUFFIX_RE.sub("", task.get_name())
+
+    # === сторожевой поток ===
+
+    def _capture_stack(self) -> List[str]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return []
+        frames = traceback.extract_stack(frame)[-self.stack_limit:]
+        return [f"{f.filename}:{f.lineno} {f.name}: {f.line or ''}".rstrip() for f in frames]
+
+    def _record_block(self, source: str, stack: List[str], duration: float):
+        duration_ms = duration * 1000
+        self.blocked_total += 1
+        stats = self.blocks_by_source.setdefault(source, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stats["count"] += 1
+        stats["total_ms"] += duration_ms
+        stats["max_ms"] = max(stats["max_ms"], duration_ms)
+        self.events.append({
+            "at": datetime.now().isoformat(),
+            "duration_ms": round(duration_ms, 1),
+            "source": source,
+            "stack": stack
+        })
+        where = stack[-1] if stack else "стек недоступен"
+        logger.warning(f"🐢 Event loop заблокирован на {duration_ms:.0f} мс ({source}): {where}")
+
+    def _watch(self):
+        while not self._stop.is_set():
+            ticked = threading.Event()
+            sent = time.perf_counter()
+            try:
+                self._loop.call_soon_threadsafe(ticked.set)
+            except RuntimeError:
+                # loop закрыт
+                return
+            if ticked.wait(self.block_threshold):
+                lag_ms = (time.perf_counter() - sent) * 1000
+            else:
+                # Loop занят дольше порога: стек и источник снимаются, пока блокировка идет
+                source = self._source()
+                stack = self._capture_stack()
+                while not ticked.wait(0.5):
+                    if self._stop.is_set():
+                        return
+                lag_ms = (time.perf_counter() - sent) * 1000
+                self._record_block(source, stack, lag_ms / 1000)
+            self.lag_samples.append(lag_ms)
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Запуск из потока event loop (в startup)"""
+        if self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(2)
+        self._thread = None
+
+    # === статистика ===
+
+    def lag_percentiles(self) -> Dict[str, Optional[float]]:
+        samples = sorted(self.lag_samples)
+        if not samples:
+            return {"p50": None, "p95": None, "p99": None}
+        pick = lambda p: round(samples[min(len(samples) - 1, int(len(samples) * p / 100))], 2)  # noqa: E731
+        return {"p50": pick(50), "p95": pick(95), "p99": pick(99)}
+
+    def get_stats(self, include_stacks: bool = True) -> Dict[str, Any]:
+        by_source = {
+            source: {"count": int(s["count"]), "total_ms": round(s["total_ms"], 1), "max_ms": round(s["max_ms"], 1)}
+            for source, s in sorted(self.blocks_by_source.items(), key=lambda item: -item[1]["total_ms"])
+        }
+        events = list(self.events)
+        if not include_stacks:
+            events = [{k: v for k, v in event.items() if k != "stack"} for event in events]
+        return {
+            "running": self._thread is not None,
+            "interval_s": self.interval,
+            "block_threshold_ms": round(self.block_threshold * 1000, 1),
+            "lag_ms": {**self.lag_percentiles(), "max": round(self.max_lag_ms, 2), "samples": len(self.lag_samples)},
+            "blocked_total": self.blocked_total,
+            "blocked_by_source": by_source,
+            "recent_blocks": events
+        }
+
+
+class LoopMonitorMiddleware:
+    """ASGI middleware: помечает задачу запроса, чтобы блокировки относились к endpoint"""
+
+    def __init__(self, app, monitor: EventLoopMonitor):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            self.monitor.label_current_task(scope)
+        await self.app(scope, receive, send)
@@ -0,0 +1,201 @@
+"""
+Профили инструкций для разных Business Connections (multi-tenant)
+
+Один процесс бота может обслуживать несколько business аккаунтов: у каждого
+connection_id может быть свой промпт, приветствие и имя консультанта.
+Профили хранятся в SQLite (та же bot.db, что и владельцы), читаются лениво
+и кэшируются в памяти. Кэш сбрасывается при изменении профилей: номер
+ревизии проверяется одним запросом не чаще раза в check_interval секунд,
+поэтому правки из другого процесса (админ панель) тоже подхватываются.
+
+Connection без профиля работает как раньше - с data/instruction.json и
+прежними ID сессий памяти.
+"""
+
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from .prompt import PromptSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+class InstructionProfile:
+    """Профиль инструкций одного Business Connection"""
+
+    __slots__ = ('connection_id', 'name', 'instruction', 'revision', 'prompt')
+
+    def __init__(self, connection_id: str, name: str, instruction: Dict[str, Any], revision: int):
+        self.connection_id = connection_id
+        self.name = name
+        self.instruction = instruction
+        self.revision = revision
+        # Промпт профиля разбирается один раз при загрузке в кэш
+        self.prompt = PromptSnapshot(instruction, source=f"profile:{name or connection_id}")
+
+    @property
+    def assistant_name(self) -> Optional[str]:
+        return self.instruction.get("assistant_name")
+
+    @property
+    def bot_signatures(self) -> Optional[List[str]]:
+        return self.instruction.get("bot_signatures")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'connection_id': self.connection_id,
+            'name': self.name,
+            'revision': self.revision,
+            'version': self.prompt.version,
+            'assistant_name': self.assistant_name,
+            'system_instruction_length': len(self.instruction.get('system_instruction', '')),
+            'last_updated': self.instruction.get('last_updated')
+        }
+
+
+class InstructionProfilesDB:
+    """Хранение профилей в SQLite + кэш в памяти"""
+
+    def __init__(self, db_path: str, check_interval: float = 5.0):
+        self.db_path = db_path
+        self.check_interval = check_interval
+        # connection_id -> профиль или None (профиля нет - тоже кэшируем)
+        self._cache: Dict[str, Optional[InstructionProfile]] = {}
+        self._signature: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def init_db(self):
+        """Создание таблицы профилей"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS instruction_profiles (
+                    connection_id TEXT PRIMARY KEY,
+                    name TEXT,
+                    instruction_json TEXT NOT NULL,
+                    revision INTEGER NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            await db.commit()
+        self._signature = await self._read_signature()
+        self._checked_at = time.monotonic()
+        logger.info(f"✅ Таблица профилей инструкций готова (профилей: {self._signature[1]})")
+
+    async def _read_signature(self) -> Tuple[int, int]:
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('SELECT COALESCE(MAX(revision), 0), COUNT(*) FROM instruction_profiles')
+            row = await cursor.fetchone()
+            return row[0], row[1]
+
+    async def _check_for_changes(self):
+        """Сбрасывает кэш, если профили изменились (в т.ч. другим процессом)"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        signature = await self._read_signature()
+        if signature != self._signature:
+            self._signature = signature
+            self.invalidate()
+
+    def invalidate(self, connection_id: Optional[str] = None):
+        """Сброс кэша (всего или одного connection)"""
+        if connection_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(connection_id, None)
+        self.invalidations += 1
+
+    async def get_profile(self, connection_id: str) -> Optional[InstructionProfile]:
+        """
+        Профиль для connection_id
+
+        Returns:
+            InstructionProfile или None, если для connection используется общий instruction.json
+        """
+        try:
+            await self._check_for_changes()
+            if connection_id in self._cache:
+                self.hits += 1
+                return self._cache[connection_id]
+
+            self.misses += 1
+            async with aiosqlite.connect(self.db_path) as db:
+                cursor = await db.execute(
+                    'SELECT name, instruction_json, revision FROM instruction_profiles WHERE connection_id = ?',
+                    (connection_id,)
+                )
+                row = await cursor.fetchone()
+
+            profile = None
+            if row:
+                profile = InstructionProfile(connection_id, row[0], json.loads(row[1]), row[2])
+                logger.info(f"📋 Загружен профиль инструкций '{profile.name}' для connection {connection_id[:20]}...")
+            self._cache[connection_id] = profile
+            return profile
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения профиля инструкций: {e}")
+            return None
+
+    async def save_profile(self, connection_id: str, instruction: Dict[str, Any], name: Optional[str] = None) -> int:
+        """
+        Создает или обновляет профиль
+
+        Returns:
+            Новый номер ревизии
+        """
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('SELECT COALESCE(MAX(revision), 0) + 1 FROM instruction_profiles')
+            revision = (await cursor.fetchone())[0]
+            await db.execute('''
+                INSERT INTO instruction_profiles (connection_id, name, instruction_json, revision, updated_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(connection_id) DO UPDATE SET
+                    name = excluded.name,
+                    instruction_json = excluded.instruction_json,
+                    revision = excluded.revision,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (connection_id, name, json.dumps(instruction, ensure_ascii=False), revision))
+            await db.commit()
+
+        self.invalidate(connection_id)
+        self._signature = await self._read_signature()
+        logger.info(f"✅ Профиль инструкций сохранен: {name or connection_id[:20]} (ревизия {revision})")
+        return revision
+
+    async def delete_profile(self, connection_id: str) -> bool:
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('DELETE FROM instruction_profiles WHERE connection_id = ?', (connection_id,))
+            await db.commit()
+            deleted = cursor.rowcount > 0
+
+        self.invalidate(connection_id)
+        self._signature = await self._read_signature()
+        return deleted
+
+    async def list_profiles(self) -> List[Dict[str, Any]]:
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                'SELECT connection_id, name, instruction_json, revision FROM instruction_profiles ORDER BY name'
+            )
+            rows = await cursor.fetchall()
+        return [InstructionProfile(row[0], row[1], json.loads(row[2]), row[3]).to_dict() for row in rows]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'cached_connections': len(self._cache),
+            'cached_profiles': sum(1 for profile in self._cache.values() if profile is not None),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'revision': self._signature[0] if self._signature else None,
+            'check_interval': self.check_interval
+        }
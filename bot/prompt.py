@@ -0,0 +1,115 @@
+"""
+Подготовленная версия инструкций (промпта)
+
+instruction.json весит десятки килобайт, а системный промпт собирается на
+каждое сообщение. PromptSnapshot разбирается один раз при загрузке: в нем
+уже склеен статический префикс (инструкция + постоянные правила), к которому
+при ответе добавляется только контекст из памяти.
+
+Snapshot неизменяем: при обновлении инструкций создается новый объект и
+подменяется одной операцией присваивания, а ответы, которые уже начали
+генерироваться, дорабатывают со своей версией.
+"""
+
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+# Правила, которые добавляются к любой инструкции
+FORMATTING_RULE = "⚠️ КРИТИЧЕСКИ ВАЖНО: Форматируй ответы с абзацами! Используй двойные переносы строк между смысловыми блоками. НЕ пиши сплошным текстом!"
+GREETING_RULE = "⚠️ ПРАВИЛО ПРИВЕТСТВИЯ: НЕ начинай каждый ответ с 'Здравствуйте!' Приветствуй только при первом сообщении или /start. В продолжении диалога сразу переходи к сути!"
+
+DEFAULT_INSTRUCTION = {
+    "system_instruction": "Вы - помощник службы поддержки Textil PRO.",
+    "welcome_message": "Добро пожаловать! Чем могу помочь?"
+}
+
+
+class PromptSnapshot:
+    """Неизменяемая разобранная версия инструкций"""
+
+    __slots__ = ('instruction', 'version', 'static_prefix', 'loaded_at', 'source', 'source_mtime')
+
+    def __init__(
+        self,
+        instruction: Dict[str, Any],
+        version: Optional[str] = None,
+        source: Optional[str] = None,
+        source_mtime: Optional[float] = None
+    ):
+        self.instruction = instruction
+        self.version = version or instruction_hash(instruction)[:12]
+        # Статическая часть системного промпта: одинакова для всех ответов этой версии
+        self.static_prefix = "\n\n".join(
+            part for part in (instruction.get("system_instruction", ""), FORMATTING_RULE, GREETING_RULE) if part
+        )
+        self.loaded_at = time.time()
+        self.source = source
+        self.source_mtime = source_mtime
+
+    def build_system_prompt(
+        self,
+        zep_context: str = "",
+        zep_history: str = "",
+        extra_instructions: Optional[str] = None
+    ) -> str:
+        """Системный промпт для одного ответа: статический префикс + контекст диалога"""
+        parts = [self.static_prefix]
+        if zep_context:
+            parts.append(f"Контекст предыдущих разговоров:\n{zep_context}")
+        if zep_history:
+            parts.append(f"Последние сообщения:\n{zep_history}")
+        if extra_instructions:
+            parts.append(f"⚠️ {extra_instructions}")
+        return "\n\n".join(parts)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.instruction.get(key, default)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'version': self.version,
+            'last_updated': self.instruction.get('last_updated'),
+            'loaded_at': datetime.fromtimestamp(self.loaded_at).isoformat(),
+            'source': self.source,
+            'source_mtime': datetime.fromtimestamp(self.source_mtime).isoformat() if self.source_mtime else None,
+            'static_prefix_length': len(self.static_prefix)
+        }
+
+
+def instruction_hash(instruction: Dict[str, Any]) -> str:
+    """
+    Хеш содержимого инструкций - идентификатор версии
+
+    last_updated не учитывается: он меняется при каждом сохранении, а промпт
+    от этого не меняется. Поэтому одинаковые инструкции из файла и из
+    хранилища версий получают одну и ту же версию.
+    """
+    content = {key: value for key, value in instruction.items() if key != "last_updated"}
+    data = json.dumps(content, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def load_prompt_file(path: str) -> PromptSnapshot:
+    """
+    Читает и разбирает файл инструкций (блокирующая функция - вызывать в потоке)
+
+    Raises:
+        FileNotFoundError, ValueError (битый JSON)
+    """
+    mtime = os.stat(path).st_mtime
+    with open(path, 'rb') as f:
+        data = f.read()
+    instruction = json.loads(data)
+    if not isinstance(instruction, dict):
+        raise ValueError("instruction.json должен содержать JSON-объект")
+    return PromptSnapshot(instruction, source=path, source_mtime=mtime)
+
+
+def default_prompt() -> PromptSnapshot:
+    instruction = dict(DEFAULT_INSTRUCTION)
+    instruction["last_updated"] = datetime.now().isoformat()
+    return PromptSnapshot(instruction, source="default")
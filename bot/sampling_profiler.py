@@ -0,0 +1,134 @@
+"""
+Статистический профайлер по запросу (/debug/profile)
+
+Поток-сэмплер раз в interval читает стеки нужных потоков через
+sys._current_frames() и считает одинаковые стеки. Код приложения не
+инструментируется (в отличие от cProfile), поэтому профиль можно снять на
+живом инстансе: стоимость - обход стеков нескольких потоков за сэмпл.
+
+Потоки:
+- loop - поток event loop (обработчики, сборка промпта, json.dumps в логах);
+- sqlite - потоки соединений aiosqlite (каждое соединение - свой поток);
+- executor - потоки asyncio.to_thread (telebot, requests, запись логов).
+
+Результат - collapsed stacks ("поток;кадр;кадр N" по строке на стек),
+формат flamegraph.pl, speedscope и inferno.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+THREAD_GROUPS = ("loop", "sqlite", "executor")
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _frame_label(code) -> str:
+    """Кадр без номера строки: вызовы одной функции из разных мест складываются"""
+    filename = code.co_filename
+    if filename.startswith(_ROOT_DIR):
+        filename = os.path.relpath(filename, _ROOT_DIR)
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Сэмплирование стеков потоков loop/aiosqlite/executor в collapsed формат"""
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._loop_thread_id: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def attach_loop_thread(self):
+        """Запоминает поток event loop (вызывается из корутины в loop)"""
+        self._loop_thread_id = threading.get_ident()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def _select_threads(self, groups: Iterable[str]) -> Dict[int, str]:
+        """thread id -> группа потоков (корень стека в профиле)"""
+        groups = set(groups)
+        current = threading.get_ident()
+        selected = {}
+        for thread in threading.enumerate():
+            if thread.ident is None or thread.ident == current:
+                continue
+            if thread.ident == self._loop_thread_id:
+                group = "loop"
+            elif aiosqlite is not None and isinstance(thread, aiosqlite.Connection):
+                group = "sqlite"
+            elif thread.name.startswith("asyncio_"):
+                group = "executor"
+            else:
+                continue
+            if group in groups:
+                selected[thread.ident] = group
+        return selected
+
+    def _stack(self, frame) -> str:
+        labels = []
+        while frame is not None and len(labels) < self.max_depth:
+            labels.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse()
+        return ";".join(labels)
+
+    def run(self, seconds: float, groups: Iterable[str] = ("loop", "sqlite")) -> Dict:
+        """
+        Сэмплирует seconds секунд (блокирующий вызов - запускать в отдельном потоке)
+
+        Потоки aiosqlite и executor появляются и исчезают во время профиля,
+        поэтому список потоков обновляется на каждом сэмпле. Пустой ожидающий
+        поток (select в loop, queue.get в aiosqlite) тоже попадает в профиль -
+        это и есть время простоя.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("Профиль уже снимается")
+        try:
+            groups = tuple(groups)
+            stacks: Counter = Counter()
+            per_group: Counter = Counter()
+            samples = 0
+            started = time.perf_counter()
+            deadline = started + seconds
+            while time.perf_counter() < deadline:
+                threads = self._select_threads(groups)
+                frames = sys._current_frames()
+                for ident, group in threads.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[f"{group};{self._stack(frame)}"] += 1
+                        per_group[group] += 1
+                del frames
+                samples += 1
+                time.sleep(self.interval)
+            elapsed = time.perf_counter() - started
+            return {
+                "seconds": round(elapsed, 2),
+                "samples": samples,
+                "effective_interval_ms": round(elapsed / samples * 1000, 2) if samples else None,
+                "thread_samples": dict(per_group),
+                "unique_stacks": len(stacks),
+                "stacks": stacks
+            }
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def collapsed(stacks: Counter) -> str:
+        lines: List[str] = [f"{stack} {count}" for stack, count in stacks.most_common()]
+        return "\n".join(lines) + ("\n" if lines else "")
@@ -0,0 +1,211 @@
+"""
+Очередь пула с приоритетами классов и честным разделением между чатами
+
+Раньше пул брал jobs строго по порядку поступления: business_connection,
+сообщения владельца аккаунта, личные сообщения боту и выгрузка backlog
+стояли в одной очереди с клиентами, которые ждут ответа.
+
+Классы (по убыванию приоритета):
+- client - сообщение клиента в business чате;
+- retry - клиент, но ответ "сводный": накопившиеся за время простоя сообщения
+  и updates, выданные очередью на диске повторно после падения worker;
+- service - business_connection и прочие служебные updates;
+- owner - сообщение владельца business аккаунта;
+- direct - личные сообщения боту (ветка message).
+
+Воркер берет job из самого приоритетного непустого класса. Чтобы нижние
+классы не голодали под постоянной нагрузкой, класс, первый job которого
+ждет дольше max_wait, обслуживается вне очереди.
+
+Внутри класса - start-time fair queuing по chat_key: каждый job получает
+метку start = max(виртуальное время, finish предыдущего job этого чата),
+finish = start + 1. Клиент, приславший 30 сообщений подряд, получает метки
+1..30, а новый чат - текущее виртуальное время, поэтому его сообщение
+обслуживается следующим, а не после всех 30. Порядок внутри чата
+сохраняется (метки чата возрастают).
+
+Пока у чата есть jobs в очереди, все они стоят в одном классе - иначе
+сообщение клиента (client) обогнало бы его же более раннее сводное (retry).
+Новый job чата встает в класс его очереди; если его собственный класс выше,
+очередь чата переезжает в этот класс целиком, с сохранением порядка.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from .stale_policy import STALE_SUMMARISE
+
+PRIORITY_CLIENT = "client"
+PRIORITY_RETRY = "retry"
+PRIORITY_SERVICE = "service"
+PRIORITY_OWNER = "owner"
+PRIORITY_DIRECT = "direct"
+PRIORITY_CLASSES = (PRIORITY_CLIENT, PRIORITY_RETRY, PRIORITY_SERVICE, PRIORITY_OWNER, PRIORITY_DIRECT)
+
+
+def default_priority(job) -> str:
+    """Класс job по типу update (владельца определяет webhook - нужен кэш владельцев)"""
+    if job.kind == "business_message":
+        if job.stale_action == STALE_SUMMARISE or job.attempt > 1:
+            return PRIORITY_RETRY
+        return PRIORITY_CLIENT
+    if job.kind == "message":
+        return PRIORITY_DIRECT
+    return PRIORITY_SERVICE
+
+
+class _FairClassQueue:
+    """Jobs одного класса: куча по (start, seq), метки finish по чатам"""
+
+    # Метки чатов без jobs в очереди чистятся, когда их становится больше
+    MAX_IDLE_FLOWS = 10000
+
+    def __init__(self):
+        self.heap: List[Tuple[float, int, float, Any]] = []
+        self.virtual_time = 0.0
+        self.flow_finish: Dict[Hashable, float] = {}
+        self.flow_queued: Counter = Counter()
+        self.served = 0
+        self.promoted = 0
+        self.wait_ms: deque = deque(maxlen=1000)
+        self.max_wait_ms = 0.0
+
+    def push(self, seq: int, flow: Optional[Hashable], entry):
+        if flow is None:
+            # Служебные updates без чата - каждый сам по себе (FIFO по виртуальному времени)
+            start = self.virtual_time
+        else:
+            start = max(self.virtual_time, self.flow_finish.get(flow, 0.0))
+            self.flow_finish[flow] = start + 1.0
+            self.flow_queued[flow] += 1
+        heapq.heappush(self.heap, (start, seq, flow, entry))
+
+    def take_flow(self, flow: Hashable) -> List[Tuple[int, Any]]:
+        """Забирает все jobs чата из класса: [(seq, entry), ...] в порядке обслуживания"""
+        taken = sorted(item for item in self.heap if item[2] == flow)
+        self.heap = [item for item in self.heap if item[2] != flow]
+        heapq.heapify(self.heap)
+        self.flow_queued.pop(flow, None)
+        return [(seq, entry) for _start, seq, _flow, entry in taken]
+
+    def head_enqueued_at(self) -> float:
+        return self.heap[0][3][1]
+
+    def pop(self):
+        start, _seq, flow, entry = heapq.heappop(self.heap)
+        self.virtual_time = max(self.virtual_time, start)
+        if flow is not None:
+            self.flow_queued[flow] -= 1
+            if self.flow_queued[flow] <= 0:
+                del self.flow_queued[flow]
+                if len(self.flow_finish) > self.MAX_IDLE_FLOWS:
+                    self._prune_flows()
+        self.served += 1
+        return entry
+
+    def _prune_flows(self):
+        """Чат без jobs в очереди с finish <= виртуального времени ничем не отличается от нового"""
+        for flow in [f for f, finish in self.flow_finish.items() if finish <= self.virtual_time and f not in self.flow_queued]:
+            del self.flow_finish[flow]
+
+
+class PriorityFairQueue:
+    """
+    Замена asyncio.Queue для пула: put_nowait / get / qsize / maxsize / task_done
+
+    Класс job определяет classify(job) (по умолчанию default_priority).
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1000,
+        classify: Optional[Callable[[Any], str]] = None,
+        max_wait: float = 30.0       # секунды: дольше - класс обслуживается вне приоритета
+    ):
+        self.maxsize = maxsize
+        self.classify = classify or default_priority
+        self.max_wait = max_wait
+        self._classes: Dict[str, _FairClassQueue] = {name: _FairClassQueue() for name in PRIORITY_CLASSES}
+        # Класс чатов, у которых есть jobs в очереди
+        self._flow_class: Dict[Hashable, str] = {}
+        self.flows_moved = 0
+        self._size = 0
+        self._seq = itertools.count()
+        self._items = asyncio.Semaphore(0)
+
+    def qsize(self) -> int:
+        return self._size
+
+    def put_nowait(self, job):
+        if self.maxsize and self._size >= self.maxsize:
+            raise asyncio.QueueFull
+        priority = self.classify(job)
+        if priority not in self._classes:
+            priority = PRIORITY_SERVICE
+        flow = job.chat_key
+        if flow is not None:
+            current = self._flow_class.get(flow)
+            if current is not None and current != priority:
+                if PRIORITY_CLASSES.index(current) < PRIORITY_CLASSES.index(priority):
+                    priority = current
+                else:
+                    self._move_flow(flow, current, priority)
+            self._flow_class[flow] = priority
+        self._classes[priority].push(next(self._seq), flow, (job, time.monotonic()))
+        self._size += 1
+        self._items.release()
+
+    def _move_flow(self, flow: Hashable, source: str, target: str):
+        """Переносит очередь чата в более приоритетный класс (порядок jobs сохраняется)"""
+        target_queue = self._classes[target]
+        for seq, entry in self._classes[source].take_flow(flow):
+            target_queue.push(seq, flow, entry)
+        self.flows_moved += 1
+
+    def _pick(self) -> _FairClassQueue:
+        now = time.monotonic()
+        first = None
+        for name in PRIORITY_CLASSES:
+            queue = self._classes[name]
+            if not queue.heap:
+                continue
+            if first is None:
+                first = queue
+            elif now - queue.head_enqueued_at() > self.max_wait:
+                # Нижний класс ждет слишком долго - обслуживаем его раньше верхнего
+                queue.promoted += 1
+                return queue
+        return first
+
+    async def get(self):
+        await self._items.acquire()
+        queue = self._pick()
+        job, enqueued_at = queue.pop()
+        self._size -= 1
+        if job.chat_key is not None and job.chat_key not in queue.flow_queued:
+            self._flow_class.pop(job.chat_key, None)
+        wait_ms = (time.monotonic() - enqueued_at) * 1000
+        queue.wait_ms.append(wait_ms)
+        queue.max_wait_ms = max(queue.max_wait_ms, wait_ms)
+        return job
+
+    def task_done(self):
+        pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        classes = {}
+        for name, queue in self._classes.items():
+            samples = sorted(queue.wait_ms)
+            pick = (lambda p: round(samples[min(len(samples) - 1, int(len(samples) * p / 100))], 1)) if samples else (lambda p: None)
+            classes[name] = {
+                'queued': len(queue.heap),
+                'chats_queued': len(queue.flow_queued),
+                'served': queue.served,
+                'promoted': queue.promoted,
+                'wait_ms': {'p50': pick(50), 'p95': pick(95), 'p99': pick(99), 'max': round(queue.max_wait_ms, 1)}
+            }
+        return {'max_wait_s': self.max_wait, 'flows_moved': self.flows_moved, 'classes': classes}
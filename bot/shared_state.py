@@ -0,0 +1,410 @@
+"""
+Общее состояние процессов webhook (несколько uvicorn workers)
+
+Один процесс держит все состояние в памяти модуля: счетчик и последние
+updates, локальные сессии агента, историю LoopDetector. При
+WEB_CONCURRENCY > 1 каждый worker получает свою часть updates, и такое
+состояние расходится: повтор update попадает в другой процесс, LoopDetector
+видит только половину сообщений чата, /debug/last-updates показывает
+updates одного worker.
+
+Бэкенды (SHARED_STATE_URL):
+- memory:// - состояние процесса (по умолчанию при одном worker). Сессии и
+  LoopDetector остаются в своих объектах, как раньше;
+- sqlite:///path/state.db - файл SQLite в режиме WAL, общий для процессов
+  одного хоста (на Railway - volume). Методы блокирующие: транзакция -
+  десятки микросекунд, но BEGIN IMMEDIATE ждет, пока другой процесс держит
+  запись. Из event loop они вызываются через asyncio.to_thread (state_call
+  в webhook.py).
+
+Лидер - процесс, который держит flock на <path>.leader: только он ставит
+webhook, выгружает backlog и публикует instruction.json в хранилище версий.
+Лидер выбирается один раз при старте. uvicorn (0.24) не перезапускает
+упавшие workers, и оставшиеся процессы лидерство не перехватывают: если
+лидер упал, webhook и прием updates продолжают работать, но слежение за
+instruction.json и выгрузка backlog возобновятся только после перезапуска
+сервиса (блокировку ОС снимает при завершении процесса).
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows - без выбора лидера, каждый процесс лидер
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryState:
+    """Состояние в памяти процесса (один worker)"""
+
+    shared = False
+    backend = "memory"
+
+    def __init__(self, lead: bool = True):
+        # lead=False - процесс не претендует на роль лидера (worker очереди updates)
+        self.lead = lead
+        self.counters: Dict[str, int] = {}
+        self.recent_items: Dict[str, deque] = {}
+        self.claims: Dict[str, float] = {}
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    @property
+    def is_leader(self) -> bool:
+        return self.lead
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        value = self.counters.get(key, 0) + amount
+        self.counters[key] = value
+        return value
+
+    def counter(self, key: str) -> int:
+        return self.counters.get(key, 0)
+
+    def push_recent(self, key: str, item: Dict[str, Any], maxlen: int):
+        items = self.recent_items.get(key)
+        if items is None or items.maxlen != maxlen:
+            items = self.recent_items[key] = deque(items or (), maxlen=maxlen)
+        items.append(item)
+
+    def recent(self, key: str) -> List[Dict[str, Any]]:
+        return list(self.recent_items.get(key, ()))
+
+    def claim(self, key: str, ttl: float) -> bool:
+        """True если ключ взят впервые за ttl секунд (повторная доставка update - False)"""
+        now = time.time()
+        expires = self.claims.get(key)
+        if expires is not None and expires > now:
+            return False
+        if len(self.claims) > 50000:
+            self.claims = {k: v for k, v in self.claims.items() if v > now}
+        self.claims[key] = now + ttl
+        return True
+
+    def release(self, key: str):
+        """Снимает claim (update не принят - Telegram доставит его снова)"""
+        self.claims.pop(key, None)
+
+    def export_state(self) -> Optional[Dict[str, Any]]:
+        """Счетчики, последние updates и неистекшие claims для checkpoint при остановке"""
+        now = time.time()
+        return {
+            "counters": dict(self.counters),
+            "recent_items": {key: list(items) for key, items in self.recent_items.items()},
+            "recent_maxlen": {key: items.maxlen for key, items in self.recent_items.items()},
+            "claims": {key: expires for key, expires in self.claims.items() if expires > now}
+        }
+
+    def import_state(self, state: Dict[str, Any]):
+        for key, value in state.get("counters", {}).items():
+            self.counters[key] = max(self.counters.get(key, 0), value)
+        maxlen = state.get("recent_maxlen", {})
+        for key, items in state.get("recent_items", {}).items():
+            self.recent_items[key] = deque(items + list(self.recent_items.get(key, ())), maxlen=maxlen.get(key))
+        now = time.time()
+        for key, expires in state.get("claims", {}).items():
+            if expires > now:
+                self.claims[key] = max(expires, self.claims.get(key, 0.0))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "pid": os.getpid(),
+            "leader": self.is_leader,
+            "counters": dict(self.counters),
+            "claims": len(self.claims)
+        }
+
+
+class SQLiteState(MemoryState):
+    """Состояние в общем файле SQLite (WAL) для нескольких процессов на одном хосте"""
+
+    shared = True
+    backend = "sqlite"
+
+    # Устаревшие claims и хеши LoopDetector удаляются не чаще раза в PRUNE_INTERVAL
+    PRUNE_INTERVAL = 30.0
+
+    def __init__(self, db_path: str, lead: bool = True):
+        self.db_path = db_path
+        self.lead = lead
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._leader_file = None
+        self._last_prune = 0.0
+        self._loop_window: Optional[float] = None
+
+    def start(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # isolation_level=None: транзакции только явные (BEGIN IMMEDIATE), остальное - autocommit
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS counters (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS recent_items (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                item TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_recent_items_key ON recent_items (key, seq);
+            CREATE TABLE IF NOT EXISTS claims (
+                key TEXT PRIMARY KEY,
+                expires REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sessions (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                exchange TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_id ON sessions (session_id, seq);
+            CREATE TABLE IF NOT EXISTS loop_chats (
+                namespace TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                last_message REAL NOT NULL,
+                PRIMARY KEY (namespace, chat_id)
+            );
+            CREATE TABLE IF NOT EXISTS loop_hashes (
+                namespace TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                at REAL NOT NULL,
+                PRIMARY KEY (namespace, hash)
+            );
+            CREATE INDEX IF NOT EXISTS idx_loop_hashes_chat ON loop_hashes (namespace, chat_id, at);
+            CREATE INDEX IF NOT EXISTS idx_loop_hashes_at ON loop_hashes (at);
+        ''')
+        self._conn = conn
+        if self.lead:
+            self._try_lead()
+        logger.info(f"🗂️ Общее состояние: {self.db_path} (pid {os.getpid()}, лидер: {self.is_leader})")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        if self._leader_file is not None:
+            self._leader_file.close()
+            self._leader_file = None
+
+    def export_state(self) -> Optional[Dict[str, Any]]:
+        # Состояние уже в файле SQLite
+        return None
+
+    def import_state(self, state: Dict[str, Any]):
+        pass
+
+    def _try_lead(self):
+        if fcntl is None:
+            self._leader_file = True
+            return
+        leader_file = open(self.db_path + ".leader", "a+")
+        try:
+            fcntl.flock(leader_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            leader_file.close()
+            return
+        leader_file.seek(0)
+        leader_file.truncate()
+        leader_file.write(str(os.getpid()))
+        leader_file.flush()
+        self._leader_file = leader_file
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leader_file is not None
+
+    def _transaction(self, fn):
+        """fn(conn) внутри BEGIN IMMEDIATE: чтение и запись без гонки с другими процессами"""
+        with self._lock:
+            conn = self._conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = fn(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+
+    def _maybe_prune(self, conn, now: float):
+        if now - self._last_prune < self.PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        conn.execute('DELETE FROM claims WHERE expires <= ?', (now,))
+        if self._loop_window is not None:
+            conn.execute('DELETE FROM loop_hashes WHERE at < ?', (now - self._loop_window,))
+            conn.execute('DELETE FROM loop_chats WHERE last_message < ?', (now - self._loop_window,))
+
+    # === счетчики, последние updates, повторы ===
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        def run(conn):
+            conn.execute(
+                'INSERT INTO counters (key, value) VALUES (?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET value = value + excluded.value',
+                (key, amount)
+            )
+            return conn.execute('SELECT value FROM counters WHERE key = ?', (key,)).fetchone()[0]
+        return self._transaction(run)
+
+    def counter(self, key: str) -> int:
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM counters WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    def push_recent(self, key: str, item: Dict[str, Any], maxlen: int):
+        payload = json.dumps(item, ensure_ascii=False, default=str)
+
+        def run(conn):
+            conn.execute('INSERT INTO recent_items (key, item) VALUES (?, ?)', (key, payload))
+            conn.execute(
+                'DELETE FROM recent_items WHERE key = ? AND seq <= '
+                '(SELECT seq FROM recent_items WHERE key = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)',
+                (key, key, maxlen)
+            )
+        self._transaction(run)
+
+    def recent(self, key: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute('SELECT item FROM recent_items WHERE key = ? ORDER BY seq', (key,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def claim(self, key: str, ttl: float) -> bool:
+        now = time.time()
+
+        def run(conn):
+            self._maybe_prune(conn, now)
+            row = conn.execute('SELECT expires FROM claims WHERE key = ?', (key,)).fetchone()
+            if row is not None and row[0] > now:
+                return False
+            conn.execute('INSERT OR REPLACE INTO claims (key, expires) VALUES (?, ?)', (key, now + ttl))
+            return True
+        return self._transaction(run)
+
+    def release(self, key: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM claims WHERE key = ?', (key,))
+
+    # === локальные сессии агента (резерв на случай недоступности Zep) ===
+
+    def append_session(self, session_id: str, exchange: Dict[str, Any], keep: int):
+        payload = json.dumps(exchange, ensure_ascii=False)
+
+        def run(conn):
+            conn.execute('INSERT INTO sessions (session_id, exchange) VALUES (?, ?)', (session_id, payload))
+            conn.execute(
+                'DELETE FROM sessions WHERE session_id = ? AND seq <= '
+                '(SELECT seq FROM sessions WHERE session_id = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)',
+                (session_id, session_id, keep)
+            )
+        self._transaction(run)
+
+    def get_session(self, session_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT exchange FROM sessions WHERE session_id = ? ORDER BY seq', (session_id,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def session_ids(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute('SELECT DISTINCT session_id FROM sessions')]
+
+    # === LoopDetector (см. SharedLoopDetector) ===
+
+    def touch_chat(self, namespace: str, chat_id: int, now: float) -> Optional[float]:
+        """Время предыдущего сообщения чата (None если не было) + запись текущего"""
+        def run(conn):
+            row = conn.execute(
+                'SELECT last_message FROM loop_chats WHERE namespace = ? AND chat_id = ?', (namespace, chat_id)
+            ).fetchone()
+            conn.execute(
+                'INSERT OR REPLACE INTO loop_chats (namespace, chat_id, last_message) VALUES (?, ?, ?)',
+                (namespace, chat_id, now)
+            )
+            return row[0] if row else None
+        return self._transaction(run)
+
+    def remember_hash(
+        self, namespace: str, chat_id: int, message_hash: str, now: float,
+        window: float, keep: int, check: bool = True
+    ) -> bool:
+        """
+        Проверка дубликата и запись хеша одной транзакцией
+
+        Returns:
+            True если хеш уже был в окне window (дубликат; при check=True не записывается)
+        """
+        self._loop_window = max(self._loop_window or 0.0, window)
+
+        def run(conn):
+            self._maybe_prune(conn, now)
+            if check:
+                row = conn.execute(
+                    'SELECT 1 FROM loop_hashes WHERE namespace = ? AND hash = ? AND at >= ?',
+                    (namespace, message_hash, now - window)
+                ).fetchone()
+                if row is not None:
+                    return True
+            conn.execute(
+                'INSERT OR REPLACE INTO loop_hashes (namespace, hash, chat_id, at) VALUES (?, ?, ?, ?)',
+                (namespace, message_hash, chat_id, now)
+            )
+            # Как deque(maxlen) у LoopDetector: в чате хранятся только keep последних хешей
+            conn.execute(
+                'DELETE FROM loop_hashes WHERE namespace = ? AND chat_id = ? AND at < '
+                '(SELECT at FROM loop_hashes WHERE namespace = ? AND chat_id = ? ORDER BY at DESC LIMIT 1 OFFSET ?)',
+                (namespace, chat_id, namespace, chat_id, keep - 1)
+            )
+            return False
+        return self._transaction(run)
+
+    def loop_stats(self, namespace: str, since: float) -> Dict[str, int]:
+        with self._lock:
+            chats, messages = self._conn.execute(
+                'SELECT COUNT(DISTINCT chat_id), COUNT(*) FROM loop_hashes WHERE namespace = ? AND at >= ?',
+                (namespace, since)
+            ).fetchone()
+        return {"tracked_chats": chats, "total_tracked_messages": messages, "recent_hashes_count": messages}
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._conn.execute('SELECT key, value FROM counters').fetchall())
+            claims = self._conn.execute('SELECT COUNT(*) FROM claims WHERE expires > ?', (time.time(),)).fetchone()[0]
+        return {
+            "backend": self.backend,
+            "path": self.db_path,
+            "pid": os.getpid(),
+            "leader": self.is_leader,
+            "counters": counters,
+            "claims": claims
+        }
+
+
+def create_shared_state(url: str, lead: bool = True):
+    """memory:// или sqlite://<путь> (sqlite:///data/state.db - абсолютный путь, sqlite://state.db - относительный)"""
+    if not url or url.startswith("memory"):
+        return MemoryState(lead=lead)
+    if url.startswith("sqlite://"):
+        return SQLiteState(url[len("sqlite://"):], lead=lead)
+    raise ValueError(f"Неизвестный SHARED_STATE_URL: {url} (поддерживаются memory:// и sqlite://<путь>)")
@@ -0,0 +1,96 @@
+"""
+Политика обработки "старых" сообщений
+
+После деплоя или сбоя Telegram доставляет накопившиеся updates. Раньше всё,
+что старше 5 минут, молча выбрасывалось. Теперь сообщения классифицируются:
+
+- answer    - свежее сообщение, отвечаем как обычно
+- summarise - сообщение пролежало в очереди; несколько таких сообщений от одного
+              клиента склеиваются в один вопрос и получают один ответ
+- skip      - слишком старое (по умолчанию больше суток), не отвечаем,
+              но учитываем в статистике
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STALE_ANSWER = "answer"
+STALE_SUMMARISE = "summarise"
+STALE_SKIP = "skip"
+
+
+def message_age_seconds(message_timestamp: Optional[int], now: Optional[float] = None) -> Optional[float]:
+    """
+    Возраст сообщения в секундах
+
+    Args:
+        message_timestamp: поле date из Telegram (unix time)
+        now: текущее время (unix time), по умолчанию time.time()
+
+    Returns:
+        Возраст в секундах или None если время сообщения неизвестно
+    """
+    if not message_timestamp:
+        return None
+    if now is None:
+        now = datetime.now(timezone.utc).timestamp()
+    return now - message_timestamp
+
+
+def is_message_too_old(message_timestamp, max_age_minutes=5):
+    """Проверка, не слишком ли старое сообщение для обработки"""
+    try:
+        age_seconds = message_age_seconds(message_timestamp)
+        if age_seconds is None:
+            return False
+        return age_seconds / 60 > max_age_minutes
+    except Exception as e:
+        logger.warning(f"⚠️ Ошибка проверки времени сообщения: {e}")
+        return False
+
+
+class StaleMessagePolicy:
+    """Классификатор сообщений по возрасту: answer / summarise / skip"""
+
+    def __init__(
+        self,
+        answer_max_age_minutes: float = 5,          # до этого возраста отвечаем как обычно
+        summarise_max_age_minutes: float = 24 * 60  # до этого возраста склеиваем и отвечаем одним сообщением
+    ):
+        self.answer_max_age_minutes = answer_max_age_minutes
+        self.summarise_max_age_minutes = summarise_max_age_minutes
+        self.counters = {STALE_ANSWER: 0, STALE_SUMMARISE: 0, STALE_SKIP: 0}
+
+    def classify(self, message_timestamp: Optional[int], now: Optional[float] = None) -> Tuple[str, float]:
+        """
+        Определяет, что делать с сообщением
+
+        Args:
+            message_timestamp: поле date из Telegram (unix time)
+            now: текущее время (unix time)
+
+        Returns:
+            (action, age_minutes) - действие и возраст сообщения в минутах
+        """
+        age_seconds = message_age_seconds(message_timestamp, now)
+        age_minutes = max(age_seconds / 60, 0.0) if age_seconds is not None else 0.0
+
+        if age_minutes <= self.answer_max_age_minutes:
+            action = STALE_ANSWER
+        elif age_minutes <= self.summarise_max_age_minutes:
+            action = STALE_SUMMARISE
+        else:
+            action = STALE_SKIP
+
+        self.counters[action] += 1
+        return action, age_minutes
+
+    def get_stats(self) -> dict:
+        return {
+            'answer_max_age_minutes': self.answer_max_age_minutes,
+            'summarise_max_age_minutes': self.summarise_max_age_minutes,
+            'counters': dict(self.counters)
+        }
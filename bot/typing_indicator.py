@@ -0,0 +1,100 @@
+"""
+Индикатор "печатает..." на все время генерации ответа
+
+Telegram показывает chat action около 5 секунд, а ответ OpenAI часто идет
+дольше. TypingKeepalive повторяет sendChatAction каждые ~4 секунды в фоновой
+задаче, пока ответ не отправлен: обработчик сообщения не ждет ни одного
+вызова, поэтому индикатор не добавляет задержки ответу.
+
+Перед отправкой ответа вызывается finish(): новые sendChatAction больше не
+начинаются (флаг проверяется и в потоке), и ответ уходит сразу. Запрос,
+уже начатый в потоке, отмена не прерывает: если он дойдет до Telegram после
+ответа, индикатор погорит еще до ~5 секунд. С settle_timeout > 0 finish()
+дожидается такого запроса (не дольше settle_timeout) - ценой задержки ответа,
+поэтому по умолчанию выключено.
+"""
+
+import asyncio
+import logging
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TypingKeepalive:
+    """
+    Фоновое обновление typing индикатора
+
+    Использование:
+        typing = TypingKeepalive(send_typing, chat_id)
+        typing.start()
+        try:
+            ...  # генерация ответа
+            await typing.finish()
+            ...  # отправка ответа
+        finally:
+            typing.stop()
+    """
+
+    def __init__(
+        self,
+        send: Callable[[], Any],       # блокирующий вызов sendChatAction (выполняется в потоке)
+        chat_id: Any = None,           # только для логов
+        interval: float = 4.0,         # Telegram гасит индикатор через ~5 секунд
+        max_failures: int = 2,         # после стольких ошибок подряд перестаем пытаться
+        settle_timeout: float = 0.0    # finish() ждет начатый sendChatAction (0 - не ждет)
+    ):
+        self.send = send
+        self.chat_id = chat_id
+        self.interval = interval
+        self.max_failures = max_failures
+        self.settle_timeout = settle_timeout
+        self.sent = 0
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = False
+        # Текущий sendChatAction в потоке (переживает отмену _task)
+        self._inflight: Optional[asyncio.Future] = None
+
+    def start(self):
+        """Запускает обновление индикатора (возвращается сразу)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """Останавливает обновление индикатора (начатый в потоке запрос не ждет)"""
+        self._stopped = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def finish(self):
+        """Останавливает индикатор перед отправкой ответа; начатый sendChatAction ждет только при settle_timeout"""
+        inflight = self._inflight
+        self.stop()
+        if self.settle_timeout > 0 and inflight is not None and not inflight.done():
+            await asyncio.wait([inflight], timeout=self.settle_timeout)
+
+    def _send_once(self) -> bool:
+        # Поток мог стартовать уже после stop() - тогда не отправляем
+        if self._stopped:
+            return False
+        self.send()
+        return True
+
+    async def _run(self):
+        failures = 0
+        while not self._stopped:
+            self._inflight = asyncio.ensure_future(asyncio.to_thread(self._send_once))
+            # После отмены _run ошибку запроса никто не заберет - иначе asyncio пишет "exception was never retrieved"
+            self._inflight.add_done_callback(lambda future: future.cancelled() or future.exception())
+            try:
+                if await asyncio.shield(self._inflight):
+                    self.sent += 1
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.warning(f"⚠️ Не удалось отправить typing в чат {self.chat_id}: {e}")
+                if failures >= self.max_failures:
+                    logger.info(f"ℹ️ Typing индикатор для чата {self.chat_id} отключен до конца ответа")
+                    return
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,156 @@
+"""
+Снимок кэшей процесса для теплого старта
+
+После рестарта бот стартовал холодным: пустые локальные сессии агента,
+пустая история LoopDetector, неизвестные пользователи и сессии Zep (два
+лишних запроса к Zep на первое сообщение каждого клиента). Снимок пишется в
+один бинарный файл при остановке и по таймеру (переживает и падение
+процесса, в отличие от checkpoint при остановке - bot/checkpoint.py).
+
+Формат: 4 байта сигнатуры + словарь {saved_at, sections: {name: bytes}}.
+Каждый раздел закодирован отдельно: при старте читается файл и декодируется
+только оглавление, раздел - при первом обращении (take).
+Кодек - msgpack, без него - json (сигнатура говорит, каким кодеком записан
+файл). Запись атомарная: временный файл + os.replace.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+try:
+    import msgpack
+
+    SNAPSHOT_CODEC = "msgpack"
+    _MAGIC = b"WSM1"
+
+    def _dumps(data: Any) -> bytes:
+        return msgpack.packb(data, use_bin_type=True)
+
+    def _loads(data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+except ImportError:
+    SNAPSHOT_CODEC = "json"
+    _MAGIC = b"WSJ1"
+
+    def _dumps(data: Any) -> bytes:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+    def _loads(data: bytes) -> Any:
+        return json.loads(data.decode("utf-8"))
+
+logger = logging.getLogger(__name__)
+
+
+def _decode_outer(magic: bytes, body: bytes) -> Dict[str, Any]:
+    if magic == b"WSJ1":
+        # Разделы json-снимка - строки внутри внешнего json
+        outer = json.loads(body.decode("utf-8"))
+        outer["sections"] = {name: data.encode("utf-8") for name, data in outer["sections"].items()}
+        outer["codec"] = "json"
+        return outer
+    if magic == _MAGIC:
+        return _loads(body)
+    raise ValueError(f"неизвестная сигнатура снимка {magic!r} (кодек процесса: {SNAPSHOT_CODEC})")
+
+
+class WarmSnapshot:
+    """Разделы {name: данные} в одном файле, декодируются при первом обращении"""
+
+    def __init__(self, path: str, max_age: float = 24 * 3600.0):
+        self.path = path
+        self.max_age = max_age
+        self._pending: Dict[str, bytes] = {}
+        self._codec = SNAPSHOT_CODEC
+        self.saved_at: Optional[float] = None
+        self.last_saved: Optional[Dict[str, Any]] = None
+        self.last_loaded: Optional[Dict[str, Any]] = None
+        self.taken = []
+
+    def save(self, sections: Dict[str, Optional[Any]]) -> Optional[Dict[str, Any]]:
+        """Пишет непустые разделы (блокирующий вызов - из asyncio.to_thread); без данных файл не трогается"""
+        started = time.perf_counter()
+        encoded = {name: _dumps(data) for name, data in sections.items() if data}
+        if not encoded:
+            return None
+        if SNAPSHOT_CODEC == "json":
+            outer = {"saved_at": time.time(), "sections": {name: data.decode("utf-8") for name, data in encoded.items()}}
+        else:
+            outer = {"saved_at": time.time(), "sections": encoded}
+        payload = _MAGIC + _dumps(outer)
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+        self.last_saved = {
+            "codec": SNAPSHOT_CODEC,
+            "bytes": len(payload),
+            "sections": {name: len(data) for name, data in encoded.items()},
+            "ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+        logger.info(f"🧊 Снимок кэшей: {self.path} {self.last_saved}")
+        return self.last_saved
+
+    def load(self) -> Dict[str, int]:
+        """Читает файл и оглавление (блокирующий вызов); разделы декодирует take()"""
+        self._pending = {}
+        if not os.path.exists(self.path):
+            self.last_loaded = {"found": False}
+            return {}
+        started = time.perf_counter()
+        with open(self.path, "rb") as f:
+            raw = f.read()
+        outer = _decode_outer(raw[:4], raw[4:])
+        self._codec = outer.get("codec", SNAPSHOT_CODEC)
+        self.saved_at = outer["saved_at"]
+        age = time.time() - self.saved_at
+        if age > self.max_age:
+            logger.info(f"🧊 Снимок кэшей устарел ({age:.0f} с) - холодный старт")
+            self.last_loaded = {"found": True, "expired": True, "age_s": round(age)}
+            return {}
+        self._pending = dict(outer["sections"])
+        self.last_loaded = {
+            "found": True,
+            "bytes": len(raw),
+            "age_s": round(age),
+            "sections": {name: len(data) for name, data in self._pending.items()},
+            "ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+        return self.last_loaded["sections"]
+
+    def take(self, name: str) -> Optional[Any]:
+        """Декодирует раздел при первом обращении и забывает его байты (None - раздела нет)"""
+        data = self._pending.pop(name, None)
+        if data is None:
+            return None
+        try:
+            value = json.loads(data.decode("utf-8")) if self._codec == "json" else _loads(data)
+        except ValueError as e:
+            logger.error(f"❌ Поврежденный раздел снимка '{name}': {e}")
+            return None
+        self.taken.append(name)
+        return value
+
+    def discard(self, name: str):
+        """Раздел не нужен (например, история уже пришла из checkpoint)"""
+        self._pending.pop(name, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "codec": SNAPSHOT_CODEC,
+            "max_age_s": self.max_age,
+            "pending_sections": sorted(self._pending),
+            "restored_sections": self.taken,
+            "last_saved": self.last_saved,
+            "last_loaded": self.last_loaded
+        }
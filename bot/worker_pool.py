@@ -0,0 +1,346 @@
+"""
+Пул фоновых обработчиков updates
+
+Webhook только проверяет и ставит update в очередь, а AI-обработку выполняют
+N воркеров. Telegram получает ответ за миллисекунды, поэтому накопившийся
+backlog после деплоя выгружается быстро, а число одновременных запросов
+к OpenAI ограничено размером пула.
+
+Updates одного чата обрабатываются строго последовательно, чтобы ответы
+не перемешивались. Порядок выдачи jobs воркерам - по классам приоритета и
+поровну между чатами (bot/scheduler.py).
+"""
+
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from .scheduler import PriorityFairQueue
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateJob:
+    """Единица работы для пула: update + метаданные маршрутизации"""
+
+    __slots__ = (
+        'update', 'kind', 'chat_key', 'received_at', 'stale_action', 'age_minutes', 'merged_count',
+        'parts', 'cancel_reason', 'restart', 'regenerations', 'task', 'sending', 'trace', 'queue_ids', 'attempt'
+    )
+
+    def __init__(
+        self,
+        update: Dict[str, Any],
+        kind: str,
+        chat_key: Optional[Hashable] = None,
+        stale_action: Optional[str] = None,
+        age_minutes: float = 0.0,
+        merged_count: int = 1,
+        parts: Optional[List[Dict[str, Any]]] = None
+    ):
+        self.update = update
+        self.kind = kind
+        self.chat_key = chat_key
+        self.received_at = time.monotonic()
+        self.stale_action = stale_action
+        self.age_minutes = age_minutes
+        self.merged_count = merged_count
+        # Исходные сообщения клиента, из которых собран update (для правок/удалений)
+        if parts is None:
+            message = update.get(kind)
+            parts = [message] if isinstance(message, dict) else []
+        self.parts = parts
+        # Отмена/перезапуск обработки (см. bot/inflight.py)
+        self.cancel_reason: Optional[str] = None
+        self.restart = False
+        self.regenerations = 0
+        self.task: Optional[asyncio.Task] = None
+        # Ответ сгенерирован и отправляется - отменять поздно
+        self.sending = False
+        # Длительности этапов обработки (мс) и токены - для аналитики
+        self.trace: Dict[str, Any] = {}
+        # Строки надежной очереди (bot/durable_queue.py), подтверждаемые по завершении job
+        self.queue_ids: List[int] = []
+        # Номер попытки: > 1 - update выдан повторно после падения worker
+        self.attempt = 1
+
+    @property
+    def message_ids(self) -> List[int]:
+        return [part.get("message_id") for part in self.parts]
+
+    @property
+    def sender_id(self):
+        return self.parts[-1].get("from", {}).get("id") if self.parts else None
+
+    def rebuild(self):
+        """Пересобирает update из parts после правки или удаления части сообщений"""
+        self.update = dict(self.update)
+        self.update[self.kind] = merge_messages(self.parts)
+        self.merged_count = len(self.parts)
+
+
+class UpdateWorkerPool:
+    """Ограниченная по размеру очередь + фиксированное число воркеров"""
+
+    def __init__(
+        self,
+        handler: Callable[[UpdateJob], Awaitable[Optional[Dict[str, Any]]]],
+        concurrency: int = 8,      # число одновременно обрабатываемых updates
+        max_queue: int = 1000,     # при переполнении webhook отвечает 503 и Telegram повторит доставку
+        on_done: Optional[Callable[[UpdateJob, Optional[Dict[str, Any]], Optional[BaseException]], None]] = None,
+        classify: Optional[Callable[[UpdateJob], str]] = None,   # класс приоритета job (bot/scheduler.py)
+        priority_max_wait: float = 30.0
+    ):
+        self.handler = handler
+        # Вызывается после каждого job (результат или ошибка) - запись аналитики
+        self.on_done = on_done
+        self.concurrency = concurrency
+        # Клиенты business аккаунтов раньше служебных updates, чаты - поровну
+        self.queue = PriorityFairQueue(maxsize=max_queue, classify=classify, max_wait=priority_max_wait)
+        self._workers: List[asyncio.Task] = []
+        # False после close(): остановка сервера, новые jobs не принимаются
+        self.accepting = True
+        self._chat_locks: Dict[Hashable, asyncio.Lock] = {}
+        self._chat_lock_users: Counter = Counter()
+
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.actions: Counter = Counter()
+        self.max_queue_wait_ms = 0.0
+
+    def submit(self, job: UpdateJob) -> bool:
+        """
+        Ставит job в очередь без ожидания
+
+        Returns:
+            False если очередь переполнена или пул останавливается
+        """
+        if not self.accepting:
+            self.rejected += 1
+            logger.warning("⚠️ Пул останавливается, update отклонен")
+            return False
+        try:
+            self.queue.put_nowait(job)
+            return True
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logger.warning(f"⚠️ Очередь updates переполнена ({self.queue.qsize()}), update отклонен")
+            return False
+
+    def _acquire_chat_lock(self, chat_key: Hashable) -> asyncio.Lock:
+        lock = self._chat_locks.get(chat_key)
+        if lock is None:
+            lock = self._chat_locks[chat_key] = asyncio.Lock()
+        self._chat_lock_users[chat_key] += 1
+        return lock
+
+    def _release_chat_lock(self, chat_key: Hashable):
+        self._chat_lock_users[chat_key] -= 1
+        if self._chat_lock_users[chat_key] <= 0:
+            del self._chat_lock_users[chat_key]
+            self._chat_locks.pop(chat_key, None)
+
+    async def _run_job(self, job: UpdateJob):
+        started = time.monotonic()
+        wait_ms = (started - job.received_at) * 1000
+        self.max_queue_wait_ms = max(self.max_queue_wait_ms, wait_ms)
+        job.trace['queue_ms'] = wait_ms
+        self.in_flight += 1
+        result, error = None, None
+        try:
+            result = await self.handler(job)
+            self.processed += 1
+            if isinstance(result, dict):
+                self.actions[result.get('action') or result.get('status') or 'processed'] += 1
+        except Exception as e:
+            error = e
+            self.failed += 1
+            logger.error(f"❌ Ошибка обработки update ({job.kind}): {e}")
+        finally:
+            self.in_flight -= 1
+            job.trace['total_ms'] = (time.monotonic() - started) * 1000
+        if self.on_done is not None:
+            try:
+                self.on_done(job, result, error)
+            except Exception as e:
+                logger.error(f"❌ Ошибка on_done обработчика: {e}")
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self.queue.get()
+            try:
+                if job.chat_key is None:
+                    await self._run_job(job)
+                else:
+                    lock = self._acquire_chat_lock(job.chat_key)
+                    try:
+                        async with lock:
+                            await self._run_job(job)
+                    finally:
+                        self._release_chat_lock(job.chat_key)
+            finally:
+                self.queue.task_done()
+
+    def start(self):
+        """Запускает воркеры в текущем event loop"""
+        if self._workers:
+            return
+        self._workers = [asyncio.create_task(self._worker(i), name=f"update-worker-{i}") for i in range(self.concurrency)]
+        logger.info(f"✅ Пул обработчиков запущен: {self.concurrency} воркеров")
+
+    def close(self):
+        """Перестает принимать jobs (уже поставленные в очередь будут обработаны до stop)"""
+        self.accepting = False
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Ждет, пока очередь опустеет и текущие jobs завершатся, не дольше timeout
+
+        Returns:
+            True если все jobs обработаны
+        """
+        deadline = time.monotonic() + timeout
+        while self.queue.qsize() or self.in_flight:
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.1)
+        return True
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'concurrency': self.concurrency,
+            'accepting': self.accepting,
+            'queued': self.queue.qsize(),
+            'queue_capacity': self.queue.maxsize,
+            'in_flight': self.in_flight,
+            'processed': self.processed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'max_queue_wait_ms': round(self.max_queue_wait_ms, 1),
+            'actions': dict(self.actions),
+            'priorities': self.queue.get_stats()
+        }
+
+
+class StaleMessageCoalescer:
+    """
+    Склеивает "старые" сообщения одного отправителя в один job
+
+    Backlog приходит пачкой, поэтому сообщения клиента, пролежавшие в очереди,
+    собираются в буфер и через короткое окно тишины отправляются в пул
+    одним вопросом - клиент получает один ответ вместо нескольких.
+    """
+
+    def __init__(
+        self,
+        submit: Callable[[UpdateJob], bool],
+        window_seconds: float = 3.0,
+        on_discard: Optional[Callable[[List[UpdateJob]], None]] = None
+    ):
+        self.submit = submit
+        # Сообщения, удаленные клиентом до склейки, в пул не попадают (подтверждение в очереди)
+        self.on_discard = on_discard
+        self.window_seconds = window_seconds
+        self._buffers: Dict[Hashable, List[UpdateJob]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self.merged_jobs = 0
+        self.merged_messages = 0
+
+    def add(self, key: Hashable, job: UpdateJob):
+        """Добавляет сообщение в буфер отправителя и перезапускает таймер"""
+        self._buffers.setdefault(key, []).append(job)
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timers[key] = loop.call_later(self.window_seconds, self._flush, key)
+
+    def _flush(self, key: Hashable):
+        self._timers.pop(key, None)
+        # Удаленные клиентом сообщения в ответ не попадают
+        buffered = self._buffers.pop(key, [])
+        jobs = [job for job in buffered if job.cancel_reason is None]
+        discarded = [job for job in buffered if job.cancel_reason is not None]
+        if discarded and self.on_discard is not None:
+            self.on_discard(discarded)
+        if not jobs:
+            return
+
+        merged = merge_jobs(jobs)
+        self.merged_jobs += 1
+        self.merged_messages += len(jobs)
+        if not self.submit(merged):
+            logger.error(f"❌ Не удалось поставить в очередь склеенные сообщения ({len(jobs)} шт.)")
+
+    def flush_all(self):
+        """Немедленно отправляет все буферы (при остановке сервера)"""
+        for key in list(self._buffers):
+            timer = self._timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+            self._flush(key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'window_seconds': self.window_seconds,
+            'buffered_senders': len(self._buffers),
+            'buffered_messages': sum(len(jobs) for jobs in self._buffers.values()),
+            'merged_jobs': self.merged_jobs,
+            'merged_messages': self.merged_messages
+        }
+
+
+def merge_messages(parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Склеивает тексты нескольких сообщений в одно
+
+    За основу берется последнее сообщение (его message_id, вложения и т.д.),
+    текст заменяется на все тексты по порядку.
+    """
+    if len(parts) == 1:
+        return parts[0]
+
+    texts = []
+    for message in parts:
+        text = message.get("text", "") or message.get("caption", "")
+        if text:
+            texts.append(text)
+
+    merged_message = dict(parts[-1])
+    merged_message.pop("caption", None)
+    merged_message["text"] = "\n".join(texts)
+    return merged_message
+
+
+def merge_jobs(jobs: List[UpdateJob]) -> UpdateJob:
+    """Склеивает несколько jobs одного отправителя в один. Возраст - по самому старому."""
+    if len(jobs) == 1:
+        return jobs[0]
+
+    last = jobs[-1]
+    parts = [part for job in jobs for part in job.parts]
+    merged_update = dict(last.update)
+    merged_update[last.kind] = merge_messages(parts)
+
+    merged = UpdateJob(
+        update=merged_update,
+        kind=last.kind,
+        chat_key=last.chat_key,
+        stale_action=last.stale_action,
+        age_minutes=max(job.age_minutes for job in jobs),
+        merged_count=sum(job.merged_count for job in jobs),
+        parts=parts
+    )
+    merged.queue_ids = [queue_id for job in jobs for queue_id in job.queue_ids]
+    merged.attempt = max(job.attempt for job in jobs)
+    return merged
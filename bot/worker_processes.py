@@ -0,0 +1,79 @@
+"""
+Запуск worker процессов рядом с ingest (python webhook.py при QUEUE_WORKER_PROCESSES > 0)
+
+Каждый worker - отдельный `python webhook.py` с PROCESS_ROLE=worker и своим
+портом на 127.0.0.1 (/health, /debug). Упавший worker перезапускается с тем
+же QUEUE_WORKER_ID: его неподтвержденные updates сразу возвращаются в
+очередь (bot/durable_queue.py), не дожидаясь конца аренды.
+
+Workers можно запускать и отдельно (другой сервис с тем же volume и
+UPDATE_QUEUE_PATH) - тогда ingest запускается с PROCESS_ROLE=ingest.
+"""
+
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerSupervisor:
+    """Держит N worker процессов запущенными до stop()"""
+
+    def __init__(self, script: str, count: int, base_port: int, restart_delay: float = 1.0):
+        self.script = script
+        self.count = count
+        self.base_port = base_port
+        self.restart_delay = restart_delay
+        self.processes: Dict[int, subprocess.Popen] = {}
+        self.restarts = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _spawn(self, index: int) -> subprocess.Popen:
+        env = dict(os.environ)
+        env.update({
+            "PROCESS_ROLE": "worker",
+            "QUEUE_WORKER_ID": f"worker-{index}",
+            "QUEUE_WORKER_PROCESSES": "0",
+            "WEB_CONCURRENCY": "1",
+            "HOST": "127.0.0.1",
+            "PORT": str(self.base_port + index),
+        })
+        process = subprocess.Popen([sys.executable, self.script], env=env)
+        print(f"👷 Worker {index} запущен: pid {process.pid}, порт {self.base_port + index}")
+        return process
+
+    def _watch(self):
+        while not self._stop.wait(self.restart_delay):
+            for index, process in list(self.processes.items()):
+                if process.poll() is None or self._stop.is_set():
+                    continue
+                logger.error(f"💥 Worker {index} (pid {process.pid}) завершился с кодом {process.returncode} - перезапуск")
+                self.restarts += 1
+                self.processes[index] = self._spawn(index)
+
+    def start(self):
+        for index in range(self.count):
+            self.processes[index] = self._spawn(index)
+        self._thread = threading.Thread(target=self._watch, name="worker-supervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        """SIGTERM всем workers (они возвращают неподтвержденные updates в очередь), затем SIGKILL"""
+        self._stop.set()
+        processes: List[subprocess.Popen] = list(self.processes.values())
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in processes:
+            try:
+                process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
@@ -1,14 +1,24 @@
 #!/bin/bash
-# 🧹 Быстрая очистка накопившихся сообщений перед деплоем
+# 🧹 Проверка накопившихся сообщений перед деплоем
+# Удалить их без обработки: ./clear_old_messages.sh --drop
 
-echo "🧹 Очистка старых сообщений перед деплоем..."
+if [[ " $* " == *" --drop "* ]]; then
+    echo "🧹 Удаление накопившихся сообщений перед деплоем..."
+else
+    echo "🔍 Проверка накопившихся сообщений перед деплоем (без удаления)..."
+fi
 echo "========================================="
 
-# Запускаем скрипт очистки
-python3 scripts/clear_pending_updates.py
+# Запускаем скрипт проверки/очистки
+python3 scripts/clear_pending_updates.py "$@" || exit $?
 
 echo ""
-echo "✅ Готово! Теперь можно безопасно деплоить бота"
+if [[ " $* " == *" --drop "* ]]; then
+    echo "✅ Готово! Накопившиеся сообщения удалены - бот не ответит на них после деплоя"
+else
+    echo "✅ Проверка завершена. Накопившиеся сообщения бот обработает после деплоя"
+    echo "   (удалить их без ответа: ./clear_old_messages.sh --drop)"
+fi
 echo "📝 Команды для деплоя:"
 echo "   git add . && git commit -m 'Update' && git push"
-echo "   railway logs --service bot-production-472c"
\ No newline at end of file
+echo "   railway logs --service bot-production-472c"
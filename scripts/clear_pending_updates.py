@@ -1,7 +1,13 @@
 #!/usr/bin/env python3
 """
 🔧 Очистка накопившихся pending updates в Telegram Bot API
-Запускать перед каждым деплоем для предотвращения лавины старых сообщений
+
+По умолчанию скрипт только показывает состояние очереди: бот больше не удаляет
+webhook при деплое, а накопившиеся updates выгружает пулом воркеров и
+классифицирует по возрасту (answer / summarise / skip), см. bot/stale_policy.py.
+
+Удаление всех pending updates - только явно, флагом --drop
+(например, после спам-атаки).
 """
 
 import os
@@ -144,6 +150,13 @@ def main():
         return 0
     
     print(f"⚠️  Обнаружено {pending_count} накопившихся обновлений")
+
+    if "--drop" not in sys.argv:
+        print("ℹ️  Бот выгрузит их сам: свежие получат ответ, пролежавшие в очереди -")
+        print("   один сводный ответ на клиента, слишком старые будут пропущены и учтены в /debug/workers")
+        print("🧹 Чтобы удалить их без обработки, запустите с флагом --drop")
+        return 0
+
     print("🚀 Запускаю процедуру очистки...")
     
     # Выполняем очистку
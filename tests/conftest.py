@@ -0,0 +1,14 @@
+"""
+Общие настройки юнит-тестов: путь к репозиторию, токен для импорта bot.config
+
+Запуск: python -m pytest tests
+"""
+
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, REPO_DIR)
+# bot.config требует токен при импорте; сеть в тестах не используется
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:test")
@@ -0,0 +1,41 @@
+"""AnalyticsRecorder: пакетная запись и учет потерь при недоступной БД"""
+
+import asyncio
+import sqlite3
+
+from bot.analytics import AnalyticsRecorder, fetch_columns
+
+
+def test_flush_writes_buffered_events(tmp_path):
+    recorder = AnalyticsRecorder(str(tmp_path / "analytics.db"))
+    recorder.init_db()
+    for chat_id in range(3):
+        recorder.record({"kind": "business_message", "chat_id": chat_id, "outcome": "answered"})
+
+    asyncio.run(recorder.flush())
+
+    assert recorder.get_stats()["written"] == 3
+    events = fetch_columns(recorder.db_path, since=0, columns=["chat_id"])
+    assert sorted(events["columns"]["chat_id"]) == [0, 1, 2]
+
+
+def test_failed_flush_keeps_newest_events_and_counts_dropped(tmp_path):
+    recorder = AnalyticsRecorder(str(tmp_path / "analytics.db"), max_buffer=4)
+
+    def failing_write(rows):
+        # Пока идет запись, приходят новые события
+        for index in range(3):
+            recorder.record({"outcome": f"new{index}"})
+        raise sqlite3.OperationalError("database is locked")
+
+    recorder._write_batch = failing_write
+    for index in range(3):
+        recorder.record({"outcome": f"old{index}"})
+
+    asyncio.run(recorder.flush())
+
+    outcomes = [row[4] for row in recorder._buffer]
+    # Не поместились два самых старых события - они и учтены как потерянные
+    assert outcomes == ["old2", "new0", "new1", "new2"]
+    assert recorder.dropped == 2
+    assert recorder.errors == 1
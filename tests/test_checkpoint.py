@@ -0,0 +1,61 @@
+"""StateCheckpoint: состояние процесса переживает остановку и не применяется дважды"""
+
+import sqlite3
+import time
+
+from bot.checkpoint import StateCheckpoint
+from bot.loop_detector import LoopDetectorRegistry
+from bot.shared_state import MemoryState
+
+
+def test_state_round_trip(tmp_path):
+    state = MemoryState()
+    state.incr("updates_received", 5)
+    state.push_recent("last_updates", {"update_id": 1}, maxlen=2)
+    state.claim("update:1", ttl=600)
+    state.claim("update:old", ttl=-1)
+    loops = LoopDetectorRegistry()
+    loops.get("bc").track_bot_response("Ответ бота", 42)
+
+    checkpoint = StateCheckpoint(str(tmp_path / "checkpoint.db"))
+    saved = checkpoint.save({"shared_state": state.export_state(), "loop_detectors": loops.export_state(),
+                             "sessions": None})
+    assert sorted(saved["sections"]) == ["loop_detectors", "shared_state"]
+
+    restored = MemoryState()
+    restored.incr("updates_received", 1)
+    restored_loops = LoopDetectorRegistry()
+    sections = checkpoint.load()
+    restored.import_state(sections["shared_state"])
+    restored_loops.import_state(sections["loop_detectors"])
+
+    assert restored.counter("updates_received") == 5
+    assert restored.recent("last_updates") == [{"update_id": 1}]
+    # Повторная доставка уже обработанного update отсекается, истекший claim не восстановлен
+    assert restored.claim("update:1", ttl=600) is False
+    assert "update:old" not in restored.claims
+    assert restored_loops.get("bc").should_ignore_message("Ответ бота", 42, 42, check_rate=False) == (
+        True, "duplicate_message")
+    assert not restored_loops.get(None).message_history
+
+    # Прочитанный checkpoint удаляется
+    assert checkpoint.load() == {}
+
+
+def test_expired_sections_skipped(tmp_path):
+    path = str(tmp_path / "checkpoint.db")
+    checkpoint = StateCheckpoint(path, max_age=60)
+    checkpoint.save({"fresh": {"a": 1}, "stale": {"b": 2}})
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("UPDATE checkpoints SET saved_at = ? WHERE name = 'stale'", (time.time() - 120,))
+    conn.close()
+
+    assert checkpoint.load() == {"fresh": {"a": 1}}
+    assert checkpoint.last_loaded == {"sections": ["fresh"], "found": 2}
+
+
+def test_missing_file_loads_nothing(tmp_path):
+    checkpoint = StateCheckpoint(str(tmp_path / "none" / "checkpoint.db"))
+    assert checkpoint.load() == {}
+    assert not (tmp_path / "none").exists()
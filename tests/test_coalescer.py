@@ -0,0 +1,56 @@
+"""StaleMessageCoalescer: склейка старых сообщений одного отправителя в один job"""
+
+import asyncio
+
+from bot.worker_pool import StaleMessageCoalescer, UpdateJob
+
+
+def make_job(message_id, text, age_minutes=0.0, queue_ids=()):
+    message = {"message_id": message_id, "text": text, "from": {"id": 10}}
+    job = UpdateJob({"update_id": message_id, "message": message}, "message", chat_key=("private", 10),
+                    age_minutes=age_minutes)
+    job.queue_ids = list(queue_ids)
+    return job
+
+
+def test_messages_merged_after_quiet_window():
+    submitted = []
+
+    async def scenario():
+        coalescer = StaleMessageCoalescer(lambda job: submitted.append(job) or True, window_seconds=0.05)
+        coalescer.add(10, make_job(1, "привет", age_minutes=30, queue_ids=[1]))
+        await asyncio.sleep(0.03)
+        # Новое сообщение перезапускает окно
+        coalescer.add(10, make_job(2, "есть ткань?", age_minutes=5, queue_ids=[2]))
+        await asyncio.sleep(0.03)
+        assert submitted == []
+        await asyncio.sleep(0.05)
+        return coalescer.get_stats()
+
+    stats = asyncio.run(scenario())
+
+    [merged] = submitted
+    assert merged.update["message"]["text"] == "привет\nесть ткань?"
+    assert merged.update["message"]["message_id"] == 2
+    assert merged.message_ids == [1, 2]
+    assert (merged.merged_count, merged.age_minutes, merged.queue_ids) == (2, 30, [1, 2])
+    assert (stats["merged_jobs"], stats["merged_messages"], stats["buffered_senders"]) == (1, 2, 0)
+
+
+def test_cancelled_messages_are_discarded():
+    submitted, discarded = [], []
+
+    async def scenario():
+        coalescer = StaleMessageCoalescer(lambda job: submitted.append(job) or True, window_seconds=10,
+                                          on_discard=discarded.extend)
+        deleted = make_job(1, "удалено", queue_ids=[1])
+        deleted.cancel_reason = "deleted"
+        coalescer.add(10, deleted)
+        coalescer.add(10, make_job(2, "вопрос", queue_ids=[2]))
+        coalescer.add(20, make_job(3, "другой клиент"))
+        coalescer.flush_all()
+
+    asyncio.run(scenario())
+
+    assert [job.update["message"]["text"] for job in submitted] == ["вопрос", "другой клиент"]
+    assert [job.queue_ids for job in discarded] == [[1]]
@@ -0,0 +1,165 @@
+"""DurableQueue: аренда, подтверждение, учет попыток и dead letters; QueueConsumer"""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+from bot.durable_queue import DurableQueue, QueueConsumer, chat_ref_key
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = DurableQueue(str(tmp_path / "queue.db"), lease_seconds=60, max_attempts=2)
+    queue.start()
+    yield queue
+    queue.close()
+
+
+def put(queue, update_id, chat_id=None):
+    return queue.put(b'{"update_id": %d}' % update_id, update_id=update_id,
+                     chat_ref=chat_ref_key(chat_id, "bc") if chat_id is not None else None)
+
+
+def attempts(queue):
+    return dict(queue._conn.execute("SELECT id, attempts FROM updates").fetchall())
+
+
+def test_lease_and_ack(queue):
+    ids = [put(queue, update_id) for update_id in (1, 2, 3)]
+
+    leased = queue.lease("w1", 10)
+    assert [item.id for item in leased] == ids
+    assert queue.lease("w2", 10) == []
+
+    queue.ack(ids[:2])
+    stats = queue.get_stats()
+    assert (stats["leased"], stats["acked"]) == (1, 2)
+
+
+def test_chat_leased_by_other_worker_is_skipped(queue):
+    put(queue, 1, chat_id=10)
+    queue.lease("w1", 1)
+    same_chat = put(queue, 2, chat_id=10)
+    other = put(queue, 3, chat_id=20)
+
+    # Продолжение чата 10 достается worker, у которого этот чат в работе
+    assert [item.id for item in queue.lease("w2", 10)] == [other]
+    assert [item.id for item in queue.lease("w1", 10)] == [same_chat]
+
+
+def test_crash_charges_only_started_rows(queue):
+    """Строки, ждавшие в пуле упавшего worker, не теряют попыток"""
+    crashed, waiting = put(queue, 1), put(queue, 2)
+    queue.lease("w1", 10)
+    queue.start_processing([crashed])
+
+    assert queue.release("w1", count_attempt=True) == 2
+    assert attempts(queue) == {crashed: 1, waiting: 0}
+
+    redelivered = {item.id: item.attempts for item in queue.lease("w1", 10)}
+    assert redelivered == {crashed: 2, waiting: 1}
+
+
+def test_stop_refunds_started_rows(queue):
+    row = put(queue, 1)
+    queue.lease("w1", 10)
+    queue.start_processing([row])
+    queue.start_processing([row])  # одна аренда - одна попытка
+
+    queue.release("w1", [row])
+    assert attempts(queue) == {row: 0}
+
+
+def test_dead_letter_and_requeue(queue):
+    row = put(queue, 1)
+    for _ in range(queue.max_attempts):
+        assert [item.id for item in queue.lease("w1", 10)] == [row]
+        queue.start_processing([row])
+        queue.release("w1", count_attempt=True)
+
+    assert queue.lease("w1", 10) == []
+    dead = queue.dead_letters()
+    assert [(item["id"], item["update_id"], item["attempts"]) for item in dead] == [(row, 1, 2)]
+    assert queue.get_stats()["dead"] == 1
+
+    assert queue.requeue_dead([row]) == 1
+    assert [(item.id, item.attempts) for item in queue.lease("w1", 10)] == [(row, 1)]
+
+
+def test_put_many_is_one_batch(queue):
+    assert queue.put_many([(b"{}", 1, None), (b"{}", 2, None)]) == 2
+    assert len(queue.lease("w1", 10)) == 2
+
+
+def test_old_schema_gets_started_column(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE updates (id INTEGER PRIMARY KEY AUTOINCREMENT, update_id INTEGER, chat_ref TEXT, "
+        "payload BLOB NOT NULL, enqueued_at REAL NOT NULL, lease_owner TEXT, lease_until REAL NOT NULL DEFAULT 0, "
+        "attempts INTEGER NOT NULL DEFAULT 0, dead INTEGER NOT NULL DEFAULT 0)"
+    )
+    conn.execute("INSERT INTO updates (payload, enqueued_at) VALUES (x'7b7d', 0)")
+    conn.commit()
+    conn.close()
+
+    queue = DurableQueue(path)
+    queue.start()
+    try:
+        [item] = queue.lease("w1", 10)
+        queue.start_processing([item.id])
+        assert attempts(queue) == {item.id: 1}
+    finally:
+        queue.close()
+
+
+def test_consumer_acks_off_loop_and_releases_rest_on_stop(queue):
+    rows = [put(queue, update_id, chat_id=update_id) for update_id in (1, 2)]
+    dispatched = []
+
+    async def scenario():
+        consumer = QueueConsumer(queue, "w1", lambda item: dispatched.append(item.id) or True, poll_interval=0.01)
+        consumer.start()
+        for _ in range(100):
+            if len(dispatched) == 2:
+                break
+            await asyncio.sleep(0.01)
+        await consumer.start_processing([rows[0]])
+        consumer.ack([rows[0]])
+        await consumer.stop()
+
+    asyncio.run(scenario())
+
+    assert dispatched == rows
+    # Подтвержденная строка удалена, вторая возвращена в очередь без потери попытки
+    assert attempts(queue) == {rows[1]: 0}
+    assert queue.get_stats()["ready"] == 1
+
+
+def test_rejected_row_holds_back_rest_of_its_chat(queue):
+    """Правка после сообщения, не принятого пулом, не применяется раньше него"""
+    message = put(queue, 1, chat_id=10)
+    edit = put(queue, 2, chat_id=10)
+    other = put(queue, 3, chat_id=20)
+    dispatched = []
+
+    def dispatch(item):
+        dispatched.append(item.id)
+        return None if item.id == message else False
+
+    async def scenario():
+        consumer = QueueConsumer(queue, "w1", dispatch, poll_interval=0.01)
+        consumer.start()
+        for _ in range(100):
+            if other in dispatched:
+                break
+            await asyncio.sleep(0.01)
+        await consumer.stop()
+
+    asyncio.run(scenario())
+
+    assert dispatched[:2] == [message, other]
+    assert edit not in dispatched
+    # Отклоненный чат целиком вернулся в очередь, другой чат обработан
+    assert sorted(attempts(queue)) == [message, edit]
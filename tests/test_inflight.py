@@ -0,0 +1,127 @@
+"""PendingMessages: правки и удаления сообщений до ответа, отмена генерации"""
+
+import asyncio
+
+from bot.inflight import PendingMessages
+from bot.worker_pool import UpdateJob
+
+CHAT_REF = (10, "bc")
+
+
+def make_job(*messages):
+    parts = [{"message_id": message_id, "text": text, "from": {"id": 10}} for message_id, text in messages]
+    job = UpdateJob({"business_message": parts[-1]}, "business_message", chat_key=("business",) + CHAT_REF,
+                    parts=parts)
+    job.rebuild()
+    return job
+
+
+def test_edit_in_queue_replaces_text():
+    pending = PendingMessages(None)
+    job = make_job((1, "старый"))
+    pending.track(job)
+
+    assert pending.apply_edit(CHAT_REF, {"message_id": 1, "text": "новый"}) == "updated_queued"
+    assert job.update["business_message"]["text"] == "новый"
+    assert job.cancel_reason is None
+
+
+def test_edit_and_delete_after_sending_are_too_late():
+    pending = PendingMessages(None)
+    job = make_job((1, "вопрос"))
+    pending.track(job)
+    job.sending = True
+
+    assert pending.apply_edit(CHAT_REF, {"message_id": 1, "text": "другой"}) == "too_late"
+    assert pending.apply_delete(CHAT_REF, [1]) == {"too_late": 1}
+    assert pending.apply_edit(CHAT_REF, {"message_id": 2, "text": "x"}) == "not_pending"
+
+
+def test_delete_in_queue_skips_handler():
+    calls = []
+
+    async def handler(job):
+        calls.append(job)
+
+    async def scenario():
+        pending = PendingMessages(handler)
+        job = make_job((1, "вопрос"))
+        pending.track(job)
+        assert pending.apply_delete(CHAT_REF, [1]) == {"cancelled": 1}
+        return await pending.run(job), pending
+
+    result, pending = asyncio.run(scenario())
+
+    assert result == {"ok": True, "action": "cancelled_deleted"}
+    assert calls == []
+    assert pending.get_stats()["pending_messages"] == 0
+
+
+def test_delete_during_generation_cancels_it():
+    started = []
+
+    async def handler(job):
+        started.append(job.update["business_message"]["text"])
+        await asyncio.sleep(10)
+
+    async def scenario():
+        pending = PendingMessages(handler)
+        job = make_job((1, "вопрос"))
+        pending.track(job)
+        run = asyncio.ensure_future(pending.run(job))
+        await asyncio.sleep(0.01)
+        pending.apply_delete(CHAT_REF, [1])
+        return await asyncio.wait_for(run, 1), pending
+
+    result, pending = asyncio.run(scenario())
+
+    assert result == {"ok": True, "action": "cancelled_deleted"}
+    assert started == ["вопрос"]
+    assert pending.counters["cancelled_deleted"] == 1
+    assert pending.get_stats()["generating_chats"] == 0
+
+
+def test_edit_during_generation_restarts_with_new_text():
+    seen = []
+
+    async def handler(job):
+        seen.append(job.update["business_message"]["text"])
+        if len(seen) == 1:
+            await asyncio.sleep(10)
+        return {"ok": True, "action": "answered"}
+
+    async def scenario():
+        pending = PendingMessages(handler)
+        job = make_job((1, "первый"), (2, "второй"))
+        pending.track(job)
+        run = asyncio.ensure_future(pending.run(job))
+        await asyncio.sleep(0.01)
+        assert pending.apply_edit(CHAT_REF, {"message_id": 2, "text": "исправлен"}) == "regenerating"
+        return await asyncio.wait_for(run, 1), job
+
+    result, job = asyncio.run(scenario())
+
+    assert result == {"ok": True, "action": "answered"}
+    assert seen == ["первый\nвторой", "первый\nисправлен"]
+    assert job.regenerations == 1
+
+
+def test_server_shutdown_cancellation_propagates():
+    """Отмену, пришедшую не из реестра, run() не глотает"""
+
+    async def handler(job):
+        await asyncio.sleep(10)
+
+    async def scenario():
+        pending = PendingMessages(handler)
+        job = make_job((1, "вопрос"))
+        run = asyncio.ensure_future(pending.run(job))
+        await asyncio.sleep(0.01)
+        run.cancel()
+        try:
+            await run
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    assert asyncio.run(scenario()) is True
@@ -0,0 +1,91 @@
+"""InstructionStore: публикация по хешу содержимого, поиск по префиксу, активация и откат"""
+
+import sqlite3
+
+import pytest
+
+from bot.instruction_store import InstructionStore
+
+V1 = {"system_instruction": "Версия 1"}
+V2 = {"system_instruction": "Версия 2"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return InstructionStore(str(tmp_path / "instructions.db"))
+
+
+def test_publish_is_idempotent_by_content(store):
+    assert store.is_empty()
+    version_hash, activated = store.publish(V1, author="admin")
+    assert activated is True
+
+    assert store.publish(dict(V1), author="admin") == (version_hash, False)
+    assert len(store.list_versions()) == 1
+    assert store.active() == (version_hash, 1)
+
+
+def test_resolve_by_prefix(store):
+    first, _ = store.publish(V1)
+    second, _ = store.publish(V2)
+
+    assert store.resolve(first[:12]) == first
+    assert store.resolve(second) == second
+    assert store.resolve("zz") is None
+    # Не hex (шаблоны LIKE, пустая строка) - не ищется вовсе
+    assert store.resolve("") is None
+    assert store.resolve("%") is None
+    assert store.resolve(first[:4] + "_") is None
+
+
+def test_rollback_is_new_revision(store):
+    first, _ = store.publish(V1)
+    second, _ = store.publish(V2)
+    assert store.active() == (second, 2)
+
+    assert store.activate(first[:12], author="admin") is True
+    assert store.activate(first) is False
+    active_hash, revision, instruction = store.get_active()
+    assert (active_hash, revision, instruction) == (first, 3, V1)
+
+    assert [entry["version"] for entry in store.history()] == [first[:12], second[:12], first[:12]]
+    assert [version["active"] for version in store.list_versions() if version["hash"] == first] == [True]
+
+    snapshot = store.snapshot(active_hash, revision)
+    assert (snapshot.version, snapshot.source) == (first[:12], "store:3")
+
+
+def test_activate_unknown_version_raises(store):
+    store.publish(V1)
+    with pytest.raises(KeyError):
+        store.activate("deadbeef")
+
+
+def test_import_keeps_rolled_back_version(store):
+    """Известное содержимое instruction.json при старте не перебивает откат"""
+    first, _ = store.publish(V1)
+    store.publish(V2)
+    store.activate(first)
+
+    assert store.import_version(V2) is False
+    assert store.active()[0] == first
+    assert store.import_version({"system_instruction": "Версия 3"}) is True
+    assert store.active()[0] != first
+
+
+def test_connections_are_closed(store, monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+
+    def tracking_connect(*args, **kwargs):
+        opened.append(connect(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(sqlite3, "connect", tracking_connect)
+    store.publish(V1)
+    store.active()
+
+    assert opened
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
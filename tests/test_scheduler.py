@@ -0,0 +1,76 @@
+"""PriorityFairQueue: приоритет классов, честность между чатами, один класс на чат"""
+
+import asyncio
+
+from bot.scheduler import PRIORITY_CLIENT, PRIORITY_RETRY, PriorityFairQueue
+from bot.stale_policy import STALE_SUMMARISE
+from bot.worker_pool import UpdateJob
+
+
+def make_job(chat_id, text, kind="business_message", stale_action=None):
+    update = {kind: {"message_id": 1, "chat": {"id": chat_id}, "text": text}}
+    return UpdateJob(update, kind, chat_key=(kind, chat_id), stale_action=stale_action)
+
+
+def drain(queue):
+    """Тексты jobs в порядке выдачи воркерам"""
+    async def take_all():
+        jobs = [await queue.get() for _ in range(queue.qsize())]
+        return [job.update[job.kind]["text"] for job in jobs]
+    return asyncio.run(take_all())
+
+
+def test_client_before_service_and_direct():
+    queue = PriorityFairQueue()
+    queue.put_nowait(make_job(1, "direct", kind="message"))
+    queue.put_nowait(make_job(2, "client"))
+
+    async def take():
+        return [(await queue.get()).kind for _ in range(2)]
+
+    assert asyncio.run(take()) == ["business_message", "message"]
+
+
+def test_new_chat_is_not_behind_a_burst():
+    queue = PriorityFairQueue()
+    for index in range(5):
+        queue.put_nowait(make_job(1, f"a{index}"))
+    queue.put_nowait(make_job(2, "b0"))
+
+    assert drain(queue) == ["a0", "b0", "a1", "a2", "a3", "a4"]
+
+
+def test_chat_jobs_stay_in_order_across_classes():
+    """Сводный ответ (retry) чата не обгоняется его же новым сообщением (client)"""
+    queue = PriorityFairQueue()
+    queue.put_nowait(make_job(1, "a-summary", stale_action=STALE_SUMMARISE))
+    queue.put_nowait(make_job(2, "b-summary", stale_action=STALE_SUMMARISE))
+    queue.put_nowait(make_job(1, "a-new"))
+
+    order = drain(queue)
+
+    # Очередь чата 1 переехала в client целиком и обслуживается раньше retry чата 2
+    assert order == ["a-summary", "a-new", "b-summary"]
+    assert queue.flows_moved == 1
+
+
+def test_lower_class_job_joins_chat_class():
+    queue = PriorityFairQueue()
+    queue.put_nowait(make_job(1, "a-new"))
+    queue.put_nowait(make_job(2, "b-summary", stale_action=STALE_SUMMARISE))
+    queue.put_nowait(make_job(1, "a-summary", stale_action=STALE_SUMMARISE))
+
+    stats = queue.get_stats()["classes"]
+    assert stats[PRIORITY_CLIENT]["queued"] == 2
+    assert stats[PRIORITY_RETRY]["queued"] == 1
+    assert drain(queue) == ["a-new", "a-summary", "b-summary"]
+
+
+def test_chat_class_is_forgotten_when_queue_empties():
+    queue = PriorityFairQueue()
+    queue.put_nowait(make_job(1, "a-new"))
+    assert drain(queue) == ["a-new"]
+
+    queue.put_nowait(make_job(1, "a-summary", stale_action=STALE_SUMMARISE))
+    assert queue.get_stats()["classes"][PRIORITY_RETRY]["queued"] == 1
+    assert drain(queue) == ["a-summary"]
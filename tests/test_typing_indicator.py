@@ -0,0 +1,69 @@
+"""TypingKeepalive: finish() не задерживает ответ и не дает начать новый sendChatAction"""
+
+import asyncio
+import time
+
+from bot.typing_indicator import TypingKeepalive
+
+
+def run_inflight_scenario(**kwargs):
+    events = []
+
+    def send():
+        events.append("typing-start")
+        time.sleep(0.2)
+        events.append("typing-done")
+
+    async def scenario():
+        typing = TypingKeepalive(send, interval=0.05, **kwargs)
+        typing.start()
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        await typing.finish()
+        events.append("answer")
+        waited = time.perf_counter() - started
+        await asyncio.sleep(0.3)
+        return waited
+
+    return events, asyncio.run(scenario())
+
+
+def test_finish_does_not_delay_answer():
+    events, waited = run_inflight_scenario()
+
+    assert events == ["typing-start", "answer", "typing-done"]
+    assert waited < 0.05
+
+
+def test_finish_settles_inflight_send_when_enabled():
+    events, waited = run_inflight_scenario(settle_timeout=1.0)
+
+    assert events == ["typing-start", "typing-done", "answer"]
+    assert waited < 1.0
+
+
+def test_send_not_started_after_stop():
+    """Поток, стартовавший уже после stop(), запрос не отправляет"""
+    calls = []
+    typing = TypingKeepalive(lambda: calls.append(1))
+    typing.stop()
+
+    assert typing._send_once() is False
+    assert calls == []
+
+
+def test_stops_after_repeated_failures():
+    attempts = []
+
+    def send():
+        attempts.append(1)
+        raise RuntimeError("chat not found")
+
+    async def scenario():
+        typing = TypingKeepalive(send, interval=0.01, max_failures=2)
+        typing.start()
+        await asyncio.sleep(0.2)
+        typing.stop()
+
+    asyncio.run(scenario())
+    assert len(attempts) == 2
@@ -0,0 +1,33 @@
+"""parse_update: тип update и ленивые представления полей"""
+
+import pytest
+
+from bot.updates import parse_update
+
+
+def test_business_message_fields():
+    update = parse_update(
+        '{"update_id": 7, "business_message": {"message_id": 3, "date": 1, "business_connection_id": "bc", '
+        '"chat": {"id": 10}, "from": {"id": 10, "first_name": "Анна"}, "caption": "фото ткани"}}'.encode("utf-8")
+    )
+
+    assert (update.update_id, update.kind, update.is_message) == (7, "business_message", True)
+    message = update.message
+    assert (message.chat_id, message.user_id, message.business_connection_id) == (10, 10, "bc")
+    assert message.text == "фото ткани"
+
+
+def test_service_and_unknown_kinds():
+    connection = parse_update(b'{"update_id": 1, "business_connection": {"id": "bc", "is_enabled": true, "user": {"id": 5}}}')
+    assert connection.kind == "business_connection"
+    assert connection.message is None
+    assert connection.business_connection.connection_id == "bc"
+
+    unknown = parse_update(b'{"update_id": 2, "poll": {}}')
+    assert unknown.kind == "unknown"
+    assert unknown.type_label == "other: ['update_id', 'poll']"
+
+
+def test_rejects_non_object():
+    with pytest.raises(ValueError):
+        parse_update(b"[1, 2]")
@@ -0,0 +1,117 @@
+"""WarmSnapshot: разделы переживают рестарт, декодируются лениво, json-кодек без msgpack"""
+
+import importlib.util
+import os
+import sys
+import time
+
+import pytest
+
+from bot import warm_snapshot
+from bot.warm_snapshot import WarmSnapshot
+
+SECTIONS = {
+    "sessions": {"123_bc": [{"user": "Есть бязь?", "assistant": "Да"}]},
+    "zep_known": {"users": ["123"], "sessions": ["123_bc"]},
+    "empty": {}
+}
+
+
+def json_codec_module(monkeypatch):
+    """Копия модуля, загруженная так, будто msgpack не установлен"""
+    monkeypatch.setitem(sys.modules, "msgpack", None)
+    spec = importlib.util.spec_from_file_location("warm_snapshot_json", warm_snapshot.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(params=["default", "json"])
+def snapshot_class(request, monkeypatch):
+    if request.param == "json":
+        module = json_codec_module(monkeypatch)
+        assert module.SNAPSHOT_CODEC == "json"
+        return module.WarmSnapshot
+    return WarmSnapshot
+
+
+def test_round_trip_with_lazy_sections(tmp_path, snapshot_class):
+    path = str(tmp_path / "warm.bin")
+    saved = snapshot_class(path).save(SECTIONS)
+    assert sorted(saved["sections"]) == ["sessions", "zep_known"]
+
+    snapshot = snapshot_class(path)
+    assert sorted(snapshot.load()) == ["sessions", "zep_known"]
+    assert snapshot.take("sessions") == SECTIONS["sessions"]
+    # Раздел отдается один раз, байты забываются
+    assert snapshot.take("sessions") is None
+    snapshot.discard("zep_known")
+    assert snapshot.take("zep_known") is None
+    assert snapshot.get_stats()["restored_sections"] == ["sessions"]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_nothing_to_save_keeps_file(tmp_path, snapshot_class):
+    path = str(tmp_path / "warm.bin")
+    snapshot_class(path).save(SECTIONS)
+    before = os.path.getmtime(path)
+
+    assert snapshot_class(path).save({"sessions": None, "empty": {}}) is None
+    assert os.path.getmtime(path) == before
+
+
+def test_expired_snapshot_is_cold_start(tmp_path, snapshot_class, monkeypatch):
+    path = str(tmp_path / "warm.bin")
+    snapshot_class(path, max_age=60).save(SECTIONS)
+
+    later = time.time() + 120
+    monkeypatch.setattr(time, "time", lambda: later)
+    snapshot = snapshot_class(path, max_age=60)
+    assert snapshot.load() == {}
+    assert snapshot.last_loaded["expired"] is True
+    assert snapshot.take("sessions") is None
+
+
+def test_json_snapshot_readable_with_msgpack(tmp_path, monkeypatch):
+    """Файл, записанный процессом без msgpack, читает и процесс с msgpack"""
+    path = str(tmp_path / "warm.bin")
+    json_codec_module(monkeypatch).WarmSnapshot(path).save(SECTIONS)
+    monkeypatch.undo()
+
+    snapshot = WarmSnapshot(path)
+    snapshot.load()
+    assert snapshot.take("zep_known") == SECTIONS["zep_known"]
+
+
+def test_unknown_signature_rejected(tmp_path):
+    path = tmp_path / "warm.bin"
+    path.write_bytes(b"XXXX{}")
+    with pytest.raises(ValueError):
+        WarmSnapshot(str(path)).load()
+
+
+def test_missing_file(tmp_path):
+    snapshot = WarmSnapshot(str(tmp_path / "warm.bin"))
+    assert snapshot.load() == {}
+    assert snapshot.last_loaded == {"found": False}
+
+
+def test_agent_exports_only_recent_sessions():
+    from datetime import datetime, timedelta
+
+    from bot.agent import TextilProAgent
+
+    def exchange(hours_ago):
+        return {"user": "?", "assistant": "!", "timestamp": (datetime.now() - timedelta(hours=hours_ago)).isoformat()}
+
+    agent = TextilProAgent()
+    agent.warm_sessions = {"old": [exchange(30)], "warm": [exchange(5)]}
+    agent.user_sessions = {"fresh": [exchange(48), exchange(1)], "newest": [exchange(0)]}
+
+    sessions = agent.export_warm_state(max_age=24 * 3600)["sessions"]
+    assert sorted(sessions) == ["fresh", "newest", "warm"]
+    assert sorted(agent.export_warm_state(max_age=24 * 3600, max_sessions=2)["sessions"]) == ["fresh", "newest"]
+
+    restored = TextilProAgent()
+    restored.import_warm_sessions({"old": [exchange(30)], "warm": [exchange(5)]}, max_age=24 * 3600)
+    assert list(restored.warm_sessions) == ["warm"]
@@ -12,12 +12,17 @@
 - Автоматическая установка webhook при старте
 """
 
+import hmac
 import os
+import socket
+import sqlite3
 import sys
 import logging
+import time
 import traceback
 from datetime import datetime
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 import telebot
 import json
 import asyncio
@@ -34,8 +39,13 @@ try:
     print("✅ Модуль bot найден")
     from bot.agent import agent
     from bot.config import DATABASE_PATH
-    from bot.database import BusinessOwnersDB
-    from bot.loop_detector import LoopDetector
+    from bot.database import BusinessOwnersDB, stop_orphan_connections
+    from bot.loop_detector import LoopDetectorRegistry
+    from bot.profiles import InstructionProfilesDB
+    from bot.config import INSTRUCTION_FILE, INSTRUCTION_STORE_PATH
+    from bot.instruction_store import InstructionStore
+    from bot.prompt import load_prompt_file
+    from bot.instruction_watcher import InstructionStoreWatcher, InstructionWatcher
     print("✅ AI Agent загружен успешно")
     print("✅ Database и Loop Detector модули загружены")
     AI_ENABLED = True
@@ -50,9 +60,102 @@ except Exception as e:
     print(f"❌ Ошибка загрузки AI Agent: {e}")
     AI_ENABLED = False
 
+from bot.health import BotIdentityCache, DependencyProber
+from bot.stale_policy import STALE_ANSWER, STALE_SKIP, STALE_SUMMARISE, StaleMessagePolicy
+from bot.worker_pool import StaleMessageCoalescer, UpdateJob, UpdateWorkerPool, merge_jobs
+from bot.scheduler import PRIORITY_OWNER, default_priority
+from bot.backlog_drain import BacklogDrainer
+from bot.attachments import attachment_reply_text, has_attachments
+from bot.updates import ParsedUpdate, parse_update
+from bot.inflight import PendingMessages
+from bot.typing_indicator import TypingKeepalive
+from bot.analytics import COLUMNS as ANALYTICS_COLUMNS, AnalyticsRecorder, fetch_columns
+from bot.loop_monitor import EventLoopMonitor, LoopMonitorMiddleware
+from bot.sampling_profiler import THREAD_GROUPS, SamplingProfiler
+from bot.shared_state import create_shared_state
+from bot.durable_queue import DurableQueue, QueueConsumer, chat_ref_key
+from bot.checkpoint import StateCheckpoint
+from bot.warm_snapshot import WarmSnapshot
+
 # === НАСТРОЙКИ ===
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")  # заглушка для нагрузочных тестов
 WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "textil_pro_business_secret_2025")
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "30"))  # секунды между фоновыми проверками
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "https://bot-production-472c.up.railway.app/webhook")
+WEBHOOK_FORCE_SET = os.getenv("WEBHOOK_FORCE_SET", "false").lower() == "true"  # всегда вызывать setWebhook при старте
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "8"))  # одновременно обрабатываемых updates
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+WORKER_PRIORITY_MAX_WAIT = float(os.getenv("WORKER_PRIORITY_MAX_WAIT", "30"))  # секунды: дольше - job вне приоритета класса
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))  # процессов uvicorn (см. bot/shared_state.py)
+# Роль процесса (см. bot/durable_queue.py): all - прием и обработка в одном процессе,
+# ingest - только прием в очередь на диске, worker - только обработка из очереди
+PROCESS_ROLE = os.getenv("PROCESS_ROLE", "all").lower()
+QUEUE_WORKER_PROCESSES = int(os.getenv("QUEUE_WORKER_PROCESSES", "0"))  # >0: python webhook.py = ingest + N workers
+if PROCESS_ROLE == "all" and WEB_CONCURRENCY > 1 and QUEUE_WORKER_PROCESSES == 0:
+    # Блокировка чата, отмена устаревшей генерации, правки/удаления и склейка
+    # работают в пределах процесса - несколько процессов обработки только
+    # через очередь на диске, где чат закреплен за одним worker
+    if __name__ != "__main__":
+        raise RuntimeError(
+            "WEB_CONCURRENCY > 1 с PROCESS_ROLE=all: запускайте python webhook.py "
+            "(прием + WEB_CONCURRENCY workers очереди) или задайте PROCESS_ROLE=ingest/worker"
+        )
+    QUEUE_WORKER_PROCESSES = WEB_CONCURRENCY
+    WEB_CONCURRENCY = 1
+UPDATE_QUEUE_PATH = os.getenv("UPDATE_QUEUE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "update_queue.db"))
+UPDATE_QUEUE_LEASE_SECONDS = float(os.getenv("UPDATE_QUEUE_LEASE_SECONDS", "60"))  # после падения worker update выдается снова
+UPDATE_QUEUE_MAX_ATTEMPTS = int(os.getenv("UPDATE_QUEUE_MAX_ATTEMPTS", "5"))
+UPDATE_QUEUE_PREFETCH = int(os.getenv("UPDATE_QUEUE_PREFETCH", str(WORKER_CONCURRENCY)))  # строк в аренде у worker
+UPDATE_QUEUE_POLL_SECONDS = float(os.getenv("UPDATE_QUEUE_POLL_SECONDS", "0.1"))  # опрос пустой очереди
+QUEUE_WORKER_ID = os.getenv("QUEUE_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+HOST = os.getenv("HOST", "0.0.0.0")
+# Общее состояние процессов: memory:// для одного процесса, при нескольких - SQLite рядом с bot.db
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL") or (
+    "sqlite://" + os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "shared_state.db")
+    if WEB_CONCURRENCY > 1 or PROCESS_ROLE != "all" or QUEUE_WORKER_PROCESSES > 0 else "memory://"
+)
+UPDATE_CLAIM_TTL = float(os.getenv("UPDATE_CLAIM_TTL", "3600"))  # секунды: повторная доставка update игнорируется
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "25"))  # ожидание текущих ответов при остановке
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "checkpoint.db"))
+# Снимок кэшей для теплого старта (у каждого worker очереди свой файл)
+WARM_SNAPSHOT_PATH = os.getenv("WARM_SNAPSHOT_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "data",
+    f"warm_snapshot.{QUEUE_WORKER_ID}.bin" if PROCESS_ROLE == "worker" else "warm_snapshot.bin"
+)
+WARM_SNAPSHOT_INTERVAL = float(os.getenv("WARM_SNAPSHOT_INTERVAL", "300"))  # секунды между снимками (0 - только при остановке)
+WARM_SNAPSHOT_MAX_AGE = float(os.getenv("WARM_SNAPSHOT_MAX_AGE", str(24 * 3600)))  # старый снимок не загружается
+WARM_SNAPSHOT_MAX_SESSIONS = int(os.getenv("WARM_SNAPSHOT_MAX_SESSIONS", "10000"))  # последних локальных сессий в снимке
+ANALYTICS_ENABLED = os.getenv("ANALYTICS_ENABLED", "true").lower() == "true"
+ANALYTICS_DB_PATH = os.getenv("ANALYTICS_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "analytics.db"))
+ANALYTICS_RETENTION_DAYS = float(os.getenv("ANALYTICS_RETENTION_DAYS", "90"))
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.25"))  # период замера лага event loop
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))  # блокировка дольше - в лог со стеком
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))  # период сэмплов /debug/profile
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+STALE_ANSWER_MAX_AGE_MINUTES = float(os.getenv("STALE_ANSWER_MAX_AGE_MINUTES", "5"))
+STALE_SUMMARISE_MAX_AGE_MINUTES = float(os.getenv("STALE_SUMMARISE_MAX_AGE_MINUTES", str(24 * 60)))
+TYPING_REFRESH_SECONDS = float(os.getenv("TYPING_REFRESH_SECONDS", "4"))  # индикатор "печатает" гаснет через ~5 с
+TYPING_SETTLE_SECONDS = float(os.getenv("TYPING_SETTLE_SECONDS", "0"))  # ждать начатый sendChatAction перед ответом (0 - не ждать)
+INSTRUCTION_WATCH_INTERVAL = float(os.getenv("INSTRUCTION_WATCH_INTERVAL", "2"))  # опрос instruction.json (0 - выкл)
+INSTRUCTION_STORE_POLL_SECONDS = float(os.getenv("INSTRUCTION_STORE_POLL_SECONDS", "1"))  # опрос версий инструкций (0 - выкл)
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")  # X-Admin-Token admin endpoints; без него они отключены (503)
+PROFILE_CACHE_CHECK_SECONDS = float(os.getenv("PROFILE_CACHE_CHECK_SECONDS", "5"))  # проверка изменений профилей
+STALE_COALESCE_SECONDS = float(os.getenv("STALE_COALESCE_SECONDS", "3"))
+BACKLOG_DRAIN_THRESHOLD = int(os.getenv("BACKLOG_DRAIN_THRESHOLD", "50"))  # pending updates для автозапуска (0 - выкл)
+BACKLOG_DRAIN_CONCURRENCY = int(os.getenv("BACKLOG_DRAIN_CONCURRENCY", "4"))  # чатов параллельно
+BACKLOG_DRAIN_BATCH_SIZE = int(os.getenv("BACKLOG_DRAIN_BATCH_SIZE", "100"))
+BACKLOG_DRAIN_MAX_UPDATES = int(os.getenv("BACKLOG_DRAIN_MAX_UPDATES", "5000"))
+# Выгруженные через getUpdates updates до ответа (режим all; в роли ingest - очередь updates)
+BACKLOG_SPOOL_PATH = os.getenv("BACKLOG_SPOOL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "backlog_spool.db"))
+ALLOWED_UPDATES = [
+    "message",
+    "business_connection",
+    "business_message",
+    "edited_business_message",
+    "deleted_business_messages"
+]
 
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("❌ TELEGRAM_BOT_TOKEN отсутствует!")
@@ -61,6 +164,8 @@ print(f"✅ Токен бота получен: {TELEGRAM_BOT_TOKEN[:20]}...")
 
 # === СОЗДАНИЕ СИНХРОННОГО БОТА (НЕ ASYNC!) ===
 bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN)
+if TELEGRAM_API_BASE != "https://api.telegram.org":
+    telebot.apihelper.API_URL = TELEGRAM_API_BASE + "/bot{0}/{1}"
 
 # === ЛОГИРОВАНИЕ ===
 import logging.handlers
@@ -108,7 +213,7 @@ def send_business_message(chat_id, text, business_connection_id):
     Отправка сообщения через Business API используя прямой HTTP запрос
     (pyTelegramBotAPI не поддерживает business_connection_id)
     """
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+    url = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
     data = {
         "chat_id": chat_id,
         "text": text,
@@ -129,46 +234,188 @@ def send_business_message(chat_id, text, business_connection_id):
         logger.error(f"❌ Business API HTTP ошибка: {e}")
         return None
 
+def telegram_api_call(method, params, timeout=30):
+    """
+    Прямой вызов метода Bot API (нужен сырой JSON, который telebot не отдает)
+
+    Returns:
+        Поле result ответа Telegram
+
+    Raises:
+        RuntimeError если Telegram вернул ok=false
+    """
+    url = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/{method}"
+    response = requests.post(url, json=params, timeout=timeout)
+    result = response.json()
+    if not result.get("ok"):
+        raise RuntimeError(f"{method}: {result.get('description', result)}")
+    return result.get("result")
+
+def typing_keepalive(chat_id, business_connection_id=None):
+    """Индикатор "печатает..." на время генерации (для business чатов - через HTTP API)"""
+    if business_connection_id:
+        def send():
+            telegram_api_call("sendChatAction", {
+                "chat_id": chat_id,
+                "action": "typing",
+                "business_connection_id": business_connection_id
+            }, timeout=10)
+    else:
+        def send():
+            bot.send_chat_action(chat_id, 'typing')
+    return TypingKeepalive(send, chat_id=chat_id, interval=TYPING_REFRESH_SECONDS, settle_timeout=TYPING_SETTLE_SECONDS)
+
 # === FASTAPI ПРИЛОЖЕНИЕ ===
 app = FastAPI(
     title="🤖 Textile Pro Bot", 
     description="Webhook-only режим для Textile Pro консультанта Елены"
 )
 
-# Хранилище последних updates для отладки
-from collections import deque
-last_updates = deque(maxlen=10)
-update_counter = 0
+# Лаг event loop и блокирующие вызовы (стек + endpoint) - /debug/event-loop
+loop_monitor = EventLoopMonitor(
+    interval=LOOP_MONITOR_INTERVAL, block_threshold=LOOP_BLOCK_THRESHOLD_MS / 1000
+) if LOOP_MONITOR_ENABLED else None
+if loop_monitor is not None:
+    app.add_middleware(LoopMonitorMiddleware, monitor=loop_monitor)
+
+# Профиль CPU по запросу (collapsed stacks для flamegraph) - /debug/profile
+profiler = SamplingProfiler(interval=PROFILE_SAMPLE_INTERVAL_MS / 1000)
+
+# Счетчик и последние updates для отладки, повторные доставки - в общем состоянии процессов.
+# Worker очереди не претендует на лидерство: webhook и backlog - забота ingest
+shared_state = create_shared_state(SHARED_STATE_URL, lead=PROCESS_ROLE != "worker")
+
+
+async def state_call(fn, *args, **kwargs):
+    """
+    Операция с общим состоянием из event loop
+
+    SQLite (BEGIN IMMEDIATE ждет блокировку других процессов до 10 с) - в
+    потоке, состояние в памяти процесса - сразу, без переключения потока.
+    """
+    if shared_state.shared:
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
+
+# Очередь updates на диске между ingest и workers (None в режиме all)
+update_queue = None
+if PROCESS_ROLE in ("ingest", "worker"):
+    update_queue = DurableQueue(
+        UPDATE_QUEUE_PATH, lease_seconds=UPDATE_QUEUE_LEASE_SECONDS, max_attempts=UPDATE_QUEUE_MAX_ATTEMPTS
+    )
+
+# Backlog, подтвержденный Telegram при выгрузке, но еще не отвеченный (режим all): переживает редеплой.
+# Строки держит один процесс (лидер) до ответа - аренда не истекает, пока он жив
+backlog_spool = None
+if PROCESS_ROLE == "all":
+    backlog_spool = DurableQueue(BACKLOG_SPOOL_PATH, lease_seconds=UPDATE_CLAIM_TTL, max_attempts=UPDATE_QUEUE_MAX_ATTEMPTS)
+BACKLOG_SPOOL_OWNER = "backlog-drain"
+
+# Защита от повторов и история LoopDetector процесса переживают редеплой (bot/checkpoint.py)
+state_checkpoint = StateCheckpoint(CHECKPOINT_PATH, max_age=UPDATE_CLAIM_TTL)
+# Сессии агента, известные Zep пользователи и история LoopDetector - и после падения (bot/warm_snapshot.py)
+warm_snapshot = WarmSnapshot(WARM_SNAPSHOT_PATH, max_age=WARM_SNAPSHOT_MAX_AGE)
+
+# Длительность шагов холодного старта (для /health/ready и логов)
+startup_report = {"phases": {}, "total_ms": None, "completed_at": None, "webhook": None}
+# Ход остановки: пока идет ожидание ответов, /health/ready отвечает 503
+shutdown_report = {"draining": False}
 
 # ✅ НОВОЕ: БД для хранения владельцев Business Connection и защита от петли
 # Заменяет глобальный словарь business_owners на персистентное хранилище
 db = None  # BusinessOwnersDB - инициализируется в startup()
-loop_detector = None  # LoopDetector - инициализируется в startup()
+loop_detector = None  # LoopDetectorRegistry (свой детектор на каждый connection) - инициализируется в startup()
+instruction_profiles = None  # InstructionProfilesDB - профили инструкций business аккаунтов
+
+# ✅ НОВОЕ: getMe кэшируется, зависимости проверяются в фоне (health check без сетевых вызовов)
+bot_identity = BotIdentityCache()
+
+
+async def probe_telegram():
+    """getMe в отдельном потоке - заодно обновляет кэш идентичности бота"""
+    bot_info = await asyncio.to_thread(bot.get_me)
+    bot_identity.update(bot_info)
+
+
+async def probe_openai():
+    if not AI_ENABLED or agent.openai_client is None:
+        return "disabled"
+    await agent.openai_client.models.list()
+
+
+async def probe_zep():
+    if not AI_ENABLED or agent.zep_client is None:
+        return "disabled"
+    await agent.zep_client.user.list_ordered(page_number=1, page_size=1)
+
+
+async def probe_sqlite():
+    if db is None:
+        return "disabled"
+    await db.ping()
+
+
+dependency_prober = DependencyProber(
+    probes={
+        "telegram": probe_telegram,
+        "openai": probe_openai,
+        "zep": probe_zep,
+        "sqlite": probe_sqlite
+    },
+    interval=HEALTH_PROBE_INTERVAL
+)
+
+# Без этих зависимостей бот не может отвечать клиентам
+READINESS_REQUIRED = ("telegram", "sqlite")
 
 @app.get("/")
 async def health_check():
-    """Health check endpoint"""
-    try:
-        bot_info = bot.get_me()
-        return {
-            "status": "🟢 ONLINE", 
-            "service": "Textile Pro Bot Webhook",
-            "bot": f"@{bot_info.username}",
-            "bot_id": bot_info.id,
-            "mode": "WEBHOOK_ONLY",
-            "ai_status": "✅ ENABLED" if AI_ENABLED else "❌ DISABLED",
-            "openai_configured": bool(os.getenv('OPENAI_API_KEY')),
-            "endpoints": {
-                "webhook_info": "/webhook/info",
-                "set_webhook": "/webhook/set",
-                "delete_webhook": "/webhook (DELETE method)",
-                "business_owners": "/debug/business-owners",
-                "last_updates": "/debug/last-updates"
-            },
-            "hint": "Используйте /webhook/set в браузере для установки webhook"
+    """Health check endpoint (без сетевых вызовов - данные из кэша)"""
+    return {
+        "status": "🟢 ONLINE",
+        "service": "Textile Pro Bot Webhook",
+        "bot": f"@{bot_identity.username}" if bot_identity.is_known else "неизвестно (getMe еще не выполнен)",
+        "bot_id": bot_identity.id,
+        "mode": "WEBHOOK_ONLY",
+        "ai_status": "✅ ENABLED" if AI_ENABLED else "❌ DISABLED",
+        "openai_configured": bool(os.getenv('OPENAI_API_KEY')),
+        "dependencies": {name: info["state"] for name, info in dependency_prober.status.items()},
+        "endpoints": {
+            "liveness": "/health/live",
+            "readiness": "/health/ready",
+            "webhook_info": "/webhook/info",
+            "set_webhook": "/webhook/set",
+            "delete_webhook": "/webhook (DELETE method)",
+            "business_owners": "/debug/business-owners",
+            "last_updates": "/debug/last-updates",
+            "workers": "/debug/workers",
+            "event_loop": "/debug/event-loop",
+            "profile": "/debug/profile?seconds=10 (X-Admin-Token)"
+        },
+        "hint": "Используйте /webhook/set в браузере для установки webhook"
+    }
+
+@app.get("/health/live")
+async def health_live():
+    """Liveness: процесс жив и event loop отвечает"""
+    return {"status": "alive", "uptime_seconds": dependency_prober.uptime_seconds()}
+
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness: закэшированный статус зависимостей от фоновой проверки"""
+    ready = dependency_prober.is_ready(READINESS_REQUIRED) and not shutdown_report["draining"]
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "not_ready",
+            "required": list(READINESS_REQUIRED),
+            "dependencies": dependency_prober.status,
+            "bot": bot_identity.to_dict(),
+            "startup": startup_report,
+            "shutdown": shutdown_report,
+            "uptime_seconds": dependency_prober.uptime_seconds()
         }
-    except Exception as e:
-        return {"status": "🔴 ERROR", "error": str(e)}
+    )
 
 @app.get("/webhook/info")
 async def webhook_info():
@@ -194,25 +441,18 @@ async def set_webhook_get():
 async def set_webhook():
     """Установка webhook"""
     try:
-        webhook_url = "https://bot-production-472c.up.railway.app/webhook"
-        
-        result = bot.set_webhook(
-            url=webhook_url,
+        result = await asyncio.to_thread(
+            bot.set_webhook,
+            url=WEBHOOK_URL,
             secret_token=WEBHOOK_SECRET_TOKEN,
-            allowed_updates=[
-                "message",
-                "business_connection", 
-                "business_message",
-                "edited_business_message",
-                "deleted_business_messages"
-            ]
+            allowed_updates=ALLOWED_UPDATES
         )
         
         if result:
-            logger.info(f"✅ Webhook установлен: {webhook_url}")
+            logger.info(f"✅ Webhook установлен: {WEBHOOK_URL}")
             return {
                 "status": "✅ SUCCESS",
-                "webhook_url": webhook_url,
+                "webhook_url": WEBHOOK_URL,
                 "secret_token": "✅ Настроен",
                 "allowed_updates": "✅ Business API включен"
             }
@@ -236,8 +476,8 @@ async def delete_webhook():
 async def get_last_updates():
     """Показать последние полученные updates для отладки"""
     return {
-        "total_received": update_counter,
-        "last_10_updates": list(last_updates),
+        "total_received": await state_call(shared_state.counter, "updates_received"),
+        "last_10_updates": await state_call(shared_state.recent, "last_updates"),
         "current_time": datetime.now().isoformat()
     }
 
@@ -256,8 +496,9 @@ async def get_zep_status():
         try:
             zep_info["zep_client_initialized"] = agent.zep_client is not None
             zep_info["memory_mode"] = "Zep Cloud" if agent.zep_client else "Local Fallback"
-            zep_info["local_sessions_count"] = len(agent.user_sessions)
-            zep_info["local_session_ids"] = list(agent.user_sessions.keys())
+            session_ids = await state_call(agent.local_session_ids)
+            zep_info["local_sessions_count"] = len(session_ids)
+            zep_info["local_session_ids"] = session_ids
         except Exception as e:
             zep_info["error"] = str(e)
     
@@ -290,8 +531,9 @@ async def get_session_memory(session_id: str):
                 memory_info["zep_error"] = str(e)
         
         # Получаем локальную память
-        if session_id in agent.user_sessions:
-            memory_info["local_memory"] = agent.user_sessions[session_id]
+        local_memory = await state_call(agent.get_local_session, session_id)
+        if local_memory:
+            memory_info["local_memory"] = local_memory
         
         return memory_info
         
@@ -326,7 +568,7 @@ async def get_loop_detector_stats():
         if loop_detector is None:
             return {"error": "Loop Detector не инициализирован"}
 
-        stats = loop_detector.get_stats()
+        stats = await state_call(loop_detector.get_stats)
         return {
             "status": "✅ АКТИВЕН",
             "stats": stats,
@@ -336,6 +578,45 @@ async def get_loop_detector_stats():
     except Exception as e:
         return {"error": str(e), "traceback": traceback.format_exc()}
 
+@app.get("/debug/profiles")
+async def get_instruction_profiles():
+    """Профили инструкций business аккаунтов и статистика кэша"""
+    if instruction_profiles is None:
+        return {"error": "Профили не инициализированы"}
+    return {
+        "profiles": await instruction_profiles.list_profiles(),
+        "cache": instruction_profiles.get_stats(),
+        "current_time": datetime.now().isoformat()
+    }
+
+@app.post("/admin/profiles/{connection_id}")
+async def save_instruction_profile(connection_id: str, request: Request):
+    """
+    Создать/обновить профиль инструкций для business аккаунта
+
+    Тело: {"name": "shop", "instruction": {"system_instruction": ..., "welcome_message": ...,
+    "assistant_name": ..., "bot_signatures": [...]}}
+    """
+    require_admin_token(request)
+    if instruction_profiles is None:
+        return {"error": "Профили не инициализированы"}
+    data = await request.json()
+    instruction = data.get("instruction")
+    if not isinstance(instruction, dict) or not instruction.get("system_instruction"):
+        raise HTTPException(status_code=400, detail="instruction.system_instruction обязателен")
+    instruction.setdefault("last_updated", datetime.now().isoformat())
+    revision = await instruction_profiles.save_profile(connection_id, instruction, name=data.get("name"))
+    return {"status": "✅ Профиль сохранен", "connection_id": connection_id, "revision": revision}
+
+@app.delete("/admin/profiles/{connection_id}")
+async def delete_instruction_profile(connection_id: str, request: Request):
+    """Удалить профиль: аккаунт вернется к общему instruction.json"""
+    require_admin_token(request)
+    if instruction_profiles is None:
+        return {"error": "Профили не инициализированы"}
+    deleted = await instruction_profiles.delete_profile(connection_id)
+    return {"status": "✅ Профиль удален" if deleted else "ℹ️ Профиль не найден", "connection_id": connection_id}
+
 @app.post("/test/business-send")
 async def test_business_send(request: Request):
     """Тестовая отправка через Business API"""
@@ -361,6 +642,94 @@ async def test_business_send(request: Request):
     except Exception as e:
         return {"error": str(e), "traceback": traceback.format_exc()}
 
+def require_admin_token(request: Request):
+    """
+    Проверка X-Admin-Token для admin endpoints
+
+    Без ADMIN_API_TOKEN endpoints закрыты (503): иначе изменять инструкции и
+    снимать профиль мог бы любой, кому доступен URL бота.
+    """
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=503, detail="ADMIN_API_TOKEN не задан - admin endpoints отключены")
+    token = request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), ADMIN_API_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Неверный X-Admin-Token")
+
+@app.get("/admin/instructions")
+async def list_instruction_versions(request: Request, limit: int = 50):
+    """Версии инструкций, журнал публикаций/откатов и активная версия"""
+    require_admin_token(request)
+    if instruction_store is None:
+        return {"error": "Хранилище версий не инициализировано"}
+    versions, history = await asyncio.gather(
+        asyncio.to_thread(instruction_store.list_versions, limit),
+        asyncio.to_thread(instruction_store.history)
+    )
+    return {
+        "active": agent.prompt.to_dict(),
+        "versions": versions,
+        "history": history,
+        "watcher": instruction_store_watcher.get_stats() if instruction_store_watcher else None
+    }
+
+@app.get("/admin/instructions/active")
+async def get_active_instruction(request: Request):
+    """Полный текст активной версии (для редактора в админ панели)"""
+    require_admin_token(request)
+    if not AI_ENABLED:
+        return {"error": "AI не включен"}
+    prompt = agent.prompt
+    return {"version": prompt.version, "instruction": prompt.instruction}
+
+@app.post("/admin/instructions")
+async def publish_instruction(request: Request):
+    """
+    Опубликовать новую версию инструкций (применяется сразу, без деплоя)
+
+    Тело: {"instruction": {"system_instruction": ..., "welcome_message": ...}, "author": ..., "comment": ...}
+    """
+    require_admin_token(request)
+    if instruction_store is None:
+        return {"error": "Хранилище версий не инициализировано"}
+    data = await request.json()
+    instruction = data.get("instruction")
+    if not isinstance(instruction, dict) or not instruction.get("system_instruction"):
+        raise HTTPException(status_code=400, detail="instruction.system_instruction обязателен")
+    instruction.setdefault("last_updated", datetime.now().isoformat())
+
+    old_version = agent.prompt.version
+    version_hash, _activated = await asyncio.to_thread(
+        instruction_store.publish, instruction, data.get("author"), data.get("comment")
+    )
+    changed = await apply_store_version(version_hash)
+    return {
+        "status": "✅ Инструкции опубликованы" if changed else "ℹ️ Эта версия уже активна",
+        "old_version": old_version,
+        "new_version": agent.prompt.version,
+        "changed": changed
+    }
+
+@app.post("/admin/instructions/{version}/activate")
+async def activate_instruction_version(version: str, request: Request):
+    """Сделать активной ранее сохраненную версию (откат)"""
+    require_admin_token(request)
+    if instruction_store is None:
+        return {"error": "Хранилище версий не инициализировано"}
+    author = request.headers.get("X-Admin-User")
+    old_version = agent.prompt.version
+    try:
+        await asyncio.to_thread(instruction_store.activate, version, author)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    version_hash = await asyncio.to_thread(instruction_store.resolve, version)
+    changed = await apply_store_version(version_hash)
+    return {
+        "status": "✅ Версия активирована" if changed else "ℹ️ Эта версия уже активна",
+        "old_version": old_version,
+        "new_version": agent.prompt.version,
+        "changed": changed
+    }
+
 @app.get("/debug/prompt")
 async def get_prompt_status():
     """Получить текущий промпт и статус инструкций"""
@@ -368,17 +737,21 @@ async def get_prompt_status():
         return {"error": "AI не включен"}
     
     try:
+        prompt = agent.prompt
         prompt_info = {
-            "instruction_file": agent.instruction,
-            "last_updated": agent.instruction.get('last_updated', 'неизвестно'),
-            "system_instruction_length": len(agent.instruction.get('system_instruction', '')),
-            "welcome_message_length": len(agent.instruction.get('welcome_message', '')),
+            "instruction_file": prompt.instruction,
+            "version": prompt.to_dict(),
+            "last_updated": prompt.get('last_updated', 'неизвестно'),
+            "system_instruction_length": len(prompt.get('system_instruction', '')),
+            "welcome_message_length": len(prompt.get('welcome_message', '')),
+            "watcher": instruction_watcher.get_stats() if instruction_watcher else None,
+            "store_watcher": instruction_store_watcher.get_stats() if instruction_store_watcher else None,
             "current_time": datetime.now().isoformat(),
             "status": "✅ Активен"
         }
         
         # Показываем первые 200 символов системной инструкции
-        system_instruction = agent.instruction.get('system_instruction', '')
+        system_instruction = prompt.get('system_instruction', '')
         if system_instruction:
             prompt_info["system_instruction_preview"] = system_instruction[:200] + "..." if len(system_instruction) > 200 else system_instruction
         
@@ -388,21 +761,35 @@ async def get_prompt_status():
         return {"error": str(e), "traceback": traceback.format_exc()}
 
 @app.post("/admin/reload-prompt")
-async def reload_prompt():
-    """Перезагрузить промпт из файла (для админ панели)"""
+async def reload_prompt(request: Request):
+    """
+    Перечитать активную версию инструкций (для админ панели; обычно изменения подхватываются сами)
+
+    С хранилищем версий применяется его активная версия: instruction.json
+    импортируется, только если такого содержимого еще не было, поэтому
+    перезагрузка не отменяет публикацию или откат из админ панели.
+    """
+    require_admin_token(request)
     if not AI_ENABLED:
         return {"error": "AI не включен"}
     
     try:
-        old_updated = agent.instruction.get('last_updated', 'неизвестно')
-        agent.reload_instruction()
-        new_updated = agent.instruction.get('last_updated', 'неизвестно')
+        old_prompt = agent.prompt
+        # Чтение и разбор файла - в потоке, чтобы не блокировать обработку сообщений
+        if instruction_store is not None:
+            snapshot = await asyncio.to_thread(load_prompt_file, INSTRUCTION_FILE)
+            changed = await publish_file_prompt(snapshot)
+        else:
+            changed = await asyncio.to_thread(agent.reload_instruction)
+        new_prompt = agent.prompt
         
         return {
             "status": "✅ Промпт перезагружен",
-            "old_updated": old_updated,
-            "new_updated": new_updated,
-            "changed": old_updated != new_updated,
+            "old_updated": old_prompt.get('last_updated', 'неизвестно'),
+            "new_updated": new_prompt.get('last_updated', 'неизвестно'),
+            "old_version": old_prompt.version,
+            "new_version": new_prompt.version,
+            "changed": changed,
             "current_time": datetime.now().isoformat()
         }
         
@@ -410,104 +797,94 @@ async def reload_prompt():
         logger.error(f"❌ Ошибка перезагрузки промпта: {e}")
         return {"error": str(e), "traceback": traceback.format_exc()}
 
-def has_attachments(message):
-    """Проверяет наличие вложений в сообщении и извлекает их метаданные"""
-    attachment_types = [
-        'photo', 'document', 'video', 'audio', 'voice', 'video_note',
-        'sticker', 'animation', 'contact', 'location', 'venue', 'poll'
-    ]
-    
-    attachments_found = []
-    attachments_details = []
-    
-    for attachment_type in attachment_types:
-        if attachment_type in message:
-            attachments_found.append(attachment_type)
-            
-            # Извлекаем детальную информацию о вложении
-            attachment_data = message[attachment_type]
-            detail = {"type": attachment_type}
-            
-            # Для разных типов вложений извлекаем разную информацию
-            if attachment_type == 'photo':
-                # Фото может быть массивом разных размеров
-                if isinstance(attachment_data, list) and len(attachment_data) > 0:
-                    largest_photo = max(attachment_data, key=lambda x: x.get('file_size', 0))
-                    detail.update({
-                        "file_id": largest_photo.get('file_id'),
-                        "file_size": largest_photo.get('file_size'),
-                        "width": largest_photo.get('width'),
-                        "height": largest_photo.get('height')
-                    })
-            elif attachment_type == 'document':
-                detail.update({
-                    "file_id": attachment_data.get('file_id'),
-                    "file_name": attachment_data.get('file_name'),
-                    "file_size": attachment_data.get('file_size'),
-                    "mime_type": attachment_data.get('mime_type')
-                })
-            elif attachment_type in ['video', 'audio', 'voice', 'video_note']:
-                detail.update({
-                    "file_id": attachment_data.get('file_id'),
-                    "file_size": attachment_data.get('file_size'),
-                    "duration": attachment_data.get('duration')
-                })
-                if attachment_type == 'video':
-                    detail.update({
-                        "width": attachment_data.get('width'),
-                        "height": attachment_data.get('height')
-                    })
-            elif attachment_type == 'sticker':
-                detail.update({
-                    "file_id": attachment_data.get('file_id'),
-                    "width": attachment_data.get('width'),
-                    "height": attachment_data.get('height'),
-                    "emoji": attachment_data.get('emoji')
-                })
-            elif attachment_type == 'contact':
-                detail.update({
-                    "phone_number": attachment_data.get('phone_number'),
-                    "first_name": attachment_data.get('first_name'),
-                    "last_name": attachment_data.get('last_name')
-                })
-            elif attachment_type == 'location':
-                detail.update({
-                    "latitude": attachment_data.get('latitude'),
-                    "longitude": attachment_data.get('longitude')
-                })
-            else:
-                # Для других типов просто сохраняем file_id если есть
-                if hasattr(attachment_data, 'get') and attachment_data.get('file_id'):
-                    detail["file_id"] = attachment_data.get('file_id')
-            
-            attachments_details.append(detail)
-    
-    return attachments_found, attachments_details
+def accept_update(claim_key, debug_update):
+    """
+    Прием update в общем состоянии: повтор, счетчик и последние updates (блокирующий - через state_call)
+
+    Returns:
+        Номер update или None, если update уже принят (повторная доставка)
+    """
+    if claim_key and not shared_state.claim(claim_key, UPDATE_CLAIM_TTL):
+        return None
+    update_number = shared_state.incr("updates_received")
+    shared_state.push_recent("last_updates", {"id": update_number, **debug_update}, maxlen=10)
+    return update_number
+
+
+def classify_update(update):
+    """(chat_key, stale_action, age_minutes): connections и другие события по возрасту не фильтруются"""
+    if update.kind not in ("message", "business_message"):
+        return None, None, 0.0
+    msg = update.message
+    # connection_id в ключе: один клиент может писать в несколько business аккаунтов
+    chat_key = (update.kind, msg.chat_id, msg.business_connection_id)
+    if not msg.date:
+        return chat_key, None, 0.0
+    stale_action, age_minutes = stale_policy.classify(msg.date)
+    return chat_key, stale_action, age_minutes
+
+
+def update_chat_ref(update):
+    """Чат update для очереди на диске: сообщения, правки и удаления одного чата идут в один worker"""
+    if update.message is not None:
+        return chat_ref_key(update.message.chat_id, update.message.business_connection_id)
+    if update.deleted_messages is not None:
+        return chat_ref_key(update.deleted_messages.chat_id, update.deleted_messages.business_connection_id)
+    return None
+
+
+def dispatch_update(update, chat_key, stale_action, age_minutes, queue_id=None, attempt=1):
+    """
+    Передает проверенный update на обработку (webhook в режиме all или worker очереди)
+
+    Returns:
+        dict со статусом; None если пул переполнен
+    """
+    message_type = update.kind
+
+    # Правки и удаления применяются сразу, без очереди: они должны успеть
+    # отменить работу, которая стоит в очереди или уже выполняется
+    if message_type == "edited_business_message":
+        return handle_edited_business_message(update.message)
+    if message_type == "deleted_business_messages":
+        return handle_deleted_business_messages(update.deleted_messages)
+    if stale_action == STALE_SKIP:
+        return {"ok": True, "status": "skipped_stale_message", "age_minutes": round(age_minutes, 1)}
+
+    job = UpdateJob(
+        update=update.raw,
+        kind=message_type,
+        chat_key=chat_key,
+        stale_action=stale_action,
+        age_minutes=age_minutes
+    )
+    if queue_id is not None:
+        job.queue_ids.append(queue_id)
+        job.attempt = attempt
+
+    # Накопившиеся сообщения одного отправителя склеиваем в один вопрос
+    if stale_action == STALE_SUMMARISE:
+        sender_id = update.message.user_id
+        logger.info(f"⏰ Старое сообщение ({message_type}, {age_minutes:.1f} мин) - буферизуем для склейки")
+        pending_messages.track(job)
+        stale_coalescer.add((chat_key, sender_id), job)
+        return {"ok": True, "status": "buffered_stale_message"}
+
+    if not submit_update_job(job):
+        return None
+    return {"ok": True, "status": "queued"}
 
-def is_message_too_old(message_timestamp, max_age_minutes=5):
-    """Проверка, не слишком ли старое сообщение для обработки"""
-    if not message_timestamp:
-        return False
-    
-    from datetime import datetime, timezone
-    try:
-        # Текущее время в UTC
-        now = datetime.now(timezone.utc)
-        # Время сообщения (timestamp в секундах)
-        message_time = datetime.fromtimestamp(message_timestamp, tz=timezone.utc)
-        
-        # Разница в минутах
-        age_minutes = (now - message_time).total_seconds() / 60
-        
-        return age_minutes > max_age_minutes
-    except Exception as e:
-        logger.warning(f"⚠️ Ошибка проверки времени сообщения: {e}")
-        return False
 
 @app.post("/webhook")
 async def process_webhook(request: Request):
-    """Главный обработчик webhook"""
-    global update_counter
+    """
+    Главный обработчик webhook
+
+    Только проверяет, классифицирует и ставит update в очередь пула воркеров.
+    Telegram получает ответ сразу, поэтому backlog после деплоя выгружается
+    быстро, а не по одному update на каждый вызов OpenAI. В роли ingest
+    update пишется в очередь на диске, и его обрабатывает worker процесс.
+    """
     try:
         # Проверяем secret token из заголовков
         secret_token = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
@@ -516,535 +893,1417 @@ async def process_webhook(request: Request):
             return {"ok": False, "error": "Invalid secret token"}
         
         json_data = await request.body()
-        json_string = json_data.decode('utf-8')
         
-        logger.info(f"📨 Webhook получен: {json_string[:150]}...")
+        # Для лога декодируем только начало тела, а не весь update
+        logger.info(f"📨 Webhook получен: {json_data[:150].decode('utf-8', 'replace')}...")
         print(f"📨 Обработка webhook update...")
         
-        update_dict = json.loads(json_string)
-        
-        # Проверяем возраст сообщения для фильтрации старых обновлений
-        message_timestamp = None
-        message_type = "unknown"
-        
-        if "message" in update_dict:
-            message_timestamp = update_dict["message"].get("date")
-            message_type = "message"
-        elif "business_message" in update_dict:
-            message_timestamp = update_dict["business_message"].get("date")
-            message_type = "business_message"
-        
-        # Фильтруем старые сообщения (но обрабатываем connections и другие события)
-        if message_timestamp and is_message_too_old(message_timestamp):
-            age_minutes = (datetime.now().timestamp() - message_timestamp) / 60
-            logger.info(f"⏰ Пропускаем старое сообщение ({message_type}): возраст {age_minutes:.1f} мин")
-            return {"ok": True, "status": "ignored_old_message", "age_minutes": round(age_minutes, 1)}
+        update = parse_update(json_data)
+        update_dict = update.raw
+        message_type = update.kind
+
+        chat_key, stale_action, age_minutes = classify_update(update)
         
         # Сохраняем update для отладки
-        update_counter += 1
         debug_update = {
-            "id": update_counter,
             "timestamp": datetime.now().isoformat(),
-            "type": "unknown",
+            "type": update.type_label,
             "data": update_dict
         }
         
-        # Определяем тип update
-        if "message" in update_dict:
-            debug_update["type"] = "message"
-        elif "business_message" in update_dict:
-            debug_update["type"] = "business_message"
-        elif "business_connection" in update_dict:
-            debug_update["type"] = "business_connection"
-        elif "edited_business_message" in update_dict:
-            debug_update["type"] = "edited_business_message"
-        elif "deleted_business_messages" in update_dict:
-            debug_update["type"] = "deleted_business_messages"
-        else:
-            debug_update["type"] = f"other: {list(update_dict.keys())}"
-            
-        last_updates.append(debug_update)
-        logger.info(f"📊 Update #{update_counter} тип: {debug_update['type']}")
+        if stale_action and stale_action != STALE_ANSWER:
+            debug_update["stale"] = {"action": stale_action, "age_minutes": round(age_minutes, 1)}
         
-        # === ОБЫЧНЫЕ СООБЩЕНИЯ ===
-        if "message" in update_dict:
-            msg = update_dict["message"]
-            chat_id = msg["chat"]["id"]
-            # Извлекаем текст из text или caption (для изображений и медиафайлов)
-            text = msg.get("text", "") or msg.get("caption", "")
-            user_id = msg.get("from", {}).get("id", "unknown")
-            user_name = msg.get("from", {}).get("first_name", "Пользователь")
-            
-            # Проверяем наличие вложений
-            attachments, attachments_details = has_attachments(msg)
-            
-            try:
-                # Логируем информацию о сообщении
-                if attachments:
-                    logger.info(f"📎 Сообщение с вложениями: {attachments}, текст: '{text}'")
-                    logger.info(f"📋 Источник текста: {'text' if msg.get('text') else 'caption' if msg.get('caption') else 'none'}")
-                    # Детальное логирование вложений
-                    for detail in attachments_details:
-                        logger.info(f"   📄 {detail['type']}: {detail}")
-                
-                # Если есть только вложения без текста - спрашиваем пользователя
-                if attachments and not text:
-                    logger.info(f"📝 Получено вложение от {user_name} без текста - спрашиваем что в вложении")
-                    
-                    # Формируем сообщение в зависимости от типа вложения
-                    attachment_types_ru = {
-                        'photo': 'фотографию',
-                        'document': 'документ',
-                        'video': 'видео',
-                        'audio': 'аудио',
-                        'voice': 'голосовое сообщение',
-                        'video_note': 'видеосообщение',
-                        'sticker': 'стикер',
-                        'animation': 'анимацию',
-                        'contact': 'контакт',
-                        'location': 'местоположение',
-                        'venue': 'место',
-                        'poll': 'опрос'
-                    }
-                    
-                    attachment_names = [attachment_types_ru.get(att, att) for att in attachments]
-                    
-                    if len(attachments) == 1:
-                        # Особый ответ для фото
-                        if attachments[0] == 'photo':
-                            response = "Фото увидела. Прокомментируйте, пожалуйста, что именно сейчас отправили?"
-                        else:
-                            response = "Вложение получила. Прокомментируйте, пожалуйста, что именно сейчас отправили?"
-                    else:
-                        response = "Вложения получила. Прокомментируйте, пожалуйста, что именно сейчас отправили?"
-                    
-                    # Отправляем ответ
-                    bot.send_message(chat_id, response)
-                    logger.info(f"✅ Отправлен запрос о вложении пользователю {user_name}")
-                    return {"ok": True, "action": "asked_about_attachment"}
-                
-                # Пытаемся отправить индикатор набора текста
-                try:
-                    bot.send_chat_action(chat_id, 'typing')
-                except Exception as typing_error:
-                    logger.warning(f"⚠️ Не удалось отправить typing индикатор: {typing_error}")
-                
-                # Обрабатываем команды
-                if text.startswith("/start"):
-                    if AI_ENABLED:
-                        response = agent.get_welcome_message()
-                    else:
-                        response = f"👋 Привет, {user_name}! Меня зовут Елена, я менеджер компании Textile Pro.\n\nКакой у вас вопрос?"
-                
-                elif text.startswith("/help"):
-                    response = """ℹ️ Помощь:
+        # Повторная доставка (таймаут ответа, другой worker уже принял update) - не обрабатываем дважды
+        claim_key = f"update:{update.update_id}" if update.update_id is not None else None
+        update_number = await state_call(accept_update, claim_key, debug_update)
+        if update_number is None:
+            logger.info(f"🔁 Update {update.update_id} уже принят - повтор пропущен")
+            return {"ok": True, "status": "duplicate_update"}
+        logger.info(f"📊 Update #{update_number} тип: {debug_update['type']}")
+        
+        # Слишком старые сообщения не отвечаем, но учитываем (stale_policy.counters + last_updates)
+        if stale_action == STALE_SKIP:
+            logger.info(f"⏰ Пропускаем очень старое сообщение ({message_type}): возраст {age_minutes:.1f} мин")
+            return {"ok": True, "status": "skipped_stale_message", "age_minutes": round(age_minutes, 1)}
+        
+        # Роль ingest: тело update на диск, обработает worker (правки и удаления - тоже, по порядку чата)
+        if update_queue is not None:
+            await asyncio.to_thread(update_queue.put, json_data, update_id=update.update_id, chat_ref=update_chat_ref(update))
+            return {"ok": True, "status": "enqueued", "update_id": update_number}
+        
+        result = dispatch_update(update, chat_key, stale_action, age_minutes)
+        if result is None:
+            # Telegram повторит доставку позже
+            if claim_key:
+                await state_call(shared_state.release, claim_key)
+            return JSONResponse(status_code=503, content={"ok": False, "error": "queue_full"})
+        result.setdefault("update_id", update_number)
+        return result
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка webhook: {e}")
+        return {"ok": False, "error": str(e)}
+
+
+def stale_note(job):
+    """Пояснение для AI, если сообщение пролежало в очереди (деплой/сбой) или их несколько"""
+    if job.stale_action != STALE_SUMMARISE:
+        if job.merged_count > 1:
+            return "Клиент написал несколько сообщений подряд. Ответь на все вопросы одним сообщением."
+        return ""
+    count_note = f" ({job.merged_count} сообщений подряд)" if job.merged_count > 1 else ""
+    return (
+        f"Клиент написал это {job.age_minutes:.0f} мин назад{count_note}, пока бот был недоступен. "
+        f"Ответь на все вопросы одним сообщением и коротко извинись за задержку."
+    )
+
+
+async def handle_update(job):
+    """Обработка update воркером пула"""
+    update = ParsedUpdate(job.update)
+
+    # === ОБЫЧНЫЕ СООБЩЕНИЯ ===
+    if update.kind == "message":
+        return await handle_message(update.message, job)
+
+    # === BUSINESS СООБЩЕНИЯ ===
+    elif update.kind == "business_message":
+        return await handle_business_message(update.message, job)
+
+    # === BUSINESS CONNECTION ===
+    elif update.kind == "business_connection":
+        return await handle_business_connection(update.business_connection)
+
+    # === ПРАВКИ И УДАЛЕНИЯ (при выгрузке backlog) ===
+    elif update.kind == "edited_business_message":
+        return handle_edited_business_message(update.message)
+
+    elif update.kind == "deleted_business_messages":
+        return handle_deleted_business_messages(update.deleted_messages)
+
+    return {"ok": True, "status": "processed"}
+
+
+async def handle_message(msg, job):
+    """Обычное сообщение боту (msg - MessageView)"""
+    chat_id = msg.chat_id
+    # Текст из text или caption (для изображений и медиафайлов)
+    text = msg.text
+    user_id = msg.user_id
+    user_name = msg.user_name
+
+    # Проверяем наличие вложений
+    attachments, attachments_details = has_attachments(msg.data)
+    typing = typing_keepalive(chat_id)
+
+    try:
+        # Логируем информацию о сообщении
+        if attachments:
+            logger.info(f"📎 Сообщение с вложениями: {attachments}, текст: '{text}'")
+            logger.info(f"📋 Источник текста: {msg.text_source}")
+            # Детальное логирование вложений
+            for detail in attachments_details:
+                logger.info(f"   📄 {detail['type']}: {detail}")
+
+        # Если есть только вложения без текста - спрашиваем пользователя
+        if attachments and not text:
+            logger.info(f"📝 Получено вложение от {user_name} без текста - спрашиваем что в вложении")
+
+            # Формируем сообщение в зависимости от типа вложения
+            response = attachment_reply_text(attachments)
+
+            # Отправляем ответ
+            await asyncio.to_thread(bot.send_message, chat_id, response)
+            logger.info(f"✅ Отправлен запрос о вложении пользователю {user_name}")
+            return {"ok": True, "action": "asked_about_attachment"}
+
+        # Индикатор набора текста обновляется в фоне, пока ответ не отправлен
+        typing.start()
+
+        # Обрабатываем команды
+        if text.startswith("/start"):
+            if AI_ENABLED:
+                response = agent.get_welcome_message()
+            else:
+                response = f"👋 Привет, {user_name}! Меня зовут Елена, я менеджер компании Textile Pro.\n\nКакой у вас вопрос?"
+
+        elif text.startswith("/help"):
+            response = """ℹ️ Помощь:
 /start - начать работу
 /help - показать помощь
 
 Просто напишите ваш вопрос о текстильном производстве, и я с радостью помогу!
 
 📞 Для срочных вопросов: +86 123 456 789"""
-                
-                # Если есть текст (с вложениями или без) - обрабатываем через AI
-                elif text and AI_ENABLED:
-                    try:
-                        session_id = f"user_{user_id}"
-                        # Создаем пользователя в Zep если нужно
-                        if agent.zep_client:
-                            await agent.ensure_user_exists(f"user_{user_id}", {
-                                'first_name': user_name,
-                                'email': f'{user_id}@telegram.user'
-                            })
-                            await agent.ensure_session_exists(session_id, f"user_{user_id}")
-                        response = await agent.generate_response(text, session_id, user_name)
-                        
-                        # Дополнительное логирование для случая с вложениями
-                        if attachments:
-                            logger.info(f"✅ AI ответил на текст с вложениями: {attachments}")
-                            for detail in attachments_details:
-                                logger.info(f"   📄 Обработано вложение {detail['type']}: {detail}")
-                        
-                    except Exception as ai_error:
-                        logger.error(f"Ошибка AI генерации: {ai_error}")
-                        response = f"Извините, произошла техническая ошибка. Попробуйте позже или напишите вопрос снова.\n\nПо любым срочным вопросам обращайтесь напрямую.\n\nЕлена, Textile Pro"
-                    
-                elif text:
-                    # Fallback если AI не доступен
-                    response = f"👋 {user_name}, получила ваш вопрос!\n\nПодготовлю детальный ответ по текстильному производству. Минуточку!\n\nЕлена, Textile Pro"
-                else:
-                    # Этот случай не должен происходить из-за проверки выше
-                    logger.warning(f"⚠️ Неожиданный случай: нет текста и нет вложений")
-                    return {"ok": True, "action": "no_action"}
-                    
-                # Отправляем ответ
-                bot.send_message(chat_id, response)
-                logger.info(f"✅ Ответ отправлен в чат {chat_id}")
-                print(f"✅ Отправлен ответ пользователю {user_name}")
-                
-            except Exception as e:
-                logger.error(f"Ошибка обработки сообщения: {e}")
-                bot.send_message(chat_id, "Извините, произошла непредвиденная ошибка. Попробуйте написать снова.\n\nЕлена, Textile Pro")
-        
-        # === BUSINESS СООБЩЕНИЯ ===
-        elif "business_message" in update_dict:
-            bus_msg = update_dict["business_message"]
-            
-            # Детальное логирование структуры business_message
-            logger.info(f"📨 Business message полная структура: {json.dumps(bus_msg, ensure_ascii=False)[:500]}...")
-            
-            chat_id = bus_msg["chat"]["id"]
-            # Извлекаем текст из text или caption (для изображений и медиафайлов)
-            text = bus_msg.get("text", "") or bus_msg.get("caption", "")
-            user_id = bus_msg.get("from", {}).get("id", "unknown")
-            business_connection_id = bus_msg.get("business_connection_id")
-            user_name = bus_msg.get("from", {}).get("first_name", "Клиент")
-            
-            # Логируем business_connection_id для отладки
-            logger.info(f"📊 Business message - connection_id: '{business_connection_id}' (тип: {type(business_connection_id)})")
-            logger.info(f"👤 Сообщение от: {user_name} (ID: {user_id})")
-            
-            # Проверяем наличие business_connection_id
-            if not business_connection_id:
-                logger.warning(f"⚠️ Business message без connection_id от {user_name} ({user_id})")
-
-            # 🚫 КРИТИЧНАЯ ПРОВЕРКА #1: Игнорируем сообщения от владельца аккаунта (БД)
-            if business_connection_id and db is not None:
-                is_owner = await db.is_owner_message(business_connection_id, user_id)
-                if is_owner:
-                    logger.info(f"🚫 ИГНОРИРУЕМ сообщение от владельца аккаунта: {user_name} (ID: {user_id})")
-                    logger.info(f"💬 Текст сообщения: '{text[:100]}{'...' if len(text) > 100 else ''}'")
-                    return {"ok": True, "action": "ignored_owner_message", "reason": "message_from_business_owner"}
-                else:
-                    logger.info(f"✅ ОБРАБАТЫВАЕМ сообщение от клиента: {user_name} (ID: {user_id})")
+
+        # Если есть текст (с вложениями или без) - обрабатываем через AI
+        elif text and AI_ENABLED:
+            try:
+                session_id = f"user_{user_id}"
+                # Создаем пользователя в Zep если нужно
+                if agent.zep_client:
+                    await agent.ensure_user_exists(f"user_{user_id}", {
+                        'first_name': user_name,
+                        'email': f'{user_id}@telegram.user'
+                    })
+                    await agent.ensure_session_exists(session_id, f"user_{user_id}")
+                response = await agent.generate_response(
+                    text, session_id, user_name, extra_instructions=stale_note(job), trace=job.trace
+                )
+
+                # Дополнительное логирование для случая с вложениями
+                if attachments:
+                    logger.info(f"✅ AI ответил на текст с вложениями: {attachments}")
+                    for detail in attachments_details:
+                        logger.info(f"   📄 Обработано вложение {detail['type']}: {detail}")
+
+            except Exception as ai_error:
+                logger.error(f"Ошибка AI генерации: {ai_error}")
+                response = f"Извините, произошла техническая ошибка. Попробуйте позже или напишите вопрос снова.\n\nПо любым срочным вопросам обращайтесь напрямую.\n\nЕлена, Textile Pro"
+
+        elif text:
+            # Fallback если AI не доступен
+            response = f"👋 {user_name}, получила ваш вопрос!\n\nПодготовлю детальный ответ по текстильному производству. Минуточку!\n\nЕлена, Textile Pro"
+        else:
+            # Этот случай не должен происходить из-за проверки выше
+            logger.warning(f"⚠️ Неожиданный случай: нет текста и нет вложений")
+            return {"ok": True, "action": "no_action"}
+
+        # Отправляем ответ (индикатор гаснет до него: запоздавший sendChatAction включил бы его снова)
+        await typing.finish()
+        started = time.perf_counter()
+        await asyncio.to_thread(bot.send_message, chat_id, response)
+        job.trace['send_ms'] = (time.perf_counter() - started) * 1000
+        logger.info(f"✅ Ответ отправлен в чат {chat_id}")
+        print(f"✅ Отправлен ответ пользователю {user_name}")
+
+    except Exception as e:
+        logger.error(f"Ошибка обработки сообщения: {e}")
+        await asyncio.to_thread(bot.send_message, chat_id, "Извините, произошла непредвиденная ошибка. Попробуйте написать снова.\n\nЕлена, Textile Pro")
+    finally:
+        typing.stop()
+
+    return {"ok": True, "action": "answered"}
+
+
+async def handle_business_message(bus_msg, job):
+    """Сообщение клиента через Business API (bus_msg - MessageView)"""
+
+    # Детальное логирование структуры business_message
+    logger.info(f"📨 Business message полная структура: {json.dumps(bus_msg.data, ensure_ascii=False)[:500]}...")
+
+    chat_id = bus_msg.chat_id
+    # Текст из text или caption (для изображений и медиафайлов)
+    text = bus_msg.text
+    user_id = bus_msg.user_id
+    business_connection_id = bus_msg.business_connection_id
+    user_name = bus_msg.user_name
+
+    # Логируем business_connection_id для отладки
+    logger.info(f"📊 Business message - connection_id: '{business_connection_id}' (тип: {type(business_connection_id)})")
+    logger.info(f"👤 Сообщение от: {user_name} (ID: {user_id})")
+
+    # Проверяем наличие business_connection_id
+    if not business_connection_id:
+        logger.warning(f"⚠️ Business message без connection_id от {user_name} ({user_id})")
+
+    # 🚫 КРИТИЧНАЯ ПРОВЕРКА #1: Игнорируем сообщения от владельца аккаунта (БД)
+    if business_connection_id and db is not None:
+        started = time.perf_counter()
+        is_owner = await db.is_owner_message(business_connection_id, user_id)
+        job.trace['owner_check_ms'] = (time.perf_counter() - started) * 1000
+        if is_owner:
+            logger.info(f"🚫 ИГНОРИРУЕМ сообщение от владельца аккаунта: {user_name} (ID: {user_id})")
+            logger.info(f"💬 Текст сообщения: '{text[:100]}{'...' if len(text) > 100 else ''}'")
+            return {"ok": True, "action": "ignored_owner_message", "reason": "message_from_business_owner"}
+        else:
+            logger.info(f"✅ ОБРАБАТЫВАЕМ сообщение от клиента: {user_name} (ID: {user_id})")
+    else:
+        # Если БД не доступна, предупреждаем
+        if db is None:
+            logger.error(f"❌ КРИТИЧНО: БД не инициализирована, фильтрация владельца НЕ РАБОТАЕТ!")
+        else:
+            logger.warning(f"⚠️ Business message без connection_id, невозможно проверить владельца")
+
+    # Профиль инструкций business аккаунта (None - общий instruction.json)
+    profile = None
+    if business_connection_id and instruction_profiles is not None:
+        profile = await instruction_profiles.get_profile(business_connection_id)
+
+    # Детектор петли - свой для каждого business аккаунта (история и подписи бота)
+    detector = None
+    if loop_detector is not None:
+        detector = loop_detector.get(business_connection_id, profile.bot_signatures if profile else None)
+
+    # 🚫 КРИТИЧНАЯ ПРОВЕРКА #2: Защита от бесконечной петли
+    if detector is not None and text:
+        started = time.perf_counter()
+        should_ignore, reason = await state_call(
+            detector.should_ignore_message,
+            text=text,
+            chat_id=chat_id,
+            user_id=user_id,
+            from_business_api=True,
+            # Накопившиеся и перезапущенные после правки сообщения не проверяем на частоту
+            check_rate=job.stale_action != STALE_SUMMARISE and job.regenerations == 0 and job.merged_count == 1 and job.attempt == 1,
+            check_duplicate=job.attempt == 1
+        )
+        job.trace['loop_check_ms'] = (time.perf_counter() - started) * 1000
+        if should_ignore:
+            logger.warning(f"🚫 LOOP DETECTED: Игнорируем сообщение по причине: {reason}")
+            logger.info(f"💬 Текст сообщения: '{text[:100]}{'...' if len(text) > 100 else ''}'")
+            return {"ok": True, "action": "ignored_loop_detected", "reason": reason}
+
+    # Проверяем наличие вложений в business сообщении
+    attachments, attachments_details = has_attachments(bus_msg.data)
+
+    # Логируем информацию о сообщении
+    if attachments:
+        logger.info(f"📎 Business сообщение с вложениями: {attachments}, текст: '{text}'")
+        logger.info(f"📋 Источник текста: {bus_msg.text_source}")
+        # Детальное логирование вложений
+        for detail in attachments_details:
+            logger.info(f"   📄 {detail['type']}: {detail}")
+
+    # Если есть только вложения без текста - спрашиваем пользователя
+    if attachments and not text:
+        logger.info(f"📝 Получено business вложение от {user_name} без текста - спрашиваем что в вложении")
+
+        # Формируем сообщение в зависимости от типа вложения
+        response = attachment_reply_text(attachments)
+
+        # Отправляем ответ через Business API (только для клиентов, не владельцев)
+        if business_connection_id:
+            result = await asyncio.to_thread(send_business_message, chat_id, response, business_connection_id)
+            if result:
+                logger.info(f"✅ Отправлен запрос о business вложении клиенту {user_name}")
             else:
-                # Если БД не доступна, предупреждаем
-                if db is None:
-                    logger.error(f"❌ КРИТИЧНО: БД не инициализирована, фильтрация владельца НЕ РАБОТАЕТ!")
+                logger.error(f"❌ Не удалось отправить запрос о business вложении")
+                # Fallback: отправляем обычное сообщение
+                await asyncio.to_thread(bot.send_message, chat_id, response)
+                logger.warning(f"⚠️ Запрос о вложении отправлен как обычное сообщение (fallback)")
+        else:
+            # Fallback: если нет connection_id
+            await asyncio.to_thread(bot.send_message, chat_id, response)
+            logger.warning(f"⚠️ Запрос о business вложении отправлен БЕЗ Business API (нет connection_id)")
+
+        return {"ok": True, "action": "asked_about_business_attachment"}
+
+    # Обрабатываем business сообщения с текстом (с вложениями или без)
+    # Проверяем, что это НЕ сообщение от владельца (дополнительная проверка)
+    if text:
+        # Индикатор набора текста от имени владельца (business_connection_id), обновляется в фоне
+        typing = typing_keepalive(chat_id, business_connection_id)
+        try:
+            logger.info(f"🔄 Начинаю обработку business message: text='{text}', chat_id={chat_id}")
+            typing.start()
+
+            if AI_ENABLED:
+                # Используем AI для Business сообщений
+                logger.info(f"🤖 AI включен, генерирую ответ...")
+                # Память клиента отдельная для каждого business аккаунта
+                legacy_session_id = None
+                if business_connection_id:
+                    session_id = f"business_{business_connection_id}_{user_id}"
+                    if not profile:
+                        # Прежний общий ID аккаунтов без профиля - только чтение, пока новая сессия пуста
+                        legacy_session_id = f"business_{user_id}"
                 else:
-                    logger.warning(f"⚠️ Business message без connection_id, невозможно проверить владельца")
-
-            # 🚫 КРИТИЧНАЯ ПРОВЕРКА #2: Защита от бесконечной петли
-            if loop_detector is not None and text:
-                should_ignore, reason = loop_detector.should_ignore_message(
-                    text=text,
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    from_business_api=True
+                    session_id = f"business_{user_id}"
+                # Создаем пользователя в Zep если нужно
+                if agent.zep_client:
+                    await agent.ensure_user_exists(session_id, {
+                        'first_name': user_name,
+                        'email': f'{user_id}@business.telegram.user'
+                    })
+                    await agent.ensure_session_exists(session_id, session_id)
+                response = await agent.generate_response(
+                    text, session_id, user_name,
+                    extra_instructions=stale_note(job),
+                    prompt=profile.prompt if profile else None,
+                    trace=job.trace,
+                    legacy_session_id=legacy_session_id
                 )
-                if should_ignore:
-                    logger.warning(f"🚫 LOOP DETECTED: Игнорируем сообщение по причине: {reason}")
-                    logger.info(f"💬 Текст сообщения: '{text[:100]}{'...' if len(text) > 100 else ''}'")
-                    return {"ok": True, "action": "ignored_loop_detected", "reason": reason}
-            
-            # Проверяем наличие вложений в business сообщении
-            attachments, attachments_details = has_attachments(bus_msg)
-            
-            # Логируем информацию о сообщении
-            if attachments:
-                logger.info(f"📎 Business сообщение с вложениями: {attachments}, текст: '{text}'")
-                logger.info(f"📋 Источник текста: {'text' if bus_msg.get('text') else 'caption' if bus_msg.get('caption') else 'none'}")
-                # Детальное логирование вложений
-                for detail in attachments_details:
-                    logger.info(f"   📄 {detail['type']}: {detail}")
-            
-            # Если есть только вложения без текста - спрашиваем пользователя
-            if attachments and not text:
-                logger.info(f"📝 Получено business вложение от {user_name} без текста - спрашиваем что в вложении")
-                
-                # Формируем сообщение в зависимости от типа вложения
-                attachment_types_ru = {
-                    'photo': 'фотографию',
-                    'document': 'документ',
-                    'video': 'видео',
-                    'audio': 'аудио',
-                    'voice': 'голосовое сообщение',
-                    'video_note': 'видеосообщение',
-                    'sticker': 'стикер',
-                    'animation': 'анимацию',
-                    'contact': 'контакт',
-                    'location': 'местоположение',
-                    'venue': 'место',
-                    'poll': 'опрос'
-                }
-                
-                attachment_names = [attachment_types_ru.get(att, att) for att in attachments]
-                
-                if len(attachments) == 1:
-                    # Особый ответ для фото
-                    if attachments[0] == 'photo':
-                        response = "Фото увидела. Прокомментируйте, пожалуйста, что именно сейчас отправили?"
-                    else:
-                        response = "Вложение получила. Прокомментируйте, пожалуйста, что именно сейчас отправили?"
+                job.sending = True
+                logger.info(f"✅ AI ответ сгенерирован: {response[:100]}...")
+
+                # Дополнительное логирование для случая с вложениями
+                if attachments:
+                    logger.info(f"✅ AI ответил на business текст с вложениями: {attachments}")
+                    for detail in attachments_details:
+                        logger.info(f"   📄 Обработано business вложение {detail['type']}: {detail}")
+            else:
+                logger.info(f"🤖 AI отключен, использую стандартный ответ")
+                response = f"👋 Здравствуйте, {user_name}!\n\nМеня зовут Елена, я менеджер компании Textile Pro.\n\nПодготовлю ответ на ваш вопрос о текстильном производстве. Минуточку!"
+
+            # Индикатор гаснет до ответа: запоздавший sendChatAction включил бы его снова
+            await typing.finish()
+
+            # Для business_message используем специальную функцию (только для клиентов)
+            logger.info(f"📤 Пытаюсь отправить ответ клиенту {user_name}...")
+            if business_connection_id:
+                logger.info(f"📤 Отправляю через Business API с connection_id='{business_connection_id}'")
+                started = time.perf_counter()
+                result = await asyncio.to_thread(send_business_message, chat_id, response, business_connection_id)
+                job.trace['send_ms'] = (time.perf_counter() - started) * 1000
+                if result:
+                    logger.info(f"✅ Business ответ отправлен клиенту в чат {chat_id} с connection_id='{business_connection_id}'")
+
+                    # ✅ НОВОЕ: Отслеживаем ответ бота для защиты от петли
+                    if detector is not None:
+                        await state_call(detector.track_bot_response, response, chat_id)
+                        logger.debug(f"✅ Ответ бота отслежен в loop detector")
                 else:
-                    response = "Вложения получила. Прокомментируйте, пожалуйста, что именно сейчас отправили?"
-                
-                # Отправляем ответ через Business API (только для клиентов, не владельцев)
+                    logger.error(f"❌ Не удалось отправить через Business API")
+            else:
+                # Если connection_id отсутствует, логируем это как критическую ошибку
+                logger.error(f"❌ КРИТИЧНО: Получен business_message без connection_id! chat_id={chat_id}, user={user_name}")
+                # Пробуем отправить как обычное сообщение
+                await asyncio.to_thread(bot.send_message, chat_id, response)
+                logger.warning(f"⚠️ Отправлено как обычное сообщение (fallback)")
+
+            print(f"✅ Business ответ отправлен клиенту {user_name}")
+
+        except Exception as e:
+            # Детальное логирование ошибки с traceback
+            error_info = {
+                "error": str(e),
+                "traceback": traceback.format_exc(),
+                "business_connection_id": business_connection_id,
+                "chat_id": chat_id,
+                "text": text
+            }
+            logger.error(f"❌ Ошибка обработки business сообщения: {e}")
+            logger.error(f"Traceback:\n{traceback.format_exc()}")
+            logger.error(f"Business connection_id: '{business_connection_id}'")
+
+            # Сохраняем ошибку в debug данные
+            received = await state_call(shared_state.counter, "updates_received")
+            await state_call(shared_state.push_recent, "last_updates", {
+                "id": f"error_{received}",
+                "timestamp": datetime.now().isoformat(),
+                "type": "business_message_error",
+                "error_info": error_info
+            }, maxlen=10)
+
+            # ВАЖНО: Отправляем ошибку ТОЖЕ через Business API!
+            try:
+                error_message = "Извините, произошла техническая ошибка. Попробуйте написать снова или обратитесь ко мне напрямую.\n\nЕлена, Textile Pro"
+
+                # Отправляем ошибку только клиентам, не владельцам аккаунта
                 if business_connection_id:
-                    result = send_business_message(chat_id, response, business_connection_id)
+                    result = await asyncio.to_thread(send_business_message, chat_id, error_message, business_connection_id)
                     if result:
-                        logger.info(f"✅ Отправлен запрос о business вложении клиенту {user_name}")
+                        logger.info(f"✅ Сообщение об ошибке отправлено через Business API")
                     else:
-                        logger.error(f"❌ Не удалось отправить запрос о business вложении")
-                        # Fallback: отправляем обычное сообщение
-                        bot.send_message(chat_id, response)
-                        logger.warning(f"⚠️ Запрос о вложении отправлен как обычное сообщение (fallback)")
-                else:
-                    # Fallback: если нет connection_id
-                    bot.send_message(chat_id, response)
-                    logger.warning(f"⚠️ Запрос о business вложении отправлен БЕЗ Business API (нет connection_id)")
-                
-                return {"ok": True, "action": "asked_about_business_attachment"}
-            
-            # Обрабатываем business сообщения с текстом (с вложениями или без)
-            # Проверяем, что это НЕ сообщение от владельца (дополнительная проверка)
-            if text:
-                try:
-                    logger.info(f"🔄 Начинаю обработку business message: text='{text}', chat_id={chat_id}")
-                    
-                    # Пытаемся отправить typing, но не критично если не получится для business чатов
-                    try:
-                        bot.send_chat_action(chat_id, 'typing')
-                        logger.info(f"✅ Отправлен typing индикатор")
-                    except Exception as typing_error:
-                        # Business чаты могут не поддерживать typing через обычный API
-                        logger.warning(f"⚠️ Не удалось отправить typing для business чата: {typing_error}")
-                        logger.info(f"ℹ️ Продолжаем без typing индикатора")
-                    
-                    if AI_ENABLED:
-                        # Используем AI для Business сообщений
-                        logger.info(f"🤖 AI включен, генерирую ответ...")
-                        session_id = f"business_{user_id}"
-                        # Создаем пользователя в Zep если нужно
-                        if agent.zep_client:
-                            await agent.ensure_user_exists(f"business_{user_id}", {
-                                'first_name': user_name,
-                                'email': f'{user_id}@business.telegram.user'
-                            })
-                            await agent.ensure_session_exists(session_id, f"business_{user_id}")
-                        response = await agent.generate_response(text, session_id, user_name)
-                        logger.info(f"✅ AI ответ сгенерирован: {response[:100]}...")
-                        
-                        # Дополнительное логирование для случая с вложениями
-                        if attachments:
-                            logger.info(f"✅ AI ответил на business текст с вложениями: {attachments}")
-                            for detail in attachments_details:
-                                logger.info(f"   📄 Обработано business вложение {detail['type']}: {detail}")
-                    else:
-                        logger.info(f"🤖 AI отключен, использую стандартный ответ")
-                        response = f"👋 Здравствуйте, {user_name}!\n\nМеня зовут Елена, я менеджер компании Textile Pro.\n\nПодготовлю ответ на ваш вопрос о текстильном производстве. Минуточку!"
-                    
-                    # Для business_message используем специальную функцию (только для клиентов)
-                    logger.info(f"📤 Пытаюсь отправить ответ клиенту {user_name}...")
-                    if business_connection_id:
-                        logger.info(f"📤 Отправляю через Business API с connection_id='{business_connection_id}'")
-                        result = send_business_message(chat_id, response, business_connection_id)
-                        if result:
-                            logger.info(f"✅ Business ответ отправлен клиенту в чат {chat_id} с connection_id='{business_connection_id}'")
-
-                            # ✅ НОВОЕ: Отслеживаем ответ бота для защиты от петли
-                            if loop_detector is not None:
-                                loop_detector.track_bot_response(response, chat_id)
-                                logger.debug(f"✅ Ответ бота отслежен в loop detector")
-                        else:
-                            logger.error(f"❌ Не удалось отправить через Business API")
-                    else:
-                        # Если connection_id отсутствует, логируем это как критическую ошибку
-                        logger.error(f"❌ КРИТИЧНО: Получен business_message без connection_id! chat_id={chat_id}, user={user_name}")
-                        # Пробуем отправить как обычное сообщение
-                        bot.send_message(chat_id, response)
-                        logger.warning(f"⚠️ Отправлено как обычное сообщение (fallback)")
-
-                    print(f"✅ Business ответ отправлен клиенту {user_name}")
-                    
-                except Exception as e:
-                    # Детальное логирование ошибки с traceback
-                    error_info = {
-                        "error": str(e),
-                        "traceback": traceback.format_exc(),
-                        "business_connection_id": business_connection_id,
-                        "chat_id": chat_id,
-                        "text": text
-                    }
-                    logger.error(f"❌ Ошибка обработки business сообщения: {e}")
-                    logger.error(f"Traceback:\n{traceback.format_exc()}")
-                    logger.error(f"Business connection_id: '{business_connection_id}'")
-                    
-                    # Сохраняем ошибку в debug данные
-                    last_updates.append({
-                        "id": f"error_{update_counter}",
-                        "timestamp": datetime.now().isoformat(),
-                        "type": "business_message_error",
-                        "error_info": error_info
-                    })
-                    
-                    # ВАЖНО: Отправляем ошибку ТОЖЕ через Business API!
-                    try:
-                        error_message = "Извините, произошла техническая ошибка. Попробуйте написать снова или обратитесь ко мне напрямую.\n\nЕлена, Textile Pro"
-                        
-                        # Отправляем ошибку только клиентам, не владельцам аккаунта
-                        if business_connection_id:
-                            result = send_business_message(chat_id, error_message, business_connection_id)
-                            if result:
-                                logger.info(f"✅ Сообщение об ошибке отправлено через Business API")
-                            else:
-                                # Если Business API не сработал, пробуем обычный способ
-                                bot.send_message(chat_id, error_message)
-                                logger.warning(f"⚠️ Business API не сработал, отправлено обычным способом")
-                        else:
-                            # Fallback: если нет connection_id, отправляем обычное сообщение
-                            bot.send_message(chat_id, error_message)
-                            logger.warning(f"⚠️ Сообщение об ошибке отправлено БЕЗ Business API (нет connection_id)")
-                            
-                    except Exception as send_error:
-                        logger.error(f"❌ Не удалось отправить сообщение об ошибке: {send_error}")
-        
-        # === BUSINESS CONNECTION ===
-        elif "business_connection" in update_dict:
-            conn = update_dict["business_connection"]
-            is_enabled = conn.get("is_enabled", False)
-            connection_id = conn.get("id")
-            user_info = conn.get("user", {})
-            user_name = user_info.get("first_name", "Пользователь")
-            owner_username = user_info.get("username")
-            owner_user_id = user_info.get("id")
-
-            # ✅ НОВОЕ: Сохраняем владельца в БД для персистентного хранения
-            if connection_id and owner_user_id and db is not None:
-                if is_enabled:
-                    success = await db.save_business_owner(
-                        connection_id=connection_id,
-                        owner_user_id=owner_user_id,
-                        owner_name=user_name,
-                        owner_username=owner_username,
-                        is_active=True
-                    )
-                    if success:
-                        logger.info(f"✅ Владелец сохранен в БД: {user_name} (@{owner_username}) ID: {owner_user_id}")
-                        logger.info(f"   connection_id: {connection_id}")
+                        # Если Business API не сработал, пробуем обычный способ
+                        await asyncio.to_thread(bot.send_message, chat_id, error_message)
+                        logger.warning(f"⚠️ Business API не сработал, отправлено обычным способом")
                 else:
-                    # Деактивируем при отключении
-                    await db.deactivate_connection(connection_id)
-                    logger.info(f"❌ Business Connection деактивирован: {user_name} (connection_id: {connection_id})")
-
-                # Получаем статистику
-                stats = await db.get_stats()
-                active_count = stats.get("active_connections", 0)
-                logger.info(f"📊 Всего активных Business Connection в БД: {active_count}")
-            elif db is None:
-                logger.error(f"❌ КРИТИЧНО: БД не инициализирована, невозможно сохранить владельца!")
-
-            status = "✅ Подключен" if is_enabled else "❌ Отключен"
-            logger.info(f"{status} к Business аккаунту: {user_name}")
-        
-        return {"ok": True, "status": "processed", "update_id": update_counter}
-        
+                    # Fallback: если нет connection_id, отправляем обычное сообщение
+                    await asyncio.to_thread(bot.send_message, chat_id, error_message)
+                    logger.warning(f"⚠️ Сообщение об ошибке отправлено БЕЗ Business API (нет connection_id)")
+
+            except Exception as send_error:
+                logger.error(f"❌ Не удалось отправить сообщение об ошибке: {send_error}")
+
+        finally:
+            typing.stop()
+
+    return {"ok": True, "action": "processed"}
+
+
+async def handle_business_connection(conn):
+    """Подключение/отключение Business аккаунта (conn - BusinessConnectionView)"""
+    is_enabled = conn.is_enabled
+    connection_id = conn.connection_id
+    user_name = conn.owner_name
+    owner_username = conn.owner_username
+    owner_user_id = conn.owner_user_id
+
+    # ✅ НОВОЕ: Сохраняем владельца в БД для персистентного хранения
+    if connection_id and owner_user_id and db is not None:
+        if is_enabled:
+            success = await db.save_business_owner(
+                connection_id=connection_id,
+                owner_user_id=owner_user_id,
+                owner_name=user_name,
+                owner_username=owner_username,
+                is_active=True
+            )
+            if success:
+                logger.info(f"✅ Владелец сохранен в БД: {user_name} (@{owner_username}) ID: {owner_user_id}")
+                logger.info(f"   connection_id: {connection_id}")
+        else:
+            # Деактивируем при отключении
+            await db.deactivate_connection(connection_id)
+            logger.info(f"❌ Business Connection деактивирован: {user_name} (connection_id: {connection_id})")
+
+        # Получаем статистику
+        stats = await db.get_stats()
+        active_count = stats.get("active_connections", 0)
+        logger.info(f"📊 Всего активных Business Connection в БД: {active_count}")
+    elif db is None:
+        logger.error(f"❌ КРИТИЧНО: БД не инициализирована, невозможно сохранить владельца!")
+
+    status = "✅ Подключен" if is_enabled else "❌ Отключен"
+    logger.info(f"{status} к Business аккаунту: {user_name}")
+
+    return {"ok": True, "action": "business_connection_saved"}
+
+
+def handle_edited_business_message(msg):
+    """Клиент исправил сообщение (msg - MessageView)"""
+    status = pending_messages.apply_edit((msg.chat_id, msg.business_connection_id), msg.data)
+    if status == "not_pending":
+        logger.info(f"✏️ Сообщение {msg.message_id} в чате {msg.chat_id} исправлено после ответа - пропускаем")
+    else:
+        logger.info(f"✏️ Сообщение {msg.message_id} в чате {msg.chat_id} исправлено до ответа: {status}")
+    return {"ok": True, "action": f"edit_{status}"}
+
+
+def handle_deleted_business_messages(deleted):
+    """Клиент удалил сообщения (deleted - DeletedMessagesView)"""
+    result = pending_messages.apply_delete((deleted.chat_id, deleted.business_connection_id), deleted.message_ids)
+    logger.info(f"🗑️ Удалены сообщения {deleted.message_ids} в чате {deleted.chat_id}: {result}")
+    return {"ok": True, "action": "deleted_messages", "result": result}
+
+
+# === ПУЛ ОБРАБОТЧИКОВ UPDATES ===
+stale_policy = StaleMessagePolicy(
+    answer_max_age_minutes=STALE_ANSWER_MAX_AGE_MINUTES,
+    summarise_max_age_minutes=STALE_SUMMARISE_MAX_AGE_MINUTES
+)
+# === АНАЛИТИКА ===
+analytics = AnalyticsRecorder(ANALYTICS_DB_PATH, retention_days=ANALYTICS_RETENTION_DAYS) if ANALYTICS_ENABLED else None
+
+
+def record_turn(job, result, error):
+    """Событие аналитики по обработанному job (вызывается пулом после каждого update)"""
+    if analytics is None:
+        return
+    result = result if isinstance(result, dict) else {}
+    message = job.update.get(job.kind) if isinstance(job.update.get(job.kind), dict) else {}
+    event = {
+        'kind': job.kind,
+        'connection_id': message.get('business_connection_id'),
+        'chat_id': message.get('chat', {}).get('id'),
+        'outcome': 'error' if error is not None else (result.get('action') or result.get('status') or 'processed'),
+        'reason': f"{type(error).__name__}: {error}"[:200] if error is not None else result.get('reason'),
+        'merged_count': job.merged_count,
+        'regenerations': job.regenerations,
+        'stale_action': job.stale_action,
+    }
+    event.update({key: value for key, value in job.trace.items()})
+    analytics.record(event)
+
+
+# Подтверждения строк backlog_spool, которые пишутся в потоке (их дожидаются перед close)
+backlog_acks = set()
+
+
+async def ack_backlog_rows(ids):
+    try:
+        await asyncio.to_thread(backlog_spool.ack, ids)
+    except sqlite3.Error as e:
+        # Строки останутся в аренде и будут доделаны при следующем старте
+        logger.error(f"❌ Не удалось подтвердить строки backlog {ids}: {e}")
+
+
+def ack_queue_rows(ids):
+    """Строки на диске обработаны: очередь updates (роль worker) или сохраненный backlog (режим all)"""
+    if not ids:
+        return
+    if queue_consumer is not None:
+        queue_consumer.ack(ids)
+    elif backlog_spool is not None:
+        task = asyncio.get_running_loop().create_task(ack_backlog_rows(ids))
+        backlog_acks.add(task)
+        task.add_done_callback(backlog_acks.discard)
+
+
+async def run_pool_job(job):
+    """Job пула; строки очереди на диске получают засчитанную попытку, только когда обработка началась"""
+    if job.queue_ids:
+        if queue_consumer is not None:
+            await queue_consumer.start_processing(job.queue_ids)
+        elif backlog_spool is not None:
+            await asyncio.to_thread(backlog_spool.start_processing, job.queue_ids)
+    return await pending_messages.run(job)
+
+
+def finish_job(job, result, error):
+    """Job завершен (ответ, отмена или ошибка): аналитика и подтверждение строк очереди на диске"""
+    record_turn(job, result, error)
+    ack_queue_rows(job.queue_ids)
+
+
+def discard_jobs(jobs):
+    """Сообщения удалены клиентом до склейки - в очереди на диске они обработаны"""
+    ack_queue_rows([queue_id for job in jobs for queue_id in job.queue_ids])
+
+
+def job_priority(job):
+    """Класс приоритета job в пуле: сообщение владельца business аккаунта - ниже клиентов"""
+    if job.kind == "business_message" and db is not None:
+        owner_id = db.cached_owner(job.update[job.kind].get("business_connection_id"))
+        if owner_id is not None and owner_id == job.sender_id:
+            return PRIORITY_OWNER
+    return default_priority(job)
+
+
+pending_messages = PendingMessages(handle_update)
+worker_pool = UpdateWorkerPool(
+    run_pool_job, concurrency=WORKER_CONCURRENCY, max_queue=WORKER_QUEUE_SIZE, on_done=finish_job,
+    classify=job_priority, priority_max_wait=WORKER_PRIORITY_MAX_WAIT
+)
+
+
+def submit_update_job(job):
+    """Ставит job в пул, регистрируя его сообщения для правок/удалений"""
+    if job.kind == "business_message":
+        # Клиент дописал вопрос, пока генерируется ответ на предыдущий - ответим на оба сразу
+        pending_messages.supersede(job)
+    pending_messages.track(job)
+    if worker_pool.submit(job):
+        return True
+    pending_messages.untrack(job)
+    return False
+
+
+stale_coalescer = StaleMessageCoalescer(
+    submit_update_job, window_seconds=STALE_COALESCE_SECONDS, on_discard=discard_jobs
+)
+
+
+def dispatch_queued_update(item):
+    """
+    Update из очереди на диске (роль worker) - тот же путь, что у webhook в режиме all
+
+    Returns:
+        True - передан в пул (ack по завершении job), False - обработан сразу, None - пул переполнен
+    """
+    update = parse_update(item.payload)
+    chat_key, stale_action, age_minutes = classify_update(update)
+    result = dispatch_update(update, chat_key, stale_action, age_minutes, queue_id=item.id, attempt=item.attempts)
+    if result is None:
+        return None
+    return result.get("status") in ("queued", "buffered_stale_message")
+
+
+queue_consumer = None
+if PROCESS_ROLE == "worker":
+    queue_consumer = QueueConsumer(
+        update_queue, QUEUE_WORKER_ID, dispatch_queued_update,
+        prefetch=UPDATE_QUEUE_PREFETCH, poll_interval=UPDATE_QUEUE_POLL_SECONDS
+    )
+
+
+# === ВЕРСИИ ИНСТРУКЦИЙ ===
+# Активная версия хранится в InstructionStore: админ панель публикует и
+# откатывает версии через /admin/instructions, а каждый процесс бота
+# замечает смену ревизии за INSTRUCTION_STORE_POLL_SECONDS.
+instruction_store = None
+instruction_store_watcher = None
+
+
+async def apply_store_version(version_hash: str) -> bool:
+    """Применяет версию из хранилища в этом процессе сразу, не дожидаясь опроса"""
+    snapshot = await asyncio.to_thread(instruction_store.snapshot, version_hash)
+    return snapshot is not None and agent.set_prompt(snapshot)
+
+
+async def publish_file_prompt(snapshot) -> bool:
+    """
+    instruction.json на диске -> хранилище версий, затем применяется активная версия хранилища
+
+    Новое содержимое файла становится активной версией; уже известное
+    (файл не менялся после публикации или отката из админ панели) выбранную
+    версию не перебивает - как при старте (InstructionStore.import_version).
+    """
+    if instruction_store is None:
+        return agent.set_prompt(snapshot)
+    await asyncio.to_thread(
+        instruction_store.import_version, snapshot.instruction, "instruction.json", "Изменен файл instruction.json"
+    )
+    active = await asyncio.to_thread(instruction_store.active)
+    return active is not None and await apply_store_version(active[0])
+
+
+async def init_instruction_store():
+    """
+    Шаг запуска: хранилище версий инструкций
+
+    instruction.json из репозитория импортируется как новая версия только
+    если такого содержимого еще не было, иначе активной остается версия,
+    выбранная в админ панели (в т.ч. после отката).
+    """
+    global instruction_store, instruction_store_watcher
+
+    if instruction_watcher is not None:
+        instruction_watcher.prime()
+    instruction_store = await asyncio.to_thread(InstructionStore, INSTRUCTION_STORE_PATH)
+    # instruction.json импортирует один процесс (лидер), остальные workers читают хранилище
+    if shared_state.is_leader:
+        try:
+            file_snapshot = await asyncio.to_thread(load_prompt_file, INSTRUCTION_FILE)
+            if await asyncio.to_thread(
+                instruction_store.import_version, file_snapshot.instruction, "instruction.json", "Версия из репозитория"
+            ):
+                print(f"📥 instruction.json импортирован в хранилище версий (версия {file_snapshot.version})")
+        except FileNotFoundError:
+            pass
+
+    active = await asyncio.to_thread(instruction_store.active)
+    if active is None:
+        # Ни файла, ни сохраненных версий - базовая инструкция становится первой версией
+        await asyncio.to_thread(instruction_store.publish, agent.prompt.instruction, "default")
+        active = await asyncio.to_thread(instruction_store.active)
+    await apply_store_version(active[0])
+    print(f"🗂️ Активная версия инструкций: {agent.prompt.version} (ревизия {active[1]})")
+
+    if INSTRUCTION_STORE_POLL_SECONDS > 0:
+        instruction_store_watcher = InstructionStoreWatcher(
+            instruction_store, agent.set_prompt, interval=INSTRUCTION_STORE_POLL_SECONDS
+        )
+        instruction_store_watcher.revision = active[1]
+
+
+# === ОТСЛЕЖИВАНИЕ instruction.json ===
+instruction_watcher = None
+if AI_ENABLED and INSTRUCTION_WATCH_INTERVAL > 0:
+    instruction_watcher = InstructionWatcher(INSTRUCTION_FILE, publish_file_prompt, interval=INSTRUCTION_WATCH_INTERVAL)
+
+
+# === ВЫГРУЗКА BACKLOG ПОСЛЕ СБОЯ ===
+def spool_rows(updates):
+    """(payload, update_id, chat_ref) для очереди на диске"""
+    rows = []
+    for update in updates:
+        parsed = ParsedUpdate(update)
+        rows.append((json.dumps(update).encode(), parsed.update_id, update_chat_ref(parsed)))
+    return rows
+
+
+def claim_drained_updates(updates):
+    """
+    Claims update_id пачки backlog, как при приеме через webhook (блокирующий - через state_call)
+
+    Returns:
+        (новые updates, взятые claim ключи); update, уже принятый webhook, в пачку не попадает
+    """
+    fresh, claimed = [], []
+    for update in updates:
+        update_id = update.get("update_id")
+        if update_id is None:
+            fresh.append(update)
+            continue
+        claim_key = f"update:{update_id}"
+        if shared_state.claim(claim_key, UPDATE_CLAIM_TTL):
+            fresh.append(update)
+            claimed.append(claim_key)
+    return fresh, claimed
+
+
+def release_claims(claim_keys):
+    for claim_key in claim_keys:
+        shared_state.release(claim_key)
+
+
+async def persist_drained_batch(updates):
+    """
+    Пачка getUpdates на диск до того, как следующий getUpdates подтвердит ее Telegram
+
+    Роль ingest - в очередь updates (сообщения отправителя склеит worker),
+    режим all - в backlog_spool, откуда ее обработает этот процесс.
+
+    Вместе с записью update_id берутся в claims: если подтверждение не
+    дошло (ошибка getUpdates, падение процесса), Telegram после возврата
+    webhook пришлет пачку снова, и webhook отбросит повтор - на эти
+    сообщения ответит продолжение выгрузки из spool.
+    """
+    queue = update_queue if update_queue is not None else backlog_spool
+    fresh, claimed = await state_call(claim_drained_updates, updates)
+    try:
+        await asyncio.to_thread(queue.put_many, spool_rows(fresh))
+    except BaseException:
+        # Пачка не сохранена и остается в Telegram - повтор через webhook должен быть принят
+        await state_call(release_claims, claimed)
+        raise
+
+
+# update_id -> строка backlog_spool (ack после ответа на сообщение)
+backlog_rows = {}
+
+
+async def load_spooled_backlog():
+    """Сохраненные и не отвеченные updates backlog (режим all); в роли ingest их берут workers"""
+    if backlog_spool is None:
+        return []
+    items = await asyncio.to_thread(backlog_spool.lease, BACKLOG_SPOOL_OWNER, 1_000_000)
+    updates = []
+    for item in items:
+        update = json.loads(item.payload)
+        if update.get("update_id") is not None:
+            backlog_rows[update["update_id"]] = item.id
+        updates.append(update)
+    return updates
+
+
+def take_backlog_rows(updates):
+    return [row for row in (backlog_rows.pop(update.get("update_id"), None) for update in updates) if row is not None]
+
+
+async def drain_process_service_update(update):
+    """business_connection и прочие служебные updates из backlog"""
+    kind = next(iter(k for k in update if k != "update_id"), "unknown")
+    result = await handle_update(UpdateJob(update=update, kind=kind))
+    ack_queue_rows(take_backlog_rows([update]))
+    return result
+
+
+async def drain_process_sender_group(key, updates):
+    """
+    Все пропущенные сообщения одного отправителя -> один вопрос и один ответ
+
+    Сводный job идет через пул: блокировка чата не дает ответить на него
+    одновременно с новым сообщением этого чата из webhook. Строки на диске
+    подтверждаются, когда job завершится (finish_job).
+    """
+    kind, chat_id, _sender_id = key
+    connection_id = updates[-1][kind].get("business_connection_id")
+    jobs = []
+    skipped = []
+    for update in updates:
+        stale_action, age_minutes = stale_policy.classify(update[kind].get("date"))
+        if stale_action == STALE_SKIP:
+            skipped.append(update)
+            continue
+        jobs.append(UpdateJob(
+            update=update,
+            kind=kind,
+            chat_key=(kind, chat_id, connection_id),
+            stale_action=stale_action,
+            age_minutes=age_minutes
+        ))
+    ack_queue_rows(take_backlog_rows(skipped))
+
+    if not jobs:
+        logger.info(f"⏰ Backlog: все сообщения отправителя {key} слишком старые - пропущены")
+        return None
+
+    merged = merge_jobs(jobs)
+    # Ответ на backlog всегда "сводный": с пометкой о задержке и без проверки частоты
+    merged.stale_action = STALE_SUMMARISE
+    rows = take_backlog_rows([job.update for job in jobs])
+    merged.queue_ids.extend(rows)
+    # Пул заполнен сообщениями из webhook - ждем места, а не отбрасываем backlog
+    while worker_pool.accepting and worker_pool.queue.maxsize and worker_pool.queue.qsize() >= worker_pool.queue.maxsize:
+        await asyncio.sleep(0.2)
+    if not submit_update_job(merged):
+        # Пул остановлен (редеплой) - строки вернутся в работу при следующем старте
+        if rows:
+            await asyncio.to_thread(backlog_spool.release, BACKLOG_SPOOL_OWNER, rows)
+        raise RuntimeError("пул не принимает jobs - чат будет обработан при следующем старте")
+    return {"ok": True, "status": "queued"}
+
+
+async def restore_webhook():
+    await asyncio.to_thread(
+        bot.set_webhook,
+        url=WEBHOOK_URL,
+        secret_token=WEBHOOK_SECRET_TOKEN,
+        allowed_updates=ALLOWED_UPDATES
+    )
+    logger.info(f"✅ Webhook восстановлен после выгрузки backlog: {WEBHOOK_URL}")
+
+
+async def telegram_api_call_async(method, params):
+    return await asyncio.to_thread(telegram_api_call, method, params)
+
+
+backlog_drainer = BacklogDrainer(
+    api_call=telegram_api_call_async,
+    process_service_update=drain_process_service_update,
+    process_sender_group=drain_process_sender_group,
+    persist_batch=persist_drained_batch,
+    load_persisted=load_spooled_backlog,
+    batch_size=BACKLOG_DRAIN_BATCH_SIZE,
+    concurrency=BACKLOG_DRAIN_CONCURRENCY,
+    max_updates=BACKLOG_DRAIN_MAX_UPDATES
+)
+background_tasks = set()
+
+
+def start_background_task(coro, name):
+    """Фоновая задача процесса (отменяется в начале остановки)"""
+    task = asyncio.create_task(coro, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def start_backlog_drain():
+    """Запускает выгрузку backlog фоновой задачей"""
+    return start_background_task(backlog_drainer.drain(ALLOWED_UPDATES, restore_webhook), "backlog-drain")
+
+
+@app.post("/admin/drain-backlog")
+async def drain_backlog(request: Request):
+    """Выгрузить накопившиеся updates через getUpdates (сводный ответ на каждый чат)"""
+    require_admin_token(request)
+    if backlog_drainer.running:
+        return {"status": "⏳ Выгрузка уже идет", "report": backlog_drainer.last_report}
+    start_backlog_drain()
+    return {"status": "🚀 Выгрузка backlog запущена", "details": "/debug/backlog-drain"}
+
+
+@app.get("/debug/backlog-drain")
+async def get_backlog_drain_status():
+    """Отчет о последней выгрузке backlog"""
+    return {
+        "running": backlog_drainer.running,
+        "last_report": backlog_drainer.last_report,
+        "spool": await asyncio.to_thread(backlog_spool.get_stats) if backlog_spool is not None else None,
+        "settings": {
+            "threshold": BACKLOG_DRAIN_THRESHOLD,
+            "concurrency": BACKLOG_DRAIN_CONCURRENCY,
+            "batch_size": BACKLOG_DRAIN_BATCH_SIZE,
+            "max_updates": BACKLOG_DRAIN_MAX_UPDATES
+        }
+    }
+
+
+def disk_queue(name):
+    """Очередь на диске по имени: updates (UPDATE_QUEUE_PATH) или backlog (BACKLOG_SPOOL_PATH)"""
+    queue = {"updates": update_queue, "backlog": backlog_spool}.get(name)
+    if queue is None:
+        raise HTTPException(status_code=404, detail=f"Очереди '{name}' нет в этом процессе (роль {PROCESS_ROLE})")
+    return queue
+
+
+@app.get("/admin/queue/{name}/dead")
+async def list_dead_updates(name: str, request: Request, limit: int = 100):
+    """Updates, помеченные dead после UPDATE_QUEUE_MAX_ATTEMPTS попыток (с телом update)"""
+    require_admin_token(request)
+    queue = disk_queue(name)
+    return {"queue": name, "dead": await asyncio.to_thread(queue.dead_letters, limit)}
+
+
+@app.post("/admin/queue/{name}/requeue-dead")
+async def requeue_dead_updates(name: str, request: Request):
+    """
+    Вернуть dead updates в очередь с нулевым счетчиком попыток
+
+    Тело (необязательно): {"ids": [...]} - без него возвращаются все.
+    """
+    require_admin_token(request)
+    queue = disk_queue(name)
+    body = await request.body()
+    ids = json.loads(body).get("ids") if body else None
+    requeued = await asyncio.to_thread(queue.requeue_dead, ids)
+    return {"queue": name, "requeued": requeued}
+
+
+@app.get("/debug/workers")
+async def get_worker_stats():
+    """Состояние пула обработчиков и политики старых сообщений"""
+    return {
+        "pool": worker_pool.get_stats(),
+        "stale_policy": stale_policy.get_stats(),
+        "stale_coalescer": stale_coalescer.get_stats(),
+        "pending_messages": pending_messages.get_stats(),
+        "generation": agent.get_generation_stats() if AI_ENABLED else None,
+        "analytics": analytics.get_stats() if analytics else None,
+        "process": {**(await state_call(shared_state.get_stats)), "role": PROCESS_ROLE},
+        "update_queue": await asyncio.to_thread(update_queue.get_stats) if update_queue is not None else None,
+        "queue_consumer": queue_consumer.get_stats() if queue_consumer is not None else None,
+        "warm_snapshot": warm_snapshot.get_stats(),
+        "current_time": datetime.now().isoformat()
+    }
+
+
+@app.get("/debug/event-loop")
+async def get_event_loop_stats(stacks: bool = True):
+    """Лаг event loop и блокировки дольше LOOP_BLOCK_THRESHOLD_MS: по endpoint/задачам и последние со стеком"""
+    if loop_monitor is None:
+        return {"error": "Монитор event loop отключен (LOOP_MONITOR_ENABLED=false)"}
+    return {**loop_monitor.get_stats(include_stacks=stacks), "current_time": datetime.now().isoformat()}
+
+
+@app.get("/debug/profile")
+async def get_profile(request: Request, seconds: float = 10, threads: str = "loop,sqlite", format: str = "collapsed"):
+    """
+    Статистический профиль за seconds секунд
+
+    threads - группы потоков через запятую: loop, sqlite (aiosqlite), executor
+    (asyncio.to_thread). format=collapsed - текст для flamegraph.pl/speedscope
+    ("поток;кадр;кадр N"), format=json - сводка и стеки словарем.
+        curl -H "X-Admin-Token: ..." ".../debug/profile?seconds=30" > profile.txt
+        flamegraph.pl profile.txt > profile.svg
+    """
+    require_admin_token(request)
+    groups = [group.strip() for group in threads.split(",") if group.strip()]
+    unknown = [group for group in groups if group not in THREAD_GROUPS]
+    if unknown or not groups:
+        raise HTTPException(status_code=400, detail=f"Неизвестные группы потоков: {unknown}, доступны: {list(THREAD_GROUPS)}")
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds должно быть в (0, {PROFILE_MAX_SECONDS:g}]")
+    if profiler.busy:
+        raise HTTPException(status_code=409, detail="Профиль уже снимается")
+
+    # Endpoint выполняется в потоке event loop - он и будет потоком "loop"
+    profiler.attach_loop_thread()
+    logger.info(f"🔬 Профиль {seconds:g} с, потоки: {', '.join(groups)}")
+    try:
+        result = await asyncio.to_thread(profiler.run, seconds, groups)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if format == "json":
+        stacks = result.pop("stacks")
+        return {**result, "stacks": dict(stacks.most_common())}
+    summary = {key: value for key, value in result.items() if key != "stacks"}
+    return PlainTextResponse(
+        SamplingProfiler.collapsed(result["stacks"]),
+        headers={"X-Profile-Summary": json.dumps(summary)}
+    )
+
+
+@app.get("/admin/analytics/events")
+async def get_analytics_events(request: Request, hours: float = 24, columns: str = None, max_rows: int = 200000):
+    """
+    События аналитики за последние hours часов в колоночном виде (для админ панели)
+
+    columns - список колонок через запятую (по умолчанию все, кроме chat_id)
+    """
+    require_admin_token(request)
+    if analytics is None:
+        return {"error": "Аналитика отключена"}
+    await analytics.flush()
+    selected = columns.split(",") if columns else [name for name in ANALYTICS_COLUMNS if name != "chat_id"]
+    return await asyncio.to_thread(
+        fetch_columns, ANALYTICS_DB_PATH, time.time() - hours * 3600, None, selected, max_rows
+    )
+
+
+async def timed_phase(name, coro):
+    """Выполняет шаг запуска и записывает его длительность в startup_report"""
+    started = time.perf_counter()
+    try:
+        result = await coro
+        startup_report["phases"][name] = {"ms": round((time.perf_counter() - started) * 1000, 1), "status": "ok"}
+        return result
     except Exception as e:
-        logger.error(f"❌ Ошибка webhook: {e}")
-        return {"ok": False, "error": str(e)}
+        startup_report["phases"][name] = {
+            "ms": round((time.perf_counter() - started) * 1000, 1),
+            "status": f"error: {type(e).__name__}: {e}"
+        }
+        raise
+
+
+async def init_storage():
+    """Шаг запуска: SQLite БД владельцев + Loop Detector + БД аналитики"""
+    global db, loop_detector, instruction_profiles
+
+    if analytics is not None:
+        try:
+            await asyncio.to_thread(analytics.init_db)
+        except Exception as e:
+            logger.error(f"❌ Не удалось подготовить БД аналитики {ANALYTICS_DB_PATH}: {e}")
+
+    if not AI_ENABLED:
+        print("⚠️ AI отключен, БД и Loop Detector не инициализированы")
+        return
+
+    try:
+        # Инициализация БД
+        db = BusinessOwnersDB(DATABASE_PATH)
+        await db.init_db()
+        print(f"✅ SQLite БД инициализирована: {DATABASE_PATH}")
+
+        # Профили инструкций business аккаунтов (та же БД)
+        instruction_profiles = InstructionProfilesDB(DATABASE_PATH, check_interval=PROFILE_CACHE_CHECK_SECONDS)
+        await instruction_profiles.init_db()
+
+        # Инициализация Loop Detector (отдельный детектор на каждый business аккаунт)
+        loop_detector = LoopDetectorRegistry(
+            state=shared_state,
+            min_message_interval=2.0,
+            max_recent_messages=50,
+            duplicate_window=300
+        )
+        print("✅ Loop Detector инициализирован")
+        print("🔒 Защита от бесконечной петли: АКТИВНА")
+
+    except Exception as e:
+        logger.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА инициализации БД/Loop Detector: {e}")
+        print(f"❌ КРИТИЧЕСКАЯ ОШИБКА: {e}")
+        print("⚠️ Бот продолжит работу БЕЗ фильтрации владельца!")
+        raise
+
+
+async def warm_up_agent():
+    """Шаг запуска: клиенты OpenAI/Zep и разбор instruction.json (в отдельном потоке) + версии инструкций"""
+    if AI_ENABLED:
+        await asyncio.to_thread(agent.warm_up)
+        await init_instruction_store()
+
+
+def webhook_matches(info) -> bool:
+    """
+    Совпадает ли зарегистрированный webhook с нужной конфигурацией
+
+    secret_token getWebhookInfo не возвращает - после его смены используйте
+    WEBHOOK_FORCE_SET=true или /webhook/set.
+    """
+    if WEBHOOK_FORCE_SET:
+        return False
+    if info.url != WEBHOOK_URL:
+        return False
+    if set(info.allowed_updates or []) != set(ALLOWED_UPDATES):
+        return False
+    # Telegram сообщает о недавней ошибке доставки (например, неверный secret) - переустанавливаем
+    if info.last_error_date and time.time() - info.last_error_date < 300:
+        return False
+    return True
+
+
+async def init_telegram():
+    """Шаг запуска: getMe и getWebhookInfo параллельно, setWebhook только при расхождении"""
+    bot_info, current_webhook = await asyncio.gather(
+        timed_phase("telegram.get_me", asyncio.to_thread(bot.get_me)),
+        timed_phase("telegram.get_webhook_info", asyncio.to_thread(bot.get_webhook_info))
+    )
+
+    bot_identity.update(bot_info)
+    print(f"🤖 Бот: @{bot_info.username}")
+    print(f"📊 ID: {bot_info.id}")
+    print(f"📛 Имя: {bot_info.first_name}")
+
+    if current_webhook.url:
+        print(f"📍 Текущий webhook: {current_webhook.url}")
+    else:
+        print("❌ Webhook не установлен")
+
+    pending = current_webhook.pending_update_count or 0
+    startup_report["pending_updates"] = pending
+    if BACKLOG_DRAIN_THRESHOLD and pending >= BACKLOG_DRAIN_THRESHOLD:
+        print(f"📦 Накопилось {pending} updates - после старта будет запущена выгрузка backlog")
+        startup_report["backlog_drain"] = True
+
+    if PROCESS_ROLE == "worker" or not shared_state.is_leader:
+        # setWebhook и выгрузку backlog выполняет только лидер (WEB_CONCURRENCY > 1) приема updates
+        startup_report["webhook"] = "worker" if PROCESS_ROLE == "worker" else "follower"
+        startup_report.pop("backlog_drain", None)
+        return
+
+    if webhook_matches(current_webhook):
+        print("✅ Webhook уже установлен с нужными параметрами - setWebhook пропущен")
+        logger.info(f"✅ Webhook актуален, setWebhook пропущен: {WEBHOOK_URL}")
+        startup_report["webhook"] = "unchanged"
+        return
+
+    print("🔧 Автоматическая установка webhook...")
+    result = await timed_phase("telegram.set_webhook", asyncio.to_thread(
+        bot.set_webhook,
+        url=WEBHOOK_URL,
+        secret_token=WEBHOOK_SECRET_TOKEN,
+        allowed_updates=ALLOWED_UPDATES
+    ))
+
+    if result:
+        print(f"✅ Webhook автоматически установлен: {WEBHOOK_URL}")
+        logger.info(f"✅ Webhook установлен при старте: {WEBHOOK_URL}")
+        startup_report["webhook"] = "set"
+    else:
+        print("❌ Не удалось установить webhook автоматически")
+        logger.error("Ошибка автоматической установки webhook")
+        startup_report["webhook"] = "failed"
+
 
 @app.on_event("startup")
 async def startup():
-    """Запуск сервера"""
-    global db, loop_detector
+    """
+    Запуск сервера
 
+    Независимые шаги (БД, прогрев AI агента, Telegram) выполняются параллельно.
+    Webhook при старте НЕ удаляется: пока идет деплой, Telegram продолжает
+    доставлять updates, а setWebhook вызывается только если конфигурация изменилась.
+    """
     print("\n" + "="*50)
     print("🚀 TEXTILE PRO BOT WEBHOOK SERVER")
     print("="*50)
 
-    # ✅ НОВОЕ: Инициализируем БД и Loop Detector ПЕРЕД всем остальным
-    if AI_ENABLED:
-        try:
-            # Инициализация БД
-            db = BusinessOwnersDB(DATABASE_PATH)
-            await db.init_db()
-            stats = await db.get_stats()
-            print(f"✅ SQLite БД инициализирована: {DATABASE_PATH}")
-            print(f"📊 Активных владельцев в БД: {stats.get('active_connections', 0)}")
-
-            # Инициализация Loop Detector
-            loop_detector = LoopDetector(
-                min_message_interval=2.0,
-                max_recent_messages=50,
-                duplicate_window=300
-            )
-            print("✅ Loop Detector инициализирован")
-            print("🔒 Защита от бесконечной петли: АКТИВНА")
+    # Монитор запускается первым: блокировки во время холодного старта тоже видны
+    if loop_monitor is not None:
+        loop_monitor.start()
 
-        except Exception as e:
-            logger.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА инициализации БД/Loop Detector: {e}")
-            print(f"❌ КРИТИЧЕСКАЯ ОШИБКА: {e}")
-            print("⚠️ Бот продолжит работу БЕЗ фильтрации владельца!")
-    else:
-        print("⚠️ AI отключен, БД и Loop Detector не инициализированы")
+    # Общее состояние до остальных шагов: от него зависит, лидер ли этот процесс
+    await asyncio.to_thread(shared_state.start)
+    if AI_ENABLED and shared_state.shared:
+        agent.session_store = shared_state
+    if update_queue is not None:
+        await asyncio.to_thread(update_queue.start)
+    if backlog_spool is not None:
+        await asyncio.to_thread(backlog_spool.start)
+        if shared_state.is_leader:
+            # Строки прошлого процесса (аренда на UPDATE_CLAIM_TTL) возвращаются в работу
+            released = await asyncio.to_thread(backlog_spool.release, BACKLOG_SPOOL_OWNER, None, True)
+            if released:
+                logger.warning(f"♻️ {released} updates прерванной выгрузки backlog будут обработаны")
 
-    # Очищаем webhook при старте
-    try:
-        bot.delete_webhook()
-        print("🧹 Webhook очищен")
-    except:
-        pass
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        timed_phase("storage", init_storage()),
+        timed_phase("agent", warm_up_agent()),
+        timed_phase("telegram", init_telegram()),
+        # Файл снимка читается параллельно с сетевыми шагами; разделы декодируются позже
+        timed_phase("warm_snapshot", asyncio.to_thread(warm_snapshot.load)),
+        return_exceptions=True
+    )
+    startup_report["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    startup_report["completed_at"] = datetime.now().isoformat()
+
+    for phase, result in zip(("storage", "agent", "telegram", "warm_snapshot"), results):
+        if isinstance(result, Exception):
+            print(f"❌ Ошибка шага запуска '{phase}': {result}")
+            logger.error(f"❌ Ошибка шага запуска '{phase}': {result}")
 
     try:
-        bot_info = bot.get_me()
-        print(f"🤖 Бот: @{bot_info.username}")
-        print(f"📊 ID: {bot_info.id}")
-        print(f"📛 Имя: {bot_info.first_name}")
-        print("🔗 Режим: WEBHOOK ONLY")
-        print("❌ Polling: ОТКЛЮЧЕН")
-        print(f"🤖 AI: {'✅ ВКЛЮЧЕН' if AI_ENABLED else '❌ ОТКЛЮЧЕН'}")
-        print(f"🔑 OpenAI API: {'✅ Настроен' if os.getenv('OPENAI_API_KEY') else '❌ Не настроен'}")
-        print(f"🗄️ БД: {'✅ ИНИЦИАЛИЗИРОВАНА' if db else '❌ НЕ ДОСТУПНА'}")
-        print(f"🔒 Loop Detector: {'✅ АКТИВЕН' if loop_detector else '❌ НЕ АКТИВЕН'}")
-        print("="*50)
-        logger.info("✅ Бот инициализирован успешно")
-        
-        # ВСЕГДА автоматически устанавливаем webhook при старте
-        print("🔧 Автоматическая установка webhook...")
+        startup_report["checkpoint"] = sorted(await asyncio.to_thread(restore_checkpoint))
+    except Exception as e:
+        logger.error(f"❌ Не удалось загрузить checkpoint {CHECKPOINT_PATH}: {e}")
+    restore_warm_loop_detector()
+
+    print("🔗 Режим: WEBHOOK ONLY")
+    print("❌ Polling: ОТКЛЮЧЕН")
+    print(f"🤖 AI: {'✅ ВКЛЮЧЕН' if AI_ENABLED else '❌ ОТКЛЮЧЕН'}")
+    print(f"🔑 OpenAI API: {'✅ Настроен' if os.getenv('OPENAI_API_KEY') else '❌ Не настроен'}")
+    print(f"🗄️ БД: {'✅ ИНИЦИАЛИЗИРОВАНА' if db else '❌ НЕ ДОСТУПНА'}")
+    print(f"🔒 Loop Detector: {'✅ АКТИВЕН' if loop_detector else '❌ НЕ АКТИВЕН'}")
+    print(f"🧩 Процесс {os.getpid()}: роль {PROCESS_ROLE}, состояние {shared_state.backend}, {'лидер' if shared_state.is_leader else 'не лидер'}")
+    phases_summary = ", ".join(f"{name}={info['ms']}ms" for name, info in startup_report["phases"].items())
+    print(f"⏱️ Холодный старт: {startup_report['total_ms']}ms ({phases_summary})")
+    print("="*50)
+    logger.info(f"✅ Бот инициализирован за {startup_report['total_ms']}ms: {phases_summary}")
+
+    # Воркеры обработки updates + фоновая проверка зависимостей для /health/ready
+    worker_pool.start()
+    if queue_consumer is not None:
+        queue_consumer.start()
+    dependency_prober.start()
+    if analytics is not None:
+        analytics.start()
+    if instruction_watcher is not None and shared_state.is_leader:
+        instruction_watcher.start()
+    if instruction_store_watcher is not None:
+        instruction_store_watcher.start()
+
+    if startup_report.get("backlog_drain"):
+        start_backlog_drain()
+    elif backlog_spool is not None and shared_state.is_leader:
+        # Выгрузку прервал редеплой: подтвержденные Telegram сообщения ждут ответа на диске
+        start_background_task(backlog_drainer.resume(), "backlog-resume")
+
+    # Остальные кэши прогреваются в фоне - прием updates их не ждет
+    start_background_task(restore_warm_caches(), "warm-restore")
+    if WARM_SNAPSHOT_INTERVAL > 0:
+        start_background_task(warm_snapshot_loop(), "warm-snapshot")
+
+def save_checkpoint():
+    """Состояние процесса в SQLite для следующего инстанса (с общим SQLite состоянием - нечего сохранять)"""
+    return state_checkpoint.save({
+        "dedup": shared_state.export_state(),
+        "loop_detector": loop_detector.export_state() if loop_detector is not None else None
+    })
+
+
+def restore_checkpoint():
+    """Загружает checkpoint прошлого инстанса (после init_storage: нужен loop_detector)"""
+    sections = state_checkpoint.load()
+    if "dedup" in sections:
+        shared_state.import_state(sections["dedup"])
+    if "loop_detector" in sections and loop_detector is not None:
+        loop_detector.import_state(sections["loop_detector"])
+    if sections:
+        print(f"💾 Состояние прошлого инстанса восстановлено: {', '.join(sorted(sections))}")
+    return sections
+
+
+def warm_snapshot_sections():
+    """Разделы снимка (в event loop: словари кэшей меняются обработчиками)"""
+    # Остановка раньше фонового прогрева: разделы прошлого снимка не должны потеряться
+    restore_warm_agent()
+    sections = agent.export_warm_state(WARM_SNAPSHOT_MAX_AGE, WARM_SNAPSHOT_MAX_SESSIONS) if AI_ENABLED else {}
+    sections["loop_detector"] = loop_detector.export_state() if loop_detector is not None else None
+    return sections
+
+
+async def save_warm_snapshot():
+    """Снимок кэшей: разделы собираются в event loop, кодирование и запись - в потоке"""
+    return await asyncio.to_thread(warm_snapshot.save, warm_snapshot_sections())
+
+
+def restore_warm_loop_detector():
+    """История LoopDetector из снимка - до приема updates; checkpoint при остановке новее снимка"""
+    if loop_detector is None or "loop_detector" in startup_report.get("checkpoint", []):
+        warm_snapshot.discard("loop_detector")
+        return
+    state = warm_snapshot.take("loop_detector")
+    if state:
+        loop_detector.import_state(state)
+
+
+def restore_warm_agent(sessions=None):
+    """Сессии агента и известные Zep пользователи из снимка (раздел декодируется один раз)"""
+    restored = []
+    if not AI_ENABLED:
+        return restored
+    sessions = sessions or warm_snapshot.take("sessions")
+    if sessions and agent.session_store is None:
+        # Сессии переходят в user_sessions при первом обращении к ним
+        agent.import_warm_sessions(sessions, max_age=WARM_SNAPSHOT_MAX_AGE)
+        restored.append(f"сессий {len(sessions)}")
+    known = warm_snapshot.take("zep_known")
+    if known:
+        agent.import_zep_known(known)
+        restored.append(f"Zep пользователей {len(known.get('users', []))}")
+    return restored
+
+
+async def restore_warm_caches():
+    """Кэши агента из снимка, владельцы соединений - из БД (источник истины, снимок мог устареть)"""
+    # Раздел сессий на 10k чатов декодируется сотни мс - не в event loop
+    restored = restore_warm_agent(await asyncio.to_thread(warm_snapshot.take, "sessions"))
+    if db is not None:
         try:
-            # Сначала проверяем текущий статус
-            current_webhook = bot.get_webhook_info()
-            if current_webhook.url:
-                print(f"📍 Текущий webhook: {current_webhook.url}")
-            else:
-                print("❌ Webhook не установлен")
-            
-            # Устанавливаем webhook
-            webhook_url = os.getenv("WEBHOOK_URL", "https://bot-production-472c.up.railway.app/webhook")
-            result = bot.set_webhook(
-                url=webhook_url,
-                secret_token=WEBHOOK_SECRET_TOKEN,
-                allowed_updates=[
-                    "message",
-                    "business_connection", 
-                    "business_message",
-                    "edited_business_message",
-                    "deleted_business_messages"
-                ]
-            )
-            
-            if result:
-                print(f"✅ Webhook автоматически установлен: {webhook_url}")
-                logger.info(f"✅ Webhook установлен при старте: {webhook_url}")
-            else:
-                print("❌ Не удалось установить webhook автоматически")
-                logger.error("Ошибка автоматической установки webhook")
-                
+            restored.append(f"владельцев {await db.warm_owner_cache()}")
         except Exception as e:
-            print(f"❌ Ошибка при автоматической установке webhook: {e}")
-            logger.error(f"Ошибка автоустановки webhook: {e}")
-            
-    except Exception as e:
-        print(f"❌ Ошибка инициализации: {e}")
-        logger.error(f"❌ Ошибка инициализации бота: {e}")
+            logger.error(f"❌ Не удалось прогреть кэш владельцев: {e}")
+    startup_report["warm_restore"] = restored
+    if restored:
+        print(f"🧊 Кэши прогреты: {', '.join(restored)}")
+
+
+async def warm_snapshot_loop():
+    """Снимок кэшей каждые WARM_SNAPSHOT_INTERVAL секунд (на случай падения без остановки)"""
+    while True:
+        await asyncio.sleep(WARM_SNAPSHOT_INTERVAL)
+        try:
+            await save_warm_snapshot()
+        except Exception as e:
+            logger.error(f"❌ Не удалось записать снимок кэшей {WARM_SNAPSHOT_PATH}: {e}")
+
 
 @app.on_event("shutdown")
 async def shutdown():
-    """Остановка сервера"""
-    logger.info("🛑 Остановка Textile Pro Bot Webhook Server")
-    print("🛑 Сервер остановлен")
+    """
+    Остановка сервера (SIGTERM при редеплое)
+
+    uvicorn к этому моменту уже не принимает соединения. Протокол:
+    1. новые jobs не берутся: выгрузка backlog и чтение очереди на диске
+       останавливаются, буфер склейки уходит в пул, пул закрывается;
+    2. текущие генерации и очередь пула дорабатывают до SHUTDOWN_DRAIN_SECONDS
+       (ответ клиенту и запись в Zep - часть job); остальные отменяются;
+    3. аналитика и логи сбрасываются на диск, защита от повторов и история
+       LoopDetector пишутся в checkpoint (bot/checkpoint.py) для следующего инстанса.
+
+    На Railway время между SIGTERM и SIGKILL задает drainingSeconds в
+    railway.json - оно должно быть больше SHUTDOWN_DRAIN_SECONDS.
+    """
+    started = time.perf_counter()
+    shutdown_report.update({"draining": True, "started_at": datetime.now().isoformat()})
+    logger.info(f"🛑 Остановка: ожидание текущих ответов до {SHUTDOWN_DRAIN_SECONDS:.0f} с")
+    print(f"🛑 Остановка: жду текущие ответы (до {SHUTDOWN_DRAIN_SECONDS:.0f} с)...")
+
+    # 1. Новая работа не принимается
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    if queue_consumer is not None:
+        await queue_consumer.pause()
+    stale_coalescer.flush_all()
+    worker_pool.close()
+    await dependency_prober.stop()
+    if instruction_watcher is not None:
+        await instruction_watcher.stop()
+    if instruction_store_watcher is not None:
+        await instruction_store_watcher.stop()
+
+    # 2. Текущие генерации дорабатывают до дедлайна
+    pool_stats = worker_pool.get_stats()
+    shutdown_report["in_flight_at_start"] = pool_stats["in_flight"]
+    shutdown_report["queued_at_start"] = pool_stats["queued"]
+    drained = await worker_pool.drain(SHUTDOWN_DRAIN_SECONDS)
+    pool_stats = worker_pool.get_stats()
+    shutdown_report.update({
+        "drained": drained,
+        "drain_ms": round((time.perf_counter() - started) * 1000, 1),
+        "abandoned": pool_stats["in_flight"] + pool_stats["queued"]
+    })
+    if not drained:
+        logger.warning(
+            f"⚠️ За {SHUTDOWN_DRAIN_SECONDS:.0f} с не завершены: {pool_stats['in_flight']} в работе, "
+            f"{pool_stats['queued']} в очереди - отменяются"
+        )
+    await worker_pool.stop()
+    if queue_consumer is not None:
+        # Прерванные jobs не подтверждены - возвращаем их строки в очередь для других workers
+        await queue_consumer.stop()
+    if update_queue is not None:
+        update_queue.close()
+    if backlog_spool is not None:
+        await asyncio.gather(*backlog_acks, return_exceptions=True)
+        # Неотвеченные строки backlog остаются в аренде - их доделает следующий инстанс
+        backlog_spool.close()
+
+    # 3. Буферы на диск, состояние - в checkpoint
+    if analytics is not None:
+        await analytics.stop()
+    try:
+        shutdown_report["checkpoint"] = await asyncio.to_thread(save_checkpoint)
+    except Exception as e:
+        logger.error(f"❌ Не удалось сохранить checkpoint {CHECKPOINT_PATH}: {e}")
+    try:
+        shutdown_report["warm_snapshot"] = await save_warm_snapshot()
+    except Exception as e:
+        logger.error(f"❌ Не удалось записать снимок кэшей {WARM_SNAPSHOT_PATH}: {e}")
+    if loop_monitor is not None:
+        loop_monitor.stop()
+    shared_state.close()
+    if AI_ENABLED:
+        # Соединения, открытие которых прервала отмена, иначе держат процесс после остановки
+        stop_orphan_connections()
+
+    shutdown_report["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(f"🛑 Остановка Textile Pro Bot Webhook Server: {shutdown_report}")
+    print(f"🛑 Сервер остановлен за {shutdown_report['total_ms']}ms (ответы дождались: {'да' if drained else 'нет'})")
+    for handler in logger.handlers:
+        handler.flush()
+    sys.stdout.flush()
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    print(f"🌐 Запуск на порту {port}")
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    print(f"🌐 Запуск на порту {port}, процессов приема: {WEB_CONCURRENCY}, workers очереди: {QUEUE_WORKER_PROCESSES}, роль: {PROCESS_ROLE} (состояние: {SHARED_STATE_URL})")
+    supervisor = None
+    if QUEUE_WORKER_PROCESSES > 0 and PROCESS_ROLE == "all":
+        # Прием в этом процессе, обработка - в QUEUE_WORKER_PROCESSES workers через очередь на диске.
+        # Роль и общее состояние читаются при импорте - передаем их workers и uvicorn через окружение
+        from bot.worker_processes import WorkerSupervisor
+        os.environ["PROCESS_ROLE"] = "ingest"
+        os.environ["SHARED_STATE_URL"] = SHARED_STATE_URL
+        os.environ["UPDATE_QUEUE_PATH"] = UPDATE_QUEUE_PATH
+        supervisor = WorkerSupervisor(os.path.abspath(__file__), QUEUE_WORKER_PROCESSES, base_port=port + 1)
+        supervisor.start()
+    try:
+        if WEB_CONCURRENCY > 1 or supervisor is not None:
+            # Каждый worker импортирует webhook заново - uvicorn нужна строка импорта, а не объект app
+            uvicorn.run("webhook:app", host=HOST, port=port, workers=WEB_CONCURRENCY if WEB_CONCURRENCY > 1 else None)
+        else:
+            uvicorn.run(app, host=HOST, port=port)
+    finally:
+        if supervisor is not None:
+            supervisor.stop()
\ No newline at end of file